@@ -10,8 +10,14 @@ from .models import (
 )
 from .config import carregar_empresas
 from .state import (
+    EstadoBackend,
+    EstadoJson,
+    EstadoSqlite,
+    abrir_estado,
+    migrar_estado_json,
     carregar_estado,
     salvar_estado,
+    atualizar_estado,
     get_ultimo_numero_nf,
     set_ultimo_numero_nf,
     get_cooldown,
@@ -20,11 +26,25 @@ from .state import (
     get_ultimo_nsu,
     set_ultimo_nsu,
 )
-from .exceptions import NfeConfigError, NfeValidationError
-from .consulta import consultar, consultar_nsu, consultar_dfe_chave
-from .manifestacao import manifestar
+from .exceptions import NfeConfigError, NfeValidationError, NfeServicoIndisponivel
+from .xml_utils import PoolSessoesSefaz, sessoes_sefaz
+from .certificado import carregar_certificado, limpar_certificados
+from .disjuntor import DisjuntorSefaz, configurar_disjuntor
+from .limitador import Limite, LimitadorSefaz, configurar_limitador
+from .retentativa import PoliticaRetentativa, controle_retentativas, configurar_retentativas
+from .consulta import consultar, consultar_nsu, consultar_dfe_chave, consultar_dfe_nsu, iter_distribuicao
+from .manifestacao import manifestar, manifestar_lote
 from .inutilizacao import inutilizar
 from .emissao import emitir
+from .assincrono import (
+    ClienteSefazAsync,
+    consultar_async,
+    consultar_nsu_async,
+    consultar_dfe_chave_async,
+    consultar_dfe_nsu_async,
+    iter_distribuicao_async,
+    manifestar_async,
+)
 
 __all__ = [
     "Certificado",
@@ -36,8 +56,14 @@ __all__ = [
     "Pagamento",
     "DadosEmissao",
     "carregar_empresas",
+    "EstadoBackend",
+    "EstadoJson",
+    "EstadoSqlite",
+    "abrir_estado",
+    "migrar_estado_json",
     "carregar_estado",
     "salvar_estado",
+    "atualizar_estado",
     "get_ultimo_numero_nf",
     "set_ultimo_numero_nf",
     "get_cooldown",
@@ -47,10 +73,33 @@ __all__ = [
     "set_ultimo_nsu",
     "NfeConfigError",
     "NfeValidationError",
+    "NfeServicoIndisponivel",
+    "PoolSessoesSefaz",
+    "sessoes_sefaz",
+    "carregar_certificado",
+    "limpar_certificados",
+    "Limite",
+    "LimitadorSefaz",
+    "configurar_limitador",
+    "DisjuntorSefaz",
+    "configurar_disjuntor",
+    "PoliticaRetentativa",
+    "controle_retentativas",
+    "configurar_retentativas",
     "consultar",
     "consultar_nsu",
     "consultar_dfe_chave",
+    "consultar_dfe_nsu",
+    "iter_distribuicao",
     "manifestar",
+    "manifestar_lote",
     "inutilizar",
     "emitir",
+    "ClienteSefazAsync",
+    "consultar_async",
+    "consultar_nsu_async",
+    "consultar_dfe_chave_async",
+    "consultar_dfe_nsu_async",
+    "iter_distribuicao_async",
+    "manifestar_async",
 ]
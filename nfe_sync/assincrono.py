@@ -0,0 +1,385 @@
+"""Cliente SEFAZ assíncrono (asyncio), ao lado do caminho bloqueante via pynfe.
+
+O XML continua sendo montado pelo pynfe — o método da ComunicacaoSefaz roda
+com um _post que apenas captura a URL e o envelope SOAP — e assinado pelo
+mesmo cache de certificado. O envio é HTTP/1.1 sobre asyncio com TLS mútuo,
+reaproveitando conexões keep-alive por host. Limitador, disjuntor e política
+de retentativa são os mesmos do caminho síncrono.
+
+Um único event loop atende muitas empresas ao mesmo tempo:
+
+    async with ClienteSefazAsync() as cliente:
+        resultados = await asyncio.gather(
+            *(consultar_async(e, chave, cliente=cliente) for e, chave in pedidos)
+        )
+
+Sem dependências novas: o transporte usa só asyncio e ssl da biblioteca padrão.
+"""
+import asyncio
+import contextlib
+import ssl
+from dataclasses import dataclass
+from typing import AsyncIterator
+from urllib.parse import urlsplit
+
+from pynfe.processamento.comunicacao import ComunicacaoSefaz
+
+from .certificado import _cache as _cache_certificados, ler_pfx
+from .consulta import (
+    CallbackProgresso, _AcumuladorDistribuicao, _inicio_distribuicao,
+    _pagina_distribuicao, _registrar_fim, _registrar_pagina, _resultado_consulta,
+    _resultado_dfe_chave, _uf_da_chave, _validar_chave,
+)
+from .disjuntor import chave_servico, disjuntor_ativo
+from .limitador import limitador_ativo, servico_da_url
+from .manifestacao import _evento_assinado, _resultado_manifestacao, _validar
+from .models import EmpresaConfig, validar_cnpj_sefaz
+from .results import PaginaDistribuicao, ResultadoConsulta, ResultadoDfeChave, ResultadoDistribuicao, ResultadoManifestacao
+from .retentativa import PoliticaRetentativa, controle_retentativas, erro_transitorio, resposta_transitoria
+from .state import abrir_estado
+from .xml_utils import _SEFAZ_TIMEOUT, _corpo_soap, safe_fromstring, to_xml_string
+
+CONEXOES_POR_HOST = 10
+# Serviços só de consulta: repetir o POST após uma queda não altera nada na SEFAZ
+_CONSULTAS = frozenset({"consulta_nota", "consulta_distribuicao"})
+
+
+@dataclass(frozen=True, slots=True)
+class RespostaHttp:
+    status_code: int
+    content: bytes
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+
+class _Capturado(Exception):
+    def __init__(self, url: str, xml):
+        self.url, self.xml = url, xml
+
+
+def montar_requisicao(con: ComunicacaoSefaz, fn, *args, **kwargs) -> tuple[str, object]:
+    """(url, envelope SOAP) que o método do pynfe enviaria, sem enviar nada.
+
+    fn: nome do método da ComunicacaoSefaz ou função fn(con, ...), como em chamar_sefaz.
+    """
+    def _capturar(url, xml, timeout=None):
+        raise _Capturado(url, xml)
+
+    con._post = _capturar
+    try:
+        (getattr(con, fn) if isinstance(fn, str) else lambda *a, **k: fn(con, *a, **k))(*args, **kwargs)
+    except _Capturado as c:
+        return c.url, c.xml
+    raise RuntimeError(f"{fn} nao enviou requisicao")
+
+
+class _Conexao:
+    __slots__ = ("reader", "writer")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader, self.writer = reader, writer
+
+    async def fechar(self) -> None:
+        self.writer.close()
+        with contextlib.suppress(Exception):
+            await asyncio.wait_for(self.writer.wait_closed(), 1)
+
+    def encerrada(self) -> bool:
+        """O servidor já fechou a conexão ociosa (EOF recebido): não serve para outro pedido."""
+        return self.reader.at_eof() or self.writer.is_closing()
+
+    async def _ler_corpo(self, cabecalhos: dict[str, str]) -> tuple[bytes, bool]:
+        """Corpo da resposta e se a conexão pode ser reaproveitada."""
+        r = self.reader
+        if "chunked" in cabecalhos.get("transfer-encoding", "").lower():
+            partes = []
+            while True:
+                tamanho = int((await r.readline()).split(b";")[0].strip() or b"0", 16)
+                if tamanho == 0:
+                    while (await r.readline()) not in (b"\r\n", b"\n", b""):
+                        pass  # trailers
+                    return b"".join(partes), True
+                partes.append(await r.readexactly(tamanho))
+                await r.readline()
+        if "content-length" in cabecalhos:
+            return await r.readexactly(int(cabecalhos["content-length"])), True
+        return await r.read(), False  # delimitado pelo fechamento
+
+    async def post(self, host: str, caminho: str, cabecalhos: dict[str, str], corpo: bytes) -> tuple[RespostaHttp, bool]:
+        linhas = [f"POST {caminho} HTTP/1.1", f"Host: {host}", f"Content-Length: {len(corpo)}"]
+        linhas += [f"{k}: {v}" for k, v in cabecalhos.items()]
+        self.writer.write(("\r\n".join(linhas) + "\r\n\r\n").encode("latin-1") + corpo)
+        await self.writer.drain()
+
+        while True:
+            status = await self.reader.readline()
+            if not status:
+                raise ConnectionResetError("conexao encerrada pelo servidor antes da resposta")
+            versao, codigo = status.decode("latin-1").split(" ", 2)[:2]
+            resp_cab: dict[str, str] = {}
+            while (linha := await self.reader.readline()) not in (b"\r\n", b"\n", b""):
+                nome, _, valor = linha.decode("latin-1").partition(":")
+                resp_cab[nome.strip().lower()] = valor.strip()
+            if not codigo.startswith("1"):  # ignora 100 Continue
+                break
+
+        try:
+            conteudo, delimitado = await self._ler_corpo(resp_cab)
+        except asyncio.IncompleteReadError as e:
+            raise ConnectionResetError("resposta incompleta da SEFAZ") from e
+        reaproveitar = delimitado and versao == "HTTP/1.1" and resp_cab.get("connection", "").lower() != "close"
+        return RespostaHttp(int(codigo), conteudo), reaproveitar
+
+
+class TransporteAsync:
+    """Conexões TLS com certificado cliente, reaproveitadas por (host, porta, certificado).
+
+    Até `conexoes_por_host` requisições simultâneas por destino; as demais
+    aguardam na fila do semáforo em vez de abrir mais handshakes.
+    Um SSLContext por certificado: quando o cache de certificados troca os
+    arquivos PEM (TTL), o contexto é refeito e o anterior descartado.
+    """
+
+    def __init__(self, conexoes_por_host: int = CONEXOES_POR_HOST):
+        self.conexoes_por_host = conexoes_por_host
+        self._livres: dict[tuple, list[_Conexao]] = {}
+        self._semaforos: dict[tuple, asyncio.Semaphore] = {}
+        # identidade do certificado → (arquivos PEM usados, contexto)
+        self._contextos: dict[str, tuple[tuple[str, str], ssl.SSLContext]] = {}
+        self.conexoes_abertas = 0  # handshakes feitos
+
+    def _contexto(self, pfx: bytes, senha: str) -> tuple[str, ssl.SSLContext]:
+        """(identidade do certificado, SSLContext) para os PEM atuais do cache."""
+        identidade = _cache_certificados._chave(pfx, senha)
+        arquivos = _cache_certificados.arquivos_pem(pfx, senha)
+        atual = self._contextos.get(identidade)
+        if atual is not None and atual[0] == arquivos:
+            return identidade, atual[1]
+        ctx = ssl.create_default_context()
+        # mesmo comportamento do pynfe (verify=False): a cadeia ICP-Brasil
+        # não está nos repositórios padrão
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+        ctx.load_cert_chain(*arquivos)
+        self._contextos[identidade] = (arquivos, ctx)  # substitui o contexto dos PEM expirados
+        return identidade, ctx
+
+    async def _abrir(self, host: str, porta: int, ctx: ssl.SSLContext) -> _Conexao:
+        reader, writer = await asyncio.open_connection(host, porta, ssl=ctx)
+        self.conexoes_abertas += 1
+        return _Conexao(reader, writer)
+
+    async def post(self, url: str, cabecalhos: dict[str, str], corpo: bytes,
+                   pfx: bytes, senha: str, timeout: float = _SEFAZ_TIMEOUT,
+                   idempotente: bool = True) -> RespostaHttp:
+        """POST numa conexão livre do destino (ou nova).
+
+        Conexão ociosa já fechada pelo servidor é descartada antes de enviar. Se a
+        conexão reaproveitada cair depois do envio, o pedido só é repetido em conexão
+        nova quando idempotente: um evento pode ter sido recebido pela SEFAZ.
+        """
+        partes = urlsplit(url)
+        host, porta = partes.hostname, partes.port or 443
+        caminho = (partes.path or "/") + (f"?{partes.query}" if partes.query else "")
+        # conexões abertas com o contexto anterior seguem no pool: o certificado é o mesmo
+        identidade, ctx = self._contexto(pfx, senha)
+        destino = (host, porta, identidade)
+        semaforo = self._semaforos.setdefault(destino, asyncio.Semaphore(self.conexoes_por_host))
+
+        async with semaforo:
+            livres = self._livres.setdefault(destino, [])
+            while True:
+                reutilizada = bool(livres)
+                conexao = livres.pop() if reutilizada else await asyncio.wait_for(
+                    self._abrir(host, porta, ctx), timeout,
+                )
+                if reutilizada and conexao.encerrada():
+                    await conexao.fechar()  # nada enviado: segue para a próxima
+                    continue
+                try:
+                    resp, reaproveitar = await asyncio.wait_for(
+                        conexao.post(partes.netloc, caminho, cabecalhos, corpo), timeout,
+                    )
+                except ConnectionError:
+                    await conexao.fechar()
+                    if reutilizada and idempotente:
+                        continue  # keep-alive expirado do lado do servidor: tenta em conexão nova
+                    raise
+                except BaseException:
+                    await conexao.fechar()
+                    raise
+                if reaproveitar:
+                    livres.append(conexao)
+                else:
+                    await conexao.fechar()
+                return resp
+
+    async def fechar(self) -> None:
+        for livres in self._livres.values():
+            for conexao in livres:
+                await conexao.fechar()
+        self._livres.clear()
+        self._contextos.clear()
+
+
+class ClienteSefazAsync:
+    """Equivalente assíncrono de chamar_sefaz, com um TransporteAsync compartilhado."""
+
+    def __init__(self, conexoes_por_host: int = CONEXOES_POR_HOST):
+        self.transporte = TransporteAsync(conexoes_por_host)
+        self._pfx: dict[str, bytes] = {}  # .pfx lido do disco uma vez por cliente
+
+    async def __aenter__(self) -> "ClienteSefazAsync":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.fechar()
+
+    async def fechar(self) -> None:
+        await self.transporte.fechar()
+
+    def _ler_pfx(self, empresa: EmpresaConfig) -> bytes:
+        cert = empresa.certificado
+        if cert.conteudo is not None:
+            return cert.conteudo
+        if cert.path not in self._pfx:
+            self._pfx[cert.path] = ler_pfx(cert)
+        return self._pfx[cert.path]
+
+    async def chamar(self, empresa: EmpresaConfig, fn_nome, *args, uf: str | None = None,
+                     politica: PoliticaRetentativa | None = None, **kwargs):
+        """Como chamar_sefaz: monta pelo pynfe, envia com retry e retorna (xml_element, xml_string)."""
+        con = ComunicacaoSefaz(uf or empresa.uf, None, empresa.certificado.senha, empresa.homologacao)
+        url, xml = montar_requisicao(con, fn_nome, *args, **kwargs)
+        corpo = _corpo_soap(xml).encode("utf-8")
+        cabecalhos = con._post_header()
+        pfx = self._ler_pfx(empresa)
+        ambiente = "homologacao" if empresa.homologacao else "producao"
+        chave = chave_servico(url, ambiente)
+        idempotente = fn_nome in _CONSULTAS
+
+        async def _post():
+            # disjuntor e limitador podem ler/gravar o estado em disco: fora do event loop
+            disjuntor = disjuntor_ativo()
+            await asyncio.to_thread(disjuntor.permitir, chave)
+            await limitador_ativo().aguardar_async(servico_da_url(url), empresa.emitente.cnpj, ambiente)
+            try:
+                resp = await self.transporte.post(
+                    url, cabecalhos, corpo, pfx, empresa.certificado.senha, idempotente=idempotente,
+                )
+            except Exception as e:
+                if erro_transitorio(e):
+                    await asyncio.to_thread(disjuntor.falha, chave)
+                raise
+            if resposta_transitoria(resp):
+                await asyncio.to_thread(disjuntor.falha, chave)
+            else:
+                await asyncio.to_thread(disjuntor.sucesso, chave)
+            return resp
+
+        resp = await controle_retentativas().executar_async(_post, politica=politica)
+        # parse fora do event loop: a resposta da distribuição traz até 50 docZips
+        return await asyncio.to_thread(_ler_resposta, resp.content)
+
+
+def _ler_resposta(conteudo: bytes) -> tuple:
+    xml_el = safe_fromstring(conteudo)
+    return xml_el, to_xml_string(xml_el)
+
+
+@contextlib.asynccontextmanager
+async def _cliente(cliente: ClienteSefazAsync | None):
+    if cliente is not None:
+        yield cliente
+        return
+    async with ClienteSefazAsync() as novo:
+        yield novo
+
+
+async def consultar_async(empresa: EmpresaConfig, chave: str,
+                          cliente: ClienteSefazAsync | None = None) -> ResultadoConsulta:
+    _validar_chave(empresa, chave)
+    uf = _uf_da_chave(chave) or empresa.uf
+    async with _cliente(cliente) as c:
+        xml_sit, xml_resposta = await c.chamar(empresa, "consulta_nota", uf=uf, modelo="nfe", chave=chave)
+    return _resultado_consulta(xml_sit, xml_resposta)
+
+
+async def consultar_dfe_chave_async(empresa: EmpresaConfig, chave: str,
+                                    cliente: ClienteSefazAsync | None = None) -> ResultadoDfeChave:
+    _validar_chave(empresa, chave)
+    uf = _uf_da_chave(chave) or empresa.uf
+    async with _cliente(cliente) as c:
+        xml_resp, xml_resposta = await c.chamar(
+            empresa, "consulta_distribuicao", uf=uf, cnpj=empresa.emitente.cnpj, chave=chave,
+        )
+    return await asyncio.to_thread(_resultado_dfe_chave, xml_resp, xml_resposta)
+
+
+async def consultar_dfe_nsu_async(empresa: EmpresaConfig, nsu: int,
+                                  cliente: ClienteSefazAsync | None = None) -> ResultadoDfeChave:
+    validar_cnpj_sefaz(empresa.emitente.cnpj, empresa.nome)
+    async with _cliente(cliente) as c:
+        xml_resp, xml_resposta = await c.chamar(
+            empresa, "consulta_distribuicao", cnpj=empresa.emitente.cnpj, nsu=nsu, consulta_nsu_especifico=True,
+        )
+    return await asyncio.to_thread(_resultado_dfe_chave, xml_resp, xml_resposta)
+
+
+async def iter_distribuicao_async(
+    empresa: EmpresaConfig, estado: dict, state_file: str | None = None,
+    nsu: int | None = None, cliente: ClienteSefazAsync | None = None,
+) -> AsyncIterator[PaginaDistribuicao]:
+    """Versão assíncrona de iter_distribuicao (mesmas regras de NSU e cooldown)."""
+    inicio = _inicio_distribuicao(empresa, estado, nsu)
+    if isinstance(inicio, PaginaDistribuicao):
+        yield inicio
+        return
+    ult_nsu = inicio
+    cnpj = empresa.emitente.cnpj
+    ambiente = "homologacao" if empresa.homologacao else "producao"
+    c_stat = None
+    pagina = 0
+    backend = abrir_estado(state_file) if state_file else None
+    ultima = None
+
+    async with _cliente(cliente) as c:
+        while True:
+            pagina += 1
+            xml_resp, _ = await c.chamar(empresa, "consulta_distribuicao", cnpj=cnpj, nsu=ult_nsu)
+            # gunzip, parse e serialização dos docZips da página fora do event loop
+            pag = await asyncio.to_thread(_pagina_distribuicao, xml_resp, pagina, ult_nsu, None)
+            c_stat, ult_nsu = pag.status, pag.ultimo_nsu
+            yield pag
+
+            if pag.status == "138":
+                ultima = pag
+            if not await asyncio.to_thread(_registrar_pagina, estado, backend, cnpj, ambiente, pag):
+                break
+
+    await asyncio.to_thread(_registrar_fim, estado, backend, cnpj, ambiente, c_stat, ultima)
+
+
+async def consultar_nsu_async(
+    empresa: EmpresaConfig, estado: dict, state_file: str | None = None,
+    nsu: int | None = None, callback: CallbackProgresso | None = None,
+    cliente: ClienteSefazAsync | None = None,
+) -> ResultadoDistribuicao:
+    acumulado = _AcumuladorDistribuicao(callback)
+    async for pagina in iter_distribuicao_async(empresa, estado, state_file, nsu=nsu, cliente=cliente):
+        acumulado.adicionar(pagina)
+    return acumulado.resultado(estado)
+
+
+async def manifestar_async(
+    empresa: EmpresaConfig, operacao: str, chave: str, justificativa: str = "",
+    cliente: ClienteSefazAsync | None = None,
+) -> ResultadoManifestacao:
+    _validar(empresa, operacao, chave, justificativa)
+    validar_cnpj_sefaz(empresa.emitente.cnpj, empresa.nome)
+    xml_assinado = _evento_assinado(empresa, operacao, chave, justificativa)
+    async with _cliente(cliente) as c:
+        xml_resp, xml_resp_str = await c.chamar(empresa, "evento", modelo="nfe", evento=xml_assinado)
+    return _resultado_manifestacao(xml_resp, xml_resp_str)
@@ -1,8 +1,8 @@
 from pynfe.entidades.fonte_dados import FonteDados
 from pynfe.entidades.evento import EventoCancelarNota
 from pynfe.processamento.serializacao import SerializacaoXML
-from pynfe.processamento.assinatura import AssinaturaA1
 
+from .certificado import assinador
 from .models import EmpresaConfig, validar_cnpj_sefaz
 from .exceptions import NfeValidationError
 from .xml_utils import extract_status_motivo, agora_local, chamar_sefaz
@@ -37,7 +37,7 @@ def cancelar(
 
     xml_evento = SerializacaoXML(fonte, homologacao=empresa.homologacao).serializar_evento(evento)
     with empresa.certificado.cert_path() as cert_path:
-        xml_assinado = AssinaturaA1(cert_path, empresa.certificado.senha).assinar(xml_evento)
+        xml_assinado = assinador(empresa.certificado).assinar(xml_evento)
         xml_resp, xml_resp_str = chamar_sefaz(empresa, "evento", modelo="nfe", evento=xml_assinado, cert_path=cert_path)
     resultados = extract_status_motivo(xml_resp, NS)
     protocolos = xml_resp.xpath("//ns:nProt", namespaces=NS)
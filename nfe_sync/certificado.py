@@ -0,0 +1,204 @@
+"""Cache do certificado A1 decifrado, compartilhado pelo processo.
+
+O pynfe reabre e decifra o PKCS#12 a cada assinatura e a cada POST; com
+`conteudo` preenchido, Certificado.cert_path() ainda gravava um .pfx novo
+por operação. Aqui o .pfx é decifrado uma vez e o material (chave/cert PEM,
+e os arquivos que o transporte exige) fica disponível por CERT_TTL segundos.
+Os arquivos ficam num diretório privado (0700, em /dev/shm quando existir)
+e são sobrescritos e apagados um TTL depois de expirar (quem recebeu o
+caminho pouco antes ainda o está usando), em limpar_certificados() e na
+saída do processo.
+"""
+import atexit
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat, pkcs12
+from pynfe.processamento.assinatura import AssinaturaA1
+
+from .exceptions import NfeConfigError
+
+CERT_TTL = int(os.environ.get("NFE_SYNC_CERT_TTL", "900"))  # segundos
+
+
+@dataclass(frozen=True, slots=True)
+class MaterialCertificado:
+    chave: bytes  # PEM PKCS#8, sem senha
+    cert: bytes  # PEM
+    carregado_em: float  # relógio do cache (time.monotonic())
+
+
+class _AssinaturaCache(AssinaturaA1):
+    """AssinaturaA1 com chave/cert já decifrados (o __init__ original relê o .pfx)."""
+
+    def __init__(self, material: MaterialCertificado):
+        self.key, self.cert = material.chave, material.cert.decode()
+
+
+def _diretorio_tmpfs() -> str | None:
+    shm = "/dev/shm"
+    return shm if os.path.isdir(shm) and os.access(shm, os.W_OK) else None
+
+
+def _apagar(caminho: str) -> None:
+    """Sobrescreve com zeros e remove — o material é chave privada sem senha."""
+    try:
+        tamanho = os.path.getsize(caminho)
+        with open(caminho, "r+b") as f:
+            f.write(b"\0" * tamanho)
+            f.flush()
+            os.fsync(f.fileno())
+        os.remove(caminho)
+    except OSError as e:
+        logging.warning("Nao foi possivel apagar %s: %s", caminho, e)
+
+
+class _Entrada:
+    __slots__ = ("material", "arquivos")
+
+    def __init__(self, material: MaterialCertificado):
+        self.material = material
+        self.arquivos: dict[str, str] = {}
+
+
+class CacheCertificados:
+    """Material decifrado por (conteúdo do .pfx, senha), válido por `ttl` segundos.
+
+    Os arquivos de uma entrada expirada só são apagados depois de mais `ttl`
+    segundos: um caminho entregue antes de expirar continua válido por pelo
+    menos um TTL (uma sessão, o pynfe ou um SSLContext podem estar abrindo-o).
+    """
+
+    def __init__(self, ttl: int = CERT_TTL, relogio: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self._relogio = relogio
+        self._entradas: dict[str, _Entrada] = {}
+        self._aposentados: list[tuple[float, list[str]]] = []  # (apagar a partir de, arquivos)
+        self._lock = threading.Lock()
+        self._diretorio: str | None = None
+        self.decifrados = 0  # quantas vezes o PKCS#12 foi de fato decifrado
+
+    @staticmethod
+    def _chave(pfx: bytes, senha: str) -> str:
+        return hashlib.sha256(pfx + b"\0" + senha.encode()).hexdigest()
+
+    def _expirar(self, agora: float) -> None:
+        for chave, entrada in list(self._entradas.items()):
+            if agora - entrada.material.carregado_em >= self.ttl:
+                if entrada.arquivos:
+                    prazo = entrada.material.carregado_em + 2 * self.ttl
+                    self._aposentados.append((prazo, list(entrada.arquivos.values())))
+                del self._entradas[chave]
+        pendentes = []
+        for prazo, caminhos in self._aposentados:
+            if agora >= prazo:
+                for caminho in caminhos:
+                    _apagar(caminho)
+            else:
+                pendentes.append((prazo, caminhos))
+        self._aposentados = pendentes
+
+    def _entrada(self, pfx: bytes, senha: str) -> _Entrada:
+        agora = self._relogio()
+        self._expirar(agora)
+        chave = self._chave(pfx, senha)
+        entrada = self._entradas.get(chave)
+        if entrada is None:
+            try:
+                chave_priv, cert = pkcs12.load_key_and_certificates(pfx, senha.encode())[:2]
+            except ValueError as e:
+                raise NfeConfigError(f"Falha ao carregar certificado A1 (senha ou arquivo invalido): {e}") from e
+            material = MaterialCertificado(
+                chave=chave_priv.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption()),
+                cert=cert.public_bytes(Encoding.PEM),
+                carregado_em=agora,
+            )
+            entrada = self._entradas[chave] = _Entrada(material)
+            self.decifrados += 1
+        return entrada
+
+    def _gravar(self, entrada: _Entrada, tipo: str, dados: bytes) -> str:
+        caminho = entrada.arquivos.get(tipo)
+        if caminho is None:
+            if self._diretorio is None:
+                self._diretorio = tempfile.mkdtemp(prefix="nfe-sync-cert-", dir=_diretorio_tmpfs())
+            fd, caminho = tempfile.mkstemp(suffix=f".{tipo}", dir=self._diretorio)
+            with os.fdopen(fd, "wb") as f:
+                f.write(dados)
+            entrada.arquivos[tipo] = caminho
+        return caminho
+
+    def material(self, pfx: bytes, senha: str) -> MaterialCertificado:
+        with self._lock:
+            return self._entrada(pfx, senha).material
+
+    def arquivos_pem(self, pfx: bytes, senha: str) -> tuple[str, str]:
+        """(cert.pem, chave.pem) para o transporte HTTPS — gravados uma vez por TTL."""
+        with self._lock:
+            entrada = self._entrada(pfx, senha)
+            return (
+                self._gravar(entrada, "cert.pem", entrada.material.cert),
+                self._gravar(entrada, "key.pem", entrada.material.chave),
+            )
+
+    def arquivo_pfx(self, pfx: bytes) -> str:
+        """Cópia do .pfx (ainda cifrado) para quem exige um path; reaproveitada por TTL."""
+        with self._lock:
+            self._expirar(self._relogio())
+            chave = "pfx:" + self._chave(pfx, "")
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                entrada = self._entradas[chave] = _Entrada(
+                    MaterialCertificado(chave=b"", cert=b"", carregado_em=self._relogio())
+                )
+            return self._gravar(entrada, "pfx", pfx)
+
+    def limpar(self) -> None:
+        with self._lock:
+            for entrada in self._entradas.values():
+                for caminho in entrada.arquivos.values():
+                    _apagar(caminho)
+            for _, caminhos in self._aposentados:
+                for caminho in caminhos:
+                    _apagar(caminho)
+            self._entradas.clear()
+            self._aposentados.clear()
+            if self._diretorio is not None:
+                try:
+                    os.rmdir(self._diretorio)
+                except OSError:
+                    pass
+                self._diretorio = None
+
+
+_cache = CacheCertificados()
+atexit.register(_cache.limpar)
+
+
+def ler_pfx(certificado) -> bytes:
+    """Bytes do .pfx de um models.Certificado (conteudo ou arquivo em path)."""
+    if certificado.conteudo is not None:
+        return certificado.conteudo
+    with open(certificado.path, "rb") as f:
+        return f.read()
+
+
+def carregar_certificado(certificado) -> MaterialCertificado:
+    """Chave e certificado PEM, decifrando o .pfx só na primeira vez (por TTL)."""
+    return _cache.material(ler_pfx(certificado), certificado.senha)
+
+
+def assinador(certificado) -> AssinaturaA1:
+    """AssinaturaA1 pronta para assinar, sem redecifrar o .pfx."""
+    return _AssinaturaCache(carregar_certificado(certificado))
+
+
+def limpar_certificados() -> None:
+    """Apaga todo o material decifrado e os arquivos temporários (também roda na saída)."""
+    _cache.limpar()
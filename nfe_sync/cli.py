@@ -4,7 +4,12 @@ import urllib3
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-from .exceptions import NfeConfigError, NfeValidationError
+from .exceptions import NfeConfigError, NfeValidationError, NfeServicoIndisponivel
+from .xml_utils import sessoes_sefaz
+from .disjuntor import DisjuntorSefaz, configurar_disjuntor
+from .limitador import LimitadorSefaz, configurar_limitador
+from .state import abrir_estado
+from .commands import STATE_FILE
 from .commands.consulta import ConsultaBlueprint
 from .commands.manifestacao import ManifestacaoBlueprint
 from .commands.inutilizacao import InutilizacaoBlueprint
@@ -38,9 +43,17 @@ def cli(argv=None):
         epilog=(
             "Comandos SEFAZ:\n"
             "  consultar       Consultar situacao de uma NF-e pela chave de acesso\n"
+            "  consultar-lote  Consultar situacao de varias NF-e (saida JSONL/CSV)\n"
             "  consultar-nsu   Baixar NF-e e eventos recebidos via distribuicao DFe\n"
+            "  baixar-chaves   Baixar XML completo de varias chaves via distribuicao DFe\n"
+            "  verificar-nsu   Listar e buscar NSUs faltantes na distribuicao DFe\n"
             "  pendentes       Listar NF-e com resumo pendente aguardando XML completo\n"
+            "  reindexar       Reconstruir o indice de downloads/{cnpj}/ a partir do disco\n"
+            "  migrar-layout   Mover os XMLs de downloads/{cnpj}/ para o layout configurado\n"
+            "  compactar       Passar os XMLs soltos de downloads/{cnpj}/ para os segmentos gzip\n"
+            "  exportar-xml    Gravar os documentos de downloads/{cnpj}/ como XMLs soltos\n"
             "  manifestar      Manifestar ciencia, confirmacao, desconhecimento ou nao-realizacao\n"
+            "  manifestar-lote Manifestar varias NF-e em lotes de ate 20 eventos\n"
             "  inutilizar      Inutilizar faixa de numeracao de NF-e\n"
             "  emitir          Emitir NF-e de teste em homologacao\n"
             "  cancelar        Cancela uma NF-e emitida na SEFAZ\n"
@@ -49,6 +62,8 @@ def cli(argv=None):
             "  versao          Verificar versao instalada e atualizacoes disponiveis\n"
             "  atualizar       Atualizar para a versao mais recente\n"
             "  readme          Exibir documentacao completa\n"
+            "  migrar-estado   Migrar .state.json para o backend SQLite\n"
+            "  log-show        Exibir uma resposta do SEFAZ gravada no log\n"
             "\n"
             "Exemplos:\n"
             "  nfe-sync consultar      EMPRESA 12345678901234567890123456789012345678901234\n"
@@ -56,6 +71,7 @@ def cli(argv=None):
             "  nfe-sync consultar-nsu  EMPRESA --chave CHAVE\n"
             "  nfe-sync pendentes      EMPRESA\n"
             "  nfe-sync manifestar     EMPRESA ciencia CHAVE\n"
+            "  nfe-sync manifestar-lote EMPRESA ciencia --pendentes\n"
             "  nfe-sync inutilizar     EMPRESA --serie 1 --inicio 5 --fim 8 --justificativa 'Motivo'\n"
             "  nfe-sync emitir         EMPRESA --serie 1\n"
             "  nfe-sync cancelar       EMPRESA CHAVE --protocolo 135XXX --justificativa 'Motivo'\n"
@@ -78,7 +94,20 @@ def cli(argv=None):
     args = parser.parse_args(argv)
 
     try:
-        args.func(args)
+        # limites de requisição e disjuntores compartilhados com outros processos via state file,
+        # só quando o backend grava por chave (SQLite): no JSON cada POST reescreveria o arquivo
+        # inteiro, então ficam em memória e valem para este processo
+        backend = abrir_estado(STATE_FILE)
+        compartilhado = backend if backend.gravacao_por_chave else None
+        limitador_anterior = configurar_limitador(LimitadorSefaz(backend=compartilhado))
+        disjuntor_anterior = configurar_disjuntor(DisjuntorSefaz(backend=compartilhado))
+        try:
+            # uma conexão TLS por (empresa, UF, ambiente) durante todo o comando
+            with sessoes_sefaz():
+                args.func(args)
+        finally:
+            configurar_limitador(limitador_anterior)
+            configurar_disjuntor(disjuntor_anterior)
     except NfeConfigError as e:
         print(f"Erro de configuracao: {e}")
         print()
@@ -101,6 +130,11 @@ def cli(argv=None):
     except NfeValidationError as e:
         print(f"Erro de validacao: {e}")
         sys.exit(1)
+    except NfeServicoIndisponivel as e:
+        print(f"Erro: {e}")
+        if args.comando == "emitir":
+            print("Para emitir em contingencia (SVC-AN/SVC-RS), use --contingencia 'JUSTIFICATIVA'.")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -4,18 +4,34 @@ import sys
 from abc import ABC, abstractmethod
 
 from ..config import carregar_empresas
-from ..state import carregar_estado, salvar_estado
+from ..state import carregar_estado
 from ..log import salvar_resposta_sefaz
 from ..exceptions import NfeConfigError, NfeValidationError
-from ..xml_utils import safe_fromstring
-from ..storage import DocumentoStorage
-
-_storage = DocumentoStorage()
+from ..storage import DocumentoStorage, abrir_storage
 
 # Issue #4: caminhos de config e estado configuráveis via variáveis de ambiente
 CONFIG_FILE = os.environ.get("NFE_SYNC_CONFIG", "nfe-sync.conf.ini")
 STATE_FILE = os.environ.get("NFE_SYNC_STATE", ".state.json")
 
+_storage_ativo: DocumentoStorage | None = None
+
+
+def _storage() -> DocumentoStorage:
+    """Armazenamento de downloads/, criado no primeiro uso.
+
+    NFE_SYNC_STORAGE=gzip guarda os XMLs comprimidos em segmentos em vez de um arquivo por documento;
+    NFE_SYNC_LAYOUT=aamm separa os arquivos em downloads/{cnpj}/{AAMM}/;
+    NFE_SYNC_FSYNC=lote troca o fsync de cada XML por um por página da distribuição.
+    Um valor inválido levanta NfeConfigError aqui, dentro do tratamento de erros
+    da CLI, e não ao importar nfe_sync.commands.
+    """
+    global _storage_ativo
+    if _storage_ativo is None:
+        _storage_ativo = abrir_storage(
+            os.environ.get("NFE_SYNC_STORAGE"), os.environ.get("NFE_SYNC_LAYOUT"), os.environ.get("NFE_SYNC_FSYNC"),
+        )
+    return _storage_ativo
+
 
 class CliBlueprint(ABC):
     """Base para todos os grupos de comandos CLI. Cada subclasse registra seus subcomandos."""
@@ -48,17 +64,19 @@ def _carregar(args):
     return empresa, estado
 
 
-def _salvar_xml(cnpj: str, nome: str, xml: str) -> str:
-    """Cria downloads/{cnpj}/ e salva XML. Retorna o caminho do arquivo."""
-    return _storage.salvar(cnpj, nome, xml)
+def _salvar_xml(cnpj: str, nome: str, xml: str | bytes, schema: str | None = None, nsu: str | None = None) -> str:
+    """Cria downloads/{cnpj}/ e salva XML (bytes são gravados sem conversão). Retorna o caminho do arquivo."""
+    return _storage().salvar(cnpj, nome, xml, schema=schema, nsu=nsu)
+
 
+def _salvar_log_xml(xml: str | bytes, tipo: str, ref: str) -> str:
+    """Salva resposta SEFAZ em log/. Wrapper sobre log.salvar_resposta_sefaz().
 
-def _salvar_log_xml(xml_str: str, tipo: str, ref: str) -> str:
-    """Salva resposta SEFAZ em log/. Wrapper sobre log.salvar_resposta_sefaz()."""
-    xml_el = safe_fromstring(xml_str.encode())
-    return salvar_resposta_sefaz(xml_el, tipo, ref)
+    O XML já vem serializado (to_xml_string) — é gravado direto, sem reparse.
+    """
+    return salvar_resposta_sefaz(xml, tipo, ref)
 
 
 def _listar_resumos_pendentes(cnpj: str) -> list[str]:
     """Escaneia downloads/{cnpj}/ por arquivos resNFe (root tag = resNFe)."""
-    return _storage.listar_resumos_pendentes(cnpj)
+    return _storage().listar_resumos_pendentes(cnpj)
@@ -1,10 +1,23 @@
 import argparse
+import asyncio
+import contextvars
+import csv
+import io
+import json
 import sys
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 
-from ..state import carregar_estado, salvar_estado, set_ultimo_nsu
+from ..state import carregar_estado, abrir_estado, get_cooldown, get_ultimo_nsu, set_cooldown, set_ultimo_nsu
 from ..config import carregar_empresas
-from ..consulta import consultar, consultar_dfe_chave, consultar_nsu
-from ..manifestacao import manifestar
+from ..gravacao import GravadorSegundoPlano
+from ..storage import DocumentoStorageCompactado
+from ..assincrono import ClienteSefazAsync, consultar_async, consultar_dfe_chave_async, consultar_dfe_nsu_async
+from ..consulta import (
+    _grava_nsu_agora, _uf_da_chave, calcular_proximo_cooldown, consultar, consultar_dfe_chave, iter_distribuicao, verificar_cooldown,
+)
+from .manifestacao import _ler_chaves, _registrar_lote
 from . import CliBlueprint, _carregar, _salvar_xml, _salvar_log_xml, _listar_resumos_pendentes, STATE_FILE, CONFIG_FILE, _storage
 
 
@@ -15,15 +28,15 @@ def _tratar_arquivo_cancelado(cnpj: str, chave: str) -> str | None:
     renomeia para -cancelada.xml. Retorna o novo caminho ou None.
     """
     nome = f"{chave}.xml"
-    if not _storage.existe(cnpj, nome):
+    if not _storage().existe(cnpj, nome):
         return None
-    root_tag = _storage.root_tag(cnpj, nome) or ""
+    root_tag = _storage().root_tag(cnpj, nome) or ""
     if root_tag == "resNFe":
-        _storage.remover(cnpj, nome)
+        _storage().remover(cnpj, nome)
         return None
     else:
         destino = f"{chave}-cancelada.xml"
-        return _storage.renomear(cnpj, nome, destino)
+        return _storage().renomear(cnpj, nome, destino)
 
 
 def _processar_e_salvar_docs(cnpj: str, docs: list, prefixo: str = "") -> list[str]:
@@ -38,8 +51,8 @@ def _processar_e_salvar_docs(cnpj: str, docs: list, prefixo: str = "") -> list[s
         else:
             chave = doc.chave or doc.nsu
             schema = doc.schema
-            substituiu = _storage.existe(cnpj, doc.nome) and "procNFe" in schema
-            arquivo = _salvar_xml(cnpj, doc.nome, doc.xml)
+            substituiu = _storage().existe(cnpj, doc.nome) and "procNFe" in schema
+            arquivo = _salvar_xml(cnpj, doc.nome, doc.conteudo, schema=schema, nsu=doc.nsu)
             if "procNFe" in schema:
                 tipo = "XML completo (substituiu resumo)" if substituiu else "XML completo"
                 completos.append(chave)
@@ -49,6 +62,97 @@ def _processar_e_salvar_docs(cnpj: str, docs: list, prefixo: str = "") -> list[s
     return completos
 
 
+def _recuperar_distribuicao(empresa, estado, backend) -> None:
+    """Confere a página registrada por uma execução interrompida de _baixar_distribuicao.
+
+    NSU abaixo do fim da página: ela não foi confirmada e será baixada de novo.
+    NSU já no fim mas documentos ausentes em downloads/: volta o NSU ao início
+    da página, para que a lacuna seja baixada outra vez.
+    """
+    cnpj = empresa.emitente.cnpj
+    ambiente = "homologacao" if empresa.homologacao else "producao"
+    pagina = backend.get_pagina_dfe(cnpj, ambiente)
+    if pagina is None:
+        return
+    nsu = backend.get_ultimo_nsu(cnpj, ambiente)
+    if nsu < pagina["ate"]:
+        print(f"Pagina NSU {pagina['de']}-{pagina['ate']} interrompida antes de confirmada: sera baixada novamente.")
+    else:
+        faltando = [nome for nome in pagina["docs"] if not _storage().existe(cnpj, nome)]
+        if faltando:
+            print(
+                f"AVISO: {len(faltando)} documento(s) da pagina NSU {pagina['de']}-{pagina['ate']} "
+                f"ausente(s) em downloads/ — NSU volta para {pagina['de']}."
+            )
+            set_ultimo_nsu(estado, cnpj, pagina["de"], ambiente)
+            backend.set_ultimo_nsu(cnpj, pagina["de"], ambiente)
+    backend.set_pagina_dfe(cnpj, None, ambiente)
+
+
+def _baixar_distribuicao(empresa, estado, nsu=None, prefixo: str = "", processos=None):
+    """Consome iter_distribuicao e grava log e documentos de cada pagina em segundo plano.
+
+    Retorna (ultima_pagina, chaves_procnfe_baixados). A gravacao de uma pagina
+    corre enquanto a proxima e buscada; a fila do gravador e limitada, entao no
+    maximo uma pagina fica pendente em memoria. Cada pagina e uma unidade:
+    registro write-ahead no estado (faixa de NSU e arquivos), documentos gravados
+    com fsync e so entao o NSU avanca (iter_distribuicao espera o gravador).
+    O registro so e feito nas paginas cujo NSU e gravado no backend (toda pagina
+    com SQLite; com JSON, as mesmas de _grava_nsu_agora).
+    Ao recomecar depois de uma interrupcao, _recuperar_distribuicao confere a
+    ultima pagina registrada.
+    """
+    cnpj = empresa.emitente.cnpj
+    ambiente = "homologacao" if empresa.homologacao else "producao"
+    backend = abrir_estado(STATE_FILE)
+    if nsu is None:
+        _recuperar_distribuicao(empresa, estado, backend)
+    de = nsu if nsu is not None else get_ultimo_nsu(estado, cnpj, ambiente)
+    ultima = None
+    gravado = {"registrada": False, "docs": 0}
+    completos = []
+
+    def _iniciar_pagina(pagina, de: int) -> None:
+        if pagina.xml_resposta is not None:
+            arq = _salvar_log_xml(pagina.xml_resposta, "dist-dfe", f"{cnpj}-p{pagina.pagina:03d}")
+            print(f"Resposta salva em: {arq}")
+        # só nas páginas cujo NSU vai para o disco: com JSON cada registro reescreve o
+        # arquivo inteiro, então segue o mesmo ritmo do NSU (a cada _SALVAR_A_CADA páginas)
+        if pagina.documentos and _grava_nsu_agora(backend, pagina):
+            backend.set_pagina_dfe(cnpj, {
+                "de": de, "ate": pagina.ultimo_nsu,
+                "docs": [d.nome for d in pagina.documentos if d.erro is None],
+            }, ambiente)
+            gravado["registrada"] = True
+
+    def _salvar_documento(doc) -> None:
+        completos.extend(_processar_e_salvar_docs(cnpj, [doc], prefixo=prefixo))
+
+    def _concluir_pagina(pagina) -> None:
+        _storage().registrar_nsus(cnpj, [(int(d.nsu), "ok" if d.erro is None else "erro") for d in pagina.documentos])
+        _storage().sincronizar(cnpj)
+        gravado["docs"] += len(pagina.documentos)
+        print(f"  Pagina {pagina.pagina}: {gravado['docs']} docs ate agora (NSU {pagina.ultimo_nsu}/{pagina.max_nsu})")
+
+    with GravadorSegundoPlano() as gravador:
+        paginas = iter_distribuicao(
+            empresa, estado, STATE_FILE, nsu=nsu, processos=processos,
+            aguardar_gravacao=lambda pagina: gravador.aguardar(),
+        )
+        for ultima in paginas:
+            gravador.enviar(_iniciar_pagina, ultima, de)
+            if ultima.documentos:
+                for doc in ultima.documentos:
+                    gravador.enviar(_salvar_documento, doc)
+                gravador.enviar(_concluir_pagina, ultima)
+            if ultima.status == "138":
+                de = ultima.ultimo_nsu
+    # iter_distribuicao já gravou o NSU da última página: nada pendente
+    if gravado["registrada"]:
+        backend.set_pagina_dfe(cnpj, None, ambiente)
+    return ultima, completos
+
+
 def cmd_consultar(args):
     empresa, estado = _carregar(args)
     cnpj = empresa.emitente.cnpj
@@ -96,8 +200,325 @@ def cmd_consultar(args):
         _processar_e_salvar_docs(cnpj, docs)
 
 
-def _cmd_consultar_nsu_empresa(empresa, args):
-    """Executa consultar-nsu para uma única empresa. Retorna True se sucesso."""
+# consultar-lote: colunas da saída (JSONL usa as mesmas chaves)
+_CAMPOS_LOTE = ("chave", "uf", "status", "motivo", "dfe_status", "dfe_motivo", "arquivos", "erro")
+LOTE_PARALELO = 8
+
+
+def _salvar_dfe_lote(cnpj: str, chave: str, dfe) -> list[str]:
+    """Como o trecho DFe de cmd_consultar, sem imprimir nada. Retorna os arquivos gravados."""
+    arquivos = []
+    if dfe.xml_cancelamento:
+        arquivos.append(_salvar_xml(cnpj, f"{chave}-cancelamento.xml", dfe.xml_cancelamento))
+        arq_cancelada = _tratar_arquivo_cancelado(cnpj, chave)
+        if arq_cancelada:
+            arquivos.append(arq_cancelada)
+    for doc in dfe.documentos:
+        if doc.erro is None:
+            arquivos.append(_salvar_xml(cnpj, doc.nome, doc.conteudo, schema=doc.schema, nsu=doc.nsu))
+    return arquivos
+
+
+async def _consultar_chave_lote(empresa, chave: str, cliente, com_dfe: bool, bloqueio: dict) -> dict:
+    """bloqueio["dfe"]: motivo do bloqueio da distribuição DFe (cooldown ou 656), compartilhado
+    entre os trabalhadores; com ele preenchido a chave não vai mais à distribuição."""
+    cnpj = empresa.emitente.cnpj
+    linha = dict.fromkeys(_CAMPOS_LOTE)
+    linha.update(chave=chave, uf=_uf_da_chave(chave), arquivos=[])
+    try:
+        resultado = await consultar_async(empresa, chave, cliente=cliente)
+        sit = resultado.situacao[0] if resultado.situacao else {"status": "", "motivo": ""}
+        linha.update(status=sit["status"], motivo=sit["motivo"])
+        # só as não autorizadas (cancelada, denegada, inexistente...) vão para a distribuição DFe;
+        # a NF-e emitida pelo próprio CNPJ não está disponível por lá
+        if com_dfe and sit["status"] != "100" and chave[6:20] != cnpj:
+            if bloqueio["dfe"]:
+                linha["dfe_motivo"] = f"Nao consultada: {bloqueio['dfe']}"
+                return linha
+            dfe = await consultar_dfe_chave_async(empresa, chave, cliente=cliente)
+            if dfe.status == "656":
+                bloqueio["dfe"] = bloqueio["dfe"] or f"{dfe.status} {dfe.motivo}"
+                bloqueio["novo"] = True
+                arquivos = []
+            else:
+                arquivos = await asyncio.to_thread(_salvar_dfe_lote, cnpj, chave, dfe)
+            linha.update(dfe_status=dfe.status, dfe_motivo=dfe.motivo, arquivos=arquivos)
+    except Exception as e:
+        linha["erro"] = f"{type(e).__name__}: {e}"
+    return linha
+
+
+async def _consultar_lote(empresa, chaves: list[str], paralelo: int, com_dfe: bool, escrever,
+                          bloqueio_dfe: str | None = None) -> str | None:
+    """Consulta as chaves agrupadas por UF, até `paralelo` simultâneas por autorizador.
+
+    Cada linha é entregue a escrever() assim que fica pronta, na ordem de término.
+    bloqueio_dfe (cooldown em vigor) desliga a distribuição DFe desde o início; num 656
+    nenhuma chave nova vai à distribuição e o motivo é retornado.
+    """
+    por_uf: dict[str, deque] = defaultdict(deque)
+    for chave in chaves:
+        por_uf[_uf_da_chave(chave) or empresa.uf].append(chave)
+    bloqueio = {"dfe": bloqueio_dfe, "novo": False}
+
+    async with ClienteSefazAsync(conexoes_por_host=paralelo) as cliente:
+        async def _trabalhador(fila: deque):
+            while fila:
+                escrever(await _consultar_chave_lote(empresa, fila.popleft(), cliente, com_dfe, bloqueio))
+
+        await asyncio.gather(*(
+            _trabalhador(fila) for fila in por_uf.values() for _ in range(min(paralelo, len(fila)))
+        ))
+    return bloqueio["dfe"] if bloqueio["novo"] else None
+
+
+def cmd_consultar_lote(args):
+    empresa, estado = _carregar(args)
+    cnpj = empresa.emitente.cnpj
+    ambiente = "homologacao" if empresa.homologacao else "producao"
+    paralelo = args.paralelo or LOTE_PARALELO
+    if paralelo < 1:
+        print("Erro: --paralelo deve ser maior ou igual a 1.")
+        sys.exit(1)
+    chaves = list(dict.fromkeys(list(args.chaves) + (_ler_chaves(args.arquivo) if args.arquivo else [])))
+    if not chaves:
+        print("Nenhuma chave informada (use CHAVE... ou --arquivo).")
+        sys.exit(1)
+
+    # stdout fica só com os resultados; progresso e resumo vão para stderr
+    print(f"Empresa: {empresa.nome} (CNPJ {empresa.emitente.cnpj})", file=sys.stderr)
+    print(f"Ambiente: {'Homologacao' if empresa.homologacao else 'Producao'}", file=sys.stderr)
+    print(f"Chaves: {len(chaves)}", file=sys.stderr)
+    com_dfe = not args.sem_dfe
+    bloqueado, msg = verificar_cooldown(get_cooldown(estado, cnpj, ambiente)) if com_dfe else (False, "")
+    if bloqueado:
+        print(f"{msg}: so a situacao sera consultada.", file=sys.stderr)
+
+    saida = open(args.saida, "w", newline="", encoding="utf-8") if args.saida else sys.stdout
+    contagem = {"linhas": 0, "autorizadas": 0, "erros": 0}
+    if args.formato == "csv":
+        escritor = csv.DictWriter(saida, fieldnames=_CAMPOS_LOTE)
+        escritor.writeheader()
+
+    def escrever(linha: dict) -> None:
+        contagem["linhas"] += 1
+        contagem["autorizadas"] += linha["status"] == "100"
+        contagem["erros"] += linha["erro"] is not None
+        if args.formato == "csv":
+            escritor.writerow({**linha, "arquivos": ";".join(linha["arquivos"])})
+        else:
+            saida.write(json.dumps(linha, ensure_ascii=False) + "\n")
+        saida.flush()
+
+    try:
+        bloqueio = asyncio.run(
+            _consultar_lote(empresa, chaves, paralelo, com_dfe, escrever, bloqueio_dfe=msg or None)
+        )
+    finally:
+        if saida is not sys.stdout:
+            saida.close()
+
+    print(
+        f"Resumo: {contagem['linhas']} chave(s), {contagem['autorizadas']} autorizada(s), "
+        f"{contagem['linhas'] - contagem['autorizadas'] - contagem['erros']} em outra situacao, "
+        f"{contagem['erros']} com erro.",
+        file=sys.stderr,
+    )
+    if bloqueio:
+        bloqueado_ate = calcular_proximo_cooldown()
+        set_cooldown(estado, cnpj, bloqueado_ate, ambiente)
+        abrir_estado(STATE_FILE).set_cooldown(cnpj, bloqueado_ate, ambiente)
+        print(f"BLOQUEADO pela SEFAZ ({bloqueio}). Distribuicao DFe liberada apos {bloqueado_ate}.", file=sys.stderr)
+        sys.exit(1)
+    if contagem["erros"]:
+        sys.exit(1)
+
+
+# baixar-chaves: chaves já resolvidas por CNPJ/ambiente, para retomar após interrupção
+_SECAO_BAIXAR_CHAVES = "baixar_chaves"
+# cStat que resolvem a chave de vez: documento baixado (138), cancelada (653) ou
+# sem documento para este CNPJ (137 nenhum localizado, 632 fora do prazo de download);
+# os demais (rejeições, indisponibilidade) ficam pendentes para a próxima execução
+_STATUS_CHAVE_RESOLVIDA = ("138", "653", "137", "632")
+
+
+async def _baixar_lote(empresa, itens: list, paralelo: int, consultar_dfe, concluir) -> str | None:
+    """Chama consultar_dfe(empresa, item, cliente=...) para cada item, até `paralelo` simultâneas.
+
+    concluir(item, dfe) é chamada quando o item termina, numa thread (grava
+    arquivos e estado com fsync, o que não pode parar o event loop).
+    Num 656 (consumo indevido) nenhum item novo é iniciado; retorna o motivo.
+    """
+    fila = deque(itens)
+    bloqueio = None
+
+    async with ClienteSefazAsync(conexoes_por_host=paralelo) as cliente:
+        async def _trabalhador():
+            nonlocal bloqueio
+            while fila and bloqueio is None:
+                item = fila.popleft()
+                try:
+                    dfe = await consultar_dfe(empresa, item, cliente=cliente)
+                except Exception as e:
+                    print(f"  {item}  ERRO: {e}")
+                    continue
+                if dfe.status == "656":
+                    bloqueio = bloqueio or f"{dfe.status} {dfe.motivo}"
+                    continue
+                await asyncio.to_thread(concluir, item, dfe)
+
+        await asyncio.gather(*(_trabalhador() for _ in range(min(paralelo, len(fila)))))
+    return bloqueio
+
+
+def cmd_baixar_chaves(args):
+    empresa, estado = _carregar(args)
+    cnpj = empresa.emitente.cnpj
+    ambiente = "homologacao" if empresa.homologacao else "producao"
+    paralelo = args.paralelo or LOTE_PARALELO
+    if paralelo < 1:
+        print("Erro: --paralelo deve ser maior ou igual a 1.")
+        sys.exit(1)
+    chaves = list(dict.fromkeys(list(args.chaves) + (_ler_chaves(args.arquivo) if args.arquivo else [])))
+    if not chaves:
+        print("Nenhuma chave informada (use CHAVE... ou --arquivo).")
+        sys.exit(1)
+
+    print(f"Empresa: {empresa.nome} (CNPJ {cnpj})")
+    print(f"Ambiente: {'Homologacao' if empresa.homologacao else 'Producao'}")
+
+    bloqueado, msg = verificar_cooldown(get_cooldown(estado, cnpj, ambiente))
+    if bloqueado:
+        print(f"BLOQUEADO: {msg}")
+        sys.exit(1)
+
+    backend = abrir_estado(STATE_FILE)
+    chave_ckpt = f"{cnpj}:{ambiente}"
+    feitas = {} if args.reiniciar else dict(backend.ler(_SECAO_BAIXAR_CHAVES, chave_ckpt) or {})
+    completas = _storage().listar_completos(cnpj)
+    restantes = [c for c in chaves if c not in completas and c not in feitas]
+    print(
+        f"Chaves: {len(chaves)} — {len(chaves) - len(restantes)} ja resolvida(s) "
+        f"(procNFe em disco ou execucao anterior), {len(restantes)} a consultar"
+    )
+    print()
+
+    baixadas = []
+
+    def concluir(chave: str, dfe) -> None:
+        arquivos = _salvar_dfe_lote(cnpj, chave, dfe)
+        # checkpoint só depois dos arquivos gravados: uma interrupção no meio
+        # faz a chave ser consultada de novo, nunca pulada
+        resolvida = dfe.status in _STATUS_CHAVE_RESOLVIDA and all(d.erro is None for d in dfe.documentos)
+        if resolvida:
+            backend.atualizar_chave(
+                _SECAO_BAIXAR_CHAVES, chave_ckpt, lambda atual: {**(atual or {}), chave: dfe.status},
+            )
+        if dfe.sucesso:
+            baixadas.append(chave)
+        detalhe = f" — {', '.join(arquivos)}" if arquivos else ""
+        print(f"  {chave}  cStat={dfe.status}  {dfe.motivo}{detalhe}")
+
+    bloqueio = (
+        asyncio.run(_baixar_lote(empresa, restantes, paralelo, consultar_dfe_chave_async, concluir))
+        if restantes else None
+    )
+    resolvidas = set(backend.ler(_SECAO_BAIXAR_CHAVES, chave_ckpt) or {}) | completas | set(baixadas)
+    faltam = [c for c in chaves if c not in resolvidas]
+
+    print()
+    print(f"Resumo: {len(baixadas)} chave(s) com documento baixado, {len(faltam)} chave(s) pendente(s).")
+    if bloqueio:
+        bloqueado_ate = calcular_proximo_cooldown()
+        set_cooldown(estado, cnpj, bloqueado_ate, ambiente)
+        backend.set_cooldown(cnpj, bloqueado_ate, ambiente)
+        print(f"BLOQUEADO pela SEFAZ ({bloqueio}). Execute novamente apos {bloqueado_ate} para continuar.")
+        sys.exit(1)
+    if faltam:
+        print("Execute novamente para retomar as chaves pendentes.")
+        sys.exit(1)
+    backend.remover(_SECAO_BAIXAR_CHAVES, chave_ckpt)
+
+
+def _faixas(lacunas: list[tuple[int, int]]) -> str:
+    return ", ".join(str(ini) if ini == fim else f"{ini}-{fim}" for ini, fim in lacunas)
+
+
+def cmd_verificar_nsu(args):
+    empresa, estado = _carregar(args)
+    cnpj = empresa.emitente.cnpj
+    ambiente = "homologacao" if empresa.homologacao else "producao"
+    paralelo = args.paralelo or LOTE_PARALELO
+    if paralelo < 1:
+        print("Erro: --paralelo deve ser maior ou igual a 1.")
+        sys.exit(1)
+
+    print(f"Empresa: {empresa.nome} (CNPJ {cnpj})")
+    print(f"Ambiente: {'Homologacao' if empresa.homologacao else 'Producao'}")
+
+    ultimo = get_ultimo_nsu(estado, cnpj, ambiente)
+    lacunas = _storage().lacunas_nsu(cnpj, ultimo, desde=args.desde)
+    if not lacunas:
+        print(f"Nenhuma lacuna de NSU ate {ultimo}.")
+        return
+    faltando = [nsu for ini, fim in lacunas for nsu in range(ini, fim + 1)]
+    print(f"{len(faltando)} NSU(s) sem documento ate {ultimo}: {_faixas(lacunas)}")
+    if not args.baixar:
+        print(f"Execute 'nfe-sync verificar-nsu {empresa.nome} --baixar' para buscar cada NSU na SEFAZ.")
+        sys.exit(1)
+
+    bloqueado, msg = verificar_cooldown(get_cooldown(estado, cnpj, ambiente))
+    if bloqueado:
+        print(f"BLOQUEADO: {msg}")
+        sys.exit(1)
+
+    if args.limite is not None:
+        faltando = faltando[:args.limite]
+    print(f"Buscando {len(faltando)} NSU(s) (consNSU)...")
+    print()
+
+    def concluir(nsu: int, dfe) -> None:
+        arquivos = []
+        situacao = None
+        if dfe.status == "138":
+            arquivos = [
+                _salvar_xml(cnpj, doc.nome, doc.conteudo, schema=doc.schema, nsu=doc.nsu)
+                for doc in dfe.documentos if doc.erro is None
+            ]
+            _storage().sincronizar(cnpj)
+            situacao = "ok" if all(doc.erro is None for doc in dfe.documentos) else "erro"
+        elif dfe.status in ("137", "632"):
+            situacao = "vazio"  # NSU sem documento para este CNPJ: não é lacuna
+        # registro só depois dos arquivos gravados; outros cStat continuam como lacuna
+        if situacao:
+            _storage().registrar_nsus(cnpj, [(nsu, situacao)])
+        detalhe = f" — {', '.join(arquivos)}" if arquivos else ""
+        print(f"  NSU {nsu}  cStat={dfe.status}  {dfe.motivo}{detalhe}")
+
+    bloqueio = asyncio.run(_baixar_lote(empresa, faltando, paralelo, consultar_dfe_nsu_async, concluir))
+    restantes = _storage().lacunas_nsu(cnpj, ultimo, desde=args.desde)
+
+    print()
+    if restantes:
+        print(f"Resumo: ainda sem documento: {_faixas(restantes)}")
+    else:
+        print(f"Resumo: nenhuma lacuna de NSU ate {ultimo}.")
+    if bloqueio:
+        bloqueado_ate = calcular_proximo_cooldown()
+        set_cooldown(estado, cnpj, bloqueado_ate, ambiente)
+        abrir_estado(STATE_FILE).set_cooldown(cnpj, bloqueado_ate, ambiente)
+        print(f"BLOQUEADO pela SEFAZ ({bloqueio}). Execute novamente apos {bloqueado_ate} para continuar.")
+        sys.exit(1)
+    if restantes:
+        sys.exit(1)
+
+
+def _cmd_consultar_nsu_empresa(empresa, args, interativo: bool = True):
+    """Executa consultar-nsu para uma única empresa. Retorna True se sucesso.
+
+    interativo=False pula a pergunta de ciencia para resumos pendentes
+    (usado em --paralelo, onde não há terminal dedicado a cada empresa).
+    """
     estado = carregar_estado(STATE_FILE)
     cnpj = empresa.emitente.cnpj
     nsu = args.nsu
@@ -105,7 +526,7 @@ def _cmd_consultar_nsu_empresa(empresa, args):
     if args.zerar_nsu:
         ambiente = "homologacao" if empresa.homologacao else "producao"
         set_ultimo_nsu(estado, cnpj, 0, ambiente)
-        salvar_estado(STATE_FILE, estado)
+        abrir_estado(STATE_FILE).set_ultimo_nsu(cnpj, 0, ambiente)
         nsu = 0
         print(f"NSU zerado para {cnpj}.")
 
@@ -114,9 +535,6 @@ def _cmd_consultar_nsu_empresa(empresa, args):
     print(f"Consultando distribuicao DFe (NSU: {nsu if nsu is not None else 'ultimo salvo'})...")
     print()
 
-    def progresso(pagina, total_docs, ult_nsu, max_nsu):
-        print(f"  Pagina {pagina}: {total_docs} docs ate agora (NSU {ult_nsu}/{max_nsu})")
-
     if args.chave:
         resultado = consultar_dfe_chave(empresa, args.chave)
         arq_resp = _salvar_log_xml(resultado.xml_resposta, "dist-dfe-chave", args.chave)
@@ -137,15 +555,15 @@ def _cmd_consultar_nsu_empresa(empresa, args):
             _processar_e_salvar_docs(cnpj, docs)
         return True
 
-    resultado = consultar_nsu(empresa, estado, STATE_FILE, nsu=nsu, callback=progresso)
+    processos = getattr(args, "processos", None)
+    resultado, _ = _baixar_distribuicao(empresa, estado, nsu=nsu, processos=processos)
 
-    if not resultado.sucesso and resultado.motivo and resultado.status is None:
+    if resultado.status is None:
         print(f"BLOQUEADO: {resultado.motivo}")
         return False
 
-    if not resultado.sucesso:
-        if resultado.status:
-            print(f"Status: {resultado.status}")
+    if resultado.status not in ("137", "138"):
+        print(f"Status: {resultado.status}")
         if resultado.motivo:
             print(f"Motivo: {resultado.motivo}")
         return False
@@ -155,15 +573,6 @@ def _cmd_consultar_nsu_empresa(empresa, args):
     print(f"Ultimo NSU: {resultado.ultimo_nsu}")
     print(f"Max NSU: {resultado.max_nsu}")
 
-    for i, xml_resp in enumerate(resultado.xmls_resposta, start=1):
-        arq = _salvar_log_xml(xml_resp, "dist-dfe", f"{cnpj}-p{i:03d}")
-        print(f"Resposta salva em: {arq}")
-
-    docs = resultado.documentos
-    if docs:
-        print(f"Documentos: {len(docs)}")
-        _processar_e_salvar_docs(cnpj, docs)
-
     pendentes = _listar_resumos_pendentes(cnpj)
     if pendentes:
         print()
@@ -171,6 +580,9 @@ def _cmd_consultar_nsu_empresa(empresa, args):
         for chave in pendentes:
             print(f"  {chave}")
         print()
+        if not interativo:
+            print(f"Execute 'nfe-sync consultar-nsu {empresa.nome}' para registrar ciencia.")
+            return True
         try:
             resposta = input("Registrar ciencia e baixar XML completo para todas? [s/N] ").strip().lower()
         except (EOFError, KeyboardInterrupt):
@@ -178,35 +590,23 @@ def _cmd_consultar_nsu_empresa(empresa, args):
         if resposta == "s":
             print()
             print("Registrando ciencia da operacao...")
-            canceladas = []
-            for chave in pendentes:
-                try:
-                    res = manifestar(empresa, "ciencia", chave, "")
-                    _salvar_log_xml(res.xml_resposta, "manifestacao", f"{cnpj}-ciencia")
-                    _salvar_xml(cnpj, f"{chave}-evento-ciencia.xml", res.xml)
-                    for r in res.resultados:
-                        print(f"  {chave[:8]}...  cStat={r['status']}  {r['motivo']}")
-                        if r["status"] == "650":
-                            canceladas.append(chave)
-                except Exception as e:
-                    print(f"  {chave[:8]}...  ERRO: {e}")
+            itens = _registrar_lote(empresa, "ciencia", pendentes)
+            canceladas = [i.chave for i in itens if i.erro is None and i.status == "650"]
             for chave in canceladas:
-                if _storage.existe(cnpj, f"{chave}.xml"):
-                    _storage.remover(cnpj, f"{chave}.xml")
+                if _storage().existe(cnpj, f"{chave}.xml"):
+                    _storage().remover(cnpj, f"{chave}.xml")
                     print(f"  {chave[:8]}...  resNFe removido (NF-e cancelada/denegada)")
             print()
             print("Consultando novamente para baixar XML completo...")
             estado2 = carregar_estado(STATE_FILE)
-            resultado2 = consultar_nsu(empresa, estado2, STATE_FILE, callback=progresso)
+            resultado2, completos = _baixar_distribuicao(
+                empresa, estado2, prefixo="NSU ... ", processos=processos,
+            )
             print(f"Status: {resultado2.status}")
             print(f"Motivo: {resultado2.motivo}")
-            docs2 = resultado2.documentos
-            if docs2:
-                print(f"Documentos: {len(docs2)}")
-                completos = _processar_e_salvar_docs(cnpj, docs2, prefixo=f"NSU ... ")
-                if completos:
-                    print()
-                    print(f"XML completo baixado para {len(completos)} NF-e(s).")
+            if completos:
+                print()
+                print(f"XML completo baixado para {len(completos)} NF-e(s).")
             ainda_pendentes = _listar_resumos_pendentes(cnpj)
             if ainda_pendentes:
                 print()
@@ -215,8 +615,82 @@ def _cmd_consultar_nsu_empresa(empresa, args):
     return True
 
 
+class _SaidaPorThread(io.TextIOBase):
+    """Substituto de sys.stdout que desvia o print() de cada worker para um buffer próprio.
+
+    O buffer fica num ContextVar: as tarefas que o worker envia ao gravador em
+    segundo plano rodam no contexto dele e escrevem no mesmo buffer. Threads
+    sem captura ativa continuam escrevendo no destino original.
+    """
+
+    def __init__(self, destino):
+        self._destino = destino
+        self._buffer: contextvars.ContextVar[io.StringIO | None] = contextvars.ContextVar("saida", default=None)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, texto: str) -> int:
+        return (self._buffer.get() or self._destino).write(texto)
+
+    def flush(self) -> None:
+        self._destino.flush()
+
+    @contextmanager
+    def capturar(self):
+        buffer = io.StringIO()
+        token = self._buffer.set(buffer)
+        try:
+            yield buffer
+        finally:
+            self._buffer.reset(token)
+
+
+def _consultar_nsu_bufferizado(saida: _SaidaPorThread, empresa, args) -> tuple[bool, str]:
+    """Worker de --paralelo: roda uma empresa com saída capturada. Retorna (sucesso, saida)."""
+    with saida.capturar() as buffer:
+        try:
+            sucesso = _cmd_consultar_nsu_empresa(empresa, args, interativo=False)
+        except Exception as e:
+            print(f"ERRO: {e}")
+            sucesso = False
+    return sucesso, buffer.getvalue()
+
+
+def _consultar_nsu_paralelo(empresas: dict, args) -> list[str]:
+    """Consulta várias empresas com até args.paralelo workers. Retorna nomes com falha.
+
+    A saída de cada empresa é impressa inteira, na ordem em que terminam.
+    """
+    saida = _SaidaPorThread(sys.stdout)
+    falhas = []
+    sys.stdout = saida
+    try:
+        with ThreadPoolExecutor(max_workers=args.paralelo) as pool:
+            futuros = {
+                pool.submit(_consultar_nsu_bufferizado, saida, empresa, args): nome
+                for nome, empresa in empresas.items()
+            }
+            for i, futuro in enumerate(as_completed(futuros)):
+                nome = futuros[futuro]
+                sucesso, texto = futuro.result()
+                if i > 0:
+                    print()
+                    print("=" * 60)
+                    print()
+                print(texto, end="")
+                if not sucesso:
+                    falhas.append(nome)
+    finally:
+        sys.stdout = saida._destino
+    return falhas
+
+
 def cmd_consultar_nsu(args):
     if args.empresa:
+        if args.paralelo:
+            print("Erro: --paralelo so se aplica sem empresa especificada.")
+            sys.exit(1)
         empresa, _ = _carregar(args)
         sucesso = _cmd_consultar_nsu_empresa(empresa, args)
         if not sucesso:
@@ -225,26 +699,35 @@ def cmd_consultar_nsu(args):
         if args.chave or args.zerar_nsu:
             print("Erro: --chave e --zerar-nsu requerem empresa especificada.")
             sys.exit(1)
+        if args.paralelo is not None and args.paralelo < 1:
+            print("Erro: --paralelo deve ser maior ou igual a 1.")
+            sys.exit(1)
         todas = carregar_empresas(CONFIG_FILE)
         if not todas:
             print("Nenhuma empresa configurada.")
             sys.exit(1)
-        falhas = []
-        for i, (nome, empresa_cfg) in enumerate(todas.items()):
-            if i > 0:
-                print()
-                print("=" * 60)
-                print()
-            if args.producao:
-                empresa_cfg = empresa_cfg.model_copy(update={"homologacao": False})
-            elif args.homologacao:
-                empresa_cfg = empresa_cfg.model_copy(update={"homologacao": True})
-            sucesso = _cmd_consultar_nsu_empresa(empresa_cfg, args)
-            if not sucesso:
-                falhas.append(nome)
+        if args.producao:
+            todas = {n: e.model_copy(update={"homologacao": False}) for n, e in todas.items()}
+        elif args.homologacao:
+            todas = {n: e.model_copy(update={"homologacao": True}) for n, e in todas.items()}
+
+        if args.paralelo:
+            falhas = _consultar_nsu_paralelo(todas, args)
+        else:
+            falhas = []
+            for i, (nome, empresa_cfg) in enumerate(todas.items()):
+                if i > 0:
+                    print()
+                    print("=" * 60)
+                    print()
+                sucesso = _cmd_consultar_nsu_empresa(empresa_cfg, args)
+                if not sucesso:
+                    falhas.append(nome)
+
+        print()
+        print(f"Resumo: {len(todas)} empresa(s), {len(todas) - len(falhas)} ok, {len(falhas)} com falha.")
         if falhas:
-            print()
-            print(f"Falha em: {', '.join(falhas)}")
+            print(f"Falha em: {', '.join(sorted(falhas))}")
             sys.exit(1)
 
 
@@ -272,6 +755,77 @@ def cmd_pendentes(args):
         print("Nenhum resumo pendente em nenhuma empresa.")
 
 
+def cmd_reindexar(args):
+    if args.empresa:
+        empresa, _ = _carregar(args)
+        empresas_cnpj = [(args.empresa, empresa.emitente.cnpj)]
+    else:
+        todas = carregar_empresas(CONFIG_FILE)
+        empresas_cnpj = [(nome, e.emitente.cnpj) for nome, e in todas.items()]
+
+    for nome, cnpj in empresas_cnpj:
+        lidos = _storage().reindexar(cnpj)
+        print(f"{nome} ({cnpj}): {lidos} arquivo(s) (re)indexado(s).")
+
+
+def cmd_migrar_layout(args):
+    if args.empresa:
+        empresa, _ = _carregar(args)
+        empresas_cnpj = [(args.empresa, empresa.emitente.cnpj)]
+    else:
+        todas = carregar_empresas(CONFIG_FILE)
+        empresas_cnpj = [(nome, e.emitente.cnpj) for nome, e in todas.items()]
+    if args.limite is not None and args.limite < 1:
+        print("Erro: --limite deve ser maior ou igual a 1.")
+        sys.exit(1)
+
+    print(f"Layout: {_storage().layout}")
+    pendentes = 0
+    for nome, cnpj in empresas_cnpj:
+        movidos, restantes = _storage().migrar_layout(cnpj, limite=args.limite)
+        print(f"{nome} ({cnpj}): {movidos} arquivo(s) movido(s), {restantes} restante(s).")
+        pendentes += restantes
+    if pendentes:
+        print("Execute novamente para continuar a migracao.")
+
+
+def cmd_compactar(args):
+    if not isinstance(_storage(), DocumentoStorageCompactado):
+        print("Erro: compactar exige NFE_SYNC_STORAGE=gzip.")
+        sys.exit(1)
+    if args.empresa:
+        empresa, _ = _carregar(args)
+        empresas_cnpj = [(args.empresa, empresa.emitente.cnpj)]
+    else:
+        todas = carregar_empresas(CONFIG_FILE)
+        empresas_cnpj = [(nome, e.emitente.cnpj) for nome, e in todas.items()]
+    if args.limite is not None and args.limite < 1:
+        print("Erro: --limite deve ser maior ou igual a 1.")
+        sys.exit(1)
+
+    pendentes = 0
+    for nome, cnpj in empresas_cnpj:
+        compactados, restantes = _storage().compactar(cnpj, limite=args.limite)
+        print(f"{nome} ({cnpj}): {compactados} arquivo(s) compactado(s), {restantes} restante(s).")
+        pendentes += restantes
+    if pendentes:
+        print("Execute novamente para continuar a compactacao.")
+
+
+def cmd_exportar_xml(args):
+    if args.empresa:
+        empresa, _ = _carregar(args)
+        empresas_cnpj = [(args.empresa, empresa.emitente.cnpj)]
+    else:
+        todas = carregar_empresas(CONFIG_FILE)
+        empresas_cnpj = [(nome, e.emitente.cnpj) for nome, e in todas.items()]
+
+    for nome, cnpj in empresas_cnpj:
+        destino = f"{args.destino}/{cnpj}"
+        total = _storage().exportar(cnpj, destino)
+        print(f"{nome} ({cnpj}): {total} arquivo(s) exportado(s) para {destino}/.")
+
+
 class ConsultaBlueprint(CliBlueprint):
     def register(self, subparsers, parser, amb_parent=None) -> None:
         parents = [amb_parent] if amb_parent else []
@@ -288,6 +842,65 @@ class ConsultaBlueprint(CliBlueprint):
         p_consultar.add_argument("chave", help="Chave de acesso com 44 digitos")
         p_consultar.set_defaults(func=cmd_consultar)
 
+        p_lote = subparsers.add_parser(
+            "consultar-lote",
+            parents=parents,
+            help=argparse.SUPPRESS,
+            description=(
+                "Consulta a situacao de varias NF-e em um unico processo, agrupadas por UF e "
+                "em paralelo, reaproveitando as conexoes. Escreve uma linha por chave (JSONL ou CSV) "
+                "assim que cada resultado chega; as nao autorizadas tambem sao buscadas na distribuicao DFe."
+            ),
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            epilog=(
+                "Exemplos:\n"
+                "  nfe-sync consultar-lote MINHAEMPRESA --arquivo chaves.txt > situacao.jsonl\n"
+                "  cat chaves.txt | nfe-sync consultar-lote MINHAEMPRESA --arquivo - --formato csv\n"
+                "  nfe-sync consultar-lote MINHAEMPRESA CHAVE1 CHAVE2 --paralelo 16 --sem-dfe"
+            ),
+        )
+        p_lote.add_argument("empresa", help="Nome da empresa (secao no nfe-sync.conf.ini)")
+        p_lote.add_argument("chaves", nargs="*", default=[], help="Chaves de acesso com 44 digitos")
+        p_lote.add_argument("--arquivo", default=None, help="Arquivo com uma chave por linha ('-' = entrada padrao)")
+        p_lote.add_argument("--formato", choices=["jsonl", "csv"], default="jsonl", help="Formato da saida (padrao: jsonl)")
+        p_lote.add_argument("--saida", default=None, help="Arquivo de saida (padrao: saida padrao)")
+        p_lote.add_argument(
+            "--paralelo", type=int, default=None, metavar="N",
+            help=f"Consultas simultaneas por UF (padrao: {LOTE_PARALELO})",
+        )
+        p_lote.add_argument("--sem-dfe", action="store_true", help="Nao buscar as nao autorizadas na distribuicao DFe")
+        p_lote.set_defaults(func=cmd_consultar_lote)
+
+        p_baixar = subparsers.add_parser(
+            "baixar-chaves",
+            parents=parents,
+            help=argparse.SUPPRESS,
+            description=(
+                "Baixa o XML completo (procNFe) de varias chaves pela distribuicao DFe, pulando as que ja "
+                "tem procNFe em downloads/. O progresso fica no arquivo de estado: se interrompido "
+                "(ou bloqueado pela SEFAZ), execute de novo com a mesma lista para continuar."
+            ),
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            epilog=(
+                "Exemplos:\n"
+                "  nfe-sync baixar-chaves MINHAEMPRESA --arquivo chaves.txt\n"
+                "  nfe-sync baixar-chaves MINHAEMPRESA CHAVE1 CHAVE2 --paralelo 4\n"
+                "  nfe-sync baixar-chaves MINHAEMPRESA --arquivo chaves.txt --reiniciar"
+            ),
+        )
+        p_baixar.add_argument("empresa", help="Nome da empresa (secao no nfe-sync.conf.ini)")
+        p_baixar.add_argument("chaves", nargs="*", default=[], help="Chaves de acesso com 44 digitos")
+        p_baixar.add_argument("--arquivo", default=None, help="Arquivo com uma chave por linha ('-' = entrada padrao)")
+        p_baixar.add_argument(
+            "--paralelo", type=int, default=None, metavar="N",
+            help=f"Requisicoes simultaneas (padrao: {LOTE_PARALELO}; o ritmo segue NFE_SYNC_LIMITES)",
+        )
+        p_baixar.add_argument(
+            "--reiniciar", action="store_true",
+            help="Ignora o progresso salvo e consulta de novo as chaves sem procNFe em disco",
+        )
+        p_baixar.set_defaults(func=cmd_baixar_chaves)
+
         p_nsu = subparsers.add_parser(
             "consultar-nsu",
             parents=parents,
@@ -298,15 +911,55 @@ class ConsultaBlueprint(CliBlueprint):
                 "Exemplos:\n"
                 "  nfe-sync consultar-nsu MINHAEMPRESA\n"
                 "  nfe-sync consultar-nsu MINHAEMPRESA --nsu 0\n"
-                "  nfe-sync consultar-nsu MINHAEMPRESA --zerar-nsu"
+                "  nfe-sync consultar-nsu MINHAEMPRESA --zerar-nsu\n"
+                "  nfe-sync consultar-nsu --paralelo 8\n"
+                "  nfe-sync consultar-nsu MINHAEMPRESA --zerar-nsu --processos 4"
             ),
         )
         p_nsu.add_argument("empresa", nargs="?", default=None, help="Nome da empresa (omitir para consultar todas)")
         p_nsu.add_argument("--nsu", type=int, default=None, help="NSU inicial (padrao: ultimo NSU salvo)")
         p_nsu.add_argument("--zerar-nsu", action="store_true", help="Zera o NSU salvo e recomeça do inicio (ultimos 90 dias)")
         p_nsu.add_argument("--chave", default=None, help="Baixar documento DFe de uma chave especifica sem avançar o NSU")
+        p_nsu.add_argument(
+            "--paralelo", type=int, default=None, metavar="N",
+            help="Sem empresa: consultar ate N empresas ao mesmo tempo (sem pergunta de ciencia)",
+        )
+        p_nsu.add_argument(
+            "--processos", type=int, default=None, metavar="N",
+            help="Descompactar os documentos de cada pagina em N processos (padrao: env NFE_SYNC_PROCESSOS)",
+        )
         p_nsu.set_defaults(func=cmd_consultar_nsu)
 
+        p_verificar = subparsers.add_parser(
+            "verificar-nsu",
+            parents=parents,
+            help=argparse.SUPPRESS,
+            description=(
+                "Lista as faixas de NSU sem documento registrado em downloads/ ate o ultimo NSU salvo. "
+                "Com --baixar, busca cada NSU faltante individualmente na SEFAZ (consNSU), "
+                "sem alterar o NSU salvo."
+            ),
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            epilog=(
+                "Exemplos:\n"
+                "  nfe-sync verificar-nsu MINHAEMPRESA\n"
+                "  nfe-sync verificar-nsu MINHAEMPRESA --baixar\n"
+                "  nfe-sync verificar-nsu MINHAEMPRESA --desde 1 --baixar --limite 50"
+            ),
+        )
+        p_verificar.add_argument("empresa", help="Nome da empresa (secao no nfe-sync.conf.ini)")
+        p_verificar.add_argument(
+            "--desde", type=int, default=None, metavar="NSU",
+            help="Primeiro NSU a verificar (padrao: menor NSU ja registrado)",
+        )
+        p_verificar.add_argument("--baixar", action="store_true", help="Buscar na SEFAZ cada NSU faltante")
+        p_verificar.add_argument("--limite", type=int, default=None, metavar="N", help="Buscar no maximo N NSUs nesta execucao")
+        p_verificar.add_argument(
+            "--paralelo", type=int, default=None, metavar="N",
+            help=f"Requisicoes simultaneas (padrao: {LOTE_PARALELO}; o ritmo segue NFE_SYNC_LIMITES)",
+        )
+        p_verificar.set_defaults(func=cmd_verificar_nsu)
+
         p_pendentes = subparsers.add_parser(
             "pendentes",
             parents=parents,
@@ -317,3 +970,74 @@ class ConsultaBlueprint(CliBlueprint):
         )
         p_pendentes.add_argument("empresa", nargs="?", default=None, help="Nome da empresa (omitir para consultar todas)")
         p_pendentes.set_defaults(func=cmd_pendentes)
+
+        p_reindexar = subparsers.add_parser(
+            "reindexar",
+            parents=parents,
+            help=argparse.SUPPRESS,
+            description=(
+                "Sincroniza o indice de downloads/{cnpj}/ com os arquivos em disco. "
+                "Necessario apenas se XMLs forem copiados, alterados ou apagados fora do nfe-sync."
+            ),
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            epilog="Exemplos:\n  nfe-sync reindexar\n  nfe-sync reindexar MINHAEMPRESA",
+        )
+        p_reindexar.add_argument("empresa", nargs="?", default=None, help="Nome da empresa (omitir para todas)")
+        p_reindexar.set_defaults(func=cmd_reindexar)
+
+        p_layout = subparsers.add_parser(
+            "migrar-layout",
+            parents=parents,
+            help=argparse.SUPPRESS,
+            description=(
+                "Move os XMLs de downloads/{cnpj}/ para o layout definido em NFE_SYNC_LAYOUT "
+                "(plano ou aamm). Pode rodar com o nfe-sync em uso: cada arquivo e movido "
+                "individualmente e os comandos encontram os arquivos nos dois layouts. "
+                "Se interrompida (ou com --limite), execute de novo para continuar."
+            ),
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            epilog=(
+                "Exemplos:\n"
+                "  NFE_SYNC_LAYOUT=aamm nfe-sync migrar-layout\n"
+                "  NFE_SYNC_LAYOUT=aamm nfe-sync migrar-layout MINHAEMPRESA --limite 50000"
+            ),
+        )
+        p_layout.add_argument("empresa", nargs="?", default=None, help="Nome da empresa (omitir para todas)")
+        p_layout.add_argument("--limite", type=int, default=None, metavar="N", help="Mover no maximo N arquivos por empresa")
+        p_layout.set_defaults(func=cmd_migrar_layout)
+
+        p_compactar = subparsers.add_parser(
+            "compactar",
+            parents=parents,
+            help=argparse.SUPPRESS,
+            description=(
+                "Com NFE_SYNC_STORAGE=gzip, passa os XMLs soltos de downloads/{cnpj}/ (gravados no "
+                "modo arquivos) para os segmentos comprimidos. Ate la eles continuam legiveis. "
+                "Cada arquivo so e apagado depois de gravado no segmento; se interrompida "
+                "(ou com --limite), execute de novo para continuar."
+            ),
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            epilog=(
+                "Exemplos:\n"
+                "  NFE_SYNC_STORAGE=gzip nfe-sync compactar\n"
+                "  NFE_SYNC_STORAGE=gzip nfe-sync compactar MINHAEMPRESA --limite 50000"
+            ),
+        )
+        p_compactar.add_argument("empresa", nargs="?", default=None, help="Nome da empresa (omitir para todas)")
+        p_compactar.add_argument("--limite", type=int, default=None, metavar="N", help="Compactar no maximo N arquivos por empresa")
+        p_compactar.set_defaults(func=cmd_compactar)
+
+        p_exportar = subparsers.add_parser(
+            "exportar-xml",
+            parents=parents,
+            help=argparse.SUPPRESS,
+            description=(
+                "Grava os documentos de downloads/{cnpj}/ como arquivos XML soltos em outro diretorio. "
+                "Util com NFE_SYNC_STORAGE=gzip, em que os XMLs ficam comprimidos em segmentos."
+            ),
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            epilog="Exemplos:\n  nfe-sync exportar-xml MINHAEMPRESA --destino /tmp/xml\n  nfe-sync exportar-xml --destino backup",
+        )
+        p_exportar.add_argument("empresa", nargs="?", default=None, help="Nome da empresa (omitir para todas)")
+        p_exportar.add_argument("--destino", default="exportados", help="Diretorio de saida (padrao: exportados)")
+        p_exportar.set_defaults(func=cmd_exportar_xml)
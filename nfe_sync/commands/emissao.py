@@ -3,21 +3,22 @@ import os
 import sys
 from decimal import Decimal
 
-from . import CliBlueprint, _carregar, _salvar_log_xml, CONFIG_FILE
+from . import CliBlueprint, _carregar, _salvar_log_xml, CONFIG_FILE, STATE_FILE
 from ..config import carregar_empresas
-from ..state import get_ultimo_numero_nf, set_ultimo_numero_nf, salvar_estado
+from ..disjuntor import disjuntor_ativo
+from ..state import abrir_estado
 from ..models import Destinatario, Produto, Pagamento, DadosEmissao, Endereco
 
-STATE_FILE = ".state.json"
-
 
 def cmd_emitir(args):
-    empresa, estado = _carregar(args)
+    empresa, _ = _carregar(args)
     cnpj = empresa.emitente.cnpj
     serie = args.serie
     ambiente = "homologacao" if empresa.homologacao else "producao"
 
-    ultimo = get_ultimo_numero_nf(estado, cnpj, serie, ambiente)
+    # numeração lida e gravada por chave: não reescreve NSU/cooldown gravados por outros processos
+    backend = abrir_estado(STATE_FILE)
+    ultimo = backend.get_ultimo_numero_nf(cnpj, serie, ambiente)
     numero_nf = ultimo + 1
 
     print(f"Empresa: {empresa.nome} (CNPJ {cnpj})")
@@ -97,8 +98,18 @@ def cmd_emitir(args):
         informacoes_complementares="NF-e de teste emitida em homologacao.",
     )
 
+    if args.contingencia and not args.forcar_contingencia and disjuntor_ativo().backend is None:
+        # com o .state.json o disjuntor vale só para este processo, que ainda não falhou nenhuma vez
+        print("Aviso: disjuntor em memoria (estado JSON); --contingencia so troca para SVC com "
+              "NFE_SYNC_STATE em SQLite. Use --forcar-contingencia para emitir em SVC agora.")
+
     from ..emissao import emitir
-    resultado = emitir(empresa, serie, numero_nf, dados)
+    resultado = emitir(
+        empresa, serie, numero_nf, dados,
+        contingencia=args.contingencia, forcar_contingencia=args.forcar_contingencia,
+    )
+    if resultado.contingencia:
+        print(f"Autorizador da UF indisponivel: emitida em contingencia {resultado.contingencia}")
 
     if resultado.sucesso:
         _salvar_log_xml(resultado.xml, "emissao", cnpj)
@@ -113,8 +124,7 @@ def cmd_emitir(args):
         print(f"Chave: {resultado.chave}")
         print(f"XML salvo em: {arquivo}")
 
-        set_ultimo_numero_nf(estado, cnpj, serie, numero_nf, ambiente)
-        salvar_estado(STATE_FILE, estado)
+        backend.set_ultimo_numero_nf(cnpj, serie, numero_nf, ambiente)
         print(f"Numero NF {numero_nf} serie {serie} salvo em {STATE_FILE}")
     else:
         if resultado.xml_resposta:
@@ -134,10 +144,20 @@ class EmissaoBlueprint(CliBlueprint):
             help=argparse.SUPPRESS,
             description="Emite uma NF-e de teste em homologacao na SEFAZ.",
             formatter_class=argparse.RawDescriptionHelpFormatter,
-            epilog="Exemplo:\n  nfe-sync emitir MINHAEMPRESA --serie 1",
+            epilog=(
+                "Exemplos:\n"
+                "  nfe-sync emitir MINHAEMPRESA --serie 1\n"
+                "  nfe-sync emitir MINHAEMPRESA --serie 1 --contingencia 'SEFAZ da UF fora do ar'\n"
+                "  nfe-sync emitir MINHAEMPRESA --serie 1 --contingencia 'SEFAZ da UF fora do ar' --forcar-contingencia"
+            ),
         )
         p.add_argument("empresa", help="Nome da empresa (secao no nfe-sync.conf.ini)")
         p.add_argument("--serie", required=True, help="Serie da NF-e")
         p.add_argument("--destinatario", default=None,
                        help="Empresa destinataria (secao no nfe-sync.conf.ini). Se omitido, usa o emitente.")
+        p.add_argument("--contingencia", metavar="JUSTIFICATIVA", default=None,
+                       help="Se o autorizador da UF estiver indisponivel (disjuntor aberto), "
+                            "emitir em SVC-AN/SVC-RS com esta justificativa (15 a 256 caracteres)")
+        p.add_argument("--forcar-contingencia", action="store_true",
+                       help="Emitir em SVC-AN/SVC-RS sem consultar o disjuntor (exige --contingencia)")
         p.set_defaults(func=cmd_emitir)
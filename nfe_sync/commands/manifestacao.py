@@ -1,6 +1,10 @@
 import argparse
+import sys
 
-from . import CliBlueprint, _carregar, _salvar_xml, _salvar_log_xml
+from . import CliBlueprint, _carregar, _salvar_xml, _salvar_log_xml, _listar_resumos_pendentes
+
+# cStat de evento registrado (135) ou registrado sem vínculo à NF-e (136)
+_STATUS_REGISTRADO = ("135", "136")
 
 
 def cmd_manifestar(args):
@@ -29,6 +33,77 @@ def cmd_manifestar(args):
     print(f"  Resposta salva em: {arquivo}")
 
 
+def _registrar_lote(empresa, operacao: str, chaves: list[str], justificativa: str = "", paralelo: int | None = None) -> list:
+    """Envia manifestar_lote, salva respostas e imprime o resultado de cada chave. Retorna os itens."""
+    from ..manifestacao import manifestar_lote, LOTE_PARALELO
+
+    cnpj = empresa.emitente.cnpj
+
+    def _progresso(itens):
+        print(f"  Lote {itens[0].lote}: {len(itens)} evento(s) processado(s)")
+
+    resultado = manifestar_lote(
+        empresa, operacao, chaves, justificativa,
+        paralelo=paralelo or LOTE_PARALELO, callback=_progresso,
+    )
+    # um xml por lote respondido, na ordem dos lotes; o número do lote no identificador
+    # evita que respostas gravadas no mesmo segundo se sobrescrevam
+    respondidos = sorted({item.lote for item in resultado.itens if item.erro is None})
+    for lote, xml in zip(respondidos, resultado.xmls_resposta):
+        _salvar_log_xml(xml, "manifestacao-lote", f"{cnpj}-{operacao}-l{lote:03d}")
+    print()
+    for item in resultado.itens:
+        if item.erro is not None:
+            print(f"  {item.chave}  ERRO: {item.erro}")
+            continue
+        if item.xml:
+            _salvar_xml(cnpj, f"{item.chave}-evento-{operacao}.xml", item.xml)
+        protocolo = f"  Protocolo: {item.protocolo}" if item.protocolo else ""
+        print(f"  {item.chave}  cStat={item.status}  {item.motivo}{protocolo}")
+    return resultado.itens
+
+
+def _ler_chaves(caminho: str) -> list[str]:
+    """Uma chave por linha; '-' lê da entrada padrão. Ignora linhas vazias e comentários (#)."""
+    f = sys.stdin if caminho == "-" else open(caminho)
+    try:
+        return [linha.split("#")[0].strip() for linha in f if linha.split("#")[0].strip()]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def cmd_manifestar_lote(args):
+    empresa, estado = _carregar(args)
+    cnpj = empresa.emitente.cnpj
+
+    chaves = list(args.chaves)
+    if args.arquivo:
+        chaves += _ler_chaves(args.arquivo)
+    if args.pendentes:
+        chaves += _listar_resumos_pendentes(cnpj)
+    chaves = list(dict.fromkeys(chaves))
+    if not chaves:
+        print("Nenhuma chave informada (use CHAVE..., --arquivo ou --pendentes).")
+        sys.exit(1)
+
+    from ..manifestacao import LOTE_MAX_EVENTOS
+    lotes = -(-len(chaves) // LOTE_MAX_EVENTOS)
+    print(f"Empresa: {empresa.nome} (CNPJ {cnpj})")
+    print(f"Ambiente: {'Homologacao' if empresa.homologacao else 'Producao'}")
+    print(f"Operacao: {args.operacao}")
+    print(f"Chaves: {len(chaves)} em {lotes} lote(s) de ate {LOTE_MAX_EVENTOS}")
+    print()
+
+    itens = _registrar_lote(empresa, args.operacao, chaves, args.justificativa, args.paralelo)
+
+    ok = sum(1 for i in itens if i.erro is None and i.status in _STATUS_REGISTRADO)
+    print()
+    print(f"Resumo: {len(itens)} chave(s), {ok} registrada(s), {len(itens) - ok} com falha.")
+    if ok < len(itens):
+        sys.exit(1)
+
+
 class ManifestacaoBlueprint(CliBlueprint):
     def register(self, subparsers, parser, amb_parent=None) -> None:
         parents = [amb_parent] if amb_parent else []
@@ -62,3 +137,40 @@ class ManifestacaoBlueprint(CliBlueprint):
             help="Justificativa (obrigatoria para nao_realizada, minimo 15 caracteres)",
         )
         p.set_defaults(func=cmd_manifestar)
+
+        p_lote = subparsers.add_parser(
+            "manifestar-lote",
+            parents=parents,
+            help=argparse.SUPPRESS,
+            description=(
+                "Registra a mesma manifestacao para varias NF-e, em envEvento de ate 20 eventos "
+                "enviados em paralelo."
+            ),
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            epilog=(
+                "Exemplos:\n"
+                "  nfe-sync manifestar-lote MINHAEMPRESA ciencia --pendentes\n"
+                "  nfe-sync manifestar-lote MINHAEMPRESA ciencia CHAVE1 CHAVE2\n"
+                "  nfe-sync manifestar-lote MINHAEMPRESA confirmacao --arquivo chaves.txt --paralelo 8\n"
+                "  cat chaves.txt | nfe-sync manifestar-lote MINHAEMPRESA ciencia --arquivo -"
+            ),
+        )
+        p_lote.add_argument("empresa", help="Nome da empresa (secao no nfe-sync.conf.ini)")
+        p_lote.add_argument(
+            "operacao",
+            choices=["ciencia", "confirmacao", "desconhecimento", "nao_realizada"],
+            help="Tipo de manifestacao",
+        )
+        p_lote.add_argument("chaves", nargs="*", default=[], help="Chaves de acesso com 44 digitos")
+        p_lote.add_argument("--arquivo", default=None, help="Arquivo com uma chave por linha ('-' = entrada padrao)")
+        p_lote.add_argument("--pendentes", action="store_true", help="Incluir as chaves com resumo (resNFe) pendente")
+        p_lote.add_argument(
+            "--justificativa",
+            default="",
+            help="Justificativa (obrigatoria para nao_realizada, minimo 15 caracteres)",
+        )
+        p_lote.add_argument(
+            "--paralelo", type=int, default=None, metavar="N",
+            help="Lotes enviados simultaneamente (padrao: 4)",
+        )
+        p_lote.set_defaults(func=cmd_manifestar_lote)
@@ -5,7 +5,9 @@ import sys
 import urllib.request
 from importlib.metadata import version, PackageNotFoundError
 
-from . import CliBlueprint
+from ..log import OPERACOES_LOG, buscar_respostas, ler_resposta
+from ..state import migrar_estado_json
+from . import CliBlueprint, STATE_FILE
 
 GITHUB_RAW = "https://raw.githubusercontent.com/igor061/nfe-sync/main/pyproject.toml"
 GITHUB_CHANGELOG = "https://raw.githubusercontent.com/igor061/nfe-sync/main/CHANGELOG.md"
@@ -105,6 +107,41 @@ def cmd_atualizar(args):
     subprocess.run([sys.executable, "-m", "pip", "install", "--upgrade", GITHUB_PKG], check=True)
 
 
+def cmd_migrar_estado(args):
+    print(f"Migrando estado: {args.origem} -> {args.destino}")
+    try:
+        total = migrar_estado_json(args.origem, args.destino)
+    except ValueError as e:
+        print(f"Erro: {e}")
+        sys.exit(1)
+    print(f"{total} chave(s) migrada(s). Original renomeado para {args.origem}.migrado")
+    print(f"Use NFE_SYNC_STATE={args.destino} nas proximas execucoes.")
+
+
+def cmd_log_show(args):
+    try:
+        respostas = buscar_respostas(args.operacao, args.timestamp, args.ref)
+    except ValueError as e:
+        print(f"Erro: {e}")
+        sys.exit(1)
+    if not respostas:
+        print(f"Nenhuma resposta '{args.operacao}' em {args.timestamp} no log.")
+        sys.exit(1)
+    # várias no mesmo segundo com a mesma referência: vale a última gravada
+    if len({(r.identificador, r.timestamp) for r in respostas}) > 1:
+        print(f"{len(respostas)} respostas encontradas; informe o timestamp completo ou --ref:")
+        for r in respostas:
+            print(f"  {r.timestamp}  {r.operacao}  {r.identificador or '-'}")
+        sys.exit(1)
+    conteudo = ler_resposta(respostas[-1])
+    if args.saida:
+        with open(args.saida, "wb") as f:
+            f.write(conteudo)
+        print(f"Resposta gravada em {args.saida}")
+    else:
+        print(conteudo.decode(errors="replace"))
+
+
 class SistemaBlueprint(CliBlueprint):
     def register(self, subparsers, parser, amb_parent=None) -> None:
         p_versao = subparsers.add_parser(
@@ -127,3 +164,39 @@ class SistemaBlueprint(CliBlueprint):
             description="Exibe o README do repositorio com instrucoes de instalacao, configuracao e uso.",
         )
         p_readme.set_defaults(func=cmd_readme)
+
+        p_migrar = subparsers.add_parser(
+            "migrar-estado",
+            help=argparse.SUPPRESS,
+            description="Migra o estado interno (.state.json) para o backend SQLite (.state.db).",
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            epilog=(
+                "Exemplos:\n"
+                "  nfe-sync migrar-estado\n"
+                "  nfe-sync migrar-estado --origem .state.json --destino /var/lib/nfe-sync/state.db"
+            ),
+        )
+        p_migrar.add_argument("--origem", default=STATE_FILE, help="Arquivo JSON de estado (padrao: NFE_SYNC_STATE)")
+        p_migrar.add_argument("--destino", default=".state.db", help="Arquivo SQLite de destino (padrao: .state.db)")
+        p_migrar.set_defaults(func=cmd_migrar_estado)
+
+        p_log_show = subparsers.add_parser(
+            "log-show",
+            help=argparse.SUPPRESS,
+            description=(
+                "Exibe uma resposta do SEFAZ gravada no log, pela operacao e pelo timestamp. "
+                "Le tanto os .xml soltos quanto o log comprimido (NFE_SYNC_LOG_MODO=gzip)."
+            ),
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            epilog=(
+                "Exemplos:\n"
+                "  nfe-sync log-show consulta 20250301-142530\n"
+                "  nfe-sync log-show dist-dfe 20250301 --ref 12345678000199-p003\n"
+                "  nfe-sync log-show emissao 20250301-1425 --saida resposta.xml"
+            ),
+        )
+        p_log_show.add_argument("operacao", choices=OPERACOES_LOG, help="Operacao gravada no log")
+        p_log_show.add_argument("timestamp", help="AAAAMMDD-HHMMSS, ou um prefixo com ao menos o dia (AAAAMMDD)")
+        p_log_show.add_argument("--ref", default=None, help="Identificador gravado com a resposta (chave, cnpj-pagina, ...)")
+        p_log_show.add_argument("--saida", default=None, help="Gravar a resposta neste arquivo em vez de exibir")
+        p_log_show.set_defaults(func=cmd_log_show)
@@ -1,15 +1,23 @@
+import atexit
+import base64
+import gzip
 import logging
+import multiprocessing
+import os
+import threading
 import traceback
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Callable
+from typing import Callable, Iterator
 
 _BRT = timezone(timedelta(hours=-3))
 
 from .models import EmpresaConfig, validar_cnpj_sefaz
-from .state import get_ultimo_nsu, set_ultimo_nsu, get_cooldown, set_cooldown, salvar_estado
+from .state import get_ultimo_nsu, set_ultimo_nsu, get_cooldown, set_cooldown, abrir_estado
 from .xml_utils import to_xml_string, extract_status_motivo, criar_comunicacao, safe_fromstring, agora_brt, _com_retry, chamar_sefaz
+from .xpaths import XP_DOC_ZIP, extrair_campos_documento, extrair_retorno
 from .exceptions import NfeValidationError
-from .results import Documento, ResultadoConsulta, ResultadoDfeChave, ResultadoDistribuicao
+from .results import Documento, PaginaDistribuicao, ResultadoConsulta, ResultadoDfeChave, ResultadoDistribuicao
 
 
 COOLDOWN_MINUTOS = 61
@@ -60,9 +68,6 @@ def calcular_proximo_cooldown(minutos: int = COOLDOWN_MINUTOS) -> str:
     return (_agora_brt() + timedelta(minutes=minutos)).isoformat(timespec="seconds")
 
 
-# Issue #7: salvar estado a cada N páginas
-_SALVAR_A_CADA = 10
-
 TIPOS_EVENTO = {
     "110110": "carta-correcao",
     "110111": "cancelamento",
@@ -82,67 +87,121 @@ TIPOS_EVENTO = {
 
 def nome_arquivo_nsu(xml_doc, schema: str, fallback: str) -> tuple[str, str | None]:
     """Retorna (nome_sem_extensao, chave_ou_None) para um documento NSU."""
-    chaves = xml_doc.xpath("//*[local-name()='chNFe']/text()")
-    if chaves:
-        chave = chaves[0]
+    campos = extrair_campos_documento(xml_doc)
+    chave = campos["chNFe"]
+    if chave:
         is_evento = "Evento" in schema or "evento" in schema
         if is_evento:
-            tp_evento = (xml_doc.xpath("//*[local-name()='tpEvento']/text()") or [""])[0]
-            n_seq = (xml_doc.xpath("//*[local-name()='nSeqEvento']/text()") or ["1"])[0]
+            tp_evento = campos["tpEvento"]
+            n_seq = campos["nSeqEvento"] or "1"
             tipo = TIPOS_EVENTO.get(tp_evento, tp_evento)
             return f"{chave}-evento-{tipo}-{n_seq}", chave
         return chave, chave
 
-    cnpj_dest = (xml_doc.xpath("//*[local-name()='dest']/*[local-name()='CNPJ']/text()") or [""])[0]
-    cnpj_emit = (xml_doc.xpath("//*[local-name()='emit']/*[local-name()='CNPJ']/text()") or [""])[0]
-    serie = (xml_doc.xpath("//*[local-name()='ide']/*[local-name()='serie']/text()") or [""])[0]
-    numero = (xml_doc.xpath("//*[local-name()='ide']/*[local-name()='nNF']/text()") or [""])[0]
+    cnpj_dest, cnpj_emit = campos["cnpj_dest"], campos["cnpj_emit"]
+    serie, numero = campos["serie"], campos["nNF"]
     nome = f"{cnpj_dest}-{cnpj_emit}-{serie}-{numero}" if any([cnpj_dest, cnpj_emit, serie, numero]) else fallback
     return nome, None
 
 
-def _processar_docs(xml_resp) -> list[Documento]:
-    from pynfe.utils.descompactar import DescompactaGzip
-    docs_xml = xml_resp.xpath("//ns:docZip", namespaces=NS)
-    documentos = []
+def _processar_doc(doc_nsu: str, schema: str, conteudo: str) -> tuple[Documento, str | None]:
+    """Descompacta e nomeia um docZip. Retorna (documento, traceback_ou_None).
 
-    for doc in docs_xml:
-        doc_nsu = doc.get("NSU", "")
-        schema = doc.get("schema", "")
-        try:
-            xml_doc = DescompactaGzip.descompacta(doc.text)
-            nome, chave = nome_arquivo_nsu(xml_doc, schema, doc_nsu)
-            documentos.append(Documento(
-                nsu=doc_nsu,
-                chave=chave,
-                schema=schema,
-                nome=f"{nome}.xml",
-                xml=to_xml_string(xml_doc),
-            ))
-        except Exception as e:
-            # Issue #1: logar traceback completo para diagnóstico
-            logging.warning(
-                "NSU %s: erro ao processar documento\n%s", doc_nsu, traceback.format_exc()
+    Função de módulo (picklable) para poder rodar em processo separado; o
+    traceback volta como texto e é logado pelo processo principal.
+    """
+    try:
+        # bytes descompactados são gravados como vieram; a árvore serve só para o nome
+        xml_bytes = gzip.decompress(base64.b64decode(conteudo))
+        nome, chave = nome_arquivo_nsu(safe_fromstring(xml_bytes), schema, doc_nsu)
+        return Documento(
+            nsu=doc_nsu,
+            chave=chave,
+            schema=schema,
+            nome=f"{nome}.xml",
+            xml_bytes=xml_bytes,
+        ), None
+    except Exception as e:
+        return Documento(nsu=doc_nsu, schema=schema, erro=str(e)), traceback.format_exc()
+
+
+# Processos para descompactar docZips em paralelo (0/1 = no próprio processo).
+# Vale a pena em catch-ups grandes em máquinas com vários núcleos.
+PROCESSOS_DESCOMPACTACAO = int(os.environ.get("NFE_SYNC_PROCESSOS", "0") or 0)
+
+_pool_descompactacao: ProcessPoolExecutor | None = None
+_processos_pool = 0  # max_workers de _pool_descompactacao
+_pool_lock = threading.Lock()
+
+
+def _obter_pool(processos: int) -> ProcessPoolExecutor:
+    """Pool de processos reaproveitado entre páginas (criar um por página custaria mais que o ganho)."""
+    global _pool_descompactacao, _processos_pool
+    with _pool_lock:
+        if _pool_descompactacao is None or _processos_pool != processos:
+            if _pool_descompactacao is not None:
+                _pool_descompactacao.shutdown()
+            # spawn: fork com threads ativas (consultar-nsu --paralelo) pode travar o filho
+            _pool_descompactacao = ProcessPoolExecutor(
+                max_workers=processos, mp_context=multiprocessing.get_context("spawn"),
             )
-            documentos.append(Documento(
-                nsu=doc_nsu,
-                schema=schema,
-                erro=str(e),
-            ))
+            _processos_pool = processos
+        return _pool_descompactacao
+
+
+def encerrar_pool_descompactacao() -> None:
+    """Finaliza o pool de processos de descompactação, se houver."""
+    global _pool_descompactacao, _processos_pool
+    with _pool_lock:
+        if _pool_descompactacao is not None:
+            _pool_descompactacao.shutdown()
+            _pool_descompactacao = None
+            _processos_pool = 0
+
+
+atexit.register(encerrar_pool_descompactacao)
+
+
+def _processar_docs(xml_resp, processos: int | None = None) -> list[Documento]:
+    """Descompacta os docZip da resposta e devolve os documentos na ordem de NSU.
+
+    Com processos > 1 e mais de um docZip, cada documento (base64, gzip, XPaths
+    de nome) vai para o pool de _obter_pool, reaproveitado entre páginas; senão
+    tudo roda no próprio processo. None usa PROCESSOS_DESCOMPACTACAO (env
+    NFE_SYNC_PROCESSOS). Documento ilegível volta com erro e o traceback é logado.
+    """
+    if processos is None:
+        processos = PROCESSOS_DESCOMPACTACAO
+    itens = [
+        (doc.get("NSU", ""), doc.get("schema", ""), doc.text)
+        for doc in XP_DOC_ZIP(xml_resp)
+    ]
+
+    if processos > 1 and len(itens) > 1:
+        pool = _obter_pool(processos)
+        # map preserva a ordem de entrada — mesma ordem de NSU do lote
+        resultados = pool.map(_processar_doc, *zip(*itens), chunksize=max(1, len(itens) // (processos * 4)))
+    else:
+        resultados = (_processar_doc(*item) for item in itens)
 
+    documentos = []
+    for documento, tb in resultados:
+        if tb is not None:
+            # Issue #1: logar traceback completo para diagnóstico
+            logging.warning("NSU %s: erro ao processar documento\n%s", documento.nsu, tb)
+        documentos.append(documento)
     return documentos
 
 
-def consultar(empresa: EmpresaConfig, chave: str) -> ResultadoConsulta:
+def _validar_chave(empresa: EmpresaConfig, chave: str) -> None:
     if len(chave) != 44 or not chave.isdigit():
         raise NfeValidationError(
             f"[{empresa.nome}] Chave de acesso deve ter 44 digitos numericos, recebeu: '{chave}'"
         )
     validar_cnpj_sefaz(empresa.emitente.cnpj, empresa.nome)
-    uf = _uf_da_chave(chave) or empresa.uf
 
-    with empresa.certificado.cert_path() as cert_path:
-        xml_sit, xml_resposta = chamar_sefaz(empresa, "consulta_nota", uf=uf, modelo="nfe", chave=chave, cert_path=cert_path)
+
+def _resultado_consulta(xml_sit, xml_resposta: str) -> ResultadoConsulta:
     situacao = extract_status_motivo(xml_sit, NS)
 
     primeiro_stat = situacao[0]["status"] if situacao else ""
@@ -155,24 +214,11 @@ def consultar(empresa: EmpresaConfig, chave: str) -> ResultadoConsulta:
     )
 
 
-def consultar_dfe_chave(empresa: EmpresaConfig, chave: str) -> ResultadoDfeChave:
-    """Baixa o documento DFe (procNFe) diretamente pela chave de acesso."""
-    if len(chave) != 44 or not chave.isdigit():
-        raise NfeValidationError(
-            f"[{empresa.nome}] Chave de acesso deve ter 44 digitos numericos, recebeu: '{chave}'"
-        )
-    validar_cnpj_sefaz(empresa.emitente.cnpj, empresa.nome)
-    cnpj = empresa.emitente.cnpj
-    uf = _uf_da_chave(chave) or empresa.uf
-
-    with empresa.certificado.cert_path() as cert_path:
-        xml_resp, xml_resposta = chamar_sefaz(empresa, "consulta_distribuicao", uf=uf, cnpj=cnpj, chave=chave, cert_path=cert_path)
-
-    # escalares — não lista; manter inline
-    status = xml_resp.xpath("//ns:cStat", namespaces=NS)
-    motivo = xml_resp.xpath("//ns:xMotivo", namespaces=NS)
-    c_stat = status[0].text if status else None
-    x_motivo = motivo[0].text if motivo else None
+def _resultado_dfe_chave(xml_resp, xml_resposta: str) -> ResultadoDfeChave:
+    # escalares — não lista
+    retorno = extrair_retorno(xml_resp, "cStat", "xMotivo")
+    c_stat = retorno["cStat"]
+    x_motivo = retorno["xMotivo"]
 
     documentos = []
     xml_cancelamento = None
@@ -192,32 +238,71 @@ def consultar_dfe_chave(empresa: EmpresaConfig, chave: str) -> ResultadoDfeChave
     )
 
 
-def consultar_nsu(
-    empresa: EmpresaConfig, estado: dict, state_file: str | None = None,
-    nsu: int | None = None, callback: CallbackProgresso | None = None,
-) -> ResultadoDistribuicao:
-    validar_cnpj_sefaz(empresa.emitente.cnpj, empresa.nome)
+def consultar(empresa: EmpresaConfig, chave: str) -> ResultadoConsulta:
+    _validar_chave(empresa, chave)
+    uf = _uf_da_chave(chave) or empresa.uf
+
+    with empresa.certificado.cert_path() as cert_path:
+        xml_sit, xml_resposta = chamar_sefaz(empresa, "consulta_nota", uf=uf, modelo="nfe", chave=chave, cert_path=cert_path)
+    return _resultado_consulta(xml_sit, xml_resposta)
+
+
+def consultar_dfe_chave(empresa: EmpresaConfig, chave: str) -> ResultadoDfeChave:
+    """Baixa o documento DFe (procNFe) diretamente pela chave de acesso."""
+    _validar_chave(empresa, chave)
     cnpj = empresa.emitente.cnpj
-    ambiente = "homologacao" if empresa.homologacao else "producao"
+    uf = _uf_da_chave(chave) or empresa.uf
 
-    bloqueado, msg = verificar_cooldown(get_cooldown(estado, cnpj, ambiente))
-    if bloqueado:
-        return ResultadoDistribuicao(
-            sucesso=False, status=None, motivo=msg,
-            ultimo_nsu=0, max_nsu=0,
-            documentos=[], xmls_resposta=[], estado=estado,
+    with empresa.certificado.cert_path() as cert_path:
+        xml_resp, xml_resposta = chamar_sefaz(empresa, "consulta_distribuicao", uf=uf, cnpj=cnpj, chave=chave, cert_path=cert_path)
+    return _resultado_dfe_chave(xml_resp, xml_resposta)
+
+
+def consultar_dfe_nsu(empresa: EmpresaConfig, nsu: int) -> ResultadoDfeChave:
+    """Baixa o documento de um NSU específico (consNSU), sem avançar o NSU salvo.
+
+    Usado para preencher lacunas: 138 traz o documento, 137/632 indicam NSU sem documento.
+    """
+    validar_cnpj_sefaz(empresa.emitente.cnpj, empresa.nome)
+    cnpj = empresa.emitente.cnpj
+    with empresa.certificado.cert_path() as cert_path:
+        xml_resp, xml_resposta = chamar_sefaz(
+            empresa, "consulta_distribuicao",
+            cnpj=cnpj, nsu=nsu, consulta_nsu_especifico=True, cert_path=cert_path,
         )
+    return _resultado_dfe_chave(xml_resp, xml_resposta)
 
-    if nsu is None:
-        nsu = get_ultimo_nsu(estado, cnpj, ambiente)
 
-    documentos = []
-    xmls_resposta = []
-    ult_nsu = nsu
-    max_nsu = nsu
+def iter_distribuicao(
+    empresa: EmpresaConfig, estado: dict, state_file: str | None = None,
+    nsu: int | None = None, processos: int | None = None,
+    aguardar_gravacao: Callable[[PaginaDistribuicao], None] | None = None,
+) -> Iterator[PaginaDistribuicao]:
+    """Gera as paginas da distribuicao DFe a medida que chegam da SEFAZ.
+
+    Cada pagina traz apenas os seus documentos — nada e acumulado entre paginas.
+    O NSU da pagina so e gravado no estado quando o consumidor pede a proxima,
+    ou seja, depois de ter persistido os documentos recebidos.
+
+    aguardar_gravacao: para consumidores que gravam em segundo plano. A proxima
+    pagina e buscada logo, e o NSU da anterior so e gravado depois que
+    aguardar_gravacao(pagina_anterior) retorna.
+
+    Com cooldown ativo, gera uma unica pagina com status=None e o motivo do bloqueio.
+    processos: descompacta os documentos de cada pagina em N processos (ver _processar_docs).
+    """
+    inicio = _inicio_distribuicao(empresa, estado, nsu)
+    if isinstance(inicio, PaginaDistribuicao):
+        yield inicio
+        return
+    ult_nsu = inicio
+    cnpj = empresa.emitente.cnpj
+    ambiente = "homologacao" if empresa.homologacao else "producao"
     c_stat = None
-    x_motivo = None
     pagina = 0
+    backend = abrir_estado(state_file) if state_file else None
+    anterior = None  # com aguardar_gravacao: página entregue cujo NSU ainda não foi gravado
+    ultima = None  # última página registrada (o NSU pode estar pendente com JSON)
 
     with empresa.certificado.cert_path() as cert_path:
         con = criar_comunicacao(empresa, cert_path=cert_path)
@@ -225,52 +310,157 @@ def consultar_nsu(
         while True:
             pagina += 1
             resp = _com_retry(con.consulta_distribuicao, cnpj=cnpj, nsu=ult_nsu)
-
             xml_resp = safe_fromstring(resp.content if hasattr(resp, "content") else resp)
 
-            # escalares — não lista
-            status = xml_resp.xpath("//ns:cStat", namespaces=NS)
-            motivo = xml_resp.xpath("//ns:xMotivo", namespaces=NS)
-            c_stat = status[0].text if status else None
-            x_motivo = motivo[0].text if motivo else None
-
-            ult_nsu_el = xml_resp.xpath("//ns:ultNSU", namespaces=NS)
-            max_nsu_el = xml_resp.xpath("//ns:maxNSU", namespaces=NS)
-            ult_nsu = int(ult_nsu_el[0].text) if ult_nsu_el else ult_nsu
-            max_nsu = int(max_nsu_el[0].text) if max_nsu_el else ult_nsu
-
-            xmls_resposta.append(to_xml_string(xml_resp))
-
-            if c_stat != "138":
+            pag = _pagina_distribuicao(xml_resp, pagina, ult_nsu, processos)
+            c_stat, ult_nsu = pag.status, pag.ultimo_nsu
+            if anterior is not None:
+                aguardar_gravacao(anterior)
+                _registrar_pagina(estado, backend, cnpj, ambiente, anterior)
+                ultima, anterior = anterior, None
+            yield pag
+
+            if aguardar_gravacao is None:
+                if pag.status == "138":
+                    ultima = pag
+                if not _registrar_pagina(estado, backend, cnpj, ambiente, pag):
+                    break
+            elif pag.status == "138" and pag.ultimo_nsu < pag.max_nsu:
+                anterior = pag  # NSU gravado depois de buscar a próxima
+            else:
+                aguardar_gravacao(pag)
+                if pag.status == "138":
+                    ultima = pag
+                _registrar_pagina(estado, backend, cnpj, ambiente, pag)
                 break
 
-            docs = _processar_docs(xml_resp)
-            documentos.extend(docs)
+    _registrar_fim(estado, backend, cnpj, ambiente, c_stat, ultima)
 
-            set_ultimo_nsu(estado, cnpj, ult_nsu, ambiente)
-            # Issue #7: salvar estado a cada _SALVAR_A_CADA páginas ou na última
-            if pagina % _SALVAR_A_CADA == 0 or ult_nsu >= max_nsu:
-                if state_file:
-                    salvar_estado(state_file, estado)
 
-            if callback:
-                callback(pagina, len(documentos), ult_nsu, max_nsu)
+def _inicio_distribuicao(empresa: EmpresaConfig, estado: dict, nsu: int | None) -> int | PaginaDistribuicao:
+    """NSU inicial da distribuição, ou a página única de bloqueio se houver cooldown ativo."""
+    validar_cnpj_sefaz(empresa.emitente.cnpj, empresa.nome)
+    cnpj = empresa.emitente.cnpj
+    ambiente = "homologacao" if empresa.homologacao else "producao"
 
-            if ult_nsu >= max_nsu:
-                break
+    bloqueado, msg = verificar_cooldown(get_cooldown(estado, cnpj, ambiente))
+    if bloqueado:
+        return PaginaDistribuicao(
+            pagina=0, status=None, motivo=msg,
+            ultimo_nsu=0, max_nsu=0, documentos=[], xml_resposta=None,
+        )
+    return nsu if nsu is not None else get_ultimo_nsu(estado, cnpj, ambiente)
 
-    if c_stat in ("137", "656"):
-        set_cooldown(estado, cnpj, calcular_proximo_cooldown(), ambiente)
-        if state_file:
-            salvar_estado(state_file, estado)
 
-    return ResultadoDistribuicao(
-        sucesso=c_stat in ("137", "138"),
+def _pagina_distribuicao(xml_resp, pagina: int, ult_nsu: int, processos: int | None) -> PaginaDistribuicao:
+    # escalares — não lista; uma passada para os quatro
+    retorno = extrair_retorno(xml_resp, "cStat", "xMotivo", "ultNSU", "maxNSU")
+    c_stat = retorno["cStat"]
+    ult_nsu = int(retorno["ultNSU"]) if retorno["ultNSU"] else ult_nsu
+    max_nsu = int(retorno["maxNSU"]) if retorno["maxNSU"] else ult_nsu
+
+    docs = _processar_docs(xml_resp, processos) if c_stat == "138" else []
+    return PaginaDistribuicao(
+        pagina=pagina,
         status=c_stat,
-        motivo=x_motivo,
+        motivo=retorno["xMotivo"],
         ultimo_nsu=ult_nsu,
         max_nsu=max_nsu,
-        documentos=documentos,
-        xmls_resposta=xmls_resposta,
-        estado=estado,
+        documentos=docs,
+        xml_resposta=to_xml_string(xml_resp),
     )
+
+
+# Issue #7: com estado JSON cada gravação reescreve o arquivo inteiro (com
+# fsync), então o NSU vai para o disco a cada N páginas; backends que gravam
+# por chave (SQLite) gravam toda página.
+_SALVAR_A_CADA = 10
+
+
+def _grava_nsu_agora(backend, pag: PaginaDistribuicao) -> bool:
+    return (
+        backend.gravacao_por_chave
+        or pag.pagina % _SALVAR_A_CADA == 0
+        or pag.ultimo_nsu >= pag.max_nsu
+    )
+
+
+def _registrar_pagina(estado: dict, backend, cnpj: str, ambiente: str, pag: PaginaDistribuicao) -> bool:
+    """Grava o NSU da página já consumida. Retorna True se há próxima página.
+
+    Chamada só quando o consumidor pede a próxima página, ou seja, depois de
+    ter gravado os documentos desta: o NSU nunca passa à frente dos arquivos.
+    Com gravação por chave toda página vai para o backend; com JSON, a cada
+    _SALVAR_A_CADA páginas e na última (o restante sai em _registrar_fim).
+    """
+    if pag.status != "138":
+        return False
+
+    set_ultimo_nsu(estado, cnpj, pag.ultimo_nsu, ambiente)
+    if backend is not None and _grava_nsu_agora(backend, pag):
+        # grava só a chave deste CNPJ — outras empresas podem estar
+        # atualizando o mesmo estado em paralelo
+        backend.set_ultimo_nsu(cnpj, pag.ultimo_nsu, ambiente)
+
+    return pag.ultimo_nsu < pag.max_nsu
+
+
+def _registrar_fim(
+    estado: dict, backend, cnpj: str, ambiente: str, c_stat: str | None,
+    ultima: PaginaDistribuicao | None = None,
+) -> None:
+    """Fecha a distribuição: NSU ainda não gravado da última página registrada e cooldown."""
+    if backend is not None and ultima is not None and not _grava_nsu_agora(backend, ultima):
+        backend.set_ultimo_nsu(cnpj, ultima.ultimo_nsu, ambiente)
+    if c_stat in ("137", "656"):
+        bloqueado_ate = calcular_proximo_cooldown()
+        set_cooldown(estado, cnpj, bloqueado_ate, ambiente)
+        if backend is not None:
+            backend.set_cooldown(cnpj, bloqueado_ate, ambiente)
+
+
+def consultar_nsu(
+    empresa: EmpresaConfig, estado: dict, state_file: str | None = None,
+    nsu: int | None = None, callback: CallbackProgresso | None = None,
+    processos: int | None = None,
+) -> ResultadoDistribuicao:
+    """Drena a fila de distribuicao DFe e acumula todas as paginas em memoria.
+
+    Para filas grandes prefira iter_distribuicao(), que entrega uma pagina por vez.
+    """
+    acumulado = _AcumuladorDistribuicao(callback)
+    for pagina in iter_distribuicao(empresa, estado, state_file, nsu=nsu, processos=processos):
+        acumulado.adicionar(pagina)
+    return acumulado.resultado(estado)
+
+
+class _AcumuladorDistribuicao:
+    """Junta as páginas de iter_distribuicao (ou da versão async) num ResultadoDistribuicao."""
+
+    def __init__(self, callback: CallbackProgresso | None = None):
+        self.callback = callback
+        self.documentos = []
+        self.xmls_resposta = []
+        self.ultima = None
+
+    def adicionar(self, pagina: PaginaDistribuicao) -> None:
+        self.ultima = pagina
+        if pagina.xml_resposta is not None:
+            self.xmls_resposta.append(pagina.xml_resposta)
+        if pagina.status == "138":
+            self.documentos.extend(pagina.documentos)
+            if self.callback:
+                self.callback(pagina.pagina, len(self.documentos), pagina.ultimo_nsu, pagina.max_nsu)
+
+    def resultado(self, estado: dict) -> ResultadoDistribuicao:
+        ultima = self.ultima
+        return ResultadoDistribuicao(
+            sucesso=ultima.status in ("137", "138"),
+            status=ultima.status,
+            motivo=ultima.motivo,
+            ultimo_nsu=ultima.ultimo_nsu,
+            max_nsu=ultima.max_nsu,
+            documentos=self.documentos,
+            xmls_resposta=self.xmls_resposta,
+            estado=estado,
+        )
@@ -0,0 +1,180 @@
+"""Disjuntor (circuit breaker) por autorizador/serviço SEFAZ.
+
+Com um autorizador fora do ar, cada chamada esperava o timeout de 30s vezes
+as retentativas antes de falhar. O disjuntor conta falhas transitórias
+consecutivas por (host, serviço, ambiente): ao atingir `falhas`, abre e as
+chamadas seguintes falham na hora com NfeServicoIndisponivel. Depois de
+`espera` segundos fica meio-aberto e deixa passar uma única sonda: sucesso
+fecha, falha reabre por mais `espera` segundos.
+
+O estado fica na seção "disjuntor" do EstadoBackend, então processos
+seguintes herdam um disjuntor aberto. Chaves fechadas sem falhas não são
+gravadas — o caminho normal só lê o estado.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable
+from urllib.parse import urlsplit
+
+from .exceptions import NfeConfigError, NfeServicoIndisponivel
+from .limitador import servico_da_url
+from .state import EstadoBackend
+
+FECHADO = "fechado"
+ABERTO = "aberto"
+MEIO_ABERTO = "meio-aberto"
+
+
+def ler_config(texto: str | None) -> tuple[int, float]:
+    """'5/60' → (falhas consecutivas para abrir, segundos aberto). Vazio = (5, 60)."""
+    if not texto:
+        return 5, 60.0
+    try:
+        falhas, espera = texto.split("/")
+        falhas, espera = int(falhas), float(espera)
+    except ValueError:
+        raise NfeConfigError(f"NFE_SYNC_DISJUNTOR invalido '{texto}' (formato: falhas/segundos)")
+    if falhas < 1 or espera <= 0:
+        raise NfeConfigError(f"NFE_SYNC_DISJUNTOR invalido '{texto}': falhas >= 1 e segundos > 0")
+    return falhas, espera
+
+
+def chave_servico(url: str, ambiente: str) -> str:
+    """'https://nfe.svrs.rs.gov.br/ws/NfeAutorizacao/NFeAutorizacao4.asmx' → 'nfe.svrs.rs.gov.br:nfeautorizacao4:producao'."""
+    return f"{urlsplit(url).hostname}:{servico_da_url(url)}:{ambiente}"
+
+
+class DisjuntorSefaz:
+    SECAO = "disjuntor"
+
+    def __init__(
+        self,
+        falhas: int | None = None,
+        espera: float | None = None,
+        backend: EstadoBackend | None = None,
+        relogio: Callable[[], float] = time.time,
+    ):
+        padrao_falhas, padrao_espera = ler_config(os.environ.get("NFE_SYNC_DISJUNTOR"))
+        self.falhas = falhas if falhas is not None else padrao_falhas
+        self.espera = espera if espera is not None else padrao_espera
+        self.backend = backend
+        self._relogio = relogio
+        self._memoria: dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._sujas: set[str] = set()  # chaves com estado gravado, vistas por este processo
+        self.rejeitadas = 0  # chamadas recusadas com o disjuntor aberto
+
+    def _ler(self, chave: str) -> dict | None:
+        if self.backend is not None:
+            return self.backend.ler(self.SECAO, chave)
+        with self._lock:
+            return self._memoria.get(chave)
+
+    def _atualizar(self, chave: str, fn: Callable[[Any], Any]) -> Any:
+        if self.backend is not None:
+            novo = self.backend.atualizar_chave(self.SECAO, chave, fn)
+        else:
+            with self._lock:
+                novo = fn(self._memoria.get(chave))
+                if novo is None:
+                    self._memoria.pop(chave, None)
+                else:
+                    self._memoria[chave] = novo
+        with self._lock:
+            (self._sujas.add if novo is not None else self._sujas.discard)(chave)
+        return novo
+
+    def estado(self, chave: str) -> str:
+        """FECHADO, ABERTO ou MEIO_ABERTO (aberto com a espera vencida), sem alterar nada."""
+        atual = self._ler(chave)
+        if atual is None or atual["estado"] == FECHADO:
+            return FECHADO
+        if self._relogio() - atual["desde"] >= self.espera:
+            return MEIO_ABERTO
+        return ABERTO
+
+    def aberto(self, chave: str) -> bool:
+        return self.estado(chave) == ABERTO
+
+    def permitir(self, chave: str) -> None:
+        """Libera a chamada ou levanta NfeServicoIndisponivel. Com a espera vencida, esta chamada vira a sonda."""
+        atual = self._ler(chave)
+        if atual is None:
+            return
+        with self._lock:
+            self._sujas.add(chave)
+        if atual["estado"] == FECHADO:
+            return
+        agora = self._relogio()
+        liberada = False
+
+        def _sondar(valor):
+            nonlocal liberada
+            # relido dentro da transação: só um processo/thread vira sonda
+            if valor is None or valor["estado"] == FECHADO:
+                liberada = True
+                return valor
+            if agora - valor["desde"] >= self.espera:
+                liberada = True
+                # "desde" avança: outra sonda só depois de mais uma espera sem resposta
+                return {"estado": MEIO_ABERTO, "falhas": valor["falhas"], "desde": agora}
+            return valor
+
+        valor = self._atualizar(chave, _sondar)
+        if liberada:
+            if valor is not None and valor["estado"] == MEIO_ABERTO:
+                logging.info("Disjuntor %s meio-aberto: enviando sonda", chave)
+            return
+        with self._lock:
+            self.rejeitadas += 1
+        restante = max(0.0, valor["desde"] + self.espera - agora)
+        raise NfeServicoIndisponivel(
+            f"SEFAZ indisponivel ({chave}): {valor['falhas']} falhas seguidas; "
+            f"nova tentativa em {restante:.0f}s"
+        )
+
+    def sucesso(self, chave: str) -> None:
+        with self._lock:
+            if chave not in self._sujas:
+                return
+
+        def _fechar(valor):
+            if valor is not None and valor["estado"] != FECHADO:
+                logging.info("Disjuntor %s fechado", chave)
+            return None
+
+        self._atualizar(chave, _fechar)
+
+    def falha(self, chave: str) -> None:
+        agora = self._relogio()
+
+        def _contar(valor):
+            valor = valor or {"estado": FECHADO, "falhas": 0, "desde": agora}
+            falhas = valor["falhas"] + 1
+            if valor["estado"] == MEIO_ABERTO or falhas >= self.falhas:
+                if valor["estado"] != ABERTO:
+                    logging.warning("Disjuntor %s aberto apos %d falhas seguidas", chave, falhas)
+                return {"estado": ABERTO, "falhas": falhas, "desde": agora}
+            return {"estado": valor["estado"], "falhas": falhas, "desde": valor["desde"]}
+
+        self._atualizar(chave, _contar)
+
+
+_disjuntor: DisjuntorSefaz | None = None
+
+
+def disjuntor_ativo() -> DisjuntorSefaz:
+    """Disjuntor usado por criar_comunicacao (criado em memória no primeiro uso)."""
+    global _disjuntor
+    if _disjuntor is None:
+        _disjuntor = DisjuntorSefaz()
+    return _disjuntor
+
+
+def configurar_disjuntor(disjuntor: DisjuntorSefaz | None) -> DisjuntorSefaz | None:
+    """Troca o disjuntor usado por criar_comunicacao (None = volta ao padrão). Retorna o anterior."""
+    global _disjuntor
+    anterior, _disjuntor = _disjuntor, disjuntor
+    return anterior
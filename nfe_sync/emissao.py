@@ -4,9 +4,12 @@ from pynfe.entidades.fonte_dados import FonteDados
 from pynfe.entidades.emitente import Emitente as PynfeEmitente
 from pynfe.entidades.cliente import Cliente
 from pynfe.entidades.notafiscal import NotaFiscal
+from pynfe.processamento.comunicacao import ComunicacaoSefaz
 from pynfe.processamento.serializacao import SerializacaoXML
-from pynfe.processamento.assinatura import AssinaturaA1
+from pynfe.utils.webservices import NFE
 
+from .certificado import assinador
+from .disjuntor import chave_servico, disjuntor_ativo
 from .models import EmpresaConfig, DadosEmissao, validar_cnpj_sefaz
 from .exceptions import NfeValidationError
 from .xml_utils import to_xml_string, extract_status_motivo, criar_comunicacao, safe_fromstring, agora_brt
@@ -15,15 +18,91 @@ from .results import ResultadoEmissao
 
 NS = {"ns": "http://www.portalfiscal.inf.br/nfe"}
 
+# tpEmis de cada SEFAZ Virtual de Contingência (NT 2013.007).
+SVC = {"SVC-AN": "6", "SVC-RS": "7"}
+# UFs atendidas pelo SVC-RS (NT 2013.007; CE, autorizada pelo SVRS, também); as demais usam o SVC-AN.
+_UFS_SVC_RS = frozenset({"AM", "BA", "CE", "GO", "MA", "MS", "MT", "PE", "PR"})
+# A tabela NFE["SVC-AN"] do pynfe ainda aponta para o NfeAutorizacao da versão 2;
+# o SVC-RS autoriza no mesmo NFeAutorizacao4 do SVRS.
+_URL_SVC_AN = {
+    "producao": "https://www.svc.fazenda.gov.br/NFeAutorizacao4/NFeAutorizacao4.asmx",
+    "homologacao": "https://hom.svc.fazenda.gov.br/NFeAutorizacao4/NFeAutorizacao4.asmx",
+}
 
-def emitir(empresa: EmpresaConfig, serie: str, numero_nf: int, dados: DadosEmissao) -> ResultadoEmissao:
+
+def url_autorizacao(uf: str, homologacao: bool) -> str:
+    """URL do NFeAutorizacao4 do autorizador normal da UF, montada da tabela NFE do pynfe.
+
+    Segue a mesma escolha do ComunicacaoSefaz: UF com tabela própria, MA pelo SVAN e
+    as demais (CE inclusive) pelo SVRS.
+    """
+    uf = uf.upper()
+    autorizador = "SVAN" if uf == "MA" else uf if uf in NFE else "SVRS"
+    return NFE[autorizador]["HOMOLOGACAO" if homologacao else "HTTPS"] + NFE[autorizador]["AUTORIZACAO"]
+
+
+def svc_da_uf(uf: str) -> str:
+    """SVC-AN ou SVC-RS, conforme a UF."""
+    return "SVC-RS" if uf.upper() in _UFS_SVC_RS else "SVC-AN"
+
+
+def url_autorizacao_svc(uf: str, homologacao: bool) -> str:
+    """URL do NFeAutorizacao4 no SVC da UF."""
+    if svc_da_uf(uf) == "SVC-AN":
+        return _URL_SVC_AN["homologacao" if homologacao else "producao"]
+    return NFE["SVRS"]["HOMOLOGACAO" if homologacao else "HTTPS"] + NFE["SVRS"]["AUTORIZACAO"]
+
+
+class ComunicacaoSvc(ComunicacaoSefaz):
+    """ComunicacaoSefaz que, com contingencia=True, autoriza no SVC-AN/SVC-RS da UF.
+
+    ComunicacaoSefaz.autorizacao() só escolhe a URL por _get_url, então a troca
+    para o SVC é feita nele; os demais serviços seguem o pynfe.
+    """
+
+    def _get_url(self, modelo, consulta, contingencia=False):
+        if contingencia and modelo == "nfe" and consulta == "AUTORIZACAO":
+            self.url = url_autorizacao_svc(self.uf, self._ambiente != 1)
+            return self.url
+        return super()._get_url(modelo, consulta, contingencia=contingencia)
+
+
+def _modo_contingencia(empresa: EmpresaConfig, justificativa: str | None, forcar: bool = False) -> str | None:
+    """SVC a usar quando há justificativa e o disjuntor do autorizador da UF está aberto (ou forcar); senão None."""
+    if not justificativa:
+        return None
+    if not forcar:
+        ambiente = "homologacao" if empresa.homologacao else "producao"
+        url = url_autorizacao(empresa.uf, empresa.homologacao)
+        if not disjuntor_ativo().aberto(chave_servico(url, ambiente)):
+            return None
+    return svc_da_uf(empresa.uf)
+
+
+def emitir(
+    empresa: EmpresaConfig, serie: str, numero_nf: int, dados: DadosEmissao,
+    contingencia: str | None = None, forcar_contingencia: bool = False,
+) -> ResultadoEmissao:
+    """Emite a NF-e no autorizador da UF.
+
+    contingencia: justificativa (15 a 256 caracteres) para emitir em SVC-AN/SVC-RS
+    quando o disjuntor do autorizador da UF estiver aberto. Sem ela, um
+    autorizador fora do ar levanta NfeServicoIndisponivel.
+    forcar_contingencia: emite em SVC sem olhar o disjuntor (exige contingencia).
+    """
     validar_cnpj_sefaz(empresa.emitente.cnpj, empresa.nome)
+    if contingencia is not None and not 15 <= len(contingencia.strip()) <= 256:
+        raise NfeValidationError("Justificativa de contingencia deve ter entre 15 e 256 caracteres.")
+    if forcar_contingencia and contingencia is None:
+        raise NfeValidationError("Contingencia forcada exige justificativa.")
     emi = empresa.emitente
     end = emi.endereco
     if end is None:
         raise NfeValidationError(
             f"[{empresa.nome}] Emitente sem endereco configurado."
         )
+    svc = _modo_contingencia(empresa, contingencia, forcar_contingencia)
+    forma_emissao = SVC[svc] if svc else dados.forma_emissao
     fonte = FonteDados()
 
     emitente = PynfeEmitente(
@@ -69,7 +148,7 @@ def emitir(empresa: EmpresaConfig, serie: str, numero_nf: int, dados: DadosEmiss
         cliente=cliente,
         uf=end.uf,
         natureza_operacao=dados.natureza_operacao,
-        forma_emissao=dados.forma_emissao,
+        forma_emissao=forma_emissao,
         finalidade_emissao=dados.finalidade_emissao,
         processo_emissao=dados.processo_emissao,
         modelo=dados.modelo,
@@ -123,14 +202,17 @@ def emitir(empresa: EmpresaConfig, serie: str, numero_nf: int, dados: DadosEmiss
     for pag in dados.pagamentos:
         nota.adicionar_pagamento(t_pag=pag.tipo, v_pag=pag.valor)
 
-    serializar = SerializacaoXML(fonte, homologacao=empresa.homologacao)
+    # em contingência o pynfe inclui dhCont/xJust no ide
+    serializar = SerializacaoXML(
+        fonte, homologacao=empresa.homologacao, contingencia=contingencia.strip() if svc else None,
+    )
     xml = serializar.exportar(limpar=False)
 
     with empresa.certificado.cert_path() as cert_path:
-        assinatura = AssinaturaA1(cert_path, empresa.certificado.senha)
+        assinatura = assinador(empresa.certificado)
         xml_assinado = assinatura.assinar(xml)
-        con = criar_comunicacao(empresa, cert_path=cert_path)
-        resposta = con.autorizacao(modelo="nfe", nota_fiscal=xml_assinado)
+        con = criar_comunicacao(empresa, cert_path=cert_path, classe=ComunicacaoSvc)
+        resposta = con.autorizacao(modelo="nfe", nota_fiscal=xml_assinado, contingencia=bool(svc))
 
     if isinstance(resposta, tuple):
         codigo = resposta[0]
@@ -151,6 +233,7 @@ def emitir(empresa: EmpresaConfig, serie: str, numero_nf: int, dados: DadosEmiss
                 xml=to_xml_string(nfe_proc),
                 xml_resposta=None,
                 erros=[],
+                contingencia=svc,
             )
         else:
             http_resp = resposta[1]
@@ -166,11 +249,12 @@ def emitir(empresa: EmpresaConfig, serie: str, numero_nf: int, dados: DadosEmiss
             return ResultadoEmissao(
                 sucesso=False, status=None, motivo=None,
                 protocolo=None, chave=None, xml=None,
-                xml_resposta=xml_resposta, erros=erros,
+                xml_resposta=xml_resposta, erros=erros, contingencia=svc,
             )
     else:
         return ResultadoEmissao(
             sucesso=False, status=None, motivo=None,
             protocolo=None, chave=None, xml=None,
             xml_resposta=None, erros=[{"status": None, "motivo": str(resposta)}],
+            contingencia=svc,
         )
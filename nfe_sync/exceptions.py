@@ -2,3 +2,6 @@ class NfeConfigError(Exception): ...
 
 
 class NfeValidationError(Exception): ...
+
+
+class NfeServicoIndisponivel(Exception): ...
@@ -0,0 +1,73 @@
+"""Gravação em segundo plano para o download da distribuição DFe.
+
+O laço de download enfileira o que precisa ser persistido (log da resposta,
+documentos, fsync da página) e segue buscando a próxima página; uma thread
+grava na ordem de chegada. A fila é limitada: se o disco ficar para trás,
+enviar() bloqueia em vez de acumular páginas em memória. Antes de gravar o
+NSU de uma página, quem baixa chama aguardar() — o NSU nunca passa à frente
+dos arquivos.
+
+As tarefas rodam no contexto (contextvars) de quem as enviou, então a saída
+capturada por worker no consultar-nsu --paralelo continua no buffer certo.
+"""
+import contextvars
+import queue
+import threading
+from typing import Callable
+
+GRAVACAO_PENDENTES = 64
+
+
+class GravadorSegundoPlano:
+    """Executa as tarefas enviadas numa thread própria, uma por vez e na ordem de envio.
+
+    O primeiro erro de uma tarefa descarta as seguintes e é relançado por
+    enviar()/aguardar(). Use como context manager: a saída espera as pendentes.
+    """
+
+    def __init__(self, pendentes: int = GRAVACAO_PENDENTES):
+        self._fila: queue.Queue = queue.Queue(maxsize=pendentes)
+        self._erro: BaseException | None = None
+        self._thread = threading.Thread(target=self._executar, name="nfe-sync-gravacao", daemon=True)
+        self._thread.start()
+
+    def _executar(self) -> None:
+        while True:
+            tarefa = self._fila.get()
+            try:
+                if tarefa is None:
+                    return
+                if self._erro is None:
+                    contexto, fn, args, kwargs = tarefa
+                    contexto.run(fn, *args, **kwargs)
+            except BaseException as e:
+                self._erro = e
+            finally:
+                self._fila.task_done()
+
+    def _verificar(self) -> None:
+        if self._erro is not None:
+            raise self._erro
+
+    def enviar(self, fn: Callable, *args, **kwargs) -> None:
+        """Enfileira fn(*args, **kwargs). Bloqueia enquanto a fila estiver cheia."""
+        self._verificar()
+        self._fila.put((contextvars.copy_context(), fn, args, kwargs))
+
+    def aguardar(self) -> None:
+        """Espera tudo o que foi enviado ser gravado; relança o erro de gravação, se houve."""
+        self._fila.join()
+        self._verificar()
+
+    def fechar(self) -> None:
+        """Espera as tarefas pendentes e encerra a thread."""
+        self._fila.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, *exc) -> None:
+        self.fechar()
+        if tipo is None:
+            self._verificar()
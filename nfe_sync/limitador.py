@@ -0,0 +1,165 @@
+"""Limite de requisições por serviço SEFAZ e CNPJ (token bucket).
+
+A SEFAZ responde 656 (consumo indevido) e bloqueia o CNPJ por uma hora
+quando as chamadas passam do ritmo tolerado. O limitador espaça as
+requisições antes de chegar nesse ponto: cada (serviço, CNPJ, ambiente) tem
+um balde com `requisicoes` fichas que se repõem ao longo de `segundos`.
+
+Com um EstadoBackend, os baldes ficam na seção "limite" do estado e são
+compartilhados entre threads e processos (atualizar_chave é atômico); sem
+backend, ficam em memória e valem só para o processo.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from .exceptions import NfeConfigError
+from .state import EstadoBackend
+
+
+@dataclass(frozen=True, slots=True)
+class Limite:
+    requisicoes: int  # capacidade do balde (rajada máxima)
+    segundos: float  # tempo para repor todas as fichas
+
+    @property
+    def taxa(self) -> float:
+        return self.requisicoes / self.segundos
+
+
+# Chave = trecho do nome do serviço na URL (minúsculo); "*" vale para o resto.
+# Os nomes variam por autorizador (NFeConsultaProtocolo4, NfeConsulta4, ...).
+LIMITES_PADRAO: dict[str, Limite] = {
+    "nfedistribuicaodfe": Limite(20, 60),
+    "nfeconsulta": Limite(20, 60),
+    "recepcaoevento": Limite(60, 60),
+    "*": Limite(60, 60),
+}
+
+
+def ler_limites(texto: str | None) -> dict[str, Limite]:
+    """'nfedistribuicaodfe=10/60,*=30/60' → limites sobre LIMITES_PADRAO. Vazio = padrão."""
+    limites = dict(LIMITES_PADRAO)
+    for item in (texto or "").split(","):
+        if not item.strip():
+            continue
+        try:
+            servico, valor = item.split("=")
+            requisicoes, segundos = valor.split("/")
+            limite = Limite(int(requisicoes), float(segundos))
+        except ValueError:
+            raise NfeConfigError(f"NFE_SYNC_LIMITES: limite invalido '{item.strip()}' (formato: servico=requisicoes/segundos)")
+        if limite.requisicoes < 1 or limite.segundos <= 0:
+            raise NfeConfigError(f"NFE_SYNC_LIMITES: limite invalido '{item.strip()}': requisicoes >= 1 e segundos > 0")
+        limites[servico.strip().lower()] = limite
+    return limites
+
+
+def servico_da_url(url: str) -> str:
+    """'https://www1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx' → 'nfedistribuicaodfe'."""
+    caminho = url.split("?")[0].rstrip("/")
+    return caminho.rsplit("/", 1)[-1].split(".")[0].lower()
+
+
+class LimitadorSefaz:
+    """Token bucket por (serviço, CNPJ, ambiente).
+
+    reservar() sempre consome uma ficha, deixando o saldo ficar negativo: a
+    espera devolvida é o tempo até a ficha existir. Assim cada chamador faz
+    uma única atualização atômica e os pedidos concorrentes saem em fila.
+    """
+
+    SECAO = "limite"
+
+    def __init__(
+        self,
+        limites: dict[str, Limite] | None = None,
+        backend: EstadoBackend | None = None,
+        relogio: Callable[[], float] = time.time,
+        dormir: Callable[[float], None] = time.sleep,
+    ):
+        self.limites = limites if limites is not None else ler_limites(os.environ.get("NFE_SYNC_LIMITES"))
+        self.backend = backend
+        self._relogio = relogio
+        self._dormir = dormir
+        self._memoria: dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.espera_total = 0.0  # segundos aguardados por este processo
+
+    def limite(self, servico: str) -> Limite | None:
+        for trecho, limite in self.limites.items():
+            if trecho != "*" and trecho in servico:
+                return limite
+        return self.limites.get("*")
+
+    def _atualizar(self, chave: str, fn: Callable[[Any], Any]) -> None:
+        if self.backend is not None:
+            self.backend.atualizar_chave(self.SECAO, chave, fn)
+            return
+        with self._lock:
+            self._memoria[chave] = fn(self._memoria.get(chave))
+
+    def reservar(self, servico: str, cnpj: str, ambiente: str) -> float:
+        """Consome uma ficha e retorna quantos segundos esperar antes de enviar."""
+        limite = self.limite(servico)
+        if limite is None:
+            return 0.0
+        agora = self._relogio()
+        espera = 0.0
+
+        def _consumir(balde):
+            nonlocal espera
+            if balde is None:
+                fichas = float(limite.requisicoes)
+            else:
+                decorrido = max(0.0, agora - balde["ts"])
+                fichas = min(float(limite.requisicoes), balde["fichas"] + decorrido * limite.taxa)
+            fichas -= 1
+            if fichas < 0:
+                espera = -fichas / limite.taxa
+            return {"fichas": fichas, "ts": agora}
+
+        self._atualizar(f"{servico}:{cnpj}:{ambiente}", _consumir)
+        return espera
+
+    def aguardar(self, servico: str, cnpj: str, ambiente: str) -> float:
+        """Bloqueia até haver ficha para a requisição. Retorna o tempo aguardado."""
+        espera = self.reservar(servico, cnpj, ambiente)
+        if espera > 0:
+            logging.info("Limite SEFAZ %s (%s): aguardando %.1fs", servico, cnpj, espera)
+            self._dormir(espera)
+            with self._lock:
+                self.espera_total += espera
+        return espera
+
+    async def aguardar_async(self, servico: str, cnpj: str, ambiente: str) -> float:
+        """Como aguardar(), sem bloquear o event loop (a reserva pode gravar no estado)."""
+        espera = await asyncio.to_thread(self.reservar, servico, cnpj, ambiente)
+        if espera > 0:
+            logging.info("Limite SEFAZ %s (%s): aguardando %.1fs", servico, cnpj, espera)
+            await asyncio.sleep(espera)
+            with self._lock:
+                self.espera_total += espera
+        return espera
+
+
+_limitador: LimitadorSefaz | None = None
+
+
+def limitador_ativo() -> LimitadorSefaz:
+    """Limitador usado por criar_comunicacao (criado em memória no primeiro uso)."""
+    global _limitador
+    if _limitador is None:
+        _limitador = LimitadorSefaz()
+    return _limitador
+
+
+def configurar_limitador(limitador: LimitadorSefaz | None) -> LimitadorSefaz | None:
+    """Troca o limitador usado por criar_comunicacao (None = volta ao padrão). Retorna o anterior."""
+    global _limitador
+    anterior, _limitador = _limitador, limitador
+    return anterior
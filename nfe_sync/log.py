@@ -1,38 +1,283 @@
+import fcntl
+import gzip
 import logging
 import os
+import shutil
+import threading
+import time
 from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
 
 from pynfe.utils import etree
 
+from .exceptions import NfeConfigError
 from .xml_utils import agora_brt
 
 # Issue #4: diretório de log configurável via variável de ambiente
 LOG_DIR = os.environ.get("NFE_SYNC_LOG_DIR", "log")
 LOG_RETENCAO_DIAS = 7
+# NFE_SYNC_LOG_MODO=gzip: respostas comprimidas num segmento por dia (log/AAAAMMDD/respostas.seg)
+# com índice em texto (respostas.idx), em vez de um .xml por resposta
+LOG_MODO = os.environ.get("NFE_SYNC_LOG_MODO", "xml")
+LOG_MODOS = ("xml", "gzip")
+# teto do tamanho total de LOG_DIR em MB (0 = sem limite); os dias mais antigos saem primeiro
+LOG_TAMANHO_MAXIMO_MB = int(os.environ.get("NFE_SYNC_LOG_MAX_MB", "0") or 0)
+LOG_SEGMENTO = "respostas.seg"
+LOG_INDICE = "respostas.idx"
+# operações gravadas pelos comandos; nomes de arquivo são {operacao}[-{identificador}]-{timestamp}.xml
+# e uma operação pode ser prefixo de outra (dist-dfe / dist-dfe-chave)
+OPERACOES_LOG = (
+    "consulta", "dist-dfe", "dist-dfe-chave", "manifestacao", "manifestacao-lote",
+    "emissao", "emissao-erro", "inutilizacao", "cancelamento",
+)
+# a limpeza roda no máximo uma vez por intervalo (segundos) em cada processo
+LOG_LIMPEZA_INTERVALO = 3600
+
+_ultima_limpeza: float | None = None
+_limpeza_lock = threading.Lock()
+
+
+def _pasta_do_dia(nome: str) -> bool:
+    return len(nome) == 8 and nome.isdigit()
 
 
 def _limpar_logs_antigos():
+    """Remove as pastas de dia (log/AAAAMMDD/) vencidas e os arquivos soltos antigos."""
     limite = agora_brt() - timedelta(days=LOG_RETENCAO_DIAS)
+    dia_limite = limite.strftime("%Y%m%d")
     for nome in os.listdir(LOG_DIR):
         caminho = os.path.join(LOG_DIR, nome)
-        if os.path.isfile(caminho):
-            modificado = datetime.fromtimestamp(os.path.getmtime(caminho), tz=timezone.utc)
+        if _pasta_do_dia(nome) and os.path.isdir(caminho):
+            # o dia inteiro expira de uma vez, sem olhar arquivo por arquivo
+            if nome < dia_limite:
+                try:
+                    shutil.rmtree(caminho)
+                except OSError as e:
+                    logging.warning("Nao foi possivel remover log %s: %s", caminho, e)
+        elif os.path.isfile(caminho):
+            # arquivos do layout antigo, gravados direto em LOG_DIR
+            try:
+                modificado = datetime.fromtimestamp(os.path.getmtime(caminho), tz=timezone.utc)
+            except OSError:
+                # removido por outro processo/thread entre o listdir e o getmtime
+                continue
             if modificado < limite:
                 # Issue #13: tratar erros de remoção individualmente
                 try:
                     os.remove(caminho)
                 except OSError as e:
                     logging.warning("Nao foi possivel remover log %s: %s", caminho, e)
+    if LOG_TAMANHO_MAXIMO_MB > 0:
+        _limitar_tamanho(LOG_TAMANHO_MAXIMO_MB * 1024 * 1024)
+
+
+def _tamanho_pasta(pasta: str) -> int:
+    total = 0
+    for entrada in os.scandir(pasta):
+        try:
+            if entrada.is_file():
+                total += entrada.stat().st_size
+        except OSError:
+            continue
+    return total
+
+
+def _limitar_tamanho(maximo: int):
+    """Remove os logs mais antigos (arquivos soltos e pastas de dia) até LOG_DIR caber em maximo bytes.
+
+    A pasta de hoje nunca é removida.
+    """
+    hoje = agora_brt().strftime("%Y%m%d")
+    candidatos = []
+    total = 0
+    for entrada in os.scandir(LOG_DIR):
+        try:
+            if _pasta_do_dia(entrada.name) and entrada.is_dir():
+                tamanho = _tamanho_pasta(entrada.path)
+                if entrada.name != hoje:
+                    candidatos.append((entrada.name, entrada.path, tamanho))
+            elif entrada.is_file():
+                info = entrada.stat()
+                tamanho = info.st_size
+                # arquivos soltos do layout antigo: ordenados pelo dia da modificação
+                dia = datetime.fromtimestamp(info.st_mtime).strftime("%Y%m%d")
+                candidatos.append((dia, entrada.path, tamanho))
+            else:
+                continue
+        except OSError:
+            continue
+        total += tamanho
+    for _, caminho, tamanho in sorted(candidatos):
+        if total <= maximo:
+            break
+        try:
+            if os.path.isdir(caminho):
+                shutil.rmtree(caminho)
+            else:
+                os.remove(caminho)
+        except OSError as e:
+            logging.warning("Nao foi possivel remover log %s: %s", caminho, e)
+            continue
+        total -= tamanho
+
+
+def _limpar_se_preciso():
+    """Roda _limpar_logs_antigos() se a última limpeza tiver mais de LOG_LIMPEZA_INTERVALO segundos.
+
+    Outra thread já limpando: segue sem esperar.
+    """
+    global _ultima_limpeza
+    agora = time.monotonic()
+    if _ultima_limpeza is not None and agora - _ultima_limpeza < LOG_LIMPEZA_INTERVALO:
+        return
+    if not _limpeza_lock.acquire(blocking=False):
+        return
+    try:
+        _ultima_limpeza = agora
+        _limpar_logs_antigos()
+    finally:
+        _limpeza_lock.release()
+
+
+_gravacao_lock = threading.Lock()
+
+
+class RespostaLog(NamedTuple):
+    """Uma resposta gravada no log: no modo xml, caminho é o .xml; no gzip, o segmento do dia."""
+
+    operacao: str
+    identificador: str
+    timestamp: str
+    caminho: str
+    inicio: int | None = None
+    tamanho: int | None = None
+
+
+def _serializar(xml_resp) -> bytes:
+    if isinstance(xml_resp, bytes):
+        return xml_resp
+    if isinstance(xml_resp, str):
+        return xml_resp.encode()
+    xml_str = etree.tostring(xml_resp, encoding="unicode", pretty_print=True)
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n' + xml_str).encode()
+
+
+def _anexar_comprimido(pasta: str, dados: bytes, operacao: str, identificador: str, timestamp: str) -> str:
+    """Acrescenta um membro gzip ao segmento do dia e a linha correspondente ao índice.
+
+    O índice é gravado depois dos dados: uma interrupção no meio deixa no máximo
+    bytes sem índice no fim do segmento, nunca uma entrada apontando para o vazio.
+    """
+    comprimido = gzip.compress(dados, mtime=0)
+    segmento = os.path.join(pasta, LOG_SEGMENTO)
+    with _gravacao_lock, open(segmento, "ab", buffering=0) as f:
+        # o flock no segmento serializa outros processos anexando ao mesmo dia:
+        # o início vem do tamanho do arquivo antes do write, e o índice sai na mesma seção
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            inicio = os.fstat(f.fileno()).st_size
+            f.write(comprimido)
+            linha = f"{timestamp}\t{operacao}\t{identificador}\t{inicio}\t{len(comprimido)}\n"
+            with open(os.path.join(pasta, LOG_INDICE), "ab", buffering=0) as indice:
+                indice.write(linha.encode())
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    return f"{segmento}#{inicio}"
 
 
 def salvar_resposta_sefaz(xml_resp, operacao: str, identificador: str = "") -> str:
-    os.makedirs(LOG_DIR, exist_ok=True)
-    _limpar_logs_antigos()
-    timestamp = agora_brt().strftime("%Y%m%d-%H%M%S")
+    """Grava a resposta em LOG_DIR/AAAAMMDD/. xml_resp: elemento lxml, ou str/bytes já serializados (gravados como estão).
+
+    Retorna o caminho do .xml ou, com NFE_SYNC_LOG_MODO=gzip, "segmento#início".
+    """
+    if LOG_MODO not in LOG_MODOS:
+        raise NfeConfigError(f"NFE_SYNC_LOG_MODO invalido '{LOG_MODO}' (use 'xml' ou 'gzip')")
+    agora = agora_brt()
+    pasta = os.path.join(LOG_DIR, agora.strftime("%Y%m%d"))
+    os.makedirs(pasta, exist_ok=True)
+    _limpar_se_preciso()
+    timestamp = agora.strftime("%Y%m%d-%H%M%S")
+    if LOG_MODO == "gzip":
+        return _anexar_comprimido(pasta, _serializar(xml_resp), operacao, identificador, timestamp)
     sufixo = f"-{identificador}" if identificador else ""
-    arquivo = f"{LOG_DIR}/{operacao}{sufixo}-{timestamp}.xml"
+    arquivo = f"{pasta}/{operacao}{sufixo}-{timestamp}.xml"
+    if isinstance(xml_resp, (str, bytes)):
+        with open(arquivo, "wb" if isinstance(xml_resp, bytes) else "w") as f:
+            f.write(xml_resp)
+        return arquivo
     xml_str = etree.tostring(xml_resp, encoding="unicode", pretty_print=True)
     with open(arquivo, "w") as f:
         f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
         f.write(xml_str)
     return arquivo
+
+
+def _respostas_indexadas(pasta: str) -> list[RespostaLog]:
+    try:
+        with open(os.path.join(pasta, LOG_INDICE), "rb") as f:
+            linhas = f.read().decode().split("\n")
+    except FileNotFoundError:
+        return []
+    segmento = os.path.join(pasta, LOG_SEGMENTO)
+    respostas = []
+    # a última posição é "" (índice terminado em \n) ou uma linha cortada por uma interrupção
+    for linha in linhas[:-1]:
+        campos = linha.split("\t")
+        if len(campos) != 5:
+            continue
+        timestamp, operacao, identificador, inicio, tamanho = campos
+        respostas.append(RespostaLog(operacao, identificador, timestamp, segmento, int(inicio), int(tamanho)))
+    return respostas
+
+
+def _respostas_em_arquivos(pasta: str, operacao: str) -> list[RespostaLog]:
+    """Respostas gravadas como {operacao}[-{identificador}]-{AAAAMMDD-HHMMSS}.xml."""
+    # a operação do arquivo é a mais longa conhecida que casa com o início do nome:
+    # "dist-dfe-chave-X-..." é de dist-dfe-chave, nunca de dist-dfe com identificador "chave-X"
+    operacoes = sorted({*OPERACOES_LOG, operacao}, key=len, reverse=True)
+    respostas = []
+    for nome in sorted(os.listdir(pasta)):
+        if not (nome.startswith(operacao) and nome.endswith(".xml")):
+            continue
+        base = nome[:-4]
+        if len(base) < len(operacao) + 16 or base[-16] != "-":
+            continue
+        timestamp, resto = base[-15:], base[:-16]
+        dono = next((op for op in operacoes if resto == op or resto.startswith(f"{op}-")), None)
+        if dono != operacao:
+            continue
+        respostas.append(RespostaLog(operacao, resto[len(operacao) + 1:], timestamp, os.path.join(pasta, nome)))
+    return respostas
+
+
+def buscar_respostas(operacao: str, timestamp: str, identificador: str | None = None) -> list[RespostaLog]:
+    """Respostas de operacao cujo timestamp (AAAAMMDD-HHMMSS) começa com timestamp, nos dois modos de log.
+
+    timestamp precisa ao menos do dia (AAAAMMDD). identificador, se dado, precisa bater exatamente.
+    """
+    dia = timestamp[:8]
+    if len(dia) != 8 or not dia.isdigit():
+        raise ValueError(f"timestamp invalido '{timestamp}' (formato: AAAAMMDD[-HHMMSS])")
+    pastas = [os.path.join(LOG_DIR, dia)]
+    if os.path.isdir(LOG_DIR):
+        pastas.append(LOG_DIR)  # arquivos soltos do layout antigo
+    respostas = []
+    for pasta in pastas:
+        if not os.path.isdir(pasta):
+            continue
+        if pasta != LOG_DIR:
+            respostas.extend(r for r in _respostas_indexadas(pasta) if r.operacao == operacao)
+        respostas.extend(_respostas_em_arquivos(pasta, operacao))
+    return [
+        r for r in respostas
+        if r.timestamp.startswith(timestamp) and (identificador is None or r.identificador == identificador)
+    ]
+
+
+def ler_resposta(resposta: RespostaLog) -> bytes:
+    """Conteúdo (descomprimido) de uma resposta devolvida por buscar_respostas()."""
+    with open(resposta.caminho, "rb") as f:
+        if resposta.inicio is None:
+            return f.read()
+        f.seek(resposta.inicio)
+        return gzip.decompress(f.read(resposta.tamanho))
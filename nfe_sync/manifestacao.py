@@ -1,12 +1,19 @@
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
+
 from pynfe.entidades.fonte_dados import FonteDados
 from pynfe.entidades.evento import EventoManifestacaoDest
 from pynfe.processamento.serializacao import SerializacaoXML
-from pynfe.processamento.assinatura import AssinaturaA1
+from pynfe.utils import etree
 
+from .certificado import assinador
 from .models import EmpresaConfig, validar_cnpj_sefaz
 from .exceptions import NfeValidationError
-from .xml_utils import extract_status_motivo, agora_brt, chamar_sefaz
-from .results import ResultadoManifestacao
+from .xml_utils import extract_status_motivo, agora_brt, chamar_sefaz, to_xml_string
+from .xpaths import extrair_retorno
+from .results import ItemManifestacaoLote, ResultadoManifestacao, ResultadoManifestacaoLote
 
 
 NS = {"ns": "http://www.portalfiscal.inf.br/nfe"}
@@ -19,12 +26,12 @@ OPERACOES = {
 }
 
 
-def manifestar(
-    empresa: EmpresaConfig,
-    operacao: str,
-    chave: str,
-    justificativa: str = "",
-) -> ResultadoManifestacao:
+# O serviço de eventos do Ambiente Nacional aceita até 20 eventos por envEvento
+LOTE_MAX_EVENTOS = 20
+LOTE_PARALELO = 4
+
+
+def _validar(empresa: EmpresaConfig, operacao: str, chave: str, justificativa: str) -> None:
     if operacao not in OPERACOES:
         raise NfeValidationError(
             f"[{empresa.nome}] Operacao '{operacao}' invalida. "
@@ -42,11 +49,9 @@ def manifestar(
             f"com minimo 15 caracteres (recebeu {len(justificativa)})."
         )
 
-    validar_cnpj_sefaz(empresa.emitente.cnpj, empresa.nome)
-    operacao_num, operacao_desc = OPERACOES[operacao]
-    cnpj = empresa.emitente.cnpj
 
-    fonte = FonteDados()
+def _serializar_evento(fonte, serializar, cnpj: str, operacao: str, chave: str, justificativa: str):
+    operacao_num, _ = OPERACOES[operacao]
     evento_kwargs = dict(
         _fonte_dados=fonte,
         cnpj=cnpj,
@@ -60,14 +65,18 @@ def manifestar(
         evento_kwargs["justificativa"] = justificativa
 
     evento = EventoManifestacaoDest(**evento_kwargs)
+    return serializar.serializar_evento(evento)
 
+
+def _evento_assinado(empresa: EmpresaConfig, operacao: str, chave: str, justificativa: str):
+    """Evento de manifestação serializado e assinado (entradas já validadas)."""
+    fonte = FonteDados()
     serializar = SerializacaoXML(fonte, homologacao=empresa.homologacao)
-    xml_evento = serializar.serializar_evento(evento)
+    xml_evento = _serializar_evento(fonte, serializar, empresa.emitente.cnpj, operacao, chave, justificativa)
+    return assinador(empresa.certificado).assinar(xml_evento)
 
-    with empresa.certificado.cert_path() as cert_path:
-        assinatura = AssinaturaA1(cert_path, empresa.certificado.senha)
-        xml_assinado = assinatura.assinar(xml_evento)
-        xml_resp, xml_resp_str = chamar_sefaz(empresa, "evento", modelo="nfe", evento=xml_assinado, cert_path=cert_path)
+
+def _resultado_manifestacao(xml_resp, xml_resp_str: str) -> ResultadoManifestacao:
     resultados = extract_status_motivo(xml_resp, NS)
     protocolos = xml_resp.xpath("//ns:nProt", namespaces=NS)
 
@@ -77,3 +86,110 @@ def manifestar(
         xml=xml_resp_str,
         xml_resposta=xml_resp_str,
     )
+
+
+def manifestar(
+    empresa: EmpresaConfig,
+    operacao: str,
+    chave: str,
+    justificativa: str = "",
+) -> ResultadoManifestacao:
+    _validar(empresa, operacao, chave, justificativa)
+    validar_cnpj_sefaz(empresa.emitente.cnpj, empresa.nome)
+
+    with empresa.certificado.cert_path() as cert_path:
+        xml_assinado = _evento_assinado(empresa, operacao, chave, justificativa)
+        xml_resp, xml_resp_str = chamar_sefaz(empresa, "evento", modelo="nfe", evento=xml_assinado, cert_path=cert_path)
+    return _resultado_manifestacao(xml_resp, xml_resp_str)
+
+
+def _enviar_env_evento(con, eventos: list, id_lote: int):
+    """POST de um envEvento com vários eventos (ComunicacaoSefaz.evento aceita só um)."""
+    raiz = etree.Element("envEvento", versao="1.00", xmlns=NS["ns"])
+    etree.SubElement(raiz, "idLote").text = str(id_lote)
+    for evento in eventos:
+        raiz.append(evento)
+    url = con._get_url_an(consulta="EVENTOS")
+    return con._post(url, con._construir_xml_soap("NFeRecepcaoEvento4", raiz))
+
+
+def _itens_da_resposta(xml_resp, chaves: list[str], id_lote: int) -> list[ItemManifestacaoLote]:
+    """Um item por chave do lote, casando cada retEvento pelo chNFe."""
+    por_chave = {}
+    for ret in xml_resp.iter(f"{{{NS['ns']}}}retEvento"):
+        inf = extrair_retorno(ret, "chNFe", "cStat", "xMotivo", "nProt")
+        if inf["chNFe"]:
+            por_chave[inf["chNFe"]] = (inf, to_xml_string(ret))
+
+    # lote rejeitado inteiro (ex: 215 falha de schema) vem sem retEvento
+    lote = extrair_retorno(xml_resp, "cStat", "xMotivo")
+    itens = []
+    for chave in chaves:
+        if chave in por_chave:
+            inf, xml = por_chave[chave]
+            itens.append(ItemManifestacaoLote(
+                chave=chave, lote=id_lote, status=inf["cStat"], motivo=inf["xMotivo"],
+                protocolo=inf["nProt"], xml=xml,
+            ))
+        else:
+            itens.append(ItemManifestacaoLote(
+                chave=chave, lote=id_lote, status=lote["cStat"],
+                motivo=lote["xMotivo"] or "Sem retorno para a chave",
+            ))
+    return itens
+
+
+def manifestar_lote(
+    empresa: EmpresaConfig,
+    operacao: str,
+    chaves: list[str],
+    justificativa: str = "",
+    paralelo: int = LOTE_PARALELO,
+    callback: Callable[[list[ItemManifestacaoLote]], None] | None = None,
+) -> ResultadoManifestacaoLote:
+    """Manifesta várias chaves em envEvento de até LOTE_MAX_EVENTOS, com até `paralelo` lotes simultâneos.
+
+    Chaves repetidas são enviadas uma vez. Falha de envio de um lote não
+    interrompe os demais: as chaves dele voltam com `erro` preenchido.
+    callback(itens) é chamado a cada lote concluído.
+    """
+    chaves = list(dict.fromkeys(chaves))
+    for chave in chaves:
+        _validar(empresa, operacao, chave, justificativa)
+    validar_cnpj_sefaz(empresa.emitente.cnpj, empresa.nome)
+    if paralelo < 1:
+        raise NfeValidationError(f"[{empresa.nome}] paralelo deve ser >= 1 (recebeu {paralelo}).")
+    cnpj = empresa.emitente.cnpj
+    assinatura = assinador(empresa.certificado)
+    lotes = [chaves[i:i + LOTE_MAX_EVENTOS] for i in range(0, len(chaves), LOTE_MAX_EVENTOS)]
+
+    def enviar(id_lote: int, chaves_lote: list[str], cert_path: str):
+        try:
+            fonte = FonteDados()
+            serializar = SerializacaoXML(fonte, homologacao=empresa.homologacao)
+            eventos = [
+                assinatura.assinar(_serializar_evento(fonte, serializar, cnpj, operacao, chave, justificativa))
+                for chave in chaves_lote
+            ]
+            xml_resp, xml_resp_str = chamar_sefaz(
+                empresa, _enviar_env_evento, eventos, id_lote, cert_path=cert_path,
+            )
+        except Exception as e:
+            logging.warning("Lote %d de manifestacao falhou:\n%s", id_lote, traceback.format_exc())
+            return [ItemManifestacaoLote(chave=c, lote=id_lote, erro=str(e)) for c in chaves_lote], None
+        return _itens_da_resposta(xml_resp, chaves_lote, id_lote), xml_resp_str
+
+    por_lote: dict[int, tuple] = {}
+    with empresa.certificado.cert_path() as cert_path, \
+         ThreadPoolExecutor(max_workers=min(paralelo, len(lotes)) or 1) as pool:
+        futuros = {pool.submit(enviar, n, lote, cert_path): n for n, lote in enumerate(lotes, 1)}
+        for futuro in as_completed(futuros):
+            itens, xml_resp_str = por_lote[futuros[futuro]] = futuro.result()
+            if callback:
+                callback(itens)
+
+    # itens e respostas na ordem das chaves/lotes, independente da ordem de conclusão
+    return ResultadoManifestacaoLote(
+        itens=[item for n in sorted(por_lote) for item in por_lote[n][0]],
+        xmls_resposta=[por_lote[n][1] for n in sorted(por_lote) if por_lote[n][1] is not None],
+    )
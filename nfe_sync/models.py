@@ -1,8 +1,6 @@
 from contextlib import contextmanager
 from decimal import Decimal
 import re
-import tempfile
-import os
 
 from pydantic import BaseModel, field_validator
 
@@ -54,17 +52,13 @@ class Certificado(BaseModel):
         """Context manager que resolve o path do certificado.
 
         Se `conteudo` estiver preenchido (certificado vindo de banco de dados),
-        grava em arquivo temporário e retorna o path. O arquivo é removido ao sair.
+        retorna uma cópia em arquivo privado do cache de certificados — gravada
+        uma vez e reaproveitada até o TTL (nfe_sync.certificado).
         Se não, retorna `path` diretamente sem criar arquivo temporário.
         """
         if self.conteudo is not None:
-            fd, tmp = tempfile.mkstemp(suffix=".pfx")
-            try:
-                os.write(fd, self.conteudo)
-                os.close(fd)
-                yield tmp
-            finally:
-                os.unlink(tmp)
+            from .certificado import _cache
+            yield _cache.arquivo_pfx(self.conteudo)
         else:
             yield self.path
 
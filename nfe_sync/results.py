@@ -9,6 +9,12 @@ class Documento:
     chave: str | None = None
     xml: str | None = None
     erro: str | None = None  # None = sucesso, str = descrição do erro
+    xml_bytes: bytes | None = None  # XML exatamente como veio da SEFAZ (distribuição DFe)
+
+    @property
+    def conteudo(self) -> str | bytes | None:
+        """XML a gravar: os bytes originais quando houver, senão o texto."""
+        return self.xml_bytes if self.xml_bytes is not None else self.xml
 
 
 @dataclass(frozen=True, slots=True)
@@ -40,6 +46,17 @@ class ResultadoDistribuicao:
     estado: dict  # estado mutável; frozen impede re-atribuição do campo, não mutação
 
 
+@dataclass(frozen=True, slots=True)
+class PaginaDistribuicao:
+    pagina: int  # 0 = nenhuma chamada feita (cooldown ativo)
+    status: str | None
+    motivo: str | None
+    ultimo_nsu: int
+    max_nsu: int
+    documentos: list  # list[Documento]
+    xml_resposta: str | None
+
+
 @dataclass(frozen=True, slots=True)
 class ResultadoEmissao:
     sucesso: bool
@@ -50,6 +67,7 @@ class ResultadoEmissao:
     xml: str | None
     xml_resposta: str | None
     erros: list  # list[dict]
+    contingencia: str | None = None  # "SVC-AN"/"SVC-RS" quando emitida em contingência
 
 
 @dataclass(frozen=True, slots=True)
@@ -60,6 +78,23 @@ class ResultadoManifestacao:
     xml_resposta: str
 
 
+@dataclass(frozen=True, slots=True)
+class ItemManifestacaoLote:
+    chave: str
+    lote: int  # idLote do envEvento em que a chave foi enviada
+    status: str | None = None
+    motivo: str | None = None
+    protocolo: str | None = None
+    xml: str | None = None  # retEvento da chave
+    erro: str | None = None  # None = lote enviado, str = falha de envio/assinatura
+
+
+@dataclass(frozen=True, slots=True)
+class ResultadoManifestacaoLote:
+    itens: list  # list[ItemManifestacaoLote], na ordem das chaves
+    xmls_resposta: list  # list[str], uma resposta por lote enviado
+
+
 @dataclass(frozen=True, slots=True)
 class ResultadoInutilizacao:
     sucesso: bool  # True se algum cStat == "102"
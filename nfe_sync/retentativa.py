@@ -0,0 +1,244 @@
+"""Política de retentativa das chamadas à SEFAZ.
+
+Só falhas transitórias são repetidas: timeout, conexão recusada/resetada,
+HTTP 5xx e as respostas cStat 108/109 (serviço paralisado). Erros de
+validação, certificado etc. sobem na primeira tentativa.
+
+As esperas usam *decorrelated jitter* (espera = uniforme(base, 3 x anterior),
+limitada a `teto`), para que clientes que falharam juntos não voltem juntos.
+Um orçamento global limita as retentativas a uma fração das chamadas: numa
+queda da SEFAZ o tráfego não se multiplica pelo número de tentativas.
+"""
+import asyncio
+import logging
+import random
+import re
+import threading
+from dataclasses import dataclass
+
+import requests
+
+# 108 = serviço paralisado momentaneamente, 109 = paralisado sem previsão
+CSTAT_TRANSITORIOS = frozenset({"108", "109"})
+_RE_CSTAT = re.compile(rb"<(?:\w+:)?cStat>\s*(\d+)\s*</")
+
+
+@dataclass(frozen=True, slots=True)
+class PoliticaRetentativa:
+    tentativas: int = 3  # total, incluindo a primeira
+    base: float = 5.0  # menor espera, em segundos
+    teto: float = 60.0  # maior espera
+    usar_orcamento: bool = True  # False = não consome (nem respeita) o orçamento global
+
+
+POLITICA_PADRAO = PoliticaRetentativa()
+
+
+def erro_transitorio(exc: BaseException) -> bool:
+    """True para falhas de rede/servidor que podem passar numa nova tentativa."""
+    if isinstance(exc, requests.HTTPError):
+        resp = exc.response
+        return resp is not None and resp.status_code >= 500
+    if isinstance(exc, requests.exceptions.SSLError):
+        return False  # certificado/handshake: não melhora repetindo (subclasse de ConnectionError)
+    return isinstance(exc, (
+        requests.Timeout, requests.ConnectionError, ConnectionError, TimeoutError,
+    ))
+
+
+def resposta_transitoria(resp) -> str | None:
+    """Motivo ('HTTP 503', 'cStat 108') se a resposta indica indisponibilidade, senão None."""
+    status = getattr(resp, "status_code", None)
+    if isinstance(status, int) and status >= 500:
+        return f"HTTP {status}"
+    conteudo = resp.content if hasattr(resp, "content") else resp
+    if isinstance(conteudo, str):
+        conteudo = conteudo.encode()
+    if isinstance(conteudo, bytes):
+        # o primeiro cStat é o do retorno (lote/consulta), não o de cada documento
+        m = _RE_CSTAT.search(conteudo)
+        if m and m.group(1).decode() in CSTAT_TRANSITORIOS:
+            return f"cStat {m.group(1).decode()}"
+    return None
+
+
+class OrcamentoRetentativas:
+    """Cada chamada deposita `proporcao` fichas (até `reserva`); cada retentativa gasta uma.
+
+    Em regime, no máximo `proporcao` das chamadas são retentativas; a reserva
+    inicial cobre falhas isoladas logo no começo do processo.
+    """
+
+    def __init__(self, proporcao: float = 0.2, reserva: float = 10.0):
+        self.proporcao = proporcao
+        self.reserva = reserva
+        self._saldo = reserva
+        self._lock = threading.Lock()
+
+    def depositar(self) -> None:
+        with self._lock:
+            self._saldo = min(self.reserva, self._saldo + self.proporcao)
+
+    def retirar(self) -> bool:
+        with self._lock:
+            if self._saldo < 1:
+                return False
+            self._saldo -= 1
+            return True
+
+    @property
+    def saldo(self) -> float:
+        return self._saldo
+
+
+class ControleRetentativas:
+    """Executa chamadas com a política, o orçamento global e os contadores do processo.
+
+    As esperas são feitas em um threading.Event: interromper() acorda todas as
+    threads em espera, que desistem e devolvem a última falha. executar_async
+    espera com `dormir_async` (asyncio.sleep) e confere a interrupção ao acordar.
+    """
+
+    def __init__(self, orcamento: OrcamentoRetentativas | None = None, dormir=None, aleatorio=None,
+                 dormir_async=None):
+        self.orcamento = orcamento if orcamento is not None else OrcamentoRetentativas()
+        self._parar = threading.Event()
+        self._dormir = dormir if dormir is not None else self._parar.wait
+        self._aleatorio = aleatorio if aleatorio is not None else random.uniform
+        self._dormir_async = dormir_async if dormir_async is not None else asyncio.sleep
+        self._lock = threading.Lock()
+        self.chamadas = 0
+        self.tentativas = 0
+        self.retentativas = 0
+        self.espera_total = 0.0
+        self.negadas = 0  # retentativas recusadas pelo orçamento
+        self.permanentes = 0  # falhas não repetidas por serem permanentes
+
+    def _contar(self, **incrementos) -> None:
+        with self._lock:
+            for nome, valor in incrementos.items():
+                setattr(self, nome, getattr(self, nome) + valor)
+
+    def contadores(self) -> dict:
+        with self._lock:
+            return {
+                "chamadas": self.chamadas,
+                "tentativas": self.tentativas,
+                "retentativas": self.retentativas,
+                "espera_total": self.espera_total,
+                "negadas": self.negadas,
+                "permanentes": self.permanentes,
+                "orcamento": self.orcamento.saldo,
+            }
+
+    def interromper(self) -> None:
+        self._parar.set()
+
+    def _proxima_espera(self, politica: PoliticaRetentativa, anterior: float, motivo: str) -> float | None:
+        """Segundos até a próxima tentativa. None = não repetir (orçamento esgotado ou interrompido)."""
+        if self._parar.is_set():
+            return None
+        if politica.usar_orcamento and not self.orcamento.retirar():
+            self._contar(negadas=1)
+            logging.warning("Retentativa SEFAZ negada (orcamento esgotado): %s", motivo)
+            return None
+        espera = min(politica.teto, self._aleatorio(politica.base, max(politica.base, anterior * 3)))
+        logging.info("SEFAZ indisponivel (%s); nova tentativa em %.1fs", motivo, espera)
+        self._contar(retentativas=1, espera_total=espera)
+        return espera
+
+    def _esperar(self, politica: PoliticaRetentativa, anterior: float, motivo: str) -> float | None:
+        espera = self._proxima_espera(politica, anterior, motivo)
+        if espera is None or self._dormir(espera) is True:  # Event.wait → True quando interrompido
+            return None
+        return espera
+
+    async def _esperar_async(self, politica: PoliticaRetentativa, anterior: float, motivo: str) -> float | None:
+        espera = self._proxima_espera(politica, anterior, motivo)
+        if espera is None:
+            return None
+        await self._dormir_async(espera)
+        return None if self._parar.is_set() else espera
+
+    def _iniciar(self, politica: PoliticaRetentativa | None) -> PoliticaRetentativa:
+        politica = politica or POLITICA_PADRAO
+        self._contar(chamadas=1)
+        if politica.usar_orcamento:
+            self.orcamento.depositar()
+        return politica
+
+    def _repetir_excecao(self, e: Exception, ultima: bool) -> bool:
+        """True se a exceção é transitória e ainda há tentativas."""
+        if not erro_transitorio(e):
+            self._contar(permanentes=1)
+            return False
+        return not ultima
+
+    def executar(self, fn, args=(), kwargs=None, politica: PoliticaRetentativa | None = None):
+        politica = self._iniciar(politica)
+        kwargs = kwargs or {}
+        anterior = politica.base
+        for n in range(1, politica.tentativas + 1):
+            self._contar(tentativas=1)
+            ultima = n == politica.tentativas
+            try:
+                resp = fn(*args, **kwargs)
+            except Exception as e:
+                if not self._repetir_excecao(e, ultima):
+                    raise
+                espera = self._esperar(politica, anterior, f"{type(e).__name__}: {e}")
+                if espera is None:
+                    raise
+                anterior = espera
+                continue
+            motivo = resposta_transitoria(resp)
+            if motivo is None or ultima:
+                return resp
+            espera = self._esperar(politica, anterior, motivo)
+            if espera is None:
+                return resp
+            anterior = espera
+
+    async def executar_async(self, fn, args=(), kwargs=None, politica: PoliticaRetentativa | None = None):
+        """Como executar(), para uma corrotina fn; as esperas não bloqueiam o event loop."""
+        politica = self._iniciar(politica)
+        kwargs = kwargs or {}
+        anterior = politica.base
+        for n in range(1, politica.tentativas + 1):
+            self._contar(tentativas=1)
+            ultima = n == politica.tentativas
+            try:
+                resp = await fn(*args, **kwargs)
+            except Exception as e:
+                if not self._repetir_excecao(e, ultima):
+                    raise
+                espera = await self._esperar_async(politica, anterior, f"{type(e).__name__}: {e}")
+                if espera is None:
+                    raise
+                anterior = espera
+                continue
+            motivo = resposta_transitoria(resp)
+            if motivo is None or ultima:
+                return resp
+            espera = await self._esperar_async(politica, anterior, motivo)
+            if espera is None:
+                return resp
+            anterior = espera
+
+
+_controle: ControleRetentativas | None = None
+
+
+def controle_retentativas() -> ControleRetentativas:
+    """Controle usado por _com_retry (criado no primeiro uso)."""
+    global _controle
+    if _controle is None:
+        _controle = ControleRetentativas()
+    return _controle
+
+
+def configurar_retentativas(controle: ControleRetentativas | None) -> ControleRetentativas | None:
+    """Troca o controle global (None = volta ao padrão). Retorna o anterior."""
+    global _controle
+    anterior, _controle = _controle, controle
+    return anterior
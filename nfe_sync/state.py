@@ -1,29 +1,286 @@
 import fcntl
 import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Any, Callable
 
+# Extensões de state file que selecionam o backend SQLite (NFE_SYNC_STATE=.state.db)
+_SUFIXOS_SQLITE = (".db", ".sqlite", ".sqlite3")
 
-def carregar_estado(state_file: str) -> dict:
-    path = Path(state_file)
-    if not path.exists():
-        return {}
-    with open(path) as f:
-        fcntl.flock(f, fcntl.LOCK_SH)
+
+class EstadoBackend(ABC):
+    """Armazenamento do estado interno (NSU, cooldown, numeração, ...).
+
+    O estado é organizado em seções ("nsu", "cooldown", "numeracao") com
+    chaves texto — o mesmo layout do dict usado pelas funções get_*/set_*.
+    carregar/salvar/atualizar operam sobre o dict inteiro; ler/gravar/
+    atualizar_chave operam sobre uma única chave.
+    """
+
+    # True quando gravar uma chave não reescreve o estado inteiro
+    gravacao_por_chave = False
+
+    @abstractmethod
+    def carregar(self) -> dict: ...
+
+    @abstractmethod
+    def salvar(self, estado: dict) -> None: ...
+
+    @abstractmethod
+    def atualizar(self, fn: Callable[[dict], None]) -> dict:
+        """Lê, aplica fn(estado) e grava atomicamente. Retorna o estado gravado."""
+        ...
+
+    @abstractmethod
+    def atualizar_chave(self, secao: str, chave: str, fn: Callable[[Any], Any]) -> Any:
+        """Grava fn(valor_atual) atomicamente (valor_atual None se ausente; retorno None remove)."""
+        ...
+
+    def ler(self, secao: str, chave: str, padrao: Any = None) -> Any:
+        return self.carregar().get(secao, {}).get(chave, padrao)
+
+    def gravar(self, secao: str, chave: str, valor: Any) -> None:
+        self.atualizar_chave(secao, chave, lambda _: valor)
+
+    def remover(self, secao: str, chave: str) -> None:
+        self.atualizar_chave(secao, chave, lambda _: None)
+
+    def get_ultimo_nsu(self, cnpj: str, ambiente: str = "producao") -> int:
+        return self.ler("nsu", f"{cnpj}:{ambiente}", 0)
+
+    def set_ultimo_nsu(self, cnpj: str, nsu: int, ambiente: str = "producao") -> None:
+        self.gravar("nsu", f"{cnpj}:{ambiente}", nsu)
+
+    def get_pagina_dfe(self, cnpj: str, ambiente: str = "producao") -> dict | None:
+        return self.ler("pagina_dfe", f"{cnpj}:{ambiente}")
+
+    def set_pagina_dfe(self, cnpj: str, pagina: dict | None, ambiente: str = "producao") -> None:
+        """Registro write-ahead da página de distribuição em gravação (None = página confirmada)."""
+        if pagina is None:
+            self.remover("pagina_dfe", f"{cnpj}:{ambiente}")
+        else:
+            self.gravar("pagina_dfe", f"{cnpj}:{ambiente}", pagina)
+
+    def get_ultimo_numero_nf(self, cnpj: str, serie: str, ambiente: str = "producao") -> int:
+        return self.ler("numeracao", f"{cnpj}:{serie}:{ambiente}", 0)
+
+    def set_ultimo_numero_nf(self, cnpj: str, serie: str, numero: int, ambiente: str = "producao") -> None:
+        self.gravar("numeracao", f"{cnpj}:{serie}:{ambiente}", numero)
+
+    def get_cooldown(self, cnpj: str, ambiente: str = "homologacao") -> str | None:
+        return self.ler("cooldown", _chave_cooldown(cnpj, ambiente))
+
+    def set_cooldown(self, cnpj: str, iso_str: str, ambiente: str = "homologacao") -> None:
+        self.gravar("cooldown", _chave_cooldown(cnpj, ambiente), iso_str)
+
+    def limpar_cooldown(self, cnpj: str, ambiente: str = "homologacao") -> None:
+        self.remover("cooldown", _chave_cooldown(cnpj, ambiente))
+
+
+class EstadoJson(EstadoBackend):
+    """Estado em um único arquivo JSON, protegido por flock. Toda gravação reescreve o arquivo."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def carregar(self) -> dict:
+        path = Path(self.path)
+        if not path.exists():
+            return {}
+        with open(path) as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                return json.loads(f.read())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _gravar(f, estado: dict) -> None:
+        f.seek(0)
+        f.truncate()
+        f.write(json.dumps(estado, indent=2, ensure_ascii=False) + "\n")
+        # flush antes de liberar o lock: senão o buffer só vai ao disco no close();
+        # fsync para o NSU gravado sobreviver a uma queda da máquina
+        f.flush()
+        os.fsync(f.fileno())
+
+    def salvar(self, estado: dict) -> None:
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self._gravar(f, estado)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def atualizar(self, fn: Callable[[dict], None]) -> dict:
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                conteudo = f.read()
+                estado = json.loads(conteudo) if conteudo.strip() else {}
+                fn(estado)
+                self._gravar(f, estado)
+                return estado
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def atualizar_chave(self, secao: str, chave: str, fn: Callable[[Any], Any]) -> Any:
+        novo = None
+
+        def _aplicar(estado: dict) -> None:
+            nonlocal novo
+            novo = fn(estado.get(secao, {}).get(chave))
+            if novo is None:
+                estado.get(secao, {}).pop(chave, None)
+            else:
+                estado.setdefault(secao, {})[chave] = novo
+
+        self.atualizar(_aplicar)
+        return novo
+
+
+class EstadoSqlite(EstadoBackend):
+    """Estado em SQLite (modo WAL), uma linha por (secao, chave).
+
+    Gravar uma chave é um UPSERT de uma linha: barato o bastante para salvar o
+    NSU a cada página, e leitores não bloqueiam escritores. Cada operação abre
+    a própria conexão, então a instância pode ser compartilhada entre threads.
+    """
+
+    gravacao_por_chave = True
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @contextmanager
+    def _conectar(self):
+        con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
         try:
-            return json.loads(f.read())
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS estado ("
+                " secao TEXT NOT NULL, chave TEXT NOT NULL, valor TEXT NOT NULL,"
+                " PRIMARY KEY (secao, chave))"
+            )
+            yield con
         finally:
-            fcntl.flock(f, fcntl.LOCK_UN)
+            con.close()
+
+    @contextmanager
+    def _transacao(self):
+        with self._conectar() as con:
+            # IMMEDIATE: reserva a escrita já no início, evitando deadlock leitura→escrita
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+
+    @staticmethod
+    def _ler_tudo(con) -> dict:
+        estado: dict = {}
+        for secao, chave, valor in con.execute("SELECT secao, chave, valor FROM estado"):
+            estado.setdefault(secao, {})[chave] = json.loads(valor)
+        return estado
+
+    @staticmethod
+    def _substituir(con, estado: dict) -> None:
+        con.execute("DELETE FROM estado")
+        con.executemany(
+            "INSERT INTO estado (secao, chave, valor) VALUES (?, ?, ?)",
+            [
+                (secao, chave, json.dumps(valor, ensure_ascii=False))
+                for secao, chaves in estado.items()
+                for chave, valor in chaves.items()
+            ],
+        )
+
+    def carregar(self) -> dict:
+        with self._conectar() as con:
+            return self._ler_tudo(con)
+
+    def salvar(self, estado: dict) -> None:
+        with self._transacao() as con:
+            self._substituir(con, estado)
+
+    def atualizar(self, fn: Callable[[dict], None]) -> dict:
+        with self._transacao() as con:
+            estado = self._ler_tudo(con)
+            fn(estado)
+            self._substituir(con, estado)
+            return estado
+
+    def ler(self, secao: str, chave: str, padrao: Any = None) -> Any:
+        with self._conectar() as con:
+            linha = con.execute(
+                "SELECT valor FROM estado WHERE secao = ? AND chave = ?", (secao, chave)
+            ).fetchone()
+        return json.loads(linha[0]) if linha else padrao
+
+    def atualizar_chave(self, secao: str, chave: str, fn: Callable[[Any], Any]) -> Any:
+        with self._transacao() as con:
+            linha = con.execute(
+                "SELECT valor FROM estado WHERE secao = ? AND chave = ?", (secao, chave)
+            ).fetchone()
+            novo = fn(json.loads(linha[0]) if linha else None)
+            if novo is None:
+                con.execute("DELETE FROM estado WHERE secao = ? AND chave = ?", (secao, chave))
+            else:
+                con.execute(
+                    "INSERT INTO estado (secao, chave, valor) VALUES (?, ?, ?)"
+                    " ON CONFLICT (secao, chave) DO UPDATE SET valor = excluded.valor",
+                    (secao, chave, json.dumps(novo, ensure_ascii=False)),
+                )
+            return novo
+
+
+def abrir_estado(state_file: str) -> EstadoBackend:
+    """Escolhe o backend pela extensão: .db/.sqlite/.sqlite3 → SQLite, demais → JSON."""
+    if state_file.endswith(_SUFIXOS_SQLITE):
+        return EstadoSqlite(state_file)
+    return EstadoJson(state_file)
+
+
+def migrar_estado_json(json_file: str, destino: str) -> int:
+    """Copia o estado de um .state.json para outro backend (ex.: .state.db). Migração única.
+
+    Recusa se o destino já tiver estado, para não sobrescrever progresso mais novo.
+    Ao final renomeia o JSON para <json_file>.migrado. Retorna o número de chaves copiadas.
+    """
+    if not os.path.exists(json_file):
+        raise ValueError(f"Arquivo de estado {json_file} nao encontrado.")
+    origem = EstadoJson(json_file).carregar()
+    backend = abrir_estado(destino)
+    if backend.carregar():
+        raise ValueError(f"Destino {destino} ja contem estado; migracao abortada.")
+    backend.salvar(origem)
+    os.replace(json_file, f"{json_file}.migrado")
+    return sum(len(chaves) for chaves in origem.values())
+
+
+def carregar_estado(state_file: str) -> dict:
+    return abrir_estado(state_file).carregar()
 
 
 def salvar_estado(state_file: str, estado: dict) -> None:
-    with open(state_file, "a+") as f:
-        fcntl.flock(f, fcntl.LOCK_EX)
-        try:
-            f.seek(0)
-            f.truncate()
-            f.write(json.dumps(estado, indent=2, ensure_ascii=False) + "\n")
-        finally:
-            fcntl.flock(f, fcntl.LOCK_UN)
+    abrir_estado(state_file).salvar(estado)
+
+
+def atualizar_estado(state_file: str, fn: Callable[[dict], None]) -> dict:
+    """Relê o estado, aplica fn(estado) e grava — tudo sob o mesmo lock exclusivo.
+
+    Ao contrário de salvar_estado, não sobrescreve chaves alteradas por outros
+    processos/threads desde a leitura: use para gravar só as chaves que mudaram
+    (ex.: NSU de um CNPJ durante consultar-nsu --paralelo).
+    """
+    return abrir_estado(state_file).atualizar(fn)
 
 
 def get_ultimo_numero_nf(estado: dict, cnpj: str, serie: str, ambiente: str = "producao") -> int:
@@ -1,60 +1,715 @@
+import gzip
 import logging
 import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager, suppress
 
-from .xml_utils import safe_parse
+from .exceptions import NfeConfigError
+from .xml_utils import safe_root_tag
+
+
+# Schemas da distribuição DFe cujo nome difere da raiz do documento
+_RAIZ_DO_SCHEMA = {"procNFe": "nfeProc"}
+
+
+def _tag_do_schema(schema: str | None) -> str | None:
+    """'procNFe_v4.00.xsd' -> 'nfeProc'. Os schemas da distribuicao DFe seguem <raiz>_vX.YY.xsd,
+    exceto procNFe, cuja raiz é nfeProc."""
+    if not schema or "_v" not in schema:
+        return None
+    tag = schema.split("_v")[0]
+    return _RAIZ_DO_SCHEMA.get(tag, tag)
+
+
+class _IndiceDocumentos:
+    """Índice SQLite em downloads/{cnpj}/.indice.db: nome → root tag, schema, NSU, tamanho, mtime.
+
+    Guarda também os NSUs recebidos (tabela nsus), para detectar lacunas na sequência.
+
+    Mantido por DocumentoStorage a cada salvar/renomear/remover, permite responder
+    existe() e listar_resumos_pendentes() sem abrir nenhum XML.
+    """
+
+    ARQUIVO = ".indice.db"
+
+    def __init__(self, pasta: str):
+        self.pasta = pasta
+        self.path = f"{pasta}/{self.ARQUIVO}"
+
+    def existe_arquivo(self) -> bool:
+        return os.path.exists(self.path)
+
+    @contextmanager
+    def conectar(self, imediato: bool = False):
+        """Conexão com o índice; o bloco roda numa transação (commit ao sair).
+
+        imediato=True abre a transação já com o lock de escrita (BEGIN IMMEDIATE),
+        serializando o bloco inteiro com os outros processos que usam a pasta.
+        """
+        os.makedirs(self.pasta, exist_ok=True)
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS documentos ("
+                " nome TEXT PRIMARY KEY, root_tag TEXT, schema TEXT, nsu TEXT,"
+                " tamanho INTEGER, mtime REAL)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS ix_root_tag ON documentos (root_tag)")
+            # NSUs recebidos na distribuição DFe: 'ok', 'erro' (documento ilegível) ou 'vazio' (137/632 no consNSU)
+            con.execute("CREATE TABLE IF NOT EXISTS nsus (nsu INTEGER PRIMARY KEY, situacao TEXT)")
+            if con.execute("PRAGMA user_version").fetchone()[0] < 1:
+                # Índices antigos gravaram o nome do schema (procNFe) no lugar da raiz real (nfeProc)
+                with con:
+                    con.execute("UPDATE documentos SET root_tag = 'nfeProc' WHERE root_tag = 'procNFe'")
+                    con.execute("PRAGMA user_version = 1")
+            with con:
+                if imediato:
+                    con.execute("BEGIN IMMEDIATE")
+                yield con
+        finally:
+            con.close()
+
+    @staticmethod
+    def gravar(con, nome: str, root_tag: str | None, schema: str | None, nsu: str | None,
+               tamanho: int, mtime: float) -> None:
+        con.execute(
+            "INSERT INTO documentos (nome, root_tag, schema, nsu, tamanho, mtime)"
+            " VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (nome) DO UPDATE SET root_tag = excluded.root_tag,"
+            " schema = excluded.schema, nsu = excluded.nsu,"
+            " tamanho = excluded.tamanho, mtime = excluded.mtime",
+            (nome, root_tag, schema, nsu, tamanho, mtime),
+        )
+
+    def buscar(self, nome: str) -> tuple | None:
+        """Retorna (root_tag, schema, nsu, tamanho, mtime) ou None."""
+        with self.conectar() as con:
+            return con.execute(
+                "SELECT root_tag, schema, nsu, tamanho, mtime FROM documentos WHERE nome = ?", (nome,)
+            ).fetchone()
+
+
+def _fsync(caminho: str) -> None:
+    fd = os.open(caminho, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
 class DocumentoStorage:
-    """Centraliza todo I/O de arquivos de NF-e em downloads/{cnpj}/."""
+    """Centraliza todo I/O de arquivos de NF-e em downloads/{cnpj}/.
+
+    layout 'plano' grava tudo direto na pasta do CNPJ; 'aamm' em subpastas
+    downloads/{cnpj}/{AAMM}/ pelo ano/mês de emissão da chave (ver _subpasta).
+
+    Cada XML é gravado num temporário e renomeado: quem lê vê o arquivo antigo
+    ou o novo inteiro, nunca um pela metade. fsync 'arquivo' sincroniza cada
+    gravação; 'lote' deixa o fsync dos arquivos e pastas para sincronizar().
+    """
 
     BASE = "downloads"
+    LAYOUTS = ("plano", "aamm")
+    MODOS_FSYNC = ("arquivo", "lote")
+    SEM_CHAVE = "sem-chave"
+    TEMPORARIO_ORFAO = 3600  # segundos até reindexar() apagar um .tmp de gravação interrompida
+
+    def __init__(self, layout: str = "plano", fsync: str = "arquivo"):
+        self._nao_sincronizados: dict[str, set[str]] = {}  # cnpj → arquivos gravados sem fsync
+        self._lock = threading.Lock()
+        self.layout = layout
+        self.fsync = fsync
 
     def _pasta(self, cnpj: str) -> str:
         return f"{self.BASE}/{cnpj}"
 
-    def salvar(self, cnpj: str, nome: str, xml: str) -> str:
+    @classmethod
+    def _subpasta(cls, nome: str) -> str:
+        """'{chave}...xml' → AAMM de emissão (dígitos 3 a 6 da chave); demais nomes → 'sem-chave'."""
+        return nome[2:6] if nome[:44].isdigit() and len(nome) >= 44 else cls.SEM_CHAVE
+
+    def _caminhos(self, cnpj: str, nome: str) -> tuple[str, str]:
+        """(caminho no layout configurado, caminho no outro layout)."""
+        plano = f"{self._pasta(cnpj)}/{nome}"
+        subpasta = f"{self._pasta(cnpj)}/{self._subpasta(nome)}/{nome}"
+        return (plano, subpasta) if self.layout == "plano" else (subpasta, plano)
+
+    def _caminho(self, cnpj: str, nome: str) -> str:
+        """Caminho do arquivo existente. Durante uma migração de layout ele pode estar
+        ainda (ou já) no outro layout; sem arquivo, o caminho no layout configurado."""
+        caminho, outro = self._caminhos(cnpj, nome)
+        if not os.path.exists(caminho) and os.path.exists(outro):
+            return outro
+        return caminho
+
+    def _arquivos_xml(self, cnpj: str):
+        """(nome, caminho) de cada XML solto da pasta, nos dois layouts."""
         pasta = self._pasta(cnpj)
+        for entrada in os.scandir(pasta):
+            if entrada.is_file() and entrada.name.endswith(".xml"):
+                yield entrada.name, entrada.path
+            elif entrada.is_dir() and (entrada.name == self.SEM_CHAVE or
+                                       (len(entrada.name) == 4 and entrada.name.isdigit())):
+                for arquivo in os.scandir(entrada.path):
+                    if arquivo.is_file() and arquivo.name.endswith(".xml"):
+                        yield arquivo.name, arquivo.path
+
+    def _indice(self, cnpj: str) -> _IndiceDocumentos:
+        """Retorna o índice da pasta, construindo-o a partir do disco na primeira vez."""
+        indice = _IndiceDocumentos(self._pasta(cnpj))
+        if not indice.existe_arquivo() and os.path.isdir(indice.pasta):
+            self.reindexar(cnpj)
+        return indice
+
+    def salvar(self, cnpj: str, nome: str, xml: str | bytes, schema: str | None = None, nsu: str | None = None) -> str:
+        indice = self._indice(cnpj)
+        caminho, outro = self._caminhos(cnpj, nome)
+        pasta = os.path.dirname(caminho)
         os.makedirs(pasta, exist_ok=True)
-        caminho = f"{pasta}/{nome}"
-        with open(caminho, "w") as f:
-            f.write(xml)
+        temporario = f"{pasta}/.{nome}.{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            with open(temporario, "wb" if isinstance(xml, bytes) else "w") as f:
+                f.write(xml)
+                if self.fsync == "arquivo":
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(temporario, caminho)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(temporario)
+            raise
+        if os.path.exists(outro):
+            os.remove(outro)  # versão anterior ainda não migrada de layout
+        if self.fsync == "arquivo":
+            _fsync(pasta)
+        else:
+            with self._lock:
+                self._nao_sincronizados.setdefault(cnpj, set()).add(caminho)
+        tag = _tag_do_schema(schema) or self._root_tag_conteudo(xml, nome)
+        st = os.stat(caminho)
+        with indice.conectar() as con:
+            indice.gravar(con, nome, tag, schema, nsu, st.st_size, st.st_mtime)
         return caminho
 
+    def sincronizar(self, cnpj: str) -> int:
+        """fsync dos arquivos gravados por salvar() desde a última chamada e da pasta.
+
+        Usado antes de avançar o NSU: depois de sincronizar, uma queda da máquina
+        não perde documentos que o estado já dá como baixados. Retorna quantos arquivos
+        (sempre 0 com fsync 'arquivo', em que salvar() já sincronizou cada um).
+        """
+        with self._lock:
+            caminhos = self._nao_sincronizados.pop(cnpj, set())
+        pastas = set()
+        for caminho in caminhos:
+            try:
+                _fsync(caminho)
+            except FileNotFoundError:
+                continue  # removido depois de gravado
+            pastas.add(os.path.dirname(caminho))
+        # entradas de diretório (arquivos novos/renomeados) também precisam ir ao disco
+        for pasta in pastas:
+            _fsync(pasta)
+        return len(caminhos)
+
     def existe(self, cnpj: str, nome: str) -> bool:
-        return os.path.exists(f"{self._pasta(cnpj)}/{nome}")
+        if not os.path.isdir(self._pasta(cnpj)):
+            return False
+        return self._indice(cnpj).buscar(nome) is not None
 
-    def root_tag(self, cnpj: str, nome: str) -> str | None:
+    @staticmethod
+    def _root_tag_conteudo(xml: str | bytes, nome: str) -> str | None:
+        try:
+            return safe_root_tag(xml if isinstance(xml, bytes) else xml.encode())
+        except Exception as e:
+            logging.warning("Nao foi possivel ler root tag de %s: %s", nome, e)
+            return None
+
+    def _root_tag_arquivo(self, cnpj: str, nome: str) -> str | None:
         try:
-            tree = safe_parse(f"{self._pasta(cnpj)}/{nome}")
-            tag = tree.getroot().tag
-            return tag.split("}")[-1] if "}" in tag else tag
+            return safe_root_tag(self._caminho(cnpj, nome))
         except Exception as e:
             logging.warning("Nao foi possivel ler %s/%s: %s", cnpj, nome, e)
             return None
 
+    def root_tag(self, cnpj: str, nome: str) -> str | None:
+        if os.path.isdir(self._pasta(cnpj)):
+            linha = self._indice(cnpj).buscar(nome)
+            if linha is not None and linha[0] is not None:
+                return linha[0]
+        return self._root_tag_arquivo(cnpj, nome)
+
     def listar_resumos_pendentes(self, cnpj: str) -> list[str]:
         pasta = self._pasta(cnpj)
         if not os.path.isdir(pasta):
             return []
-        resumos = []
-        for nome in os.listdir(pasta):
-            if not nome.endswith(".xml"):
-                continue
-            try:
-                tag = self.root_tag(cnpj, nome)
-                if tag == "resNFe":
-                    resumos.append(nome[:-4])
-            except Exception as e:
-                logging.warning("Arquivo %s ignorado: %s", nome, e)
-        return resumos
+        with self._indice(cnpj).conectar() as con:
+            linhas = con.execute(
+                "SELECT nome FROM documentos WHERE root_tag = 'resNFe' AND nome LIKE '%.xml' ORDER BY nome"
+            ).fetchall()
+        return [nome[:-4] for (nome,) in linhas]
 
-    def renomear(self, cnpj: str, origem: str, destino: str) -> str:
+    def listar_completos(self, cnpj: str) -> set[str]:
+        """Chaves cujo {chave}.xml já é um procNFe (raiz nfeProc) — consulta só o índice, sem abrir XML."""
         pasta = self._pasta(cnpj)
-        caminho_destino = f"{pasta}/{destino}"
-        os.rename(f"{pasta}/{origem}", caminho_destino)
+        if not os.path.isdir(pasta):
+            return set()
+        with self._indice(cnpj).conectar() as con:
+            linhas = con.execute(
+                "SELECT nome FROM documentos WHERE root_tag = 'nfeProc' AND nome LIKE '%.xml'"
+            ).fetchall()
+        return {nome[:-4] for (nome,) in linhas}
+
+    def ler(self, cnpj: str, nome: str) -> bytes:
+        with open(self._caminho(cnpj, nome), "rb") as f:
+            return f.read()
+
+    def listar(self, cnpj: str) -> list[str]:
+        """Nomes de todos os documentos da pasta, pelo índice."""
+        if not os.path.isdir(self._pasta(cnpj)):
+            return []
+        with self._indice(cnpj).conectar() as con:
+            return [nome for (nome,) in con.execute("SELECT nome FROM documentos ORDER BY nome")]
+
+    def exportar(self, cnpj: str, destino: str) -> int:
+        """Grava cada documento como arquivo solto em destino/. Retorna quantos."""
+        os.makedirs(destino, exist_ok=True)
+        nomes = self.listar(cnpj)
+        for nome in nomes:
+            with open(f"{destino}/{nome}", "wb") as f:
+                f.write(self.ler(cnpj, nome))
+        return len(nomes)
+
+    def registrar_nsus(self, cnpj: str, itens: list[tuple[int, str]]) -> None:
+        """Registra (nsu, situacao) recebidos; situacao é 'ok', 'erro' ou 'vazio'."""
+        if not itens:
+            return
+        with self._indice(cnpj).conectar() as con:
+            con.executemany(
+                "INSERT INTO nsus (nsu, situacao) VALUES (?, ?)"
+                " ON CONFLICT (nsu) DO UPDATE SET situacao = excluded.situacao",
+                itens,
+            )
+
+    def lacunas_nsu(self, cnpj: str, ate: int, desde: int | None = None) -> list[tuple[int, int]]:
+        """Faixas (inicio, fim) de NSUs em [desde, ate] sem registro 'ok'/'vazio'.
+
+        desde=None começa no menor NSU registrado: o histórico anterior ao registro
+        não conta como lacuna. NSUs com 'erro' contam (o documento não foi gravado).
+        """
+        if not os.path.isdir(self._pasta(cnpj)):
+            return []
+        with self._indice(cnpj).conectar() as con:
+            if desde is None:
+                (desde,) = con.execute("SELECT MIN(nsu) FROM nsus").fetchone()
+                if desde is None:
+                    return []
+            recebidos = con.execute(
+                "SELECT nsu FROM nsus WHERE situacao IN ('ok', 'vazio') AND nsu BETWEEN ? AND ? ORDER BY nsu",
+                (desde, ate),
+            ).fetchall()
+        lacunas = []
+        proximo = desde
+        for (nsu,) in recebidos:
+            if nsu > proximo:
+                lacunas.append((proximo, nsu - 1))
+            proximo = nsu + 1
+        if proximo <= ate:
+            lacunas.append((proximo, ate))
+        return lacunas
+
+    def renomear(self, cnpj: str, origem: str, destino: str) -> str:
+        indice = self._indice(cnpj)
+        caminho_origem = self._caminho(cnpj, origem)
+        caminho_destino = self._caminhos(cnpj, destino)[0]
+        os.makedirs(os.path.dirname(caminho_destino), exist_ok=True)
+        os.rename(caminho_origem, caminho_destino)
+        with self._lock:
+            pendentes = self._nao_sincronizados.get(cnpj, set())
+            if caminho_origem in pendentes:
+                pendentes.discard(caminho_origem)
+                pendentes.add(caminho_destino)
+        with indice.conectar() as con:
+            con.execute("DELETE FROM documentos WHERE nome = ?", (destino,))
+            con.execute("UPDATE documentos SET nome = ? WHERE nome = ?", (destino, origem))
         return caminho_destino
 
     def remover(self, cnpj: str, nome: str) -> None:
-        caminho = f"{self._pasta(cnpj)}/{nome}"
+        caminho = self._caminho(cnpj, nome)
         if os.path.exists(caminho):
             os.remove(caminho)
+        if os.path.isdir(self._pasta(cnpj)):
+            with self._indice(cnpj).conectar() as con:
+                con.execute("DELETE FROM documentos WHERE nome = ?", (nome,))
+
+    def _limpar_temporarios(self, cnpj: str) -> None:
+        """Apaga .tmp deixados por gravações interrompidas (só os antigos: outro processo pode estar gravando)."""
+        limite = time.time() - self.TEMPORARIO_ORFAO
+        pastas = [self._pasta(cnpj)] + [
+            e.path for e in os.scandir(self._pasta(cnpj))
+            if e.is_dir() and (e.name == self.SEM_CHAVE or (len(e.name) == 4 and e.name.isdigit()))
+        ]
+        for pasta in pastas:
+            for entrada in os.scandir(pasta):
+                if entrada.name.startswith(".") and entrada.name.endswith(".tmp") \
+                        and entrada.stat().st_mtime < limite:
+                    logging.warning("Removendo temporario orfao %s", entrada.path)
+                    with suppress(FileNotFoundError):
+                        os.remove(entrada.path)
+
+    def migrar_layout(self, cnpj: str, limite: int | None = None) -> tuple[int, int]:
+        """Move os XMLs que estão fora do layout configurado. Retorna (movidos, restantes).
+
+        Cada arquivo é um os.rename independente e os demais métodos acham o arquivo
+        nos dois layouts, então a migração pode rodar com o nfe-sync em uso, ser
+        interrompida e retomada. O índice não muda: ele é por nome.
+        """
+        if not os.path.isdir(self._pasta(cnpj)):
+            return 0, 0
+        movidos = restantes = 0
+        pastas = set()
+        for nome, caminho in list(self._arquivos_xml(cnpj)):
+            destino = self._caminhos(cnpj, nome)[0]
+            if caminho == destino:
+                continue
+            if limite is not None and movidos >= limite:
+                restantes += 1
+                continue
+            if os.path.exists(destino):
+                os.remove(caminho)  # salvar() já gravou uma versão mais nova no destino
+            else:
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                os.rename(caminho, destino)
+            pastas.update((os.path.dirname(caminho), os.path.dirname(destino)))
+            movidos += 1
+        for pasta in pastas:
+            _fsync(pasta)
+        return movidos, restantes
+
+    def reindexar(self, cnpj: str) -> int:
+        """Sincroniza o índice com o disco. Retorna o número de XMLs (re)lidos.
+
+        Só abre arquivos novos ou cujo tamanho/mtime mudou; remove do índice
+        os que não existem mais.
+        """
+        indice = _IndiceDocumentos(self._pasta(cnpj))
+        if not os.path.isdir(indice.pasta):
+            return 0
+        lidos = 0
+        with indice.conectar() as con:
+            self._limpar_temporarios(cnpj)
+            conhecidos = {
+                nome: (tamanho, mtime)
+                for nome, tamanho, mtime in con.execute("SELECT nome, tamanho, mtime FROM documentos")
+            }
+            no_disco = set()
+            for nome, caminho in self._arquivos_xml(cnpj):
+                try:
+                    st = os.stat(caminho)
+                except OSError as e:
+                    logging.warning("Arquivo %s ignorado: %s", nome, e)
+                    continue
+                no_disco.add(nome)
+                if conhecidos.get(nome) == (st.st_size, st.st_mtime):
+                    continue
+                indice.gravar(con, nome, self._root_tag_arquivo(cnpj, nome), None, None, st.st_size, st.st_mtime)
+                lidos += 1
+            removidos = [(nome,) for nome in conhecidos if nome not in no_disco]
+            con.executemany("DELETE FROM documentos WHERE nome = ?", removidos)
+        return lidos
+
+
+# Registro dos segmentos: marca, tipo, tamanho dos metadados, tamanho dos dados, crc32(metadados + dados)
+_REGISTRO = struct.Struct("<4sBHII")
+_MARCA = b"NFSG"
+_DOCUMENTO, _ALIAS, _REMOCAO = ord("D"), ord("A"), ord("X")
+
+
+class DocumentoStorageCompactado(DocumentoStorage):
+    """Guarda os XMLs comprimidos (gzip) em segmentos append-only downloads/{cnpj}/docs-NNNNNN.seg.
+
+    Cada registro traz nome, schema e NSU junto do XML comprimido; o índice aponta
+    nome → (segmento, início). renomear() grava um alias e remover() uma lápide, sem
+    reescrever dados. Os segmentos são a fonte da verdade: reindexar() reconstrói o índice.
+
+    Cada gravação (ler o fim do segmento, anexar, registrar no índice) roda numa
+    transação BEGIN IMMEDIATE do índice, então vários processos podem gravar no
+    mesmo CNPJ. XMLs soltos de uma pasta gravada no modo arquivos continuam
+    legíveis até compactar() passá-los para os segmentos.
+    """
+
+    TAMANHO_SEGMENTO = 64 * 1024 * 1024
+    NIVEL = 6
+
+    def __init__(self, fsync: str = "arquivo"):
+        super().__init__(fsync=fsync)
+        self._lock_segmentos = threading.Lock()
+
+    @staticmethod
+    def _nome_segmento(numero: int) -> str:
+        return f"docs-{numero:06d}.seg"
+
+    @contextmanager
+    def _conectar(self, indice: _IndiceDocumentos, imediato: bool = False):
+        with indice.conectar(imediato) as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS arquivados (nome TEXT PRIMARY KEY, segmento TEXT, inicio INTEGER)"
+            )
+            con.execute("CREATE TABLE IF NOT EXISTS segmentos (segmento TEXT PRIMARY KEY, fim INTEGER)")
+            yield con
+
+    @staticmethod
+    def _ler_registro(f) -> tuple[int, list[str], bytes] | None:
+        """Lê o registro na posição atual; None no fim do arquivo ou em registro truncado/corrompido."""
+        cabecalho = f.read(_REGISTRO.size)
+        if len(cabecalho) < _REGISTRO.size:
+            return None
+        marca, tipo, n_meta, n_dados, crc = _REGISTRO.unpack(cabecalho)
+        if marca != _MARCA:
+            return None
+        corpo = f.read(n_meta + n_dados)
+        if len(corpo) < n_meta + n_dados or zlib.crc32(corpo) != crc:
+            return None
+        return tipo, corpo[:n_meta].decode().split("\0"), corpo[n_meta:]
+
+    def _aplicar(self, con, segmento: str, inicio: int, tipo: int, meta: list[str], dados: bytes, mtime: float) -> None:
+        if tipo == _DOCUMENTO:
+            nome, schema, nsu = meta
+            con.execute(
+                "INSERT INTO arquivados (nome, segmento, inicio) VALUES (?, ?, ?)"
+                " ON CONFLICT (nome) DO UPDATE SET segmento = excluded.segmento, inicio = excluded.inicio",
+                (nome, segmento, inicio),
+            )
+            tag = _tag_do_schema(schema) or self._root_tag_conteudo(gzip.decompress(dados), nome)
+            tamanho = int.from_bytes(dados[-4:], "little")  # ISIZE do trailer gzip
+            _IndiceDocumentos.gravar(con, nome, tag, schema or None, nsu or None, tamanho, mtime)
+        elif tipo == _ALIAS:
+            origem, destino = meta
+            for tabela in ("arquivados", "documentos"):
+                con.execute(f"DELETE FROM {tabela} WHERE nome = ?", (destino,))
+                con.execute(f"UPDATE {tabela} SET nome = ? WHERE nome = ?", (destino, origem))
+        elif tipo == _REMOCAO:
+            for tabela in ("arquivados", "documentos"):
+                con.execute(f"DELETE FROM {tabela} WHERE nome = ?", (meta[0],))
+
+    def _recuperar(self, con, cnpj: str, segmento: str, inicio: int) -> int:
+        """Aplica ao índice os registros do segmento a partir de inicio.
+
+        Uma cauda inválida (gravação interrompida no meio do registro) não é cortada:
+        o fim registrado para o segmento para antes dela e _anexar() passa ao próximo
+        segmento. Retorna quantos registros foram aplicados.
+        """
+        caminho = f"{self._pasta(cnpj)}/{segmento}"
+        mtime = os.stat(caminho).st_mtime
+        aplicados = 0
+        with open(caminho, "rb") as f:
+            f.seek(inicio)
+            while (registro := self._ler_registro(f)) is not None:
+                self._aplicar(con, segmento, inicio, *registro, mtime)
+                inicio = f.tell()
+                aplicados += 1
+            if f.seek(0, os.SEEK_END) > inicio:
+                logging.warning("Segmento %s com registro incompleto em %d; ignorado", caminho, inicio)
+        con.execute(
+            "INSERT INTO segmentos (segmento, fim) VALUES (?, ?)"
+            " ON CONFLICT (segmento) DO UPDATE SET fim = excluded.fim",
+            (segmento, inicio),
+        )
+        return aplicados
+
+    def _anexar(self, con, cnpj: str, tipo: int, meta: list[str], dados: bytes = b"") -> tuple[str, int]:
+        """Acrescenta um registro ao segmento corrente. Retorna (segmento, início).
+
+        con precisa estar numa transação imediata (_conectar(..., imediato=True)):
+        é o lock de escrita do índice que impede dois processos de anexar no mesmo fim.
+        """
+        corpo = "\0".join(meta).encode() + dados
+        n_meta = len(corpo) - len(dados)
+        registro = _REGISTRO.pack(_MARCA, tipo, n_meta, len(dados), zlib.crc32(corpo)) + corpo
+        segmento, fim = con.execute(
+            "SELECT segmento, fim FROM segmentos ORDER BY segmento DESC LIMIT 1"
+        ).fetchone() or (self._nome_segmento(1), 0)
+        while True:
+            caminho = f"{self._pasta(cnpj)}/{segmento}"
+            tamanho = os.path.getsize(caminho) if os.path.exists(caminho) else 0
+            if tamanho > fim:
+                # registros de um processo que caiu antes do commit do índice
+                self._recuperar(con, cnpj, segmento, fim)
+                (fim,) = con.execute("SELECT fim FROM segmentos WHERE segmento = ?", (segmento,)).fetchone()
+            # segmento com cauda inválida (ou alterado fora do nfe-sync) não recebe mais registros
+            if tamanho == fim and fim < self.TAMANHO_SEGMENTO:
+                break
+            segmento, fim = self._nome_segmento(int(segmento[5:11]) + 1), 0
+        with open(caminho, "ab", buffering=0) as f:
+            try:
+                gravado = 0
+                while gravado < len(registro):
+                    gravado += f.write(registro[gravado:])
+                if self.fsync == "arquivo":
+                    os.fsync(f.fileno())
+            except BaseException:
+                # desfaz só o que esta gravação acrescentou: com o lock de escrita, o resto do segmento não muda
+                with suppress(OSError):
+                    f.truncate(fim)
+                raise
+        if self.fsync == "arquivo":
+            if fim == 0:
+                _fsync(self._pasta(cnpj))  # segmento novo: a entrada na pasta também
+        else:
+            with self._lock:
+                self._nao_sincronizados.setdefault(cnpj, set()).add(caminho)
+        con.execute(
+            "INSERT INTO segmentos (segmento, fim) VALUES (?, ?)"
+            " ON CONFLICT (segmento) DO UPDATE SET fim = excluded.fim",
+            (segmento, fim + len(registro)),
+        )
+        return segmento, fim
+
+    def _localizar(self, con, nome: str) -> tuple[str, int] | None:
+        return con.execute("SELECT segmento, inicio FROM arquivados WHERE nome = ?", (nome,)).fetchone()
+
+    def salvar(self, cnpj: str, nome: str, xml: str | bytes, schema: str | None = None, nsu: str | None = None) -> str:
+        dados = xml if isinstance(xml, bytes) else xml.encode()
+        tag = _tag_do_schema(schema) or self._root_tag_conteudo(dados, nome)
+        indice = self._indice(cnpj)
+        with self._lock_segmentos, self._conectar(indice, imediato=True) as con:
+            segmento, inicio = self._anexar(
+                con, cnpj, _DOCUMENTO, [nome, schema or "", nsu or ""], gzip.compress(dados, self.NIVEL, mtime=0),
+            )
+            con.execute(
+                "INSERT INTO arquivados (nome, segmento, inicio) VALUES (?, ?, ?)"
+                " ON CONFLICT (nome) DO UPDATE SET segmento = excluded.segmento, inicio = excluded.inicio",
+                (nome, segmento, inicio),
+            )
+            indice.gravar(con, nome, tag, schema, nsu, len(dados), time.time())
+        return f"{self._pasta(cnpj)}/{segmento}:{nome}"
+
+    def ler(self, cnpj: str, nome: str) -> bytes:
+        with self._conectar(self._indice(cnpj)) as con:
+            local = self._localizar(con, nome)
+        if local is None:
+            return super().ler(cnpj, nome)  # XML solto, ainda não compactado
+        segmento, inicio = local
+        with open(f"{self._pasta(cnpj)}/{segmento}", "rb") as f:
+            f.seek(inicio)
+            registro = self._ler_registro(f)
+        if registro is None:
+            raise ValueError(f"Registro de {nome} corrompido em {segmento}")
+        return gzip.decompress(registro[2])
+
+    def _root_tag_arquivo(self, cnpj: str, nome: str) -> str | None:
+        try:
+            return safe_root_tag(self.ler(cnpj, nome))
+        except Exception as e:
+            logging.warning("Nao foi possivel ler %s/%s: %s", cnpj, nome, e)
+            return None
+
+    def renomear(self, cnpj: str, origem: str, destino: str) -> str:
+        with self._lock_segmentos, self._conectar(self._indice(cnpj), imediato=True) as con:
+            local = self._localizar(con, origem)
+            if local is not None:
+                self._anexar(con, cnpj, _ALIAS, [origem, destino])
+                self._aplicar(con, local[0], local[1], _ALIAS, [origem, destino], b"", 0)
+            elif not os.path.exists(self._caminho(cnpj, origem)):
+                raise FileNotFoundError(f"{self._pasta(cnpj)}/{origem}")
+            elif self._localizar(con, destino) is not None:
+                # origem é um XML solto: a versão compactada do destino deixa de valer
+                self._anexar(con, cnpj, _REMOCAO, [destino])
+                self._aplicar(con, "", 0, _REMOCAO, [destino], b"", 0)
+        if local is None:
+            return super().renomear(cnpj, origem, destino)
+        # cópias soltas de uma compactação interrompida
+        for nome in (origem, destino):
+            with suppress(FileNotFoundError):
+                os.remove(self._caminho(cnpj, nome))
+        return f"{self._pasta(cnpj)}/{local[0]}:{destino}"
+
+    def remover(self, cnpj: str, nome: str) -> None:
+        if not os.path.isdir(self._pasta(cnpj)):
+            return
+        with self._lock_segmentos, self._conectar(self._indice(cnpj), imediato=True) as con:
+            if self._localizar(con, nome) is not None:
+                self._anexar(con, cnpj, _REMOCAO, [nome])
+                self._aplicar(con, "", 0, _REMOCAO, [nome], b"", 0)
+        super().remover(cnpj, nome)  # cópia solta, se houver
+
+    def reindexar(self, cnpj: str) -> int:
+        """Reconstrói o índice relendo os segmentos. XMLs soltos ainda não compactados
+        entram no índice como estão (ver compactar()).
+
+        Retorna o número de registros lidos mais o de XMLs soltos indexados.
+        """
+        indice = _IndiceDocumentos(self._pasta(cnpj))
+        if not os.path.isdir(indice.pasta):
+            return 0
+        lidos = 0
+        with self._lock_segmentos, self._conectar(indice, imediato=True) as con:
+            self._limpar_temporarios(cnpj)
+            for tabela in ("documentos", "arquivados", "segmentos"):
+                con.execute(f"DELETE FROM {tabela}")
+            for segmento in sorted(os.listdir(indice.pasta)):
+                if segmento.startswith("docs-") and segmento.endswith(".seg"):
+                    lidos += self._recuperar(con, cnpj, segmento, 0)
+            for nome, caminho in self._arquivos_xml(cnpj):
+                if self._localizar(con, nome) is not None:
+                    continue  # cópia de uma compactação interrompida: vale a do segmento
+                try:
+                    st = os.stat(caminho)
+                except OSError as e:
+                    logging.warning("Arquivo %s ignorado: %s", nome, e)
+                    continue
+                tag = DocumentoStorage._root_tag_arquivo(self, cnpj, nome)
+                indice.gravar(con, nome, tag, None, None, st.st_size, st.st_mtime)
+                lidos += 1
+        return lidos
+
+    def compactar(self, cnpj: str, limite: int | None = None) -> tuple[int, int]:
+        """Passa os XMLs soltos da pasta (gravados no modo arquivos) para os segmentos.
+
+        Retorna (compactados, restantes). Cada arquivo só é apagado depois de gravado
+        e sincronizado no segmento, então a compactação pode ser interrompida e retomada.
+        """
+        if not os.path.isdir(self._pasta(cnpj)):
+            return 0, 0
+        soltos = sorted(self._arquivos_xml(cnpj))
+        restantes = 0
+        if limite is not None and len(soltos) > limite:
+            soltos, restantes = soltos[:limite], len(soltos) - limite
+        indice = self._indice(cnpj)
+        for nome, caminho in soltos:
+            with self._conectar(indice) as con:
+                compactado = self._localizar(con, nome) is not None
+            if compactado:
+                continue  # interrompida depois de gravar no segmento: só falta apagar
+            linha = indice.buscar(nome)
+            with open(caminho, "rb") as f:
+                self.salvar(cnpj, nome, f.read(), schema=linha[1] if linha else None, nsu=linha[2] if linha else None)
+        self.sincronizar(cnpj)
+        for _, caminho in soltos:
+            with suppress(FileNotFoundError):
+                os.remove(caminho)
+        return len(soltos), restantes
+
+
+def abrir_storage(tipo: str | None = None, layout: str | None = None, fsync: str | None = None) -> DocumentoStorage:
+    """Escolhe o armazenamento: 'arquivos' (padrão, um XML por arquivo) ou 'gzip' (segmentos).
+
+    layout ('plano' ou 'aamm') só se aplica a 'arquivos'; fsync é 'arquivo' (padrão) ou 'lote'.
+    """
+    layout = layout or "plano"
+    fsync = fsync or "arquivo"
+    if layout not in DocumentoStorage.LAYOUTS:
+        raise NfeConfigError(f"NFE_SYNC_LAYOUT invalido '{layout}' (use 'plano' ou 'aamm')")
+    if fsync not in DocumentoStorage.MODOS_FSYNC:
+        raise NfeConfigError(f"NFE_SYNC_FSYNC invalido '{fsync}' (use 'arquivo' ou 'lote')")
+    if not tipo or tipo == "arquivos":
+        return DocumentoStorage(layout, fsync)
+    if tipo == "gzip":
+        return DocumentoStorageCompactado(fsync)
+    raise NfeConfigError(f"NFE_SYNC_STORAGE invalido '{tipo}' (use 'arquivos' ou 'gzip')")
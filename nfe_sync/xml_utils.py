@@ -1,10 +1,23 @@
-import time
+import functools
+import io
+import re
+import threading
+from contextlib import contextmanager
+from dataclasses import replace
 from datetime import datetime, timedelta, timezone
 
+import requests
 from pynfe.processamento.comunicacao import ComunicacaoSefaz
 from pynfe.utils import etree
 
+from .certificado import _cache as _cache_certificados
+from .disjuntor import chave_servico, disjuntor_ativo
+from .limitador import limitador_ativo, servico_da_url
+from .retentativa import (
+    POLITICA_PADRAO, PoliticaRetentativa, controle_retentativas, erro_transitorio, resposta_transitoria,
+)
 from .models import EmpresaConfig
+from .xpaths import NS, XP_CSTAT, XP_XMOTIVO
 
 _BRT = timezone(timedelta(hours=-3))
 
@@ -41,6 +54,40 @@ def safe_parse(path: str):
     return etree.parse(path, parser=_PARSER)
 
 
+# Tamanho de cada leitura em safe_root_tag: a raiz costuma estar nos primeiros ~100 bytes
+_BLOCO_ROOT_TAG = 4096
+
+
+def safe_root_tag(fonte: str | bytes) -> str:
+    """Retorna o nome local do elemento raiz sem montar a árvore inteira.
+
+    fonte: caminho de arquivo ou bytes. Alimenta um parser incremental em blocos
+    de _BLOCO_ROOT_TAG bytes e para no primeiro evento "start" — um procNFe de
+    centenas de KB é lido só até a raiz. Mesmas proteções XXE de _PARSER.
+    """
+    parser = etree.XMLPullParser(
+        events=("start",), resolve_entities=False, no_network=True, load_dtd=False,
+    )
+    with (io.BytesIO(fonte) if isinstance(fonte, bytes) else open(fonte, "rb")) as f:
+        while bloco := f.read(_BLOCO_ROOT_TAG):
+            parser.feed(bloco)
+            for _, elemento in parser.read_events():
+                return _nome_local(elemento.tag)
+    # documento curto (ex: <a/>): o libxml2 só entrega o "start" no close()
+    erro = None
+    try:
+        parser.close()
+    except etree.XMLSyntaxError as e:
+        erro = e  # truncado depois da raiz: a raiz já lida continua valendo
+    for _, elemento in parser.read_events():
+        return _nome_local(elemento.tag)
+    raise ValueError("XML sem elemento raiz") from erro
+
+
+def _nome_local(tag: str) -> str:
+    return tag.split("}")[-1] if "}" in tag else tag
+
+
 def to_xml_string(element) -> str:
     """Serializa elemento lxml para string com declaração XML."""
     return '<?xml version="1.0" encoding="UTF-8"?>\n' + etree.tostring(
@@ -50,26 +97,137 @@ def to_xml_string(element) -> str:
 
 def extract_status_motivo(xml_resp, ns: dict) -> list[dict]:
     """Extrai pares cStat/xMotivo de uma resposta XML da SEFAZ."""
-    stats = xml_resp.xpath("//ns:cStat", namespaces=ns)
-    motivos = xml_resp.xpath("//ns:xMotivo", namespaces=ns)
+    if ns == NS:
+        stats, motivos = XP_CSTAT(xml_resp), XP_XMOTIVO(xml_resp)
+    else:
+        stats = xml_resp.xpath("//ns:cStat", namespaces=ns)
+        motivos = xml_resp.xpath("//ns:xMotivo", namespaces=ns)
     return [{"status": s.text, "motivo": m.text} for s, m in zip(stats, motivos)]
 
 
-def _com_retry(fn, *args, tentativas=3, base=5, **kwargs):
-    """Chama fn(*args, **kwargs) com retry exponencial (tentativas x, delay base*2^n segundos)."""
-    for n in range(tentativas):
-        try:
-            return fn(*args, **kwargs)
-        except Exception:
-            if n == tentativas - 1:
-                raise
-            time.sleep(base * (2 ** n))
+def _com_retry(fn, *args, politica: PoliticaRetentativa | None = None,
+               tentativas: int | None = None, base: float | None = None, **kwargs):
+    """Chama fn(*args, **kwargs) repetindo só falhas transitórias (ver retentativa.py).
+
+    politica: sobrescreve a POLITICA_PADRAO para esta operação; tentativas/base
+    são atalhos que ajustam só esses campos.
+    """
+    politica = politica or POLITICA_PADRAO
+    if tentativas is not None or base is not None:
+        politica = replace(
+            politica,
+            tentativas=tentativas if tentativas is not None else politica.tentativas,
+            base=base if base is not None else politica.base,
+        )
+    return controle_retentativas().executar(fn, args, kwargs, politica)
 
 
 _SEFAZ_TIMEOUT = 30  # segundos
 
 
-def criar_comunicacao(empresa: EmpresaConfig, uf: str | None = None, cert_path: str | None = None) -> ComunicacaoSefaz:
+def _corpo_soap(xml) -> str:
+    """Mesmo corpo que ComunicacaoSefaz._post envia (declaração + limpeza do qrCode de NFC-e)."""
+    xml = re.sub(
+        "<qrCode>(.*?)</qrCode>",
+        lambda x: x.group(0).replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", ""),
+        etree.tostring(xml, encoding="unicode").replace("\n", ""),
+    )
+    return '<?xml version="1.0" encoding="UTF-8"?>' + xml
+
+
+# conexões keep-alive guardadas por sessão: chamadas em paralelo do mesmo
+# (CNPJ, UF, ambiente) — --paralelo, lotes de manifestação — usam conexões próprias
+CONEXOES_POR_SESSAO = 16
+
+
+class _SessaoSefaz:
+    """requests.Session com certificado cliente, mantendo as conexões keep-alive.
+
+    O pynfe abre um requests.post por chamada — novo handshake TLS com
+    certificado cliente a cada consulta. O par PEM vem do cache de
+    certificados (decifrado uma vez; renovado quando o TTL expira).
+
+    A sessão é compartilhada entre threads sem lock: o pool do HTTPAdapter
+    entrega uma conexão por requisição em andamento (até CONEXOES_POR_SESSAO
+    ficam abertas para reuso; acima disso, as extras são fechadas ao terminar).
+    """
+
+    def __init__(self, cert_path: str, senha: str):
+        with open(cert_path, "rb") as f:
+            self._pfx = f.read()
+        self._senha = senha
+        self.session = requests.Session()
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=CONEXOES_POR_SESSAO))
+
+    def post(self, con: ComunicacaoSefaz, url: str, xml, timeout=None):
+        cert = _cache_certificados.arquivos_pem(self._pfx, self._senha)
+        # verify por requisição: REQUESTS_CA_BUNDLE no ambiente sobrepõe session.verify
+        resp = self.session.post(
+            url, _corpo_soap(xml), headers=con._post_header(), timeout=timeout,
+            cert=cert, verify=False,
+        )
+        resp.encoding = "utf-8"
+        return resp
+
+    def fechar(self) -> None:
+        self.session.close()
+
+
+class PoolSessoesSefaz:
+    """Sessões HTTPS por (CNPJ, UF, ambiente), reaproveitadas entre chamadas à SEFAZ.
+
+    Use via sessoes_sefaz(); fechar() encerra as conexões. Os PEM temporários
+    pertencem ao cache de certificados (ver certificado.limpar_certificados).
+    """
+
+    def __init__(self):
+        self._sessoes: dict[tuple[str, str, bool], _SessaoSefaz] = {}
+        self._lock = threading.Lock()
+
+    def obter(self, empresa: EmpresaConfig, uf: str, cert_path: str) -> _SessaoSefaz:
+        chave = (empresa.emitente.cnpj, uf.lower(), empresa.homologacao)
+        with self._lock:
+            sessao = self._sessoes.get(chave)
+            if sessao is None:
+                sessao = self._sessoes[chave] = _SessaoSefaz(cert_path, empresa.certificado.senha)
+            return sessao
+
+    def __len__(self) -> int:
+        return len(self._sessoes)
+
+    def fechar(self) -> None:
+        with self._lock:
+            sessoes, self._sessoes = list(self._sessoes.values()), {}
+        for sessao in sessoes:
+            sessao.fechar()
+
+
+_pool_ativo: PoolSessoesSefaz | None = None
+
+
+@contextmanager
+def sessoes_sefaz():
+    """Ativa o pool de sessões SEFAZ dentro do bloco; ao sair, fecha as conexões.
+
+    Blocos aninhados reaproveitam o pool externo. Fora de um bloco, cada
+    chamada abre sua própria conexão (comportamento do pynfe).
+    """
+    global _pool_ativo
+    if _pool_ativo is not None:
+        yield _pool_ativo
+        return
+    pool = _pool_ativo = PoolSessoesSefaz()
+    try:
+        yield pool
+    finally:
+        _pool_ativo = None
+        pool.fechar()
+
+
+def criar_comunicacao(
+    empresa: EmpresaConfig, uf: str | None = None, cert_path: str | None = None,
+    classe: type[ComunicacaoSefaz] | None = None,
+) -> ComunicacaoSefaz:
     """Factory para ComunicacaoSefaz com timeout de 30s injetado via monkey-patch em _post.
 
     pynfe nao expoe timeout nos metodos publicos (exceto autorizacao/status_servico),
@@ -78,34 +236,66 @@ def criar_comunicacao(empresa: EmpresaConfig, uf: str | None = None, cert_path:
 
     cert_path: path do certificado a usar. Se None, usa empresa.certificado.path.
     Deve ser o path já resolvido pelo context manager Certificado.cert_path().
+    classe: subclasse de ComunicacaoSefaz a instanciar (ex: ComunicacaoSvc na emissão).
+
+    Dentro de sessoes_sefaz(), o POST usa a sessão keep-alive do pool em vez
+    de abrir uma conexão nova.
+
+    Todo POST (inclusive retentativas) passa antes pelo disjuntor ativo, que
+    falha na hora se o serviço está fora do ar (ver disjuntor.py), e pelo
+    limitador, que espaça as requisições por serviço/CNPJ/ambiente (ver limitador.py).
     """
-    con = ComunicacaoSefaz(
-        uf if uf is not None else empresa.uf,
-        cert_path if cert_path is not None else empresa.certificado.path,
-        empresa.certificado.senha,
-        empresa.homologacao,
-    )
-    _original_post = con._post
+    uf = uf if uf is not None else empresa.uf
+    cert_path = cert_path if cert_path is not None else empresa.certificado.path
+    classe = classe if classe is not None else ComunicacaoSefaz
+    con = classe(uf, cert_path, empresa.certificado.senha, empresa.homologacao)
+    pool = _pool_ativo
+    if pool is not None:
+        sessao = pool.obter(empresa, uf, cert_path)
+
+        def _original_post(url, xml, timeout=None):
+            return sessao.post(con, url, xml, timeout=timeout)
+    else:
+        _original_post = con._post
+
+    ambiente = "homologacao" if empresa.homologacao else "producao"
 
     def _post_com_timeout(url, xml, timeout=None):
-        return _original_post(url, xml, timeout=timeout if timeout is not None else _SEFAZ_TIMEOUT)
+        disjuntor = disjuntor_ativo()
+        chave = chave_servico(url, ambiente)
+        disjuntor.permitir(chave)
+        limitador_ativo().aguardar(servico_da_url(url), empresa.emitente.cnpj, ambiente)
+        try:
+            resp = _original_post(url, xml, timeout=timeout if timeout is not None else _SEFAZ_TIMEOUT)
+        except Exception as e:
+            if erro_transitorio(e):
+                disjuntor.falha(chave)
+            raise
+        if resposta_transitoria(resp):
+            disjuntor.falha(chave)
+        else:
+            disjuntor.sucesso(chave)
+        return resp
 
     con._post = _post_com_timeout
     return con
 
 
 def chamar_sefaz(empresa: EmpresaConfig, fn_nome: str, *args,
-                 uf: str | None = None, cert_path: str | None = None, **kwargs):
+                 uf: str | None = None, cert_path: str | None = None,
+                 politica: PoliticaRetentativa | None = None, **kwargs):
     """Executa fn_nome na ComunicacaoSefaz com retry e retorna (xml_element, xml_string).
 
-    fn_nome: nome do método de ComunicacaoSefaz (ex: 'consulta_nota', 'consulta_distribuicao').
+    fn_nome: nome do método de ComunicacaoSefaz (ex: 'consulta_nota', 'consulta_distribuicao'),
+    ou uma função fn(con, *args, **kwargs) para requisições que o pynfe não monta.
     Centraliza: criar_comunicacao → _com_retry → safe_fromstring → to_xml_string.
 
     cert_path: path já resolvido pelo context manager Certificado.cert_path().
+    politica: PoliticaRetentativa desta operação (padrão: POLITICA_PADRAO).
     """
     con = criar_comunicacao(empresa, uf=uf or empresa.uf, cert_path=cert_path)
-    fn = getattr(con, fn_nome)
-    resp = _com_retry(fn, *args, **kwargs)
+    fn = getattr(con, fn_nome) if isinstance(fn_nome, str) else functools.partial(fn_nome, con)
+    resp = _com_retry(fn, *args, politica=politica, **kwargs)
     content = resp.content if hasattr(resp, "content") else resp
     xml_el = safe_fromstring(content)
     return xml_el, to_xml_string(xml_el)
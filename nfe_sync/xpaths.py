@@ -0,0 +1,69 @@
+"""XPaths pré-compilados e extratores de passada única para respostas da SEFAZ.
+
+Compilar a expressão uma vez evita o parse do XPath a cada chamada; os
+extratores percorrem a árvore uma única vez em vez de um scan
+`//*[local-name()=...]` por campo.
+"""
+from pynfe.utils import etree
+
+NS = {"ns": "http://www.portalfiscal.inf.br/nfe"}
+_NFE = "{http://www.portalfiscal.inf.br/nfe}"
+
+XP_CSTAT = etree.XPath("//ns:cStat", namespaces=NS)
+XP_XMOTIVO = etree.XPath("//ns:xMotivo", namespaces=NS)
+XP_DOC_ZIP = etree.XPath("//ns:docZip", namespaces=NS)
+XP_NPROT = etree.XPath("//ns:nProt", namespaces=NS)
+
+
+def _local(tag: str) -> str:
+    return tag[tag.index("}") + 1:] if tag[0] == "{" else tag
+
+
+def extrair_retorno(xml_resp, *campos: str) -> dict[str, str | None]:
+    """Texto do primeiro elemento de cada campo (namespace da NF-e), em uma passada.
+
+    extrair_retorno(resp, "cStat", "xMotivo") -> {"cStat": "138", "xMotivo": "..."}
+    Para assim que todos os campos forem encontrados.
+    """
+    valores: dict[str, str | None] = dict.fromkeys(campos)
+    faltam = len(campos)
+    for el in xml_resp.iter(*(_NFE + c for c in campos)):
+        nome = el.tag[len(_NFE):]
+        if valores[nome] is None:
+            valores[nome] = el.text
+            faltam -= 1
+            if not faltam:
+                break
+    return valores
+
+
+# campo -> nome do pai exigido (None = qualquer), como nos XPaths
+# //dest/CNPJ, //emit/CNPJ, //ide/serie, //ide/nNF
+_CAMPOS_DOCUMENTO = ("chNFe", "tpEvento", "nSeqEvento", "CNPJ", "serie", "nNF")
+_TAGS_DOCUMENTO = tuple("{*}" + c for c in _CAMPOS_DOCUMENTO)
+_PAI_CNPJ = {"dest": "cnpj_dest", "emit": "cnpj_emit"}
+
+
+def extrair_campos_documento(xml_doc) -> dict[str, str]:
+    """Lê chNFe, tpEvento, nSeqEvento, CNPJ de dest/emit, serie e nNF em uma passada.
+
+    Independe de namespace. Cada campo recebe o texto da primeira ocorrência
+    não vazia, em ordem de documento; ausentes ficam "".
+    """
+    campos = {"chNFe": "", "tpEvento": "", "nSeqEvento": "",
+              "cnpj_dest": "", "cnpj_emit": "", "serie": "", "nNF": ""}
+    for el in xml_doc.iter(*_TAGS_DOCUMENTO):
+        texto = el.text
+        if not texto:
+            continue
+        nome = _local(el.tag)
+        if nome == "CNPJ":
+            pai = el.getparent()
+            nome = _PAI_CNPJ.get(_local(pai.tag)) if pai is not None else None
+        elif nome in ("serie", "nNF"):
+            pai = el.getparent()
+            if pai is None or _local(pai.tag) != "ide":
+                continue
+        if nome and not campos[nome]:
+            campos[nome] = texto
+    return campos
@@ -0,0 +1,309 @@
+"""Testes para assincrono.py — cliente SEFAZ sobre asyncio com TLS mútuo."""
+import asyncio
+import ssl
+from unittest.mock import patch
+
+import pytest
+from lxml import etree
+from pynfe.processamento.comunicacao import ComunicacaoSefaz
+
+from nfe_sync.assincrono import (
+    ClienteSefazAsync, TransporteAsync, consultar_async, consultar_dfe_chave_async, consultar_dfe_nsu_async, consultar_nsu_async,
+    manifestar_async,
+    montar_requisicao,
+)
+from nfe_sync.consulta import consultar, consultar_nsu
+from nfe_sync.disjuntor import DisjuntorSefaz, configurar_disjuntor
+from nfe_sync.limitador import LimitadorSefaz, configurar_limitador
+from nfe_sync.manifestacao import manifestar
+from nfe_sync.retentativa import ControleRetentativas, configurar_retentativas
+from nfe_sync.xml_utils import safe_fromstring
+from tests.conftest import CHAVE_VALIDA
+from tests.test_xml_utils import _gerar_certificados
+
+NFE = "http://www.portalfiscal.inf.br/nfe"
+RET_CONSULTA = (
+    f'<retConsSitNFe xmlns="{NFE}"><tpAmb>2</tpAmb><cStat>100</cStat>'
+    f"<xMotivo>Autorizado o uso da NF-e</xMotivo><chNFe>{CHAVE_VALIDA}</chNFe></retConsSitNFe>"
+).encode()
+RET_PARALISADO = f'<retConsSitNFe xmlns="{NFE}"><cStat>108</cStat><xMotivo>Paralisado</xMotivo></retConsSitNFe>'.encode()
+RET_DIST = (
+    f'<retDistDFeInt xmlns="{NFE}"><tpAmb>2</tpAmb><cStat>137</cStat>'
+    "<xMotivo>Nenhum documento localizado</xMotivo><ultNSU>000000000000042</ultNSU>"
+    "<maxNSU>000000000000042</maxNSU></retDistDFeInt>"
+).encode()
+RET_EVENTO = (
+    f'<retEnvEvento xmlns="{NFE}"><cStat>128</cStat><xMotivo>Lote de Evento Processado</xMotivo>'
+    f"<retEvento><infEvento><cStat>135</cStat><xMotivo>Evento registrado</xMotivo>"
+    f"<chNFe>{CHAVE_VALIDA}</chNFe><nProt>135000000000001</nProt></infEvento></retEvento></retEnvEvento>"
+).encode()
+
+
+class ServidorAsync:
+    """Stand-in HTTPS da SEFAZ no próprio event loop do teste; exige certificado cliente."""
+
+    def __init__(self, pasta, responder, chunked=False, fechar_apos_resposta=False, sem_resposta=()):
+        self.responder = responder
+        self.chunked = chunked
+        self.fechar_apos_resposta = fechar_apos_resposta
+        self.sem_resposta = sem_resposta  # nº dos pedidos (a partir de 1) recebidos e largados sem resposta
+        self.conexoes = 0
+        self.pedidos: list[bytes] = []
+        self.ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self.ctx.load_cert_chain(pasta / "srv.pem", pasta / "srv.key")
+        self.ctx.load_verify_locations(pasta / "ca.pem")
+        self.ctx.verify_mode = ssl.CERT_REQUIRED
+
+    async def __aenter__(self):
+        self.servidor = await asyncio.start_server(self._atender, "127.0.0.1", 0, ssl=self.ctx)
+        self.url = f"https://127.0.0.1:{self.servidor.sockets[0].getsockname()[1]}/ws/Servico4.asmx"
+        return self
+
+    async def __aexit__(self, *exc):
+        self.servidor.close()
+        await self.servidor.wait_closed()
+
+    async def _atender(self, reader, writer):
+        self.conexoes += 1
+        try:
+            while await reader.readline():
+                cabecalhos = {}
+                while (linha := await reader.readline()) not in (b"\r\n", b""):
+                    nome, _, valor = linha.decode().partition(":")
+                    cabecalhos[nome.strip().lower()] = valor.strip()
+                corpo = await reader.readexactly(int(cabecalhos["content-length"]))
+                self.pedidos.append(corpo)
+                if len(self.pedidos) in self.sem_resposta:
+                    break  # derruba a conexão depois de receber o pedido
+                resposta = self.responder(corpo)
+                if self.chunked:
+                    meio = len(resposta) // 2
+                    partes = b"".join(b"%x\r\n%s\r\n" % (len(p), p) for p in (resposta[:meio], resposta[meio:]))
+                    writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n" + partes + b"0\r\n\r\n")
+                else:
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(resposta) + resposta)
+                await writer.drain()
+                if self.fechar_apos_resposta:
+                    break  # simula keep-alive expirado sem avisar o cliente
+        finally:
+            writer.close()
+
+
+@pytest.fixture(scope="module")
+def certificados(tmp_path_factory):
+    pasta = tmp_path_factory.mktemp("certs_async")
+    _gerar_certificados(pasta)
+    return pasta
+
+
+@pytest.fixture
+def empresa_async(empresa_sul, certificados):
+    certificado = empresa_sul.certificado.model_copy(update={"path": str(certificados / "cliente.pfx")})
+    return empresa_sul.model_copy(update={"certificado": certificado})
+
+
+@pytest.fixture(autouse=True)
+def isolado():
+    esperas = []
+
+    async def dormir(segundos):
+        esperas.append(segundos)
+
+    anteriores = (
+        configurar_disjuntor(DisjuntorSefaz()),
+        configurar_limitador(LimitadorSefaz({})),
+        configurar_retentativas(ControleRetentativas(dormir_async=dormir, aleatorio=lambda a, b: b)),
+    )
+    yield esperas
+    configurar_disjuntor(anteriores[0])
+    configurar_limitador(anteriores[1])
+    configurar_retentativas(anteriores[2])
+
+
+def _rodar(certificados, responder, cenario, **opcoes):
+    """Sobe o servidor, aponta as URLs do pynfe para ele e roda cenario(servidor)."""
+    async def principal():
+        async with ServidorAsync(certificados, responder, **opcoes) as servidor:
+            with patch.object(ComunicacaoSefaz, "_get_url", lambda self, *a, **k: servidor.url), \
+                 patch.object(ComunicacaoSefaz, "_get_url_an", lambda self, *a, **k: servidor.url):
+                return servidor, await cenario(servidor)
+
+    return asyncio.run(principal())
+
+
+class TestMontarRequisicao:
+    def test_captura_sem_enviar(self, empresa_sul):
+        con = ComunicacaoSefaz("sp", None, None, True)
+        url, xml = montar_requisicao(con, "consulta_nota", modelo="nfe", chave=CHAVE_VALIDA)
+        assert url.startswith("https://homologacao.nfe.fazenda.sp.gov.br/")
+        assert b"consSitNFe" in etree.tostring(xml)
+        assert CHAVE_VALIDA.encode() in etree.tostring(xml)
+
+
+class TestTransporte:
+    def test_consulta_mesmo_resultado_do_sincrono(self, empresa_async, certificados):
+        async def cenario(_):
+            return await consultar_async(empresa_async, CHAVE_VALIDA)
+
+        _, resultado = _rodar(certificados, lambda corpo: RET_CONSULTA, cenario)
+        with patch("nfe_sync.consulta.chamar_sefaz", return_value=(safe_fromstring(RET_CONSULTA), RET_CONSULTA.decode())):
+            esperado = consultar(empresa_async, CHAVE_VALIDA)
+        assert resultado.situacao == esperado.situacao == [{"status": "100", "motivo": "Autorizado o uso da NF-e"}]
+        assert resultado.xml is not None
+
+    def test_resposta_chunked(self, empresa_async, certificados):
+        async def cenario(_):
+            return await consultar_async(empresa_async, CHAVE_VALIDA)
+
+        _, resultado = _rodar(certificados, lambda corpo: RET_CONSULTA, cenario, chunked=True)
+        assert resultado.situacao[0]["status"] == "100"
+
+    def test_keep_alive_um_handshake(self, empresa_async, certificados):
+        async def cenario(_):
+            async with ClienteSefazAsync() as cliente:
+                for _ in range(5):
+                    await consultar_async(empresa_async, CHAVE_VALIDA, cliente=cliente)
+
+        servidor, _ = _rodar(certificados, lambda corpo: RET_CONSULTA, cenario)
+        assert servidor.conexoes == 1
+        assert len(servidor.pedidos) == 5
+
+    def test_conexao_expirada_reabre(self, empresa_async, certificados):
+        async def cenario(_):
+            async with ClienteSefazAsync() as cliente:
+                return [await consultar_async(empresa_async, CHAVE_VALIDA, cliente=cliente) for _ in range(3)]
+
+        servidor, resultados = _rodar(certificados, lambda corpo: RET_CONSULTA, cenario, fechar_apos_resposta=True)
+        assert [r.situacao[0]["status"] for r in resultados] == ["100"] * 3
+        assert servidor.conexoes == 3
+
+    @pytest.mark.parametrize("idempotente,pedidos", [(True, [b"a", b"b", b"b"]), (False, [b"a", b"b"])])
+    def test_queda_depois_do_envio_so_repete_consulta(self, empresa_async, certificados, idempotente, pedidos):
+        pfx = (certificados / "cliente.pfx").read_bytes()
+        senha = empresa_async.certificado.senha
+
+        async def cenario(servidor):
+            transporte = TransporteAsync()
+            try:
+                await transporte.post(servidor.url, {}, b"a", pfx, senha)
+                return await transporte.post(servidor.url, {}, b"b", pfx, senha, idempotente=idempotente)
+            except ConnectionError as e:
+                return e
+            finally:
+                await transporte.fechar()
+
+        servidor, resultado = _rodar(certificados, lambda corpo: RET_CONSULTA, cenario, sem_resposta={2})
+        assert servidor.pedidos == pedidos  # o evento não é reenviado em conexão nova
+        assert isinstance(resultado, ConnectionError) is not idempotente
+
+    def test_gather_limita_conexoes_por_host(self, empresa_async, certificados):
+        async def cenario(_):
+            async with ClienteSefazAsync(conexoes_por_host=4) as cliente:
+                return await asyncio.gather(
+                    *(consultar_async(empresa_async, CHAVE_VALIDA, cliente=cliente) for _ in range(20))
+                )
+
+        servidor, resultados = _rodar(certificados, lambda corpo: RET_CONSULTA, cenario)
+        assert len(resultados) == 20
+        assert all(r.situacao[0]["status"] == "100" for r in resultados)
+        assert servidor.conexoes <= 4
+
+    def test_rotacao_do_certificado_troca_o_contexto(self, empresa_async, certificados):
+        from nfe_sync.certificado import _cache
+
+        async def cenario(_):
+            async with ClienteSefazAsync() as cliente:
+                await consultar_async(empresa_async, CHAVE_VALIDA, cliente=cliente)
+                ctx = next(iter(cliente.transporte._contextos.values()))[1]
+                with patch.object(_cache, "ttl", 0):  # próximo acesso expira e regrava os PEM
+                    await consultar_async(empresa_async, CHAVE_VALIDA, cliente=cliente)
+                return ctx, list(cliente.transporte._contextos.values())
+
+        _, (anterior, contextos) = _rodar(certificados, lambda corpo: RET_CONSULTA, cenario)
+        assert len(contextos) == 1
+        assert contextos[0][1] is not anterior
+
+    def test_retentativa_em_servico_paralisado(self, empresa_async, certificados, isolado):
+        respostas = iter([RET_PARALISADO, RET_CONSULTA])
+
+        async def cenario(_):
+            return await consultar_async(empresa_async, CHAVE_VALIDA)
+
+        servidor, resultado = _rodar(certificados, lambda corpo: next(respostas), cenario)
+        assert resultado.situacao[0]["status"] == "100"
+        assert len(servidor.pedidos) == 2
+        assert isolado == [15.0]  # aleatorio → limite superior: 3 x base
+
+
+class TestDistribuicao:
+    def test_consultar_nsu_grava_cooldown(self, empresa_async, certificados):
+        estado = {}
+
+        async def cenario(_):
+            return await consultar_nsu_async(empresa_async, estado)
+
+        servidor, resultado = _rodar(certificados, lambda corpo: RET_DIST, cenario)
+        assert resultado.status == "137"
+        assert resultado.ultimo_nsu == 42
+        assert b"<ultNSU>000000000000000</ultNSU>" in servidor.pedidos[0]
+
+        estado_sinc = {}
+        with patch("nfe_sync.consulta._com_retry", return_value=RET_DIST), \
+             patch("nfe_sync.consulta.criar_comunicacao"):
+            esperado = consultar_nsu(empresa_async, estado_sinc)
+        assert (resultado.status, resultado.motivo, resultado.ultimo_nsu, resultado.max_nsu) == \
+               (esperado.status, esperado.motivo, esperado.ultimo_nsu, esperado.max_nsu)
+        assert estado.keys() == estado_sinc.keys()
+
+    def test_pagina_processada_fora_do_event_loop(self, empresa_async, certificados):
+        import threading
+        from nfe_sync import assincrono
+        threads = []
+        original = assincrono._pagina_distribuicao
+
+        def registrar(*a, **kw):
+            threads.append(threading.current_thread())
+            return original(*a, **kw)
+
+        async def cenario(_):
+            return await consultar_nsu_async(empresa_async, {})
+
+        with patch.object(assincrono, "_pagina_distribuicao", side_effect=registrar):
+            _rodar(certificados, lambda corpo: RET_DIST, cenario)
+        assert threads and threading.main_thread() not in threads
+
+    def test_dfe_chave(self, empresa_async, certificados):
+        ret = f'<retDistDFeInt xmlns="{NFE}"><cStat>653</cStat><xMotivo>NF-e cancelada</xMotivo></retDistDFeInt>'.encode()
+
+        async def cenario(_):
+            return await consultar_dfe_chave_async(empresa_async, CHAVE_VALIDA)
+
+        servidor, resultado = _rodar(certificados, lambda corpo: ret, cenario)
+        assert (resultado.sucesso, resultado.status, resultado.xml_cancelamento) == (False, "653", resultado.xml_resposta)
+        assert CHAVE_VALIDA.encode() in servidor.pedidos[0]
+
+    def test_dfe_nsu_especifico(self, empresa_async, certificados):
+        async def cenario(_):
+            return await consultar_dfe_nsu_async(empresa_async, 42)
+
+        servidor, resultado = _rodar(certificados, lambda corpo: RET_DIST, cenario)
+        assert (resultado.sucesso, resultado.status, resultado.documentos) == (False, "137", [])
+        assert b"<consNSU><NSU>000000000000042</NSU></consNSU>" in servidor.pedidos[0]
+
+
+class TestManifestacao:
+    def test_mesmo_resultado_do_sincrono(self, empresa_async, certificados):
+        evento = etree.fromstring(f'<evento xmlns="{NFE}" versao="1.00"><infEvento/></evento>')
+
+        async def cenario(_):
+            return await manifestar_async(empresa_async, "ciencia", CHAVE_VALIDA)
+
+        with patch("nfe_sync.assincrono._evento_assinado", return_value=evento):
+            servidor, resultado = _rodar(certificados, lambda corpo: RET_EVENTO, cenario)
+        assert b"envEvento" in servidor.pedidos[0]
+
+        with patch("nfe_sync.manifestacao._evento_assinado", return_value=evento), \
+             patch("nfe_sync.manifestacao.chamar_sefaz", return_value=(safe_fromstring(RET_EVENTO), RET_EVENTO.decode())):
+            esperado = manifestar(empresa_async, "ciencia", CHAVE_VALIDA)
+        assert resultado.resultados == esperado.resultados
+        assert resultado.protocolo == esperado.protocolo
@@ -32,7 +32,7 @@ def _patch_pynfe(chamar_sefaz_return):
     """Context manager que mocka os componentes pynfe para não precisar de certificado real."""
     return (
         patch("nfe_sync.cancelamento.SerializacaoXML"),
-        patch("nfe_sync.cancelamento.AssinaturaA1"),
+        patch("nfe_sync.cancelamento.assinador"),
         patch("nfe_sync.cancelamento.chamar_sefaz", return_value=chamar_sefaz_return),
     )
 
@@ -53,7 +53,7 @@ class TestCancelarUF:
 
         with patch("nfe_sync.cancelamento.EventoCancelarNota") as mock_evento, \
              patch("nfe_sync.cancelamento.SerializacaoXML"), \
-             patch("nfe_sync.cancelamento.AssinaturaA1"), \
+             patch("nfe_sync.cancelamento.assinador"), \
              patch("nfe_sync.cancelamento.chamar_sefaz", return_value=(xml_el, xml_bytes.decode())):
             cancelar(empresa_sul, CHAVE_VALIDA, PROTOCOLO_VALIDO, JUSTIFICATIVA_VALIDA)
 
@@ -85,7 +85,7 @@ class TestCancelarTimezone:
         with patch("nfe_sync.cancelamento.agora_local", return_value=data_local_mock) as mock_local, \
              patch("nfe_sync.cancelamento.EventoCancelarNota") as mock_evento, \
              patch("nfe_sync.cancelamento.SerializacaoXML"), \
-             patch("nfe_sync.cancelamento.AssinaturaA1"), \
+             patch("nfe_sync.cancelamento.assinador"), \
              patch("nfe_sync.cancelamento.chamar_sefaz", return_value=(xml_el, xml_bytes.decode())):
             cancelar(empresa_sul, CHAVE_VALIDA, PROTOCOLO_VALIDO, JUSTIFICATIVA_VALIDA)
 
@@ -3,7 +3,7 @@ import argparse
 import pytest
 from unittest.mock import patch, MagicMock
 
-from nfe_sync.results import ResultadoDistribuicao
+from nfe_sync.results import PaginaDistribuicao
 
 
 def _mock_empresas_hom():
@@ -34,9 +34,9 @@ def _mock_empresas_prod():
     }
 
 
-_NSU_OK = ResultadoDistribuicao(
-    sucesso=True, status="137", motivo="OK",
-    ultimo_nsu=0, max_nsu=0, documentos=[], xmls_resposta=[], estado={},
+_NSU_OK = PaginaDistribuicao(
+    pagina=1, status="137", motivo="OK",
+    ultimo_nsu=0, max_nsu=0, documentos=[], xml_resposta=None,
 )
 
 
@@ -45,9 +45,9 @@ class TestFlagsAmbientePos:
 
     def test_homologacao_antes_do_subcomando(self):
         """nfe-sync --homologacao consultar-nsu SUL → empresa.homologacao = True."""
-        mock_nsu = MagicMock(return_value=_NSU_OK)
+        mock_nsu = MagicMock(side_effect=lambda *a, **kw: iter([_NSU_OK]))
         with patch("nfe_sync.commands.carregar_empresas", return_value=_mock_empresas_prod()), \
-             patch("nfe_sync.commands.consulta.consultar_nsu", mock_nsu), \
+             patch("nfe_sync.commands.consulta.iter_distribuicao", mock_nsu), \
              patch("nfe_sync.commands._salvar_log_xml", return_value="x"), \
              patch("nfe_sync.commands.consulta._listar_resumos_pendentes", return_value=[]):
             from nfe_sync.cli import cli
@@ -58,9 +58,9 @@ class TestFlagsAmbientePos:
 
     def test_homologacao_apos_subcomando(self):
         """nfe-sync consultar-nsu SUL --homologacao → empresa.homologacao = True."""
-        mock_nsu = MagicMock(return_value=_NSU_OK)
+        mock_nsu = MagicMock(side_effect=lambda *a, **kw: iter([_NSU_OK]))
         with patch("nfe_sync.commands.carregar_empresas", return_value=_mock_empresas_prod()), \
-             patch("nfe_sync.commands.consulta.consultar_nsu", mock_nsu), \
+             patch("nfe_sync.commands.consulta.iter_distribuicao", mock_nsu), \
              patch("nfe_sync.commands._salvar_log_xml", return_value="x"), \
              patch("nfe_sync.commands.consulta._listar_resumos_pendentes", return_value=[]):
             from nfe_sync.cli import cli
@@ -71,9 +71,9 @@ class TestFlagsAmbientePos:
 
     def test_producao_apos_subcomando(self):
         """nfe-sync consultar-nsu SUL --producao → empresa.homologacao = False."""
-        mock_nsu = MagicMock(return_value=_NSU_OK)
+        mock_nsu = MagicMock(side_effect=lambda *a, **kw: iter([_NSU_OK]))
         with patch("nfe_sync.commands.carregar_empresas", return_value=_mock_empresas_hom()), \
-             patch("nfe_sync.commands.consulta.consultar_nsu", mock_nsu), \
+             patch("nfe_sync.commands.consulta.iter_distribuicao", mock_nsu), \
              patch("nfe_sync.commands._salvar_log_xml", return_value="x"), \
              patch("nfe_sync.commands.consulta._listar_resumos_pendentes", return_value=[]):
             from nfe_sync.cli import cli
@@ -84,9 +84,9 @@ class TestFlagsAmbientePos:
 
     def test_sem_flag_usa_config(self):
         """nfe-sync consultar-nsu SUL (sem flag) → usa valor do config (homologacao=True)."""
-        mock_nsu = MagicMock(return_value=_NSU_OK)
+        mock_nsu = MagicMock(side_effect=lambda *a, **kw: iter([_NSU_OK]))
         with patch("nfe_sync.commands.carregar_empresas", return_value=_mock_empresas_hom()), \
-             patch("nfe_sync.commands.consulta.consultar_nsu", mock_nsu), \
+             patch("nfe_sync.commands.consulta.iter_distribuicao", mock_nsu), \
              patch("nfe_sync.commands._salvar_log_xml", return_value="x"), \
              patch("nfe_sync.commands.consulta._listar_resumos_pendentes", return_value=[]):
             from nfe_sync.cli import cli
@@ -94,3 +94,50 @@ class TestFlagsAmbientePos:
 
         empresa_chamada = mock_nsu.call_args[0][0]
         assert empresa_chamada.homologacao is True
+
+
+class TestServicoIndisponivel:
+    def test_disjuntor_aberto_sai_com_mensagem(self, capsys):
+        from nfe_sync.exceptions import NfeServicoIndisponivel
+        mock_nsu = MagicMock(side_effect=NfeServicoIndisponivel("SEFAZ indisponivel (x): 5 falhas seguidas"))
+        with patch("nfe_sync.commands.carregar_empresas", return_value=_mock_empresas_hom()), \
+             patch("nfe_sync.commands.consulta.iter_distribuicao", mock_nsu), \
+             patch("nfe_sync.commands.consulta._listar_resumos_pendentes", return_value=[]):
+            from nfe_sync.cli import cli
+            with pytest.raises(SystemExit) as exc:
+                cli(["consultar-nsu", "SUL"])
+
+        assert exc.value.code == 1
+        assert "5 falhas seguidas" in capsys.readouterr().out
+
+
+class TestLimitadorDisjuntorNoEstado:
+    """Baldes e disjuntores só vão para o arquivo de estado quando ele grava por chave (SQLite)."""
+
+    def _backends(self, state_file):
+        from nfe_sync.disjuntor import disjuntor_ativo
+        from nfe_sync.limitador import limitador_ativo
+        vistos = {}
+
+        def gerar(*a, **kw):
+            vistos["limitador"] = limitador_ativo().backend
+            vistos["disjuntor"] = disjuntor_ativo().backend
+            return iter([_NSU_OK])
+
+        with patch("nfe_sync.cli.STATE_FILE", state_file), \
+             patch("nfe_sync.commands.carregar_empresas", return_value=_mock_empresas_hom()), \
+             patch("nfe_sync.commands.consulta.iter_distribuicao", MagicMock(side_effect=gerar)), \
+             patch("nfe_sync.commands._salvar_log_xml", return_value="x"), \
+             patch("nfe_sync.commands.consulta._listar_resumos_pendentes", return_value=[]):
+            from nfe_sync.cli import cli
+            cli(["consultar-nsu", "SUL"])
+        return vistos
+
+    def test_json_em_memoria(self, tmp_path):
+        vistos = self._backends(str(tmp_path / "state.json"))
+        assert vistos == {"limitador": None, "disjuntor": None}
+
+    def test_sqlite_compartilhado(self, tmp_path):
+        vistos = self._backends(str(tmp_path / "state.db"))
+        assert vistos["limitador"] is not None and vistos["limitador"].gravacao_por_chave
+        assert vistos["disjuntor"] is vistos["limitador"]
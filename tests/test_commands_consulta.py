@@ -4,11 +4,24 @@ import os
 import pytest
 from unittest.mock import patch, MagicMock
 
+from nfe_sync.state import carregar_estado, get_cooldown
 from nfe_sync.results import (
-    Documento, ResultadoConsulta, ResultadoDfeChave, ResultadoDistribuicao,
+    Documento, PaginaDistribuicao, ResultadoConsulta, ResultadoDfeChave,
 )
 
 
+@pytest.fixture(autouse=True)
+def _state_file_temporario(tmp_path):
+    """_baixar_distribuicao grava o registro de página no estado: nunca no .state.json do diretório."""
+    with patch("nfe_sync.commands.consulta.STATE_FILE", str(tmp_path / "estado-cmd.json")):
+        yield
+
+
+def _paginas(*paginas):
+    """side_effect para iter_distribuicao: gera um iterador novo a cada chamada."""
+    return lambda *a, **kw: iter(paginas)
+
+
 class TestProcessarESalvarDocs:
     """Issue #8: helper _processar_e_salvar_docs elimina duplicação."""
 
@@ -59,7 +72,7 @@ class TestProcessarESalvarDocs:
         assert "resumo" in captured.out
 
     def test_substituiu_quando_procnfe_existente(self, capsys):
-        """Issue #36: usa _storage.existe() para detectar substituição de resumo."""
+        """Issue #36: usa _storage().existe() para detectar substituição de resumo."""
         from nfe_sync.commands.consulta import _processar_e_salvar_docs
 
         docs = [Documento(
@@ -72,11 +85,11 @@ class TestProcessarESalvarDocs:
 
         with patch("nfe_sync.commands.consulta._salvar_xml") as mock_salvar, \
              patch("nfe_sync.commands.consulta._storage") as mock_storage:
-            mock_storage.existe.return_value = True
+            mock_storage.return_value.existe.return_value = True
             mock_salvar.return_value = "downloads/99999999000191/chave.xml"
             completos = _processar_e_salvar_docs("99999999000191", docs)
 
-        mock_storage.existe.assert_called_once_with(
+        mock_storage.return_value.existe.assert_called_once_with(
             "99999999000191", "12345678901234567890123456789012345678901234.xml"
         )
         captured = capsys.readouterr()
@@ -86,51 +99,48 @@ class TestProcessarESalvarDocs:
 class TestListarResumosPendentes:
     """Issue #9: deve detectar resNFe por root tag, sem filtrar por len(nome)."""
 
+    @pytest.fixture(autouse=True)
+    def _base_tmp(self, tmp_path):
+        from nfe_sync.commands import _storage
+        with patch.object(_storage(), "BASE", str(tmp_path)):
+            yield
+
     def test_detecta_arquivo_com_nome_curto(self, tmp_path):
         """Arquivos com nome != 44 chars também devem ser detectados se root tag = resNFe."""
         from nfe_sync.commands import _listar_resumos_pendentes
-        import nfe_sync.storage as storage_mod
 
         cnpj = "99999999000191"
+        pasta = tmp_path / cnpj
+        pasta.mkdir()
+        (pasta / "resumo-curto.xml").write_text('<resNFe xmlns="http://www.portalfiscal.inf.br/nfe"/>')
+        (pasta / "outro.xml").write_text("<outro/>")
 
-        with patch("os.path.isdir", return_value=True), \
-             patch("os.listdir", return_value=["resumo-curto.xml", "outro.xml"]), \
-             patch.object(storage_mod, "safe_parse") as mock_parse:
-
-            def fake_parse(path):
-                mock_tree = MagicMock()
-                if "resumo-curto" in path:
-                    mock_tree.getroot.return_value.tag = "{http://www.portalfiscal.inf.br/nfe}resNFe"
-                else:
-                    mock_tree.getroot.return_value.tag = "outro"
-                return mock_tree
-
-            mock_parse.side_effect = fake_parse
-            resultado = _listar_resumos_pendentes(cnpj)
+        resultado = _listar_resumos_pendentes(cnpj)
 
         assert "resumo-curto" in resultado
+        assert "outro" not in resultado
 
     def test_ignora_arquivos_nao_xml(self, tmp_path):
         from nfe_sync.commands import _listar_resumos_pendentes
 
         cnpj = "99999999000191"
-        with patch("os.path.isdir", return_value=True), \
-             patch("os.listdir", return_value=["arquivo.txt", "arquivo.pdf"]):
-            resultado = _listar_resumos_pendentes(cnpj)
-
+        pasta = tmp_path / cnpj
+        pasta.mkdir()
+        (pasta / "arquivo.txt").write_text("<resNFe/>")
+        (pasta / "arquivo.pdf").write_text("<resNFe/>")
+        resultado = _listar_resumos_pendentes(cnpj)
         assert resultado == []
 
     def test_loga_warning_para_xml_invalido(self, tmp_path, caplog):
         """Issue #10: XML inválido deve gerar warning, não engolir silenciosamente."""
         from nfe_sync.commands import _listar_resumos_pendentes
-        import nfe_sync.storage as storage_mod
 
         cnpj = "99999999000191"
-        with patch("os.path.isdir", return_value=True), \
-             patch("os.listdir", return_value=["invalido.xml"]), \
-             patch.object(storage_mod, "safe_parse", side_effect=Exception("xml quebrado")):
-            with caplog.at_level(logging.WARNING):
-                resultado = _listar_resumos_pendentes(cnpj)
+        pasta = tmp_path / cnpj
+        pasta.mkdir()
+        (pasta / "invalido.xml").write_text("isto nao e xml")
+        with caplog.at_level(logging.WARNING):
+            resultado = _listar_resumos_pendentes(cnpj)
 
         assert resultado == []
         assert any("invalido.xml" in r.message for r in caplog.records)
@@ -140,20 +150,20 @@ class TestTratarArquivoCancelado:
     """Issue #10: logging em _tratar_arquivo_cancelado."""
 
     def test_loga_warning_ao_falhar_leitura(self, tmp_path, caplog):
-        import nfe_sync.storage as storage_mod
-        from nfe_sync.commands.consulta import _tratar_arquivo_cancelado
+        from nfe_sync.commands.consulta import _tratar_arquivo_cancelado, _storage
+        storage = _storage()
 
         cnpj = "99999999000191"
         chave = "12345678901234567890123456789012345678901234"
 
-        with patch("os.path.exists", return_value=True), \
-             patch("os.rename"), \
-             patch.object(storage_mod, "safe_parse", side_effect=Exception("parse error")):
+        with patch.object(storage, "BASE", str(tmp_path)):
+            storage.salvar(cnpj, f"{chave}.xml", "conteudo corrompido")
             with caplog.at_level(logging.WARNING):
                 # Deve continuar sem levantar exceção
                 _tratar_arquivo_cancelado(cnpj, chave)
 
-        assert any("parse error" in r.message or chave in r.message for r in caplog.records)
+        assert any(chave in r.message for r in caplog.records)
+        assert (tmp_path / cnpj / f"{chave}-cancelada.xml").exists()
 
 
 class TestCmdConsultarExitCode:
@@ -223,27 +233,27 @@ class TestCmdConsultarExitCode:
 
     @patch("nfe_sync.commands.consulta._carregar")
     @patch("nfe_sync.commands.consulta._salvar_log_xml")
-    @patch("nfe_sync.commands.consulta.consultar_nsu")
+    @patch("nfe_sync.commands.consulta.iter_distribuicao")
     def test_nsu_status_589_sai_com_codigo_1(self, mock_nsu, mock_log, mock_carregar, tmp_path):
         """consultar_nsu com status 589 (erro) → exit code 1."""
         mock_carregar.return_value = (self._make_mock_empresa(), {})
         mock_log.return_value = "log/x.xml"
-        mock_nsu.return_value = ResultadoDistribuicao(
-            sucesso=False,
+        mock_nsu.side_effect = _paginas(PaginaDistribuicao(
+            pagina=1,
             status="589",
             motivo="Rejeicao: acesso negado",
             ultimo_nsu=0,
             max_nsu=0,
             documentos=[],
-            xmls_resposta=["<resp/>"],
-            estado={},
-        )
+            xml_resposta="<resp/>",
+        ))
 
         args = MagicMock()
         args.empresa = "SUL"
         args.nsu = None
         args.zerar_nsu = False
         args.chave = None
+        args.paralelo = None
         args.producao = False
         args.homologacao = False
 
@@ -254,27 +264,27 @@ class TestCmdConsultarExitCode:
 
     @patch("nfe_sync.commands.consulta._carregar")
     @patch("nfe_sync.commands.consulta._salvar_log_xml")
-    @patch("nfe_sync.commands.consulta.consultar_nsu")
+    @patch("nfe_sync.commands.consulta.iter_distribuicao")
     def test_nsu_status_137_nao_sai(self, mock_nsu, mock_log, mock_carregar, tmp_path):
         """consultar_nsu com status 137 (sem docs) → sem SystemExit."""
         mock_carregar.return_value = (self._make_mock_empresa(), {})
         mock_log.return_value = "log/x.xml"
-        mock_nsu.return_value = ResultadoDistribuicao(
-            sucesso=True,
+        mock_nsu.side_effect = _paginas(PaginaDistribuicao(
+            pagina=1,
             status="137",
             motivo="Nenhum documento localizado",
             ultimo_nsu=0,
             max_nsu=0,
             documentos=[],
-            xmls_resposta=["<resp/>"],
-            estado={},
-        )
+            xml_resposta="<resp/>",
+        ))
 
         args = MagicMock()
         args.empresa = "SUL"
         args.nsu = None
         args.zerar_nsu = False
         args.chave = None
+        args.paralelo = None
         args.producao = False
         args.homologacao = False
 
@@ -283,27 +293,27 @@ class TestCmdConsultarExitCode:
 
     @patch("nfe_sync.commands.consulta._carregar")
     @patch("nfe_sync.commands.consulta._salvar_log_xml")
-    @patch("nfe_sync.commands.consulta.consultar_nsu")
+    @patch("nfe_sync.commands.consulta.iter_distribuicao")
     def test_nsu_erro_imprime_status_antes_de_sair(self, mock_nsu, mock_log, mock_carregar, capsys):
         """Issue #71: consultar_nsu com sucesso=False deve imprimir status e motivo antes do exit."""
         mock_carregar.return_value = (self._make_mock_empresa(), {})
         mock_log.return_value = "log/x.xml"
-        mock_nsu.return_value = ResultadoDistribuicao(
-            sucesso=False,
+        mock_nsu.side_effect = _paginas(PaginaDistribuicao(
+            pagina=1,
             status="656",
             motivo="Consumo Indevido",
             ultimo_nsu=0,
             max_nsu=0,
             documentos=[],
-            xmls_resposta=[],
-            estado={},
-        )
+            xml_resposta="<resp/>",
+        ))
 
         args = MagicMock()
         args.empresa = "SUL"
         args.nsu = None
         args.zerar_nsu = False
         args.chave = None
+        args.paralelo = None
         args.producao = False
         args.homologacao = False
 
@@ -320,29 +330,29 @@ class TestCmdConsultarNsuTodasEmpresas:
     """Issue #92: sem empresa → itera todos os cadastros."""
 
     def _make_resultado_sucesso(self):
-        return ResultadoDistribuicao(
-            sucesso=True, status="137", motivo="Nenhum documento localizado",
-            ultimo_nsu=0, max_nsu=0, documentos=[], xmls_resposta=["<r/>"], estado={},
-        )
+        return iter([PaginaDistribuicao(
+            pagina=1, status="137", motivo="Nenhum documento localizado",
+            ultimo_nsu=0, max_nsu=0, documentos=[], xml_resposta="<r/>",
+        )])
 
     def _make_resultado_falha(self):
-        return ResultadoDistribuicao(
-            sucesso=False, status="656", motivo="Consumo Indevido",
-            ultimo_nsu=0, max_nsu=0, documentos=[], xmls_resposta=[], estado={},
-        )
+        return iter([PaginaDistribuicao(
+            pagina=1, status="656", motivo="Consumo Indevido",
+            ultimo_nsu=0, max_nsu=0, documentos=[], xml_resposta="<r/>",
+        )])
 
     @patch("nfe_sync.commands.consulta._salvar_log_xml")
-    @patch("nfe_sync.commands.consulta.consultar_nsu")
+    @patch("nfe_sync.commands.consulta.iter_distribuicao")
     @patch("nfe_sync.commands.consulta.carregar_empresas")
     def test_sem_empresa_itera_todas(self, mock_empresas, mock_nsu, mock_log, capsys):
-        """Sem empresa: cmd_consultar_nsu deve chamar consultar_nsu para cada empresa."""
+        """Sem empresa: cmd_consultar_nsu deve chamar iter_distribuicao para cada empresa."""
         from unittest.mock import MagicMock
         from nfe_sync.commands.consulta import cmd_consultar_nsu
 
         emp1 = MagicMock(); emp1.emitente.cnpj = "11111111000191"; emp1.nome = "EMP1"; emp1.homologacao = True
         emp2 = MagicMock(); emp2.emitente.cnpj = "22222222000191"; emp2.nome = "EMP2"; emp2.homologacao = True
         mock_empresas.return_value = {"EMP1": emp1, "EMP2": emp2}
-        mock_nsu.return_value = self._make_resultado_sucesso()
+        mock_nsu.side_effect = lambda *a, **kw: self._make_resultado_sucesso()
         mock_log.return_value = "log/x.xml"
 
         args = MagicMock()
@@ -350,6 +360,7 @@ class TestCmdConsultarNsuTodasEmpresas:
         args.nsu = None
         args.zerar_nsu = False
         args.chave = None
+        args.paralelo = None
         args.producao = False
         args.homologacao = False
 
@@ -361,7 +372,7 @@ class TestCmdConsultarNsuTodasEmpresas:
         assert "EMP2" in out
 
     @patch("nfe_sync.commands.consulta._salvar_log_xml")
-    @patch("nfe_sync.commands.consulta.consultar_nsu")
+    @patch("nfe_sync.commands.consulta.iter_distribuicao")
     @patch("nfe_sync.commands.consulta.carregar_empresas")
     def test_sem_empresa_falha_parcial_sai_1(self, mock_empresas, mock_nsu, mock_log):
         """Sem empresa: se qualquer empresa falhar, exit code 1 ao final."""
@@ -379,6 +390,7 @@ class TestCmdConsultarNsuTodasEmpresas:
         args.nsu = None
         args.zerar_nsu = False
         args.chave = None
+        args.paralelo = None
         args.producao = False
         args.homologacao = False
 
@@ -419,3 +431,628 @@ class TestCmdConsultarNsuTodasEmpresas:
             cmd_consultar_nsu(args)
         assert exc.value.code == 1
         assert "requerem empresa" in capsys.readouterr().out
+
+
+class TestBaixarDistribuicaoStreaming:
+    """Documentos de cada pagina sao gravados em segundo plano, antes de o NSU da pagina ser gravado."""
+
+    CHAVE = "12345678901234567890123456789012345678901234"
+
+    @pytest.fixture(autouse=True)
+    def _downloads_temporario(self, tmp_path):
+        from nfe_sync.commands import _storage
+        with patch.object(_storage(), "BASE", str(tmp_path / "downloads")):
+            yield
+
+    def _empresa(self):
+        emp = MagicMock()
+        emp.emitente.cnpj = "99999999000191"
+        return emp
+
+    def _pagina(self, n, nsu):
+        return PaginaDistribuicao(
+            pagina=n, status="138", motivo="Documento localizado",
+            ultimo_nsu=nsu, max_nsu=2,
+            documentos=[Documento(nsu=str(nsu), schema="resNFe_v1.01.xsd",
+                                  chave=self.CHAVE, nome=f"doc{nsu}.xml", xml="<resNFe/>")],
+            xml_resposta="<r/>",
+        )
+
+    @patch("nfe_sync.commands.consulta._salvar_log_xml", return_value="log/x.xml")
+    @patch("nfe_sync.commands.consulta._salvar_xml", return_value="downloads/x.xml")
+    def test_grava_pagina_antes_do_nsu(self, mock_salvar, mock_log):
+        import threading
+        from nfe_sync.commands.consulta import _baixar_distribuicao
+
+        eventos = []
+        threads = set()
+
+        def gerar(*a, aguardar_gravacao, **kw):
+            # como iter_distribuicao: busca a próxima e só então espera a gravação da anterior
+            pagina1 = self._pagina(1, 1)
+            yield pagina1
+            eventos.append("busca2")
+            aguardar_gravacao(pagina1)
+            eventos.append("nsu1")
+            pagina2 = self._pagina(2, 2)
+            yield pagina2
+            aguardar_gravacao(pagina2)
+            eventos.append("nsu2")
+
+        def salvar(cnpj, nome, xml, **kw):
+            threads.add(threading.current_thread())
+            eventos.append(nome)
+            return nome
+
+        mock_salvar.side_effect = salvar
+        with patch("nfe_sync.commands.consulta.iter_distribuicao", side_effect=gerar):
+            ultima, completos = _baixar_distribuicao(self._empresa(), {})
+
+        assert eventos.index("doc1.xml") < eventos.index("nsu1")
+        assert eventos.index("doc2.xml") < eventos.index("nsu2")
+        assert threading.current_thread() not in threads
+        assert ultima.ultimo_nsu == 2
+        assert completos == []
+        assert mock_log.call_count == 2
+
+    @patch("nfe_sync.commands.consulta._salvar_log_xml", return_value="log/x.xml")
+    def test_bloqueado_retorna_pagina_sem_status(self, mock_log, capsys):
+        from nfe_sync.commands.consulta import _baixar_distribuicao
+
+        bloqueio = PaginaDistribuicao(
+            pagina=0, status=None, motivo="bloqueada ate 10:00:00",
+            ultimo_nsu=0, max_nsu=0, documentos=[], xml_resposta=None,
+        )
+        with patch("nfe_sync.commands.consulta.iter_distribuicao", side_effect=_paginas(bloqueio)):
+            ultima, completos = _baixar_distribuicao(self._empresa(), {})
+
+        assert ultima.status is None
+        mock_log.assert_not_called()
+
+
+class TestPaginaDuravel:
+    """Registro write-ahead por página: fsync dos documentos antes do NSU e recuperação ao reiniciar."""
+
+    CNPJ = "99999999000191"
+
+    @pytest.fixture
+    def ambiente(self, tmp_path, request):
+        from nfe_sync.commands import _storage
+        from nfe_sync.state import abrir_estado
+        storage = _storage()
+        # SQLite registra toda página; JSON só as que gravam o NSU (ver test_json_registra_so_paginas_gravadas)
+        state_file = str(tmp_path / getattr(request, "param", "estado.db"))
+        with patch.object(storage, "BASE", str(tmp_path / "downloads")), \
+             patch("nfe_sync.commands.consulta.STATE_FILE", state_file), \
+             patch("nfe_sync.commands.consulta._salvar_log_xml", return_value="log/x.xml"):
+            yield storage, abrir_estado(state_file)
+
+    def _empresa(self):
+        return TestCmdConsultarExitCode()._make_mock_empresa()
+
+    def _pagina(self, n, nsu, max_nsu=3):
+        return PaginaDistribuicao(
+            pagina=n, status="138", motivo="Documento localizado", ultimo_nsu=nsu, max_nsu=max_nsu,
+            documentos=[Documento(nsu=str(nsu), schema="resNFe_v1.01.xsd", chave=f"{nsu:044d}",
+                                  nome=f"{nsu:044d}.xml", xml="<resNFe/>")],
+            xml_resposta="<r/>",
+        )
+
+    def test_fsync_antes_de_pedir_a_proxima_pagina(self, ambiente):
+        from nfe_sync.commands.consulta import _baixar_distribuicao
+        storage, backend = ambiente
+        eventos = []
+
+        def gerar(*a, aguardar_gravacao, **kw):
+            pagina1 = self._pagina(1, 1)
+            yield pagina1
+            aguardar_gravacao(pagina1)
+            eventos.append(("proxima", backend.get_pagina_dfe(self.CNPJ, "homologacao")))
+            yield self._pagina(2, 3)
+
+        with patch("nfe_sync.commands.consulta.iter_distribuicao", side_effect=gerar), \
+             patch.object(storage, "sincronizar", wraps=storage.sincronizar) as sinc:
+            sinc.side_effect = lambda cnpj: eventos.append(("fsync", cnpj))
+            _baixar_distribuicao(self._empresa(), {})
+
+        assert eventos == [
+            ("fsync", self.CNPJ),
+            ("proxima", {"de": 0, "ate": 1, "docs": [f"{1:044d}.xml"]}),
+            ("fsync", self.CNPJ),
+        ]
+        assert backend.get_pagina_dfe(self.CNPJ, "homologacao") is None  # tudo confirmado
+        assert storage.lacunas_nsu(self.CNPJ, 3) == [(2, 2)]  # NSUs recebidos ficam registrados
+
+    @pytest.mark.parametrize("ambiente", ["estado.json"], indirect=True)
+    def test_json_registra_so_paginas_gravadas(self, ambiente):
+        from nfe_sync.commands.consulta import _baixar_distribuicao
+        storage, backend = ambiente
+        registros = []
+
+        paginas = [self._pagina(n, n, max_nsu=12) for n in range(1, 13)]
+        with patch("nfe_sync.commands.consulta.iter_distribuicao", side_effect=_paginas(*paginas)), \
+             patch.object(backend, "set_pagina_dfe", side_effect=lambda cnpj, pagina, amb: registros.append(pagina)), \
+             patch("nfe_sync.commands.consulta.abrir_estado", return_value=backend):
+            _baixar_distribuicao(self._empresa(), {})
+
+        # página 10 (_SALVAR_A_CADA), página 12 (última) e a limpeza no fim
+        assert [r and r["ate"] for r in registros] == [10, 12, None]
+
+    def test_interrupcao_no_meio_da_pagina(self, ambiente, capsys):
+        from nfe_sync.commands.consulta import _baixar_distribuicao
+        storage, backend = ambiente
+        backend.set_ultimo_nsu(self.CNPJ, 1, "homologacao")
+
+        with patch("nfe_sync.commands.consulta.iter_distribuicao", side_effect=_paginas(self._pagina(1, 3))), \
+             patch.object(storage, "sincronizar", side_effect=OSError("disco")):
+            with pytest.raises(OSError):
+                _baixar_distribuicao(self._empresa(), {"nsu": {f"{self.CNPJ}:homologacao": 1}})
+        assert backend.get_pagina_dfe(self.CNPJ, "homologacao") == {"de": 1, "ate": 3, "docs": [f"{3:044d}.xml"]}
+
+        estado = {}
+        with patch("nfe_sync.commands.consulta.iter_distribuicao", side_effect=_paginas()):
+            _baixar_distribuicao(self._empresa(), estado)
+        assert "NSU 1-3 interrompida antes de confirmada" in capsys.readouterr().out
+        assert backend.get_ultimo_nsu(self.CNPJ, "homologacao") == 1  # página refeita a partir do NSU 1
+
+    def test_documentos_ausentes_voltam_nsu(self, ambiente, capsys):
+        from nfe_sync.commands.consulta import _baixar_distribuicao
+        storage, backend = ambiente
+        storage.salvar(self.CNPJ, "a.xml", "<resNFe/>")
+        backend.set_ultimo_nsu(self.CNPJ, 5, "homologacao")
+        backend.set_pagina_dfe(self.CNPJ, {"de": 2, "ate": 5, "docs": ["a.xml", "b.xml"]}, "homologacao")
+
+        estado = {}
+        with patch("nfe_sync.commands.consulta.iter_distribuicao", side_effect=_paginas()):
+            _baixar_distribuicao(self._empresa(), estado)
+        assert "1 documento(s) da pagina NSU 2-5 ausente(s)" in capsys.readouterr().out
+        assert backend.get_ultimo_nsu(self.CNPJ, "homologacao") == 2
+        assert estado["nsu"][f"{self.CNPJ}:homologacao"] == 2
+        assert backend.get_pagina_dfe(self.CNPJ, "homologacao") is None
+
+
+class TestCmdConsultarNsuParalelo:
+    """--paralelo N: empresas em paralelo, saida agrupada por empresa e resumo final."""
+
+    def _args(self, paralelo):
+        args = MagicMock()
+        args.empresa = None
+        args.nsu = None
+        args.zerar_nsu = False
+        args.chave = None
+        args.paralelo = paralelo
+        args.producao = False
+        args.homologacao = False
+        return args
+
+    def _empresas(self, n):
+        empresas = {}
+        for i in range(n):
+            emp = MagicMock()
+            emp.emitente.cnpj = f"{i:08d}000191"
+            emp.nome = f"EMP{i}"
+            emp.homologacao = True
+            empresas[emp.nome] = emp
+        return empresas
+
+    @patch("nfe_sync.commands.consulta._listar_resumos_pendentes", return_value=[])
+    @patch("nfe_sync.commands.consulta._salvar_log_xml", return_value="log/x.xml")
+    @patch("nfe_sync.commands.consulta.carregar_estado", return_value={})
+    @patch("nfe_sync.commands.consulta.carregar_empresas")
+    def test_saida_de_cada_empresa_nao_se_mistura(self, mock_empresas, mock_estado, mock_log, mock_pend, capsys):
+        import threading
+        from nfe_sync.commands.consulta import cmd_consultar_nsu
+
+        mock_empresas.return_value = self._empresas(4)
+        todas_iniciadas = threading.Barrier(4, timeout=5)
+
+        def gerar(empresa, *a, **kw):
+            # garante que as 4 empresas rodam ao mesmo tempo
+            todas_iniciadas.wait()
+            yield PaginaDistribuicao(
+                pagina=1, status="137", motivo="Nenhum documento localizado",
+                ultimo_nsu=0, max_nsu=0, documentos=[], xml_resposta=None,
+            )
+
+        with patch("nfe_sync.commands.consulta.iter_distribuicao", side_effect=gerar):
+            cmd_consultar_nsu(self._args(4))
+
+        out = capsys.readouterr().out
+        blocos = out.split("=" * 60)
+        assert len(blocos) == 4
+        for bloco in blocos[:-1]:
+            assert bloco.count("Empresa: EMP") == 1
+            assert bloco.count("Status: 137") == 1
+        assert "Resumo: 4 empresa(s), 4 ok, 0 com falha." in out
+
+    @patch("nfe_sync.commands.consulta._listar_resumos_pendentes", return_value=[])
+    @patch("nfe_sync.commands.consulta._salvar_log_xml", return_value="log/x.xml")
+    @patch("nfe_sync.commands.consulta.carregar_estado", return_value={})
+    @patch("nfe_sync.commands.consulta.carregar_empresas")
+    def test_excecao_em_uma_empresa_nao_interrompe_as_outras(self, mock_empresas, mock_estado, mock_log, mock_pend, capsys):
+        from nfe_sync.commands.consulta import cmd_consultar_nsu
+
+        mock_empresas.return_value = self._empresas(3)
+
+        def gerar(empresa, *a, **kw):
+            if empresa.nome == "EMP1":
+                raise RuntimeError("timeout SEFAZ")
+            yield PaginaDistribuicao(
+                pagina=1, status="137", motivo="Nenhum documento localizado",
+                ultimo_nsu=0, max_nsu=0, documentos=[], xml_resposta=None,
+            )
+
+        with patch("nfe_sync.commands.consulta.iter_distribuicao", side_effect=gerar):
+            with pytest.raises(SystemExit) as exc:
+                cmd_consultar_nsu(self._args(2))
+
+        assert exc.value.code == 1
+        out = capsys.readouterr().out
+        assert "ERRO: timeout SEFAZ" in out
+        assert "Resumo: 3 empresa(s), 2 ok, 1 com falha." in out
+        assert "Falha em: EMP1" in out
+
+    def test_paralelo_com_empresa_sai_com_erro(self, capsys):
+        from nfe_sync.commands.consulta import cmd_consultar_nsu
+
+        args = self._args(4)
+        args.empresa = "SUL"
+        with pytest.raises(SystemExit) as exc:
+            cmd_consultar_nsu(args)
+        assert exc.value.code == 1
+        assert "--paralelo" in capsys.readouterr().out
+
+
+class TestConsultarLote:
+    """consultar-lote: várias chaves por processo, uma linha JSONL/CSV por chave."""
+
+    CHAVE_SP = "35" + "0" * 4 + "11111111000191" + "0" * 24
+    CHAVE_PR = "41" + "0" * 4 + "22222222000191" + "0" * 24
+    CHAVE_PROPRIA = "35" + "0" * 4 + "99999999000191" + "0" * 24
+
+    def _args(self, chaves, formato="jsonl", sem_dfe=False, saida=None, paralelo=4):
+        args = MagicMock()
+        args.empresa = "SUL"
+        args.chaves = chaves
+        args.arquivo = None
+        args.formato = formato
+        args.saida = saida
+        args.paralelo = paralelo
+        args.sem_dfe = sem_dfe
+        return args
+
+    def _rodar(self, args, situacoes, capsys, estado=None, dfe_status="653", state_file=None):
+        from nfe_sync.commands.consulta import cmd_consultar_lote
+        empresa = TestCmdConsultarExitCode()._make_mock_empresa()
+        consultadas, dfe_chamadas = [], []
+
+        async def fake_consultar(empresa, chave, cliente=None):
+            consultadas.append(chave)
+            status = situacoes[chave]
+            if isinstance(status, Exception):
+                raise status
+            return ResultadoConsulta(situacao=[{"status": status, "motivo": f"motivo {status}"}], xml=None, xml_resposta="<r/>")
+
+        async def fake_dfe(empresa, chave, cliente=None):
+            dfe_chamadas.append(chave)
+            if dfe_status == "656":
+                return ResultadoDfeChave(
+                    sucesso=False, status="656", motivo="Consumo Indevido", documentos=[],
+                    xml_resposta="<r/>", xml_cancelamento=None,
+                )
+            return ResultadoDfeChave(
+                sucesso=False, status="653", motivo="NF-e cancelada", documentos=[],
+                xml_resposta="<r/>", xml_cancelamento="<procEventoNFe/>",
+            )
+
+        with patch("nfe_sync.commands.consulta._carregar", return_value=(empresa, {} if estado is None else estado)), \
+             patch("nfe_sync.commands.consulta.STATE_FILE", state_file or "/nao/usado.json"), \
+             patch("nfe_sync.commands.consulta.consultar_async", fake_consultar), \
+             patch("nfe_sync.commands.consulta.consultar_dfe_chave_async", fake_dfe), \
+             patch("nfe_sync.commands.consulta._salvar_xml", side_effect=lambda cnpj, nome, xml, **kw: f"downloads/{nome}"), \
+             patch("nfe_sync.commands.consulta._tratar_arquivo_cancelado", return_value=None):
+            try:
+                cmd_consultar_lote(args)
+                codigo = 0
+            except SystemExit as e:
+                codigo = e.code
+        out = capsys.readouterr()
+        return codigo, out, consultadas, dfe_chamadas
+
+    def test_jsonl_e_dfe_so_para_nao_autorizadas(self, capsys):
+        import json
+        situacoes = {self.CHAVE_SP: "100", self.CHAVE_PR: "101", self.CHAVE_PROPRIA: "101"}
+        codigo, out, consultadas, dfe = self._rodar(self._args(list(situacoes)), situacoes, capsys)
+
+        assert codigo == 0
+        linhas = {l["chave"]: l for l in map(json.loads, out.out.splitlines())}
+        assert sorted(consultadas) == sorted(situacoes)
+        assert dfe == [self.CHAVE_PR]  # autorizada e do próprio CNPJ não vão à distribuição
+        assert linhas[self.CHAVE_SP]["uf"] == "sp" and linhas[self.CHAVE_SP]["dfe_status"] is None
+        assert linhas[self.CHAVE_PR]["uf"] == "pr"
+        assert linhas[self.CHAVE_PR]["dfe_status"] == "653"
+        assert linhas[self.CHAVE_PR]["arquivos"] == [f"downloads/{self.CHAVE_PR}-cancelamento.xml"]
+        assert "Resumo: 3 chave(s), 1 autorizada(s), 2 em outra situacao, 0 com erro." in out.err
+
+    def test_csv_e_erro_por_chave(self, capsys):
+        import csv
+        import io
+        from nfe_sync.exceptions import NfeValidationError
+        situacoes = {self.CHAVE_SP: "100", "123": NfeValidationError("chave invalida")}
+        codigo, out, _, _ = self._rodar(self._args(list(situacoes), formato="csv"), situacoes, capsys)
+
+        assert codigo == 1
+        linhas = {l["chave"]: l for l in csv.DictReader(io.StringIO(out.out))}
+        assert linhas[self.CHAVE_SP]["status"] == "100"
+        assert linhas["123"]["erro"] == "NfeValidationError: chave invalida"
+
+    def test_sem_dfe_e_chaves_repetidas(self, capsys):
+        situacoes = {self.CHAVE_PR: "101"}
+        _, _, consultadas, dfe = self._rodar(
+            self._args([self.CHAVE_PR, self.CHAVE_PR], sem_dfe=True), situacoes, capsys,
+        )
+        assert consultadas == [self.CHAVE_PR]
+        assert dfe == []
+
+    def test_cooldown_em_vigor_nao_vai_a_distribuicao(self, capsys):
+        import json
+        from datetime import datetime, timedelta
+        from nfe_sync.state import set_cooldown
+        estado = {}
+        set_cooldown(estado, "99999999000191", (datetime.now().astimezone() + timedelta(hours=1)).isoformat(), "homologacao")
+        situacoes = {self.CHAVE_PR: "101"}
+        codigo, out, consultadas, dfe = self._rodar(self._args(list(situacoes)), situacoes, capsys, estado=estado)
+
+        assert codigo == 0
+        assert consultadas == [self.CHAVE_PR] and dfe == []
+        linha = json.loads(out.out)
+        assert linha["dfe_status"] is None and linha["dfe_motivo"].startswith("Nao consultada: Distribuicao DFe bloqueada")
+
+    def test_656_para_a_distribuicao_e_grava_cooldown(self, capsys, tmp_path):
+        import json
+        state_file = str(tmp_path / "estado.json")
+        chaves = ["41" + f"{i:04d}" + "22222222000191" + "0" * 24 for i in range(3)]
+        situacoes = dict.fromkeys(chaves, "101")
+        estado = {}
+        codigo, out, consultadas, dfe = self._rodar(
+            self._args(chaves, paralelo=1), situacoes, capsys, estado=estado, dfe_status="656", state_file=state_file,
+        )
+
+        assert codigo == 1
+        assert consultadas == chaves  # a situação continua sendo consultada
+        assert dfe == chaves[:1]
+        linhas = [json.loads(l) for l in out.out.splitlines()]
+        assert linhas[0]["dfe_status"] == "656"
+        assert all(l["dfe_motivo"] == "Nao consultada: 656 Consumo Indevido" for l in linhas[1:])
+        assert "BLOQUEADO pela SEFAZ (656 Consumo Indevido)" in out.err
+        assert get_cooldown(estado, "99999999000191", "homologacao")
+        assert get_cooldown(carregar_estado(state_file), "99999999000191", "homologacao")
+
+    def test_sem_chaves_sai_com_codigo_1(self, capsys):
+        codigo, out, _, _ = self._rodar(self._args([]), {}, capsys)
+        assert codigo == 1
+        assert "Nenhuma chave informada" in out.out
+
+
+class TestBaixarChaves:
+    """baixar-chaves: DFe de várias chaves, pulando procNFe em disco e retomando do checkpoint."""
+
+    CHAVES = [f"35{i:04d}11111111000191" + "0" * 24 for i in range(4)]
+
+    @pytest.fixture
+    def ambiente(self, tmp_path):
+        from nfe_sync.commands import _storage
+        storage = _storage()
+        empresa = TestCmdConsultarExitCode()._make_mock_empresa()
+        state_file = str(tmp_path / "estado.json")
+        with patch.object(storage, "BASE", str(tmp_path / "downloads")), \
+             patch("nfe_sync.commands.consulta.STATE_FILE", state_file), \
+             patch("nfe_sync.commands.consulta._carregar", side_effect=lambda a: (empresa, carregar_estado(state_file))):
+            yield storage, state_file
+
+    def _args(self, chaves, reiniciar=False):
+        args = MagicMock()
+        args.empresa = "SUL"
+        args.chaves = chaves
+        args.arquivo = None
+        args.paralelo = 2
+        args.reiniciar = reiniciar
+        return args
+
+    def _rodar(self, args, respostas):
+        """respostas: chave → cStat ou exceção. Retorna (código de saída, chaves consultadas)."""
+        from nfe_sync.commands.consulta import cmd_baixar_chaves
+        consultadas = []
+
+        async def fake_dfe(empresa, chave, cliente=None):
+            consultadas.append(chave)
+            status = respostas[chave]
+            if isinstance(status, Exception):
+                raise status
+            docs = []
+            if status == "138":
+                docs = [Documento(nsu="1", chave=chave, schema="procNFe_v4.00.xsd", nome=f"{chave}.xml", xml="<nfeProc/>")]
+            return ResultadoDfeChave(
+                sucesso=status == "138", status=status, motivo=f"motivo {status}", documentos=docs,
+                xml_resposta="<r/>", xml_cancelamento=None,
+            )
+
+        with patch("nfe_sync.commands.consulta.consultar_dfe_chave_async", fake_dfe):
+            try:
+                cmd_baixar_chaves(args)
+                return 0, consultadas
+            except SystemExit as e:
+                return e.code, consultadas
+
+    def test_pula_procnfe_em_disco(self, ambiente, capsys):
+        storage, state_file = ambiente
+        cnpj = "99999999000191"
+        storage.salvar(cnpj, f"{self.CHAVES[0]}.xml", "<nfeProc/>", schema="procNFe_v4.00.xsd")
+        storage.salvar(cnpj, f"{self.CHAVES[1]}.xml", '<resNFe xmlns="http://www.portalfiscal.inf.br/nfe"/>')
+
+        codigo, consultadas = self._rodar(self._args(self.CHAVES), {c: "138" for c in self.CHAVES})
+
+        assert codigo == 0
+        assert sorted(consultadas) == sorted(self.CHAVES[1:])  # resNFe não conta como completo
+        assert storage.listar_completos(cnpj) == set(self.CHAVES)
+        assert carregar_estado(state_file).get("baixar_chaves", {}) == {}  # checkpoint limpo ao terminar
+
+    def test_pula_procnfe_em_disco_antes_do_indice(self, ambiente, capsys):
+        storage, _ = ambiente
+        cnpj = "99999999000191"
+        caminho = storage._caminhos(cnpj, f"{self.CHAVES[0]}.xml")[0]
+        os.makedirs(os.path.dirname(caminho))
+        with open(caminho, "w") as f:  # baixado por uma versão sem índice
+            f.write('<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe"/>')
+
+        codigo, consultadas = self._rodar(self._args(self.CHAVES[:2]), {c: "138" for c in self.CHAVES[:2]})
+
+        assert codigo == 0
+        assert consultadas == [self.CHAVES[1]]
+
+    def test_grava_fora_do_event_loop(self, ambiente, capsys):
+        import threading
+        from nfe_sync.commands import consulta
+        threads = []
+        salvar = consulta._salvar_dfe_lote
+
+        def _salvar(*args):
+            threads.append(threading.current_thread())
+            return salvar(*args)
+
+        with patch("nfe_sync.commands.consulta._salvar_dfe_lote", _salvar):
+            codigo, _ = self._rodar(self._args(self.CHAVES[:2]), {c: "138" for c in self.CHAVES[:2]})
+        assert codigo == 0
+        assert len(threads) == 2 and threading.main_thread() not in threads
+
+    def test_retoma_apos_falha(self, ambiente, capsys):
+        import requests
+        respostas = {c: "138" for c in self.CHAVES}
+        respostas[self.CHAVES[2]] = "632"  # inexistente: resolvida sem documento
+        respostas[self.CHAVES[3]] = requests.Timeout("30s")
+
+        codigo, _ = self._rodar(self._args(self.CHAVES), respostas)
+        assert codigo == 1
+        assert "Execute novamente" in capsys.readouterr().out
+
+        respostas[self.CHAVES[3]] = "138"
+        codigo, consultadas = self._rodar(self._args(self.CHAVES), respostas)
+        assert codigo == 0
+        assert consultadas == [self.CHAVES[3]]  # 632 ficou no checkpoint; 138 tem procNFe em disco
+
+    def test_rejeicao_transitoria_fica_pendente(self, ambiente, capsys):
+        _, state_file = ambiente
+        respostas = {self.CHAVES[0]: "137", self.CHAVES[1]: "108"}  # 108: serviço paralisado
+
+        codigo, _ = self._rodar(self._args(self.CHAVES[:2]), respostas)
+        assert codigo == 1
+        assert carregar_estado(state_file)["baixar_chaves"]["99999999000191:homologacao"] == {self.CHAVES[0]: "137"}
+
+        respostas[self.CHAVES[1]] = "138"
+        codigo, consultadas = self._rodar(self._args(self.CHAVES[:2]), respostas)
+        assert codigo == 0
+        assert consultadas == [self.CHAVES[1]]
+
+    def test_reiniciar_ignora_checkpoint(self, ambiente, capsys):
+        import requests
+        respostas = {self.CHAVES[0]: "632", self.CHAVES[1]: requests.Timeout("30s")}
+        self._rodar(self._args(self.CHAVES[:2]), respostas)
+
+        respostas[self.CHAVES[1]] = "632"
+        _, consultadas = self._rodar(self._args(self.CHAVES[:2], reiniciar=True), respostas)
+        assert sorted(consultadas) == sorted(self.CHAVES[:2])
+
+    def test_656_para_e_grava_cooldown(self, ambiente, capsys):
+        _, state_file = ambiente
+        respostas = {c: "656" for c in self.CHAVES}
+
+        codigo, consultadas = self._rodar(self._args(self.CHAVES), respostas)
+        assert codigo == 1
+        assert len(consultadas) <= 2  # só as que já estavam em voo
+        assert get_cooldown(carregar_estado(state_file), "99999999000191", "homologacao")
+
+        codigo, consultadas = self._rodar(self._args(self.CHAVES), respostas)
+        assert codigo == 1
+        assert consultadas == []
+        assert "BLOQUEADO" in capsys.readouterr().out
+
+
+class TestVerificarNsu:
+    """verificar-nsu: lacunas entre os NSUs registrados e busca individual via consNSU."""
+
+    CNPJ = "99999999000191"
+
+    @pytest.fixture
+    def ambiente(self, tmp_path):
+        from nfe_sync.commands import _storage
+        from nfe_sync.state import EstadoJson
+        storage = _storage()
+        empresa = TestCmdConsultarExitCode()._make_mock_empresa()
+        state_file = str(tmp_path / "estado.json")
+        EstadoJson(state_file).set_ultimo_nsu(self.CNPJ, 6, "homologacao")
+        with patch.object(storage, "BASE", str(tmp_path / "downloads")), \
+             patch("nfe_sync.commands.consulta.STATE_FILE", state_file), \
+             patch("nfe_sync.commands.consulta._carregar", side_effect=lambda a: (empresa, carregar_estado(state_file))):
+            storage.registrar_nsus(self.CNPJ, [(1, "ok"), (3, "ok"), (6, "ok")])
+            yield storage, state_file
+
+    def _args(self, baixar=False):
+        args = MagicMock()
+        args.empresa = "SUL"
+        args.desde = None
+        args.baixar = baixar
+        args.limite = None
+        args.paralelo = 2
+        return args
+
+    def _rodar(self, args, respostas=None):
+        """respostas: NSU → cStat. Retorna (código de saída, NSUs consultados)."""
+        from nfe_sync.commands.consulta import cmd_verificar_nsu
+        consultados = []
+
+        async def fake_nsu(empresa, nsu, cliente=None):
+            consultados.append(nsu)
+            status = respostas[nsu]
+            docs = []
+            if status == "138":
+                docs = [Documento(nsu=f"{nsu:015d}", schema="resNFe_v1.01.xsd", nome=f"{nsu:044d}.xml", xml="<resNFe/>")]
+            return ResultadoDfeChave(
+                sucesso=status == "138", status=status, motivo=f"motivo {status}", documentos=docs,
+                xml_resposta="<r/>", xml_cancelamento=None,
+            )
+
+        with patch("nfe_sync.commands.consulta.consultar_dfe_nsu_async", fake_nsu):
+            try:
+                cmd_verificar_nsu(args)
+                return 0, consultados
+            except SystemExit as e:
+                return e.code, consultados
+
+    def test_lista_lacunas_sem_consultar(self, ambiente, capsys):
+        codigo, consultados = self._rodar(self._args())
+        assert codigo == 1
+        assert consultados == []
+        assert "3 NSU(s) sem documento ate 6: 2, 4-5" in capsys.readouterr().out
+
+    def test_baixar_preenche_lacunas(self, ambiente, capsys):
+        storage, _ = ambiente
+        codigo, consultados = self._rodar(self._args(baixar=True), {2: "138", 4: "632", 5: "138"})
+
+        assert codigo == 0
+        assert sorted(consultados) == [2, 4, 5]
+        assert storage.existe(self.CNPJ, f"{2:044d}.xml")
+        assert storage.lacunas_nsu(self.CNPJ, 6) == []
+        assert "nenhuma lacuna de NSU ate 6" in capsys.readouterr().out
+
+    def test_656_para_e_grava_cooldown(self, ambiente, capsys):
+        storage, state_file = ambiente
+        codigo, consultados = self._rodar(self._args(baixar=True), {2: "656", 4: "656", 5: "656"})
+
+        assert codigo == 1
+        assert len(consultados) <= 2
+        assert storage.lacunas_nsu(self.CNPJ, 6) == [(2, 2), (4, 5)]
+        assert get_cooldown(carregar_estado(state_file), self.CNPJ, "homologacao")
+
+        codigo, consultados = self._rodar(self._args(baixar=True), {})
+        assert (codigo, consultados) == (1, [])
+        assert "BLOQUEADO" in capsys.readouterr().out
@@ -48,6 +48,8 @@ class TestCmdEmitirSemEndereco:
         args.destinatario = destinatario
         args.homologacao = True
         args.producao = False
+        args.contingencia = None
+        args.forcar_contingencia = False
         return args
 
     def test_exit_code_1_sem_endereco(self, empresa_sem_endereco, capsys):
@@ -133,6 +135,8 @@ class TestCmdEmitirDestinatario:
         args.destinatario = "INEXISTENTE"
         args.homologacao = True
         args.producao = False
+        args.contingencia = None
+        args.forcar_contingencia = False
 
         with patch("nfe_sync.commands.emissao._carregar", return_value=(emitente, {})), \
              patch("nfe_sync.commands.emissao.carregar_empresas", return_value={"SUL": emitente}):
@@ -153,6 +157,8 @@ class TestCmdEmitirDestinatario:
         args.destinatario = "SRNACIONAL"
         args.homologacao = True
         args.producao = False
+        args.contingencia = None
+        args.forcar_contingencia = False
 
         with patch("nfe_sync.commands.emissao._carregar", return_value=(emitente, {})), \
              patch("nfe_sync.commands.emissao.carregar_empresas",
@@ -194,6 +200,8 @@ class TestCmdEmitirIndicadores:
         args.destinatario = destinatario
         args.homologacao = True
         args.producao = False
+        args.contingencia = None
+        args.forcar_contingencia = False
         return args
 
     def test_intraestadual_cfop_5102_indicador_1(self, capsys):
@@ -210,7 +218,7 @@ class TestCmdEmitirIndicadores:
         )
 
         capturado = {}
-        def fake_emitir(empresa, serie, numero_nf, dados):
+        def fake_emitir(empresa, serie, numero_nf, dados, contingencia=None, forcar_contingencia=False):
             capturado["dados"] = dados
             return resultado_mock
 
@@ -240,7 +248,7 @@ class TestCmdEmitirIndicadores:
         )
 
         capturado = {}
-        def fake_emitir(empresa, serie, numero_nf, dados):
+        def fake_emitir(empresa, serie, numero_nf, dados, contingencia=None, forcar_contingencia=False):
             capturado["dados"] = dados
             return resultado_mock
 
@@ -270,7 +278,7 @@ class TestCmdEmitirIndicadores:
         )
 
         capturado = {}
-        def fake_emitir(empresa, serie, numero_nf, dados):
+        def fake_emitir(empresa, serie, numero_nf, dados, contingencia=None, forcar_contingencia=False):
             capturado["dados"] = dados
             return resultado_mock
 
@@ -282,3 +290,96 @@ class TestCmdEmitirIndicadores:
                 cmd_emitir(self._make_args(destinatario="DEST"))
 
         assert capturado["dados"].destinatario.indicador_ie == 9
+
+
+class TestCmdEmitirNumeracao:
+    """A numeração é gravada por chave, sem reescrever o estado carregado no início."""
+
+    def _make_args(self):
+        args = MagicMock()
+        args.empresa = "SUL"
+        args.serie = "1"
+        args.destinatario = None
+        args.homologacao = True
+        args.producao = False
+        args.contingencia = None
+        args.forcar_contingencia = False
+        return args
+
+    def test_grava_so_a_numeracao(self, empresa_com_endereco, tmp_path, monkeypatch):
+        from nfe_sync.commands.emissao import cmd_emitir
+        from nfe_sync.results import ResultadoEmissao
+        from nfe_sync.state import abrir_estado
+
+        monkeypatch.chdir(tmp_path)
+        state_file = str(tmp_path / "state.db")
+        backend = abrir_estado(state_file)
+        backend.set_ultimo_numero_nf("99999999000191", "1", 41, "homologacao")
+
+        def fake_emitir(empresa, serie, numero_nf, dados, contingencia=None, forcar_contingencia=False):
+            # outro processo avança o NSU enquanto a NF-e é emitida
+            backend.set_ultimo_nsu("99999999000191", 500, "homologacao")
+            return ResultadoEmissao(
+                sucesso=True, status="100", motivo="Autorizado", protocolo="135", chave="1" * 44,
+                xml="<nfeProc/>", xml_resposta=None, erros=[],
+            )
+
+        with patch("nfe_sync.commands.emissao._carregar", return_value=(empresa_com_endereco, {})), \
+             patch("nfe_sync.commands.emissao.STATE_FILE", state_file), \
+             patch("nfe_sync.commands.emissao._salvar_log_xml"), \
+             patch("nfe_sync.emissao.emitir", fake_emitir):
+            cmd_emitir(self._make_args())
+
+        assert backend.get_ultimo_numero_nf("99999999000191", "1", "homologacao") == 42
+        assert backend.get_ultimo_nsu("99999999000191", "homologacao") == 500
+
+
+class TestCmdEmitirContingencia:
+    """Com o disjuntor em memória (estado JSON), --contingencia avisa que não troca para SVC."""
+
+    def _emitir(self, empresa, tmp_path, monkeypatch, disjuntor, forcar):
+        from nfe_sync.commands.emissao import cmd_emitir
+        from nfe_sync.disjuntor import configurar_disjuntor
+        from nfe_sync.results import ResultadoEmissao
+
+        monkeypatch.chdir(tmp_path)
+        args = MagicMock()
+        args.empresa = "SUL"
+        args.serie = "1"
+        args.destinatario = None
+        args.contingencia = "SEFAZ SP FORA DO AR HA 10 MIN"
+        args.forcar_contingencia = forcar
+        fake = MagicMock(return_value=ResultadoEmissao(
+            sucesso=True, status="100", motivo="Autorizado", protocolo="135", chave="1" * 44,
+            xml="<nfeProc/>", xml_resposta=None, erros=[], contingencia="SVC-AN" if forcar else None,
+        ))
+        anterior = configurar_disjuntor(disjuntor)
+        try:
+            with patch("nfe_sync.commands.emissao._carregar", return_value=(empresa, {})), \
+                 patch("nfe_sync.commands.emissao.STATE_FILE", str(tmp_path / "state.json")), \
+                 patch("nfe_sync.commands.emissao._salvar_log_xml"), \
+                 patch("nfe_sync.emissao.emitir", fake):
+                cmd_emitir(args)
+        finally:
+            configurar_disjuntor(anterior)
+        return fake
+
+    def test_disjuntor_em_memoria_avisa(self, empresa_com_endereco, tmp_path, monkeypatch, capsys):
+        from nfe_sync.disjuntor import DisjuntorSefaz
+        self._emitir(empresa_com_endereco, tmp_path, monkeypatch, DisjuntorSefaz(), forcar=False)
+        assert "--forcar-contingencia" in capsys.readouterr().out
+
+    def test_disjuntor_no_estado_sem_aviso(self, empresa_com_endereco, tmp_path, monkeypatch, capsys):
+        from nfe_sync.disjuntor import DisjuntorSefaz
+        from nfe_sync.state import abrir_estado
+        disjuntor = DisjuntorSefaz(backend=abrir_estado(str(tmp_path / "state.db")))
+        self._emitir(empresa_com_endereco, tmp_path, monkeypatch, disjuntor, forcar=False)
+        assert "Aviso" not in capsys.readouterr().out
+
+    def test_forcar_repassa_para_emitir(self, empresa_com_endereco, tmp_path, monkeypatch, capsys):
+        from nfe_sync.disjuntor import DisjuntorSefaz
+        fake = self._emitir(empresa_com_endereco, tmp_path, monkeypatch, DisjuntorSefaz(), forcar=True)
+        assert fake.call_args.kwargs["forcar_contingencia"] is True
+        out = capsys.readouterr().out
+        assert "Aviso" not in out
+        assert "contingencia SVC-AN" in out
@@ -1,31 +1,64 @@
-"""Testes para commands/__init__.py — Issue #23: XXE em _salvar_log_xml."""
-from unittest.mock import patch, MagicMock
+"""Testes para commands/__init__.py — Issue #23: XXE em _salvar_log_xml; storage criado sob demanda."""
+import os
+import subprocess
+import sys
+from unittest.mock import patch
+
+import pytest
 
 import nfe_sync.commands as cmds_mod
+import nfe_sync.log as log_module
+from nfe_sync.exceptions import NfeConfigError
 
 
 class TestSalvarLogXmlSeguro:
-    """Issue #23: _salvar_log_xml deve usar safe_fromstring, não etree.fromstring."""
+    """Issue #23: _salvar_log_xml não pode fazer parse inseguro — hoje não faz parse algum."""
 
     XML_SIMPLES = '<?xml version="1.0"?><retConsSitNFe><cStat>100</cStat></retConsSitNFe>'
 
-    def test_usa_safe_fromstring_nao_etree(self):
-        """Garantia: safe_fromstring é chamado (sem vulnerabilidade XXE)."""
-        with patch.object(cmds_mod, "safe_fromstring") as mock_safe, \
-             patch("nfe_sync.commands.salvar_resposta_sefaz", return_value="log/x.xml") as mock_salvar:
-            mock_safe.return_value = MagicMock()
+    def test_grava_sem_reparse(self):
+        """O XML já serializado é repassado como está para salvar_resposta_sefaz."""
+        with patch("nfe_sync.commands.salvar_resposta_sefaz", return_value="log/x.xml") as mock_salvar:
             cmds_mod._salvar_log_xml(self.XML_SIMPLES, "consulta", "chave123")
 
-        mock_safe.assert_called_once()
-        args = mock_safe.call_args[0]
-        assert args[0] == self.XML_SIMPLES.encode()
+        mock_salvar.assert_called_once_with(self.XML_SIMPLES, "consulta", "chave123")
 
-    def test_nao_usa_etree_fromstring(self):
-        """Garantia: etree.fromstring NÃO é chamado (removido do módulo)."""
+    def test_nao_usa_etree_fromstring(self, tmp_path, monkeypatch):
+        """Garantia: nenhum parser é chamado (sem superfície para XXE)."""
         from pynfe.utils import etree
-        with patch.object(etree, "fromstring") as mock_etree, \
-             patch.object(cmds_mod, "safe_fromstring", return_value=MagicMock()), \
-             patch("nfe_sync.commands.salvar_resposta_sefaz", return_value="log/x.xml"):
-            cmds_mod._salvar_log_xml(self.XML_SIMPLES, "consulta", "chave123")
+        monkeypatch.setattr(log_module, "LOG_DIR", str(tmp_path))
+        with patch.object(etree, "fromstring") as mock_etree:
+            arquivo = cmds_mod._salvar_log_xml(self.XML_SIMPLES, "consulta", "chave123")
 
         mock_etree.assert_not_called()
+        with open(arquivo) as f:
+            assert f.read() == self.XML_SIMPLES
+
+    def test_bytes_gravados_identicos(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(log_module, "LOG_DIR", str(tmp_path))
+        conteudo = '<resNFe><xNome>AÇÚCAR</xNome></resNFe>'.encode()
+        arquivo = cmds_mod._salvar_log_xml(conteudo, "dist-dfe", "x")
+        with open(arquivo, "rb") as f:
+            assert f.read() == conteudo
+
+
+class TestStorageSobDemanda:
+    """Configuração inválida de storage só falha quando um comando usa downloads/."""
+
+    def test_import_nao_abre_storage(self):
+        env = {**os.environ, "NFE_SYNC_STORAGE": "invalido"}
+        resultado = subprocess.run(
+            [sys.executable, "-c", "import nfe_sync.commands, nfe_sync.cli"],
+            env=env, capture_output=True, text=True,
+        )
+        assert resultado.returncode == 0, resultado.stderr
+
+    def test_erro_no_primeiro_uso(self, monkeypatch):
+        monkeypatch.setenv("NFE_SYNC_LAYOUT", "invalido")
+        monkeypatch.setattr(cmds_mod, "_storage_ativo", None)
+        with pytest.raises(NfeConfigError, match="NFE_SYNC_LAYOUT"):
+            cmds_mod._storage()
+
+    def test_criado_uma_vez(self, monkeypatch):
+        monkeypatch.setattr(cmds_mod, "_storage_ativo", None)
+        assert cmds_mod._storage() is cmds_mod._storage()
@@ -0,0 +1,102 @@
+"""Testes para commands/manifestacao.py."""
+import pytest
+from unittest.mock import patch, MagicMock
+
+from nfe_sync.results import ItemManifestacaoLote, ResultadoManifestacaoLote
+
+
+CHAVE_A = "52991299999999999999550010000000011000000010"
+CHAVE_B = "52991299999999999999550010000000021000000020"
+
+
+def _make_args(empresa, **kw):
+    args = MagicMock()
+    args.empresa = empresa.nome
+    args.operacao = "ciencia"
+    args.chaves = []
+    args.arquivo = None
+    args.pendentes = False
+    args.justificativa = ""
+    args.paralelo = None
+    for k, v in kw.items():
+        setattr(args, k, v)
+    return args
+
+
+def _fake_lote(status_por_chave: dict):
+    def fake(empresa, operacao, chaves, justificativa="", paralelo=4, callback=None):
+        itens = [
+            ItemManifestacaoLote(chave=c, lote=1, status=status_por_chave[c], motivo="ok", xml="<retEvento/>")
+            if status_por_chave[c] else ItemManifestacaoLote(chave=c, lote=1, erro="timeout")
+            for c in chaves
+        ]
+        if callback:
+            callback(itens)
+        return ResultadoManifestacaoLote(itens=itens, xmls_resposta=["<retEnvEvento/>"])
+    return fake
+
+
+class TestCmdManifestarLote:
+    def test_chaves_de_arquivo_e_pendentes_sem_repetir(self, empresa_sul, tmp_path, capsys):
+        from nfe_sync.commands.manifestacao import cmd_manifestar_lote
+        arquivo = tmp_path / "chaves.txt"
+        arquivo.write_text(f"# lote de segunda\n{CHAVE_A}\n\n{CHAVE_B}  # fornecedor X\n")
+        args = _make_args(empresa_sul, arquivo=str(arquivo), pendentes=True)
+        fake = MagicMock(side_effect=_fake_lote({CHAVE_A: "135", CHAVE_B: "135"}))
+
+        with patch("nfe_sync.commands.manifestacao._carregar", return_value=(empresa_sul, {})), \
+             patch("nfe_sync.commands.manifestacao._listar_resumos_pendentes", return_value=[CHAVE_A]), \
+             patch("nfe_sync.manifestacao.manifestar_lote", fake), \
+             patch("nfe_sync.commands.manifestacao._salvar_log_xml"), \
+             patch("nfe_sync.commands.manifestacao._salvar_xml") as mock_salvar:
+            cmd_manifestar_lote(args)  # nao deve levantar SystemExit
+
+        assert fake.call_args[0][2] == [CHAVE_A, CHAVE_B]
+        mock_salvar.assert_any_call(empresa_sul.emitente.cnpj, f"{CHAVE_A}-evento-ciencia.xml", "<retEvento/>")
+        out = capsys.readouterr().out
+        assert "2 chave(s), 2 registrada(s), 0 com falha" in out
+
+    def test_falha_em_alguma_chave_exit_1(self, empresa_sul, capsys):
+        from nfe_sync.commands.manifestacao import cmd_manifestar_lote
+        args = _make_args(empresa_sul, chaves=[CHAVE_A, CHAVE_B])
+
+        with patch("nfe_sync.commands.manifestacao._carregar", return_value=(empresa_sul, {})), \
+             patch("nfe_sync.manifestacao.manifestar_lote", side_effect=_fake_lote({CHAVE_A: "135", CHAVE_B: None})), \
+             patch("nfe_sync.commands.manifestacao._salvar_log_xml"), \
+             patch("nfe_sync.commands.manifestacao._salvar_xml"):
+            with pytest.raises(SystemExit) as exc:
+                cmd_manifestar_lote(args)
+
+        assert exc.value.code == 1
+        out = capsys.readouterr().out
+        assert f"{CHAVE_B}  ERRO: timeout" in out
+        assert f"{CHAVE_A}  cStat=135" in out
+
+    def test_log_de_cada_lote_com_numero_do_lote(self, empresa_sul):
+        from nfe_sync.commands.manifestacao import _registrar_lote
+        resultado = ResultadoManifestacaoLote(
+            itens=[
+                ItemManifestacaoLote(chave=CHAVE_A, lote=1, erro="timeout"),
+                ItemManifestacaoLote(chave=CHAVE_B, lote=2, status="135", motivo="ok"),
+                ItemManifestacaoLote(chave=CHAVE_B, lote=3, status="135", motivo="ok"),
+            ],
+            xmls_resposta=["<lote2/>", "<lote3/>"],
+        )
+        cnpj = empresa_sul.emitente.cnpj
+
+        with patch("nfe_sync.manifestacao.manifestar_lote", return_value=resultado), \
+             patch("nfe_sync.commands.manifestacao._salvar_log_xml") as mock_log, \
+             patch("nfe_sync.commands.manifestacao._salvar_xml"):
+            _registrar_lote(empresa_sul, "ciencia", [CHAVE_A, CHAVE_B])
+
+        assert [c.args for c in mock_log.call_args_list] == [
+            ("<lote2/>", "manifestacao-lote", f"{cnpj}-ciencia-l002"),
+            ("<lote3/>", "manifestacao-lote", f"{cnpj}-ciencia-l003"),
+        ]
+
+    def test_sem_chaves_exit_1(self, empresa_sul, capsys):
+        from nfe_sync.commands.manifestacao import cmd_manifestar_lote
+        with patch("nfe_sync.commands.manifestacao._carregar", return_value=(empresa_sul, {})):
+            with pytest.raises(SystemExit):
+                cmd_manifestar_lote(_make_args(empresa_sul))
+        assert "Nenhuma chave" in capsys.readouterr().out
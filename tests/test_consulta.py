@@ -2,13 +2,17 @@ import logging
 from datetime import datetime, timedelta
 from unittest.mock import patch, MagicMock, call
 import pytest
+import requests
 
 from nfe_sync.consulta import (
     verificar_cooldown, calcular_proximo_cooldown, consultar_nsu,
-    consultar, consultar_dfe_chave,
-    _agora_brt, _SALVAR_A_CADA,
+    consultar, consultar_dfe_chave, iter_distribuicao,
+    _agora_brt,
 )
 from nfe_sync.xml_utils import _com_retry
+from nfe_sync.retentativa import (
+    ControleRetentativas, OrcamentoRetentativas, PoliticaRetentativa, configurar_retentativas,
+)
 from nfe_sync.exceptions import NfeValidationError
 from nfe_sync.state import carregar_estado
 
@@ -210,6 +214,85 @@ class TestConsultarNsuCallback:
         assert resultado.sucesso is True
 
 
+class TestIterDistribuicao:
+    """Modo streaming: uma pagina por vez, NSU avancado so apos o consumidor retomar."""
+
+    XML_PAG1 = TestConsultarNsuCallback.XML_PAG1
+    XML_PAG2 = TestConsultarNsuCallback.XML_PAG2
+
+    @patch("nfe_sync.xml_utils.ComunicacaoSefaz")
+    def test_gera_documentos_por_pagina(self, mock_sefaz_cls, empresa_sul, tmp_path):
+        resp1, resp2 = MagicMock(), MagicMock()
+        resp1.content = self.XML_PAG1
+        resp2.content = self.XML_PAG2
+        mock_sefaz_cls.return_value.consulta_distribuicao.side_effect = [resp1, resp2]
+
+        paginas = list(iter_distribuicao(empresa_sul, {}, str(tmp_path / "state.json")))
+
+        assert [p.pagina for p in paginas] == [1, 2]
+        assert [len(p.documentos) for p in paginas] == [1, 1]
+        assert paginas[0].documentos[0].nsu == "000000000000042"
+        assert paginas[1].ultimo_nsu == 100
+        assert all(p.xml_resposta for p in paginas)
+
+    @patch("nfe_sync.xml_utils.ComunicacaoSefaz")
+    def test_nsu_nao_avanca_antes_do_consumidor_retomar(self, mock_sefaz_cls, empresa_sul, tmp_path):
+        resp1, resp2 = MagicMock(), MagicMock()
+        resp1.content = self.XML_PAG1
+        resp2.content = self.XML_PAG2
+        mock_sefaz_cls.return_value.consulta_distribuicao.side_effect = [resp1, resp2]
+        cnpj = empresa_sul.emitente.cnpj
+        estado = {}
+
+        gen = iter_distribuicao(empresa_sul, estado, str(tmp_path / "state.json"))
+        primeira = next(gen)
+        assert primeira.ultimo_nsu == 42
+        assert f"{cnpj}:homologacao" not in estado.get("nsu", {})
+
+        next(gen)
+        assert estado["nsu"][f"{cnpj}:homologacao"] == 42
+        assert mock_sefaz_cls.return_value.consulta_distribuicao.call_count == 2
+        gen.close()
+
+    @patch("nfe_sync.xml_utils.ComunicacaoSefaz")
+    def test_aguardar_gravacao_antes_do_nsu(self, mock_sefaz_cls, empresa_sul, tmp_path):
+        """Com gravação em segundo plano: busca a próxima página, espera a anterior e só então grava o NSU."""
+        resp1, resp2 = MagicMock(), MagicMock()
+        resp1.content = self.XML_PAG1
+        resp2.content = self.XML_PAG2
+        mock_sefaz_cls.return_value.consulta_distribuicao.side_effect = [resp1, resp2]
+        cnpj = empresa_sul.emitente.cnpj
+        chave = f"{cnpj}:homologacao"
+        estado = {}
+        eventos = []
+
+        def aguardar(pagina):
+            chamadas = mock_sefaz_cls.return_value.consulta_distribuicao.call_count
+            eventos.append((pagina.pagina, chamadas, estado.get("nsu", {}).get(chave)))
+
+        paginas = list(iter_distribuicao(
+            empresa_sul, estado, str(tmp_path / "state.json"), aguardar_gravacao=aguardar,
+        ))
+
+        assert [p.pagina for p in paginas] == [1, 2]
+        # a página 2 já foi pedida quando a 1 é aguardada; o NSU ainda não avançou
+        assert eventos == [(1, 2, None), (2, 2, 42)]
+        assert estado["nsu"][chave] == 100
+
+    def test_bloqueado_gera_unica_pagina_sem_chamar_sefaz(self, empresa_sul, tmp_path):
+        futuro = (datetime.now() + timedelta(hours=1)).isoformat(timespec="seconds")
+        cnpj = empresa_sul.emitente.cnpj
+        estado = {"cooldown": {f"{cnpj}:homologacao": futuro}}
+
+        with patch("nfe_sync.xml_utils.ComunicacaoSefaz") as mock_cls:
+            paginas = list(iter_distribuicao(empresa_sul, estado, str(tmp_path / "state.json")))
+
+        assert len(paginas) == 1
+        assert paginas[0].status is None
+        assert "bloqueada" in paginas[0].motivo
+        mock_cls.assert_not_called()
+
+
 class TestAgoraBrt:
     """Issue #53: _agora_brt retorna datetime com tzinfo BRT (-03:00)."""
 
@@ -224,7 +307,16 @@ class TestAgoraBrt:
 
 
 class TestComRetry:
-    """Issue #5: retry com backoff exponencial."""
+    """Issue #5 / retentativa.py: só falhas transitórias, com jitter e orçamento."""
+
+    @pytest.fixture(autouse=True)
+    def controle(self):
+        self.esperas = []
+        # aleatorio devolve o limite superior: esperas determinísticas
+        controle = ControleRetentativas(dormir=self.esperas.append, aleatorio=lambda a, b: b)
+        anterior = configurar_retentativas(controle)
+        yield controle
+        configurar_retentativas(anterior)
 
     def test_sucesso_na_primeira_tentativa(self):
         fn = MagicMock(return_value="ok")
@@ -233,28 +325,86 @@ class TestComRetry:
         fn.assert_called_once_with("arg1", kw=1)
 
     def test_retry_apos_falha(self):
-        fn = MagicMock(side_effect=[RuntimeError("falha"), "ok"])
-        with patch("nfe_sync.xml_utils.time.sleep") as mock_sleep:
-            resultado = _com_retry(fn, tentativas=3, base=1)
+        fn = MagicMock(side_effect=[requests.ConnectionError("reset"), "ok"])
+        resultado = _com_retry(fn, tentativas=3, base=1)
         assert resultado == "ok"
-        mock_sleep.assert_called_once_with(1)  # base * 2^0 = 1
+        assert self.esperas == [3]  # uniforme(1, 3 x 1)
 
     def test_levanta_na_ultima_tentativa(self):
-        fn = MagicMock(side_effect=RuntimeError("sempre falha"))
-        with patch("nfe_sync.xml_utils.time.sleep"):
-            with pytest.raises(RuntimeError, match="sempre falha"):
-                _com_retry(fn, tentativas=3, base=1)
+        fn = MagicMock(side_effect=requests.Timeout("sempre falha"))
+        with pytest.raises(requests.Timeout, match="sempre falha"):
+            _com_retry(fn, tentativas=3, base=1)
         assert fn.call_count == 3
 
-    def test_backoff_exponencial(self):
-        fn = MagicMock(side_effect=[RuntimeError(), RuntimeError(), "ok"])
-        with patch("nfe_sync.xml_utils.time.sleep") as mock_sleep:
-            _com_retry(fn, tentativas=3, base=5)
-        assert mock_sleep.call_args_list == [call(5), call(10)]  # 5*2^0, 5*2^1
+    def test_backoff_decorrelacionado_com_teto(self):
+        fn = MagicMock(side_effect=[TimeoutError(), TimeoutError(), TimeoutError(), "ok"])
+        _com_retry(fn, politica=PoliticaRetentativa(tentativas=4, base=5, teto=60))
+        assert self.esperas == [15, 45, 60]
+
+    def test_erro_permanente_nao_repete(self, controle):
+        fn = MagicMock(side_effect=NfeValidationError("schema"))
+        with pytest.raises(NfeValidationError):
+            _com_retry(fn)
+        assert fn.call_count == 1
+        assert self.esperas == []
+        assert controle.permanentes == 1
+
+    def test_http_5xx_repete_4xx_nao(self):
+        resp_500 = requests.Response()
+        resp_500.status_code = 503
+        resp_400 = requests.Response()
+        resp_400.status_code = 403
+        fn = MagicMock(side_effect=[requests.HTTPError(response=resp_500), "ok"])
+        assert _com_retry(fn) == "ok"
+        fn = MagicMock(side_effect=requests.HTTPError(response=resp_400))
+        with pytest.raises(requests.HTTPError):
+            _com_retry(fn)
+        assert fn.call_count == 1
+
+    def test_resposta_paralisada_repete(self):
+        paralisado = MagicMock(status_code=200, content=b"<retDistDFeInt><cStat>108</cStat></retDistDFeInt>")
+        ok = MagicMock(status_code=200, content=b"<retDistDFeInt><cStat>138</cStat></retDistDFeInt>")
+        fn = MagicMock(side_effect=[paralisado, ok])
+        assert _com_retry(fn) is ok
+        assert len(self.esperas) == 1
+
+    def test_resposta_paralisada_na_ultima_tentativa_e_devolvida(self):
+        paralisado = MagicMock(status_code=200, content=b"<ret><cStat>109</cStat></ret>")
+        fn = MagicMock(return_value=paralisado)
+        assert _com_retry(fn, tentativas=2) is paralisado
+        assert fn.call_count == 2
+
+    def test_orcamento_limita_retentativas(self, controle):
+        controle.orcamento = OrcamentoRetentativas(proporcao=0.5, reserva=2)
+        fn = MagicMock(side_effect=requests.ConnectionError())
+        for _ in range(3):
+            with pytest.raises(requests.ConnectionError):
+                _com_retry(fn, tentativas=3)
+        # reserva 2 (+0.5 por chamada, até o teto 2): 2 retentativas na 1a chamada,
+        # nenhuma na 2a (saldo 0.5), 1 na 3a (saldo 1.0)
+        assert fn.call_count == 3 + 1 + 2
+        assert controle.retentativas == 3
+        assert controle.negadas == 2
+
+    def test_contadores(self, controle):
+        fn = MagicMock(side_effect=[requests.Timeout(), "ok"])
+        _com_retry(fn, base=2)
+        c = controle.contadores()
+        assert (c["chamadas"], c["tentativas"], c["retentativas"]) == (1, 2, 1)
+        assert c["espera_total"] == 6
+
+    def test_interromper_acorda_e_desiste(self):
+        controle = ControleRetentativas(aleatorio=lambda a, b: 3600)
+        configurar_retentativas(controle)
+        controle.interromper()
+        fn = MagicMock(side_effect=requests.Timeout("fora"))
+        with pytest.raises(requests.Timeout):
+            _com_retry(fn)
+        assert fn.call_count == 1
 
 
 class TestStateSaveFrequency:
-    """Issue #7: salvar estado a cada _SALVAR_A_CADA páginas."""
+    """Issue #7: com JSON o NSU é gravado em lotes; com SQLite, a cada página."""
 
     XML_TEMPLATE = b"""<?xml version="1.0" encoding="utf-8"?>
     <retDistDFeInt xmlns="http://www.portalfiscal.inf.br/nfe">
@@ -278,11 +428,11 @@ class TestStateSaveFrequency:
     </retDistDFeInt>"""
 
     @patch("nfe_sync.xml_utils.ComunicacaoSefaz")
-    def test_salva_apenas_a_cada_n_paginas(self, mock_sefaz_cls, empresa_sul, tmp_path):
-        """Deve salvar estado a cada _SALVAR_A_CADA páginas, não a cada 1."""
+    def test_json_salva_em_lotes(self, mock_sefaz_cls, empresa_sul, tmp_path):
+        """Com JSON grava a cada _SALVAR_A_CADA páginas e o restante no fim."""
         respostas = []
-        # Gerar _SALVAR_A_CADA páginas com nsu crescente, cada uma ainda abaixo do max
-        for i in range(1, _SALVAR_A_CADA + 1):
+        paginas = 12
+        for i in range(1, paginas + 1):
             nsu = i
             xml = self.XML_TEMPLATE.replace(b"{nsu:015d}", f"{nsu:015d}".encode()).replace(
                 b"{nsu:015d}", f"{nsu:015d}".encode()
@@ -314,19 +464,43 @@ class TestStateSaveFrequency:
         estado = {}
 
         save_calls = []
-        import nfe_sync.consulta as consulta_mod
-        original_salvar = consulta_mod.salvar_estado
+        from nfe_sync.state import EstadoJson
+        original_set = EstadoJson.set_ultimo_nsu
 
-        def track_save(sf, est):
-            save_calls.append(est.get("nsu", {}).copy())
-            original_salvar(sf, est)
+        def track_save(backend, cnpj, nsu, ambiente="producao"):
+            save_calls.append(nsu)
+            original_set(backend, cnpj, nsu, ambiente)
 
-        with patch.object(consulta_mod, "salvar_estado", side_effect=track_save):
+        with patch.object(EstadoJson, "set_ultimo_nsu", autospec=True, side_effect=track_save):
             consultar_nsu(empresa_sul, estado, state_file)
 
-        # Deve ter salvo na página _SALVAR_A_CADA (NSU = _SALVAR_A_CADA) e no cooldown final
-        # Não deve ter salvo nas páginas 1..(_SALVAR_A_CADA - 1)
-        assert len(save_calls) >= 1
+        assert save_calls == [10, 12]
+        assert carregar_estado(state_file)["nsu"][f"{empresa_sul.emitente.cnpj}:homologacao"] == 12
+
+    @patch("nfe_sync.xml_utils.ComunicacaoSefaz")
+    def test_sqlite_salva_toda_pagina(self, mock_sefaz_cls, empresa_sul, tmp_path):
+        """Com backend SQLite (gravação por chave) o NSU é salvo a cada página."""
+        respostas = []
+        for nsu in (1, 2, 3):
+            resp = MagicMock()
+            resp.content = (
+                b'<retDistDFeInt xmlns="http://www.portalfiscal.inf.br/nfe">'
+                b"<cStat>138</cStat><xMotivo>Documento localizado</xMotivo>"
+                + f"<ultNSU>{nsu:015d}</ultNSU><maxNSU>{3:015d}</maxNSU>".encode()
+                + b"</retDistDFeInt>"
+            )
+            respostas.append(resp)
+        mock_sefaz_cls.return_value.consulta_distribuicao.side_effect = respostas
+
+        state_file = str(tmp_path / "state.db")
+        cnpj = empresa_sul.emitente.cnpj
+        gravados = []
+        for pagina in iter_distribuicao(empresa_sul, {}, state_file):
+            # o NSU da página anterior já está no banco quando a próxima chega
+            gravados.append(carregar_estado(state_file).get("nsu", {}).get(f"{cnpj}:homologacao"))
+
+        assert gravados == [None, 1, 2]
+        assert carregar_estado(state_file)["nsu"][f"{cnpj}:homologacao"] == 3
 
 
 class TestProcessarDocsLogging:
@@ -362,6 +536,85 @@ class TestProcessarDocsLogging:
         assert any("000000000000001" in r.message for r in caplog.records)
 
 
+class TestProcessarDocsParalelo:
+    """Descompactacao dos docZip em pool de processos deve ser equivalente a sequencial."""
+
+    @staticmethod
+    def _doc_zip(nsu: int, conteudo: str) -> str:
+        import base64
+        import gzip
+        dados = base64.b64encode(gzip.compress(conteudo.encode())).decode()
+        return f'<docZip NSU="{nsu:015d}" schema="resNFe_v1.01.xsd">{dados}</docZip>'
+
+    def _resposta(self):
+        from lxml import etree
+        docs = []
+        for i in range(1, 7):
+            if i == 4:
+                docs.append(f'<docZip NSU="{i:015d}" schema="resNFe_v1.01.xsd">DADOS_INVALIDOS</docZip>')
+                continue
+            docs.append(self._doc_zip(i, (
+                '<resNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.01">'
+                f"<chNFe>{i:044d}</chNFe><CNPJ>99999999000191</CNPJ></resNFe>"
+            )))
+        return etree.fromstring((
+            '<retDistDFeInt xmlns="http://www.portalfiscal.inf.br/nfe"><cStat>138</cStat>'
+            f'<loteDistDFeInt>{"".join(docs)}</loteDistDFeInt></retDistDFeInt>'
+        ).encode())
+
+    def test_pool_equivale_a_sequencial(self, caplog):
+        from nfe_sync.consulta import _processar_docs, encerrar_pool_descompactacao
+        xml_resp = self._resposta()
+        try:
+            sequencial = _processar_docs(xml_resp, processos=0)
+            with caplog.at_level(logging.WARNING):
+                paralelo = _processar_docs(xml_resp, processos=2)
+        finally:
+            encerrar_pool_descompactacao()
+
+        assert paralelo == sequencial
+        assert [d.nsu for d in paralelo] == [f"{i:015d}" for i in range(1, 7)]
+        assert paralelo[3].erro is not None
+        assert paralelo[0].chave == f"{1:044d}"
+        # traceback do worker e logado pelo processo principal (Issue #1)
+        assert any("000000000000004" in r.message and "Traceback" in r.message for r in caplog.records)
+
+    def test_pool_reaproveitado_ate_mudar_processos(self):
+        from nfe_sync import consulta
+        with patch.object(consulta, "ProcessPoolExecutor") as pool_cls:
+            try:
+                primeiro = consulta._obter_pool(2)
+                assert consulta._obter_pool(2) is primeiro
+                consulta._obter_pool(3)
+            finally:
+                consulta.encerrar_pool_descompactacao()
+        assert [c.kwargs["max_workers"] for c in pool_cls.call_args_list] == [2, 3]
+        primeiro.shutdown.assert_called()
+
+    def test_bytes_originais_preservados(self):
+        """O documento carrega exatamente o XML descompactado — sem pretty-print nem reserializacao."""
+        import base64
+        import gzip
+        from lxml import etree
+        from nfe_sync.consulta import _processar_docs
+        original = (
+            '<?xml version="1.0" encoding="UTF-8"?><resNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.01">'
+            f"<chNFe>{1:044d}</chNFe><xNome>AÇÚCAR &amp; CIA</xNome></resNFe>"
+        ).encode()
+        dados = base64.b64encode(gzip.compress(original)).decode()
+        xml_resp = etree.fromstring((
+            '<retDistDFeInt xmlns="http://www.portalfiscal.inf.br/nfe"><loteDistDFeInt>'
+            f'<docZip NSU="000000000000001" schema="resNFe_v1.01.xsd">{dados}</docZip>'
+            "</loteDistDFeInt></retDistDFeInt>"
+        ).encode())
+
+        [doc] = _processar_docs(xml_resp, processos=0)
+
+        assert doc.erro is None
+        assert doc.xml_bytes == original
+        assert doc.nome == f"{1:044d}.xml"
+
+
 class TestConsultarNsuCstat656:
     """Issue #82: cStat=656 (Consumo Indevido) deve registrar cooldown."""
 
@@ -0,0 +1,287 @@
+"""Testes para disjuntor.py — circuit breaker por autorizador/serviço SEFAZ."""
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+from pynfe.processamento.comunicacao import ComunicacaoSefaz
+
+from nfe_sync.emissao import ComunicacaoSvc
+from nfe_sync.disjuntor import (
+    ABERTO, FECHADO, MEIO_ABERTO, DisjuntorSefaz, chave_servico, configurar_disjuntor, ler_config,
+)
+from nfe_sync.exceptions import NfeConfigError, NfeServicoIndisponivel, NfeValidationError
+from nfe_sync.limitador import LimitadorSefaz, configurar_limitador
+from nfe_sync.state import EstadoSqlite
+from nfe_sync.xml_utils import criar_comunicacao
+
+URL = "https://nfe.svrs.rs.gov.br/ws/NfeAutorizacao/NFeAutorizacao4.asmx"
+CHAVE = "nfe.svrs.rs.gov.br:nfeautorizacao4:producao"
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+def _disjuntor(relogio, backend=None):
+    return DisjuntorSefaz(falhas=3, espera=60, backend=backend, relogio=relogio)
+
+
+class TestDisjuntor:
+    def test_chave_servico(self):
+        assert chave_servico(URL, "producao") == CHAVE
+
+    def test_abre_apos_falhas_consecutivas(self):
+        d = _disjuntor(Relogio())
+        for _ in range(2):
+            d.falha(CHAVE)
+            d.permitir(CHAVE)
+        d.falha(CHAVE)
+        assert d.estado(CHAVE) == ABERTO
+        with pytest.raises(NfeServicoIndisponivel, match="3 falhas seguidas; nova tentativa em 60s"):
+            d.permitir(CHAVE)
+        assert d.rejeitadas == 1
+
+    def test_sucesso_zera_falhas(self):
+        d = _disjuntor(Relogio())
+        d.falha(CHAVE)
+        d.permitir(CHAVE)
+        d.falha(CHAVE)
+        d.sucesso(CHAVE)
+        d.falha(CHAVE)
+        d.falha(CHAVE)
+        assert d.estado(CHAVE) == FECHADO
+
+    def test_meio_aberto_libera_uma_sonda(self):
+        rel = Relogio()
+        d = _disjuntor(rel)
+        for _ in range(3):
+            d.falha(CHAVE)
+        rel.agora += 60
+        assert d.estado(CHAVE) == MEIO_ABERTO
+        d.permitir(CHAVE)  # sonda
+        with pytest.raises(NfeServicoIndisponivel):
+            d.permitir(CHAVE)  # enquanto a sonda não responde
+
+    def test_sonda_com_sucesso_fecha(self):
+        rel = Relogio()
+        d = _disjuntor(rel)
+        for _ in range(3):
+            d.falha(CHAVE)
+        rel.agora += 60
+        d.permitir(CHAVE)
+        d.sucesso(CHAVE)
+        assert d.estado(CHAVE) == FECHADO
+        d.permitir(CHAVE)
+
+    def test_sonda_com_falha_reabre(self):
+        rel = Relogio()
+        d = _disjuntor(rel)
+        for _ in range(3):
+            d.falha(CHAVE)
+        rel.agora += 60
+        d.permitir(CHAVE)
+        d.falha(CHAVE)
+        assert d.estado(CHAVE) == ABERTO
+        rel.agora += 59
+        with pytest.raises(NfeServicoIndisponivel):
+            d.permitir(CHAVE)
+
+    def test_outros_servicos_nao_afetados(self):
+        d = _disjuntor(Relogio())
+        for _ in range(3):
+            d.falha(CHAVE)
+        d.permitir("nfe.svrs.rs.gov.br:nfeautorizacao4:homologacao")
+        d.permitir("nfe.fazenda.sp.gov.br:nfeautorizacao4:producao")
+
+
+class TestPersistencia:
+    def test_processo_seguinte_herda_aberto(self, tmp_path):
+        rel = Relogio()
+        arquivo = str(tmp_path / "estado.db")
+        d1 = _disjuntor(rel, EstadoSqlite(arquivo))
+        for _ in range(3):
+            d1.falha(CHAVE)
+        d2 = _disjuntor(rel, EstadoSqlite(arquivo))
+        with pytest.raises(NfeServicoIndisponivel):
+            d2.permitir(CHAVE)
+
+    def test_uma_sonda_entre_processos(self, tmp_path):
+        rel = Relogio()
+        arquivo = str(tmp_path / "estado.db")
+        d1, d2 = _disjuntor(rel, EstadoSqlite(arquivo)), _disjuntor(rel, EstadoSqlite(arquivo))
+        for _ in range(3):
+            d1.falha(CHAVE)
+        rel.agora += 60
+        d1.permitir(CHAVE)
+        with pytest.raises(NfeServicoIndisponivel):
+            d2.permitir(CHAVE)
+        d1.sucesso(CHAVE)
+        d2.permitir(CHAVE)
+
+    def test_caminho_normal_nao_grava(self, tmp_path):
+        backend = MagicMock()
+        backend.ler.return_value = None
+        d = _disjuntor(Relogio(), backend)
+        for _ in range(10):
+            d.permitir(CHAVE)
+            d.sucesso(CHAVE)
+        backend.atualizar_chave.assert_not_called()
+
+
+class TestConfig:
+    def test_padrao(self):
+        assert ler_config(None) == (5, 60.0)
+
+    def test_env(self, monkeypatch):
+        monkeypatch.setenv("NFE_SYNC_DISJUNTOR", "2/30")
+        d = DisjuntorSefaz()
+        assert (d.falhas, d.espera) == (2, 30.0)
+
+    @pytest.mark.parametrize("texto", ["5", "a/60", "0/60", "5/0"])
+    def test_invalido(self, texto):
+        with pytest.raises(NfeConfigError, match="NFE_SYNC_DISJUNTOR"):
+            ler_config(texto)
+
+
+@pytest.fixture
+def disjuntor_isolado():
+    rel = Relogio()
+    d = _disjuntor(rel)
+    anterior_d = configurar_disjuntor(d)
+    anterior_l = configurar_limitador(LimitadorSefaz({}))
+    yield d, rel
+    configurar_disjuntor(anterior_d)
+    configurar_limitador(anterior_l)
+
+
+class TestCriarComunicacao:
+    def _con(self, empresa, post):
+        mock_con = MagicMock()
+        mock_con._post = post
+        with patch("nfe_sync.xml_utils.ComunicacaoSefaz", return_value=mock_con):
+            return criar_comunicacao(empresa)
+
+    def test_falha_rapido_apos_timeouts(self, empresa_sul, disjuntor_isolado):
+        post = MagicMock(side_effect=requests.Timeout("30s"))
+        con = self._con(empresa_sul, post)
+        for _ in range(3):
+            with pytest.raises(requests.Timeout):
+                con._post(URL, "<xml/>")
+        with pytest.raises(NfeServicoIndisponivel):
+            con._post(URL, "<xml/>")
+        assert post.call_count == 3
+
+    def test_servico_paralisado_conta_como_falha(self, empresa_sul, disjuntor_isolado):
+        d, _ = disjuntor_isolado
+        resp = MagicMock(status_code=200, content=b"<ret><cStat>108</cStat></ret>")
+        con = self._con(empresa_sul, MagicMock(return_value=resp))
+        for _ in range(3):
+            assert con._post(URL, "<xml/>") is resp
+        ambiente = "homologacao" if empresa_sul.homologacao else "producao"
+        assert d.aberto(chave_servico(URL, ambiente))
+
+    def test_erro_permanente_nao_conta(self, empresa_sul, disjuntor_isolado):
+        post = MagicMock(side_effect=requests.exceptions.SSLError("cert"))
+        con = self._con(empresa_sul, post)
+        for _ in range(5):
+            with pytest.raises(requests.exceptions.SSLError):
+                con._post(URL, "<xml/>")
+        assert post.call_count == 5
+
+
+@pytest.fixture
+def empresa_sp(empresa_sul, dados_emissao_padrao):
+    emitente = empresa_sul.emitente.model_copy(update={
+        "razao_social": "EMPRESA TESTE", "inscricao_estadual": "111111111111",
+        "endereco": dados_emissao_padrao.destinatario.endereco,
+    })
+    return empresa_sul.model_copy(update={"emitente": emitente})
+
+
+class TestEmissaoContingencia:
+    def _emitir(self, empresa, dados, contingencia, **kw):
+        from nfe_sync.emissao import emitir
+        assinatura = MagicMock()
+        assinatura.assinar.side_effect = lambda xml: xml
+        con = MagicMock()
+        con.autorizacao.return_value = (1, MagicMock(content=b"<ret><cStat>999</cStat></ret>"))
+        with patch("nfe_sync.emissao.assinador", return_value=assinatura), \
+             patch("nfe_sync.emissao.criar_comunicacao", return_value=con) as criar:
+            resultado = emitir(empresa, "1", 1, dados, contingencia=contingencia, **kw)
+        return resultado, con, criar
+
+    def _abrir(self, d, empresa):
+        from nfe_sync.emissao import url_autorizacao
+        url = url_autorizacao(empresa.uf, empresa.homologacao)
+        for _ in range(3):
+            d.falha(chave_servico(url, "homologacao" if empresa.homologacao else "producao"))
+
+    def test_disjuntor_fechado_emite_normal(self, empresa_sp, dados_emissao_padrao, disjuntor_isolado):
+        resultado, con, criar = self._emitir(empresa_sp, dados_emissao_padrao, "SEFAZ SP FORA DO AR HA 10 MIN")
+        assert resultado.contingencia is None
+        assert con.autorizacao.call_args.kwargs["contingencia"] is False
+
+    def test_disjuntor_aberto_emite_em_svc(self, empresa_sp, dados_emissao_padrao, disjuntor_isolado):
+        d, _ = disjuntor_isolado
+        self._abrir(d, empresa_sp)
+        resultado, con, criar = self._emitir(empresa_sp, dados_emissao_padrao, "SEFAZ SP FORA DO AR HA 10 MIN")
+        assert resultado.contingencia == "SVC-AN"  # SP → SVC-AN
+        kwargs = con.autorizacao.call_args.kwargs
+        assert kwargs["contingencia"] is True
+        assert criar.call_args.kwargs["classe"] is ComunicacaoSvc
+        # o pynfe monta o NFe com xmlns como atributo: filhos sem namespace
+        nfe = kwargs["nota_fiscal"]
+        assert nfe.findtext(".//ide/tpEmis") == "6"
+        assert nfe.findtext(".//ide/xJust") == "SEFAZ SP FORA DO AR HA 10 MIN"
+        assert nfe.findtext(".//ide/dhCont")
+        assert nfe.find(".//infNFe").get("Id")[3:][34] == "6"  # tpEmis também na chave
+
+    def test_forcar_ignora_disjuntor(self, empresa_sp, dados_emissao_padrao, disjuntor_isolado):
+        resultado, con, criar = self._emitir(
+            empresa_sp, dados_emissao_padrao, "SEFAZ SP FORA DO AR HA 10 MIN", forcar_contingencia=True,
+        )
+        assert resultado.contingencia == "SVC-AN"
+        assert con.autorizacao.call_args.kwargs["contingencia"] is True
+
+    def test_forcar_exige_justificativa(self, empresa_sp, dados_emissao_padrao):
+        from nfe_sync.emissao import emitir
+        with pytest.raises(NfeValidationError, match="exige justificativa"):
+            emitir(empresa_sp, "1", 1, dados_emissao_padrao, forcar_contingencia=True)
+
+    def test_justificativa_curta(self, empresa_sp, dados_emissao_padrao):
+        from nfe_sync.emissao import emitir
+        with pytest.raises(NfeValidationError, match="15 e 256"):
+            emitir(empresa_sp, "1", 1, dados_emissao_padrao, contingencia="curta")
+
+    @pytest.mark.parametrize("uf,svc", [
+        ("pr", "SVC-RS"), ("ba", "SVC-RS"), ("ce", "SVC-RS"), ("sp", "SVC-AN"), ("rj", "SVC-AN"),
+    ])
+    def test_svc_da_uf(self, uf, svc):
+        from nfe_sync.emissao import svc_da_uf
+        assert svc_da_uf(uf) == svc
+
+    @pytest.mark.parametrize("uf", [
+        "AC", "AL", "AM", "AP", "BA", "CE", "DF", "ES", "GO", "MA", "MG", "MS", "MT", "PA",
+        "PB", "PE", "PI", "PR", "RJ", "RN", "RO", "RR", "RS", "SC", "SE", "SP", "TO",
+    ])
+    @pytest.mark.parametrize("homologacao", [True, False])
+    def test_url_de_autorizacao_igual_a_do_pynfe(self, uf, homologacao):
+        # a chave do disjuntor tem de ser a mesma URL em que o pynfe envia a NF-e
+        from nfe_sync.emissao import url_autorizacao
+        esperada = ComunicacaoSefaz(uf, None, None, homologacao)._get_url("nfe", "AUTORIZACAO")
+        assert url_autorizacao(uf.lower(), homologacao) == esperada
+
+    @pytest.mark.parametrize("uf,homologacao,inicio", [
+        ("SP", True, "https://hom.svc.fazenda.gov.br/"),
+        ("SP", False, "https://www.svc.fazenda.gov.br/"),
+        ("CE", True, "https://nfe-homologacao.svrs.rs.gov.br/"),
+        ("PR", False, "https://nfe.svrs.rs.gov.br/"),
+    ])
+    def test_url_de_autorizacao_em_contingencia(self, uf, homologacao, inicio):
+        con = ComunicacaoSvc(uf, None, None, homologacao)
+        assert con._get_url("nfe", "AUTORIZACAO", contingencia=True).startswith(inicio)
+        assert con._get_url("nfe", "AUTORIZACAO") == ComunicacaoSefaz(uf, None, None, homologacao)._get_url("nfe", "AUTORIZACAO")
@@ -0,0 +1,89 @@
+import contextvars
+import threading
+
+import pytest
+
+from nfe_sync.gravacao import GravadorSegundoPlano
+
+
+class TestGravadorSegundoPlano:
+    def test_executa_na_ordem_de_envio(self):
+        feitos = []
+        with GravadorSegundoPlano() as gravador:
+            for i in range(20):
+                gravador.enviar(feitos.append, i)
+        assert feitos == list(range(20))
+
+    def test_executa_fora_da_thread_principal(self):
+        threads = []
+        with GravadorSegundoPlano() as gravador:
+            gravador.enviar(lambda: threads.append(threading.current_thread()))
+        assert threads and threads[0] is not threading.main_thread()
+
+    def test_aguardar_espera_pendentes(self):
+        liberar = threading.Event()
+        feitos = []
+
+        def lento():
+            liberar.wait(5)
+            feitos.append("lento")
+
+        with GravadorSegundoPlano() as gravador:
+            gravador.enviar(lento)
+            assert feitos == []
+            liberar.set()
+            gravador.aguardar()
+            assert feitos == ["lento"]
+
+    def test_enviar_bloqueia_com_fila_cheia(self):
+        liberar = threading.Event()
+        gravador = GravadorSegundoPlano(pendentes=1)
+        gravador.enviar(liberar.wait, 5)   # em execução
+        gravador.enviar(lambda: None)      # ocupa a fila
+        enviado = threading.Event()
+
+        def produtor():
+            gravador.enviar(lambda: None)
+            enviado.set()
+
+        t = threading.Thread(target=produtor)
+        t.start()
+        assert not enviado.wait(0.2)
+        liberar.set()
+        assert enviado.wait(5)
+        t.join()
+        gravador.fechar()
+
+    def test_erro_relancado_e_descarta_seguintes(self):
+        feitos = []
+
+        def falha():
+            raise OSError("disco cheio")
+
+        gravador = GravadorSegundoPlano()
+        gravador.enviar(falha)
+        gravador.enviar(feitos.append, 1)
+        with pytest.raises(OSError, match="disco cheio"):
+            gravador.aguardar()
+        with pytest.raises(OSError):
+            gravador.enviar(feitos.append, 2)
+        gravador.fechar()
+        assert feitos == []
+
+    def test_saida_do_with_relanca_erro(self):
+        def falha():
+            raise OSError("sem permissao")
+
+        with pytest.raises(OSError, match="sem permissao"):
+            with GravadorSegundoPlano() as gravador:
+                gravador.enviar(falha)
+
+    def test_tarefa_roda_no_contexto_de_quem_enviou(self):
+        var = contextvars.ContextVar("var", default="padrao")
+        vistos = []
+        with GravadorSegundoPlano() as gravador:
+            token = var.set("worker")
+            gravador.enviar(lambda: vistos.append(var.get()))
+            var.reset(token)
+            gravador.enviar(lambda: vistos.append(var.get()))
+        assert vistos == ["worker", "padrao"]
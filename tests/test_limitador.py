@@ -0,0 +1,183 @@
+"""Testes para limitador.py — token bucket por serviço/CNPJ/ambiente."""
+import asyncio
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from nfe_sync.exceptions import NfeConfigError
+from nfe_sync.limitador import (
+    LIMITES_PADRAO, Limite, LimitadorSefaz, configurar_limitador, ler_limites, servico_da_url,
+)
+from nfe_sync.state import EstadoJson, EstadoSqlite
+from nfe_sync.xml_utils import criar_comunicacao
+
+CNPJ = "99999999000191"
+DIST = "nfedistribuicaodfe"
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+        self.esperas = []
+
+    def __call__(self):
+        return self.agora
+
+    def dormir(self, segundos):
+        self.esperas.append(segundos)
+        self.agora += segundos
+
+
+def _limitador(relogio, backend=None, limite=Limite(3, 3)):
+    return LimitadorSefaz({"*": limite}, backend=backend, relogio=relogio, dormir=relogio.dormir)
+
+
+class TestTokenBucket:
+    def test_rajada_ate_capacidade_sem_espera(self):
+        rel = Relogio()
+        lim = _limitador(rel)
+        assert [lim.aguardar(DIST, CNPJ, "producao") for _ in range(3)] == [0, 0, 0]
+        assert rel.esperas == []
+
+    def test_excesso_espera_reposicao(self):
+        rel = Relogio()
+        lim = _limitador(rel)
+        for _ in range(3):
+            lim.aguardar(DIST, CNPJ, "producao")
+        assert lim.aguardar(DIST, CNPJ, "producao") == pytest.approx(1.0)
+        assert lim.aguardar(DIST, CNPJ, "producao") == pytest.approx(1.0)
+        assert lim.espera_total == pytest.approx(2.0)
+
+    def test_reservas_concorrentes_saem_em_fila(self):
+        """Sem dormir entre reservas, cada uma espera uma ficha a mais."""
+        rel = Relogio()
+        lim = _limitador(rel)
+        esperas = [lim.reservar(DIST, CNPJ, "producao") for _ in range(5)]
+        assert esperas == pytest.approx([0, 0, 0, 1.0, 2.0])
+
+    def test_reposicao_limitada_a_capacidade(self):
+        rel = Relogio()
+        lim = _limitador(rel)
+        lim.aguardar(DIST, CNPJ, "producao")
+        rel.agora += 3600
+        esperas = [lim.reservar(DIST, CNPJ, "producao") for _ in range(4)]
+        assert esperas == pytest.approx([0, 0, 0, 1.0])
+
+    def test_baldes_independentes(self):
+        rel = Relogio()
+        lim = _limitador(rel, limite=Limite(1, 60))
+        assert lim.reservar(DIST, CNPJ, "producao") == 0
+        assert lim.reservar(DIST, CNPJ, "homologacao") == 0
+        assert lim.reservar(DIST, "11111111000111", "producao") == 0
+        assert lim.reservar("nfeconsultaprotocolo4", CNPJ, "producao") == 0
+        assert lim.reservar(DIST, CNPJ, "producao") == pytest.approx(60.0)
+
+    def test_limite_por_trecho_do_servico(self):
+        lim = LimitadorSefaz(dict(LIMITES_PADRAO))
+        assert lim.limite("nfeconsultaprotocolo4") == LIMITES_PADRAO["nfeconsulta"]
+        assert lim.limite("recepcaoevento4") == LIMITES_PADRAO["recepcaoevento"]
+        assert lim.limite("nfeinutilizacao4") == LIMITES_PADRAO["*"]
+
+    def test_sem_limite_nao_espera(self):
+        lim = LimitadorSefaz({})
+        assert [lim.reservar(DIST, CNPJ, "producao") for _ in range(100)] == [0.0] * 100
+
+
+class TestCompartilhado:
+    """Baldes no EstadoBackend valem para todas as instâncias (processos) que o usam."""
+
+    @pytest.mark.parametrize("backend_cls,arquivo", [(EstadoSqlite, "estado.db"), (EstadoJson, "estado.json")])
+    def test_duas_instancias_dividem_o_balde(self, tmp_path, backend_cls, arquivo):
+        rel = Relogio()
+        backend = backend_cls(str(tmp_path / arquivo))
+        a, b = _limitador(rel, backend), _limitador(rel, backend_cls(str(tmp_path / arquivo)))
+        esperas = [a.reservar(DIST, CNPJ, "producao"), b.reservar(DIST, CNPJ, "producao"),
+                   a.reservar(DIST, CNPJ, "producao"), b.reservar(DIST, CNPJ, "producao")]
+        assert esperas == pytest.approx([0, 0, 0, 1.0])
+        assert backend.ler("limite", f"{DIST}:{CNPJ}:producao")["fichas"] == pytest.approx(-1.0)
+
+    def test_threads_nao_perdem_reservas(self, tmp_path):
+        rel = Relogio()
+        lim = _limitador(rel, EstadoSqlite(str(tmp_path / "estado.db")), limite=Limite(10, 10))
+        esperas = []
+        lock = threading.Lock()
+
+        def _worker():
+            for _ in range(5):
+                espera = lim.reservar(DIST, CNPJ, "producao")
+                with lock:
+                    esperas.append(espera)
+
+        threads = [threading.Thread(target=_worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # 20 reservas, 10 fichas: as 10 excedentes esperam 1s, 2s, ..., 10s
+        assert sorted(esperas) == pytest.approx([0] * 10 + list(range(1, 11)))
+
+    def test_aguardar_async_reserva_fora_do_event_loop(self, tmp_path):
+        rel = Relogio()
+        lim = _limitador(rel, EstadoSqlite(str(tmp_path / "estado.db")))
+        threads = []
+        reservar = lim.reservar
+
+        def _reservar(*args):
+            threads.append(threading.current_thread())
+            return reservar(*args)
+
+        lim.reservar = _reservar
+        assert asyncio.run(lim.aguardar_async(DIST, CNPJ, "producao")) == 0
+        assert threads and threads[0] is not threading.main_thread()
+
+
+class TestConfiguracao:
+    def test_ler_limites_sobrescreve_padrao(self):
+        limites = ler_limites("NFeDistribuicaoDFe=10/60, *=30/120")
+        assert limites["nfedistribuicaodfe"] == Limite(10, 60)
+        assert limites["*"] == Limite(30, 120)
+        assert limites["recepcaoevento"] == LIMITES_PADRAO["recepcaoevento"]
+
+    def test_ler_limites_vazio_e_padrao(self):
+        assert ler_limites(None) == LIMITES_PADRAO
+        assert ler_limites("") == LIMITES_PADRAO
+
+    @pytest.mark.parametrize("texto", ["dist=10", "dist=a/60", "dist=0/60", "dist=10/0"])
+    def test_ler_limites_invalido(self, texto):
+        with pytest.raises(NfeConfigError, match="NFE_SYNC_LIMITES"):
+            ler_limites(texto)
+
+    def test_env(self, monkeypatch):
+        monkeypatch.setenv("NFE_SYNC_LIMITES", "nfeconsulta=5/10")
+        assert LimitadorSefaz().limite("nfeconsultaprotocolo4") == Limite(5, 10)
+
+    @pytest.mark.parametrize("url,servico", [
+        ("https://www1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx", "nfedistribuicaodfe"),
+        ("https://nfe.sefaz.rs.gov.br/ws/NfeConsulta/NfeConsulta4.asmx", "nfeconsulta4"),
+        ("https://nfe.fazenda.sp.gov.br/ws/nferecepcaoevento4.asmx?wsdl", "nferecepcaoevento4"),
+        ("https://nfe.sefa.pr.gov.br/nfe/NFeRecepcaoEvento4", "nferecepcaoevento4"),
+    ])
+    def test_servico_da_url(self, url, servico):
+        assert servico_da_url(url) == servico
+
+
+class TestCriarComunicacaoLimitada:
+    def test_post_passa_pelo_limitador(self, empresa_sul):
+        rel = Relogio()
+        lim = _limitador(rel, limite=Limite(1, 10))
+        mock_con = MagicMock()
+        mock_con._post = MagicMock(return_value="resp")
+        anterior = configurar_limitador(lim)
+        try:
+            with patch("nfe_sync.xml_utils.ComunicacaoSefaz", return_value=mock_con):
+                con = criar_comunicacao(empresa_sul)
+            url = "https://www1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx"
+            assert con._post(url, "<xml/>") == "resp"
+            assert con._post(url, "<xml/>") == "resp"
+        finally:
+            configurar_limitador(anterior)
+
+        assert rel.esperas == pytest.approx([10.0])
+        ambiente = "homologacao" if empresa_sul.homologacao else "producao"
+        assert lim.reservar(DIST, empresa_sul.emitente.cnpj, ambiente) == pytest.approx(10.0)
@@ -1,5 +1,8 @@
 """Testes para log.py — Issue #13 (log cleanup tolerante a erros)."""
+import argparse
+import gzip
 import logging
+import multiprocessing
 import os
 import time
 from datetime import datetime, timedelta
@@ -71,3 +74,183 @@ class TestLimparLogsAntigos:
                 _limpar_logs_antigos()
 
         assert any("antigo1" in r.message for r in caplog.records)
+
+    def test_remove_pasta_de_dia_vencida(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(log_module, "LOG_DIR", str(tmp_path))
+        hoje = _agora_brt()
+        antiga = tmp_path / (hoje - timedelta(days=9)).strftime("%Y%m%d")
+        recente = tmp_path / (hoje - timedelta(days=2)).strftime("%Y%m%d")
+        for pasta in (antiga, recente):
+            pasta.mkdir()
+            (pasta / "dist-dfe-x.xml").write_text("<x/>")
+
+        with patch("os.path.getmtime") as mock_mtime:
+            _limpar_logs_antigos()
+
+        # pastas de dia expiram pelo nome, sem getmtime por arquivo
+        mock_mtime.assert_not_called()
+        assert not antiga.exists()
+        assert recente.exists()
+
+
+class TestSalvarRespostaSefaz:
+    @pytest.fixture(autouse=True)
+    def _log_temporario(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(log_module, "LOG_DIR", str(tmp_path))
+        monkeypatch.setattr(log_module, "_ultima_limpeza", None)
+
+    def test_grava_na_pasta_do_dia(self, tmp_path):
+        arquivo = log_module.salvar_resposta_sefaz("<x/>", "consulta", "chave123")
+        dia = _agora_brt().strftime("%Y%m%d")
+        assert os.path.dirname(arquivo) == os.path.join(str(tmp_path), dia)
+        assert os.path.basename(arquivo).startswith("consulta-chave123-")
+
+    def test_limpeza_no_maximo_uma_vez_por_intervalo(self, monkeypatch):
+        with patch.object(log_module, "_limpar_logs_antigos") as mock_limpar:
+            for i in range(5):
+                log_module.salvar_resposta_sefaz("<x/>", "dist-dfe", str(i))
+            assert mock_limpar.call_count == 1
+
+            monkeypatch.setattr(log_module, "_ultima_limpeza", time.monotonic() - log_module.LOG_LIMPEZA_INTERVALO - 1)
+            log_module.salvar_resposta_sefaz("<x/>", "dist-dfe", "5")
+            assert mock_limpar.call_count == 2
+
+
+class TestLogComprimido:
+    @pytest.fixture(autouse=True)
+    def _log_gzip(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(log_module, "LOG_DIR", str(tmp_path))
+        monkeypatch.setattr(log_module, "LOG_MODO", "gzip")
+        monkeypatch.setattr(log_module, "_ultima_limpeza", None)
+
+    def test_anexa_ao_segmento_do_dia(self, tmp_path):
+        log_module.salvar_resposta_sefaz("<a/>", "dist-dfe", "cnpj-p001")
+        log_module.salvar_resposta_sefaz(b"<b>\xc3\x87</b>", "dist-dfe", "cnpj-p002")
+
+        pasta = tmp_path / _agora_brt().strftime("%Y%m%d")
+        assert sorted(os.listdir(pasta)) == ["respostas.idx", "respostas.seg"]
+        # segmento é uma sequência de membros gzip: zcat devolve tudo
+        assert gzip.decompress((pasta / "respostas.seg").read_bytes()) == "<a/><b>Ç</b>".encode()
+        assert len((pasta / "respostas.idx").read_text().splitlines()) == 2
+
+    def test_buscar_e_ler_por_operacao_e_timestamp(self):
+        log_module.salvar_resposta_sefaz("<a/>", "dist-dfe", "cnpj-p001")
+        log_module.salvar_resposta_sefaz("<b/>", "dist-dfe", "cnpj-p002")
+        log_module.salvar_resposta_sefaz("<c/>", "consulta", "chave")
+        dia = _agora_brt().strftime("%Y%m%d")
+
+        respostas = log_module.buscar_respostas("dist-dfe", dia)
+        assert [r.identificador for r in respostas] == ["cnpj-p001", "cnpj-p002"]
+        (segunda,) = log_module.buscar_respostas("dist-dfe", respostas[1].timestamp, "cnpj-p002")
+        assert log_module.ler_resposta(segunda) == b"<b/>"
+
+    def test_ignora_linha_de_indice_cortada(self, tmp_path):
+        log_module.salvar_resposta_sefaz("<a/>", "consulta", "chave")
+        pasta = tmp_path / _agora_brt().strftime("%Y%m%d")
+        with open(pasta / "respostas.idx", "a") as f:
+            f.write("20250101-000000\tconsulta\tch")  # gravação interrompida
+
+        assert len(log_module.buscar_respostas("consulta", pasta.name)) == 1
+
+    def test_processos_concorrentes_no_mesmo_segmento(self):
+        def gravar(n):
+            for i in range(20):
+                log_module.salvar_resposta_sefaz(f"<p{n}>{i}</p{n}>", "consulta", f"p{n}-{i}")
+
+        ctx = multiprocessing.get_context("fork")
+        processos = [ctx.Process(target=gravar, args=(n,)) for n in range(4)]
+        for p in processos:
+            p.start()
+        for p in processos:
+            p.join()
+
+        respostas = log_module.buscar_respostas("consulta", _agora_brt().strftime("%Y%m%d"))
+        assert len(respostas) == 80
+        for r in respostas:
+            n, i = r.identificador[1:].split("-")
+            assert log_module.ler_resposta(r) == f"<p{n}>{i}</p{n}>".encode()
+
+    def test_le_tambem_xml_solto(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(log_module, "LOG_MODO", "xml")
+        arquivo = log_module.salvar_resposta_sefaz("<x/>", "dist-dfe-chave", "123")
+        (resposta,) = log_module.buscar_respostas("dist-dfe-chave", _agora_brt().strftime("%Y%m%d"))
+        assert resposta.caminho == arquivo
+        assert resposta.identificador == "123"
+        assert log_module.ler_resposta(resposta) == b"<x/>"
+
+    def test_operacao_exata_entre_xml_soltos(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(log_module, "LOG_MODO", "xml")
+        dist = log_module.salvar_resposta_sefaz("<a/>", "dist-dfe", "cnpj-p001")
+        chave = log_module.salvar_resposta_sefaz("<b/>", "dist-dfe-chave", "123")
+        dia = _agora_brt().strftime("%Y%m%d")
+        assert [r.caminho for r in log_module.buscar_respostas("dist-dfe", dia)] == [dist]
+        (resposta,) = log_module.buscar_respostas("dist-dfe-chave", dia)
+        assert (resposta.caminho, resposta.identificador) == (chave, "123")
+
+    def test_modo_invalido(self, monkeypatch):
+        from nfe_sync.exceptions import NfeConfigError
+        monkeypatch.setattr(log_module, "LOG_MODO", "zip")
+        with pytest.raises(NfeConfigError, match="NFE_SYNC_LOG_MODO"):
+            log_module.salvar_resposta_sefaz("<x/>", "consulta")
+
+
+class TestRetencaoPorTamanho:
+    def test_remove_dias_mais_antigos_ate_caber(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(log_module, "LOG_DIR", str(tmp_path))
+        monkeypatch.setattr(log_module, "LOG_TAMANHO_MAXIMO_MB", 1)
+        hoje = _agora_brt()
+        pastas = []
+        for dias in (3, 2, 1, 0):
+            pasta = tmp_path / (hoje - timedelta(days=dias)).strftime("%Y%m%d")
+            pasta.mkdir()
+            (pasta / "respostas.seg").write_bytes(b"x" * 400 * 1024)
+            pastas.append(pasta)
+
+        _limpar_logs_antigos()
+
+        assert [p.exists() for p in pastas] == [False, False, True, True]
+
+    def test_pasta_de_hoje_nunca_sai(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(log_module, "LOG_DIR", str(tmp_path))
+        monkeypatch.setattr(log_module, "LOG_TAMANHO_MAXIMO_MB", 1)
+        pasta = tmp_path / _agora_brt().strftime("%Y%m%d")
+        pasta.mkdir()
+        (pasta / "respostas.seg").write_bytes(b"x" * 2 * 1024 * 1024)
+
+        _limpar_logs_antigos()
+        assert pasta.exists()
+
+
+class TestCmdLogShow:
+    @pytest.fixture(autouse=True)
+    def _log_gzip(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(log_module, "LOG_DIR", str(tmp_path))
+        monkeypatch.setattr(log_module, "LOG_MODO", "gzip")
+        monkeypatch.setattr(log_module, "_ultima_limpeza", None)
+
+    def _args(self, operacao, timestamp, ref=None, saida=None):
+        return argparse.Namespace(operacao=operacao, timestamp=timestamp, ref=ref, saida=saida)
+
+    def test_exibe_resposta(self, capsys):
+        from nfe_sync.commands.sistema import cmd_log_show
+        log_module.salvar_resposta_sefaz("<retConsSitNFe/>", "consulta", "chave")
+        cmd_log_show(self._args("consulta", _agora_brt().strftime("%Y%m%d")))
+        assert "<retConsSitNFe/>" in capsys.readouterr().out
+
+    def test_varias_pede_para_refinar(self, capsys):
+        from nfe_sync.commands.sistema import cmd_log_show
+        log_module.salvar_resposta_sefaz("<a/>", "dist-dfe", "cnpj-p001")
+        log_module.salvar_resposta_sefaz("<b/>", "dist-dfe", "cnpj-p002")
+        dia = _agora_brt().strftime("%Y%m%d")
+        with pytest.raises(SystemExit):
+            cmd_log_show(self._args("dist-dfe", dia))
+        assert "cnpj-p002" in capsys.readouterr().out
+
+        cmd_log_show(self._args("dist-dfe", dia, ref="cnpj-p002"))
+        assert "<b/>" in capsys.readouterr().out
+
+    def test_nao_encontrada(self, capsys):
+        from nfe_sync.commands.sistema import cmd_log_show
+        with pytest.raises(SystemExit):
+            cmd_log_show(self._args("consulta", "20200101"))
+        assert "Nenhuma resposta" in capsys.readouterr().out
@@ -26,3 +26,112 @@ class TestManifestarValidacao:
         assert "confirmacao" in OPERACOES
         assert "desconhecimento" in OPERACOES
         assert "nao_realizada" in OPERACOES
+
+
+def _chaves(n: int) -> list[str]:
+    return [f"35{i:042d}" for i in range(1, n + 1)]
+
+
+def _ret_env_evento(chaves: list[str], status: str = "135") -> tuple:
+    from lxml import etree
+    rets = "".join(
+        f"<retEvento><infEvento><cStat>{status}</cStat><xMotivo>Evento registrado</xMotivo>"
+        f"<chNFe>{c}</chNFe><nProt>8{c[-14:]}</nProt></infEvento></retEvento>"
+        for c in chaves
+    )
+    xml = (
+        '<retEnvEvento xmlns="http://www.portalfiscal.inf.br/nfe"><cStat>128</cStat>'
+        f"<xMotivo>Lote de evento processado</xMotivo>{rets}</retEnvEvento>"
+    )
+    return etree.fromstring(xml.encode()), xml
+
+
+class TestManifestarLote:
+    """Eventos agrupados em envEvento de ate 20, enviados em paralelo, resultado por chave."""
+
+    @pytest.fixture
+    def envios(self):
+        """Patcha assinatura e envio; devolve a lista de (id_lote, chaves) recebidos pela SEFAZ fake."""
+        from unittest.mock import patch, MagicMock
+        from nfe_sync.xpaths import extrair_campos_documento
+        recebidos = []
+
+        def fake_chamar_sefaz(empresa, fn, eventos, id_lote, cert_path=None):
+            chaves = [extrair_campos_documento(ev)["chNFe"] for ev in eventos]
+            recebidos.append((id_lote, chaves))
+            return _ret_env_evento(chaves)
+
+        assinatura = MagicMock()
+        assinatura.assinar.side_effect = lambda xml: xml
+        with patch("nfe_sync.manifestacao.assinador", return_value=assinatura), \
+             patch("nfe_sync.manifestacao.chamar_sefaz", side_effect=fake_chamar_sefaz):
+            yield recebidos
+
+    def test_agrupa_em_lotes_de_20(self, empresa_sul, envios):
+        from nfe_sync.manifestacao import manifestar_lote
+        chaves = _chaves(45)
+        resultado = manifestar_lote(empresa_sul, "ciencia", chaves, paralelo=3)
+
+        assert sorted(len(c) for _, c in envios) == [5, 20, 20]
+        assert sorted(i for i, _ in envios) == [1, 2, 3]
+        assert [item.chave for item in resultado.itens] == chaves
+        assert all(item.status == "135" and item.protocolo for item in resultado.itens)
+        assert [item.lote for item in resultado.itens] == [1] * 20 + [2] * 20 + [3] * 5
+        assert len(resultado.xmls_resposta) == 3
+
+    def test_chaves_repetidas_enviadas_uma_vez(self, empresa_sul, envios):
+        from nfe_sync.manifestacao import manifestar_lote
+        chave = _chaves(1)[0]
+        resultado = manifestar_lote(empresa_sul, "ciencia", [chave, chave])
+        assert envios == [(1, [chave])]
+        assert len(resultado.itens) == 1
+
+    def test_chave_invalida_antes_de_enviar(self, empresa_sul, envios):
+        from nfe_sync.manifestacao import manifestar_lote
+        with pytest.raises(NfeValidationError, match="44 digitos"):
+            manifestar_lote(empresa_sul, "ciencia", _chaves(3) + ["123"])
+        assert envios == []
+
+    def test_falha_de_um_lote_nao_interrompe_os_demais(self, empresa_sul):
+        from unittest.mock import patch, MagicMock
+        from nfe_sync.manifestacao import manifestar_lote
+        from nfe_sync.xpaths import extrair_campos_documento
+
+        def fake_chamar_sefaz(empresa, fn, eventos, id_lote, cert_path=None):
+            if id_lote == 2:
+                raise ConnectionError("timeout")
+            return _ret_env_evento([extrair_campos_documento(ev)["chNFe"] for ev in eventos])
+
+        assinatura = MagicMock()
+        assinatura.assinar.side_effect = lambda xml: xml
+        with patch("nfe_sync.manifestacao.assinador", return_value=assinatura), \
+             patch("nfe_sync.manifestacao.chamar_sefaz", side_effect=fake_chamar_sefaz):
+            resultado = manifestar_lote(empresa_sul, "ciencia", _chaves(25))
+
+        assert [i.erro for i in resultado.itens[:20]] == [None] * 20
+        assert all(i.erro == "timeout" and i.lote == 2 for i in resultado.itens[20:])
+
+    def test_lote_rejeitado_sem_ret_evento(self, empresa_sul):
+        from lxml import etree
+        from nfe_sync.manifestacao import _itens_da_resposta
+        xml = etree.fromstring(
+            b'<retEnvEvento xmlns="http://www.portalfiscal.inf.br/nfe">'
+            b"<cStat>215</cStat><xMotivo>Rejeicao: Falha no schema XML</xMotivo></retEnvEvento>"
+        )
+        itens = _itens_da_resposta(xml, _chaves(2), 7)
+        assert [(i.status, i.motivo, i.lote) for i in itens] == [("215", "Rejeicao: Falha no schema XML", 7)] * 2
+
+    def test_env_evento_com_varios_eventos(self):
+        from unittest.mock import MagicMock
+        from lxml import etree
+        from nfe_sync.manifestacao import _enviar_env_evento
+        con = MagicMock()
+        con._construir_xml_soap.side_effect = lambda metodo, raiz: raiz
+        eventos = [etree.fromstring(f'<evento xmlns="http://www.portalfiscal.inf.br/nfe" n="{i}"/>'.encode()) for i in range(3)]
+
+        _enviar_env_evento(con, eventos, 9)
+
+        con._get_url_an.assert_called_once_with(consulta="EVENTOS")
+        raiz = con._post.call_args[0][1]
+        assert raiz.findtext("{*}idLote") == "9"
+        assert len(raiz.findall("{*}evento")) == 3
@@ -89,13 +89,19 @@ class TestCertificadoCertPath:
             assert os.path.exists(path)
             assert open(path, "rb").read() == conteudo
 
-    def test_cert_path_temp_file_removido_ao_sair(self):
-        """Certificado com conteudo: tempfile é removido ao sair do context manager."""
+    def test_cert_path_conteudo_reaproveitado_e_apagado_na_limpeza(self):
+        """Certificado com conteudo: mesmo arquivo privado entre chamadas; limpar_certificados() o remove."""
         import os
+        import stat
+        from nfe_sync.certificado import limpar_certificados
         from nfe_sync.models import Certificado
         cert = Certificado(path="", senha="123", conteudo=b"cert-bytes")
         with cert.cert_path() as path:
             temp_path = path
+        with cert.cert_path() as path:
+            assert path == temp_path
+        assert stat.S_IMODE(os.stat(temp_path).st_mode) == 0o600
+        limpar_certificados()
         assert not os.path.exists(temp_path)
 
     def test_cert_path_com_arquivo_nao_cria_tempfile(self, tmp_path):
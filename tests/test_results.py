@@ -31,6 +31,12 @@ class TestDocumento:
         assert doc.xml is None
         assert doc.chave is None
 
+    def test_conteudo_prefere_bytes_originais(self):
+        doc = Documento(nsu="003", schema="resNFe_v1.01.xsd", xml_bytes=b"<resNFe/>")
+        assert doc.xml is None
+        assert doc.conteudo == b"<resNFe/>"
+        assert Documento(nsu="004", schema="x", xml="<procNFe/>").conteudo == "<procNFe/>"
+
     def test_frozen_impede_atribuicao(self):
         doc = Documento(nsu="001", schema="x")
         with pytest.raises(FrozenInstanceError):
@@ -0,0 +1,68 @@
+"""Testes para retentativa.py — classificação de falhas transitórias."""
+import pytest
+import requests
+from unittest.mock import MagicMock
+
+from nfe_sync.exceptions import NfeValidationError
+from nfe_sync.retentativa import OrcamentoRetentativas, erro_transitorio, resposta_transitoria
+
+
+def _http_error(status):
+    resp = requests.Response()
+    resp.status_code = status
+    return requests.HTTPError(response=resp)
+
+
+class TestErroTransitorio:
+    @pytest.mark.parametrize("exc", [
+        requests.Timeout(), requests.ConnectTimeout(), requests.ConnectionError(),
+        ConnectionResetError(), TimeoutError(), _http_error(500), _http_error(503),
+    ])
+    def test_transitorios(self, exc):
+        assert erro_transitorio(exc)
+
+    @pytest.mark.parametrize("exc", [
+        NfeValidationError("x"), ValueError(), KeyError(), requests.exceptions.SSLError(),
+        _http_error(400), _http_error(403), requests.HTTPError(),
+    ])
+    def test_permanentes(self, exc):
+        assert not erro_transitorio(exc)
+
+
+class TestRespostaTransitoria:
+    def test_http_5xx(self):
+        assert resposta_transitoria(MagicMock(status_code=502, content=b"")) == "HTTP 502"
+
+    @pytest.mark.parametrize("cstat", ["108", "109"])
+    def test_servico_paralisado(self, cstat):
+        xml = f'<soap:Body><retConsSitNFe xmlns="x"><cStat>{cstat}</cStat></retConsSitNFe></soap:Body>'
+        assert resposta_transitoria(MagicMock(status_code=200, content=xml.encode())) == f"cStat {cstat}"
+
+    def test_cstat_com_prefixo_e_bytes_diretos(self):
+        assert resposta_transitoria(b"<nfe:ret><nfe:cStat>108</nfe:cStat></nfe:ret>") == "cStat 108"
+
+    def test_so_o_primeiro_cstat_conta(self):
+        """cStat 108 de um retEvento interno não torna o lote (128) transitório."""
+        xml = b"<retEnvEvento><cStat>128</cStat><retEvento><cStat>108</cStat></retEvento></retEnvEvento>"
+        assert resposta_transitoria(xml) is None
+
+    @pytest.mark.parametrize("conteudo", [b"<ret><cStat>138</cStat></ret>", b"", "<ret/>"])
+    def test_normais(self, conteudo):
+        assert resposta_transitoria(conteudo) is None
+
+
+class TestOrcamento:
+    def test_reserva_e_proporcao(self):
+        orc = OrcamentoRetentativas(proporcao=0.25, reserva=1)
+        assert orc.retirar()
+        assert not orc.retirar()
+        for _ in range(4):
+            orc.depositar()
+        assert orc.retirar()
+        assert not orc.retirar()
+
+    def test_saldo_limitado_a_reserva(self):
+        orc = OrcamentoRetentativas(proporcao=1, reserva=2)
+        for _ in range(10):
+            orc.depositar()
+        assert orc.saldo == 2
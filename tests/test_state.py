@@ -1,8 +1,13 @@
 import json
 import pytest
 from nfe_sync.state import (
+    EstadoJson,
+    EstadoSqlite,
+    abrir_estado,
+    migrar_estado_json,
     carregar_estado,
     salvar_estado,
+    atualizar_estado,
     get_ultimo_numero_nf,
     set_ultimo_numero_nf,
     get_cooldown,
@@ -65,6 +70,38 @@ class TestSalvarEstado:
         assert "v" in resultado
 
 
+class TestAtualizarEstado:
+    def test_arquivo_inexistente_cria(self, tmp_path):
+        f = str(tmp_path / "state.json")
+        atualizar_estado(f, lambda e: set_ultimo_nsu(e, "111", 10))
+        assert get_ultimo_nsu(carregar_estado(f), "111") == 10
+
+    def test_preserva_chaves_gravadas_por_outro_processo(self, tmp_path):
+        f = str(tmp_path / "state.json")
+        salvar_estado(f, {"nsu": {"222:producao": 20}})
+        atualizar_estado(f, lambda e: set_ultimo_nsu(e, "111", 10))
+        estado = carregar_estado(f)
+        assert get_ultimo_nsu(estado, "111") == 10
+        assert get_ultimo_nsu(estado, "222") == 20
+
+    def test_threads_concorrentes_nao_perdem_atualizacoes(self, tmp_path):
+        import threading
+        f = str(tmp_path / "state.json")
+
+        def atualizar(i):
+            for nsu in range(1, 6):
+                atualizar_estado(f, lambda e: set_ultimo_nsu(e, f"{i:03d}", nsu))
+
+        threads = [threading.Thread(target=atualizar, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        estado = carregar_estado(f)
+        assert all(get_ultimo_nsu(estado, f"{i:03d}") == 5 for i in range(8))
+
+
 class TestNumeracao:
     def test_get_inexistente(self):
         assert get_ultimo_numero_nf({}, "123", "1") == 0
@@ -167,3 +204,91 @@ class TestNsu:
         """Issue #57: chave nova (cnpj:ambiente) prevalece sobre legada."""
         estado = {"nsu": {"123": 4059, "123:producao": 5000}}
         assert get_ultimo_nsu(estado, "123", "producao") == 5000
+
+
+class TestEstadoSqlite:
+    def test_carregar_e_salvar_pelas_funcoes_de_modulo(self, tmp_path):
+        f = str(tmp_path / "state.db")
+        assert carregar_estado(f) == {}
+        estado = {"nsu": {"123:producao": 42}, "cooldown": {"123:producao": "2026-02-26T18:00:00"}}
+        salvar_estado(f, estado)
+        assert carregar_estado(f) == estado
+
+    def test_abrir_estado_escolhe_backend_pela_extensao(self, tmp_path):
+        assert isinstance(abrir_estado(str(tmp_path / "s.db")), EstadoSqlite)
+        assert isinstance(abrir_estado(str(tmp_path / "s.sqlite")), EstadoSqlite)
+        assert isinstance(abrir_estado(str(tmp_path / "s.json")), EstadoJson)
+
+    def test_modo_wal(self, tmp_path):
+        import sqlite3
+        f = str(tmp_path / "state.db")
+        EstadoSqlite(f).set_ultimo_nsu("123", 1)
+        con = sqlite3.connect(f)
+        assert con.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        con.close()
+
+    def test_metodos_por_chave(self, tmp_path):
+        backend = EstadoSqlite(str(tmp_path / "state.db"))
+        backend.set_ultimo_nsu("123", 4059, "producao")
+        backend.set_ultimo_numero_nf("123", "1", 7, "homologacao")
+        backend.set_cooldown("123", "2026-02-26T18:00:00", "producao")
+        assert backend.get_ultimo_nsu("123", "producao") == 4059
+        assert backend.get_ultimo_nsu("123", "homologacao") == 0
+        assert backend.get_ultimo_numero_nf("123", "1", "homologacao") == 7
+        assert backend.get_cooldown("123", "producao") == "2026-02-26T18:00:00"
+        backend.limpar_cooldown("123", "producao")
+        assert backend.get_cooldown("123", "producao") is None
+        # mesmo layout do dict usado pelas funções get_*/set_*
+        estado = backend.carregar()
+        assert get_ultimo_nsu(estado, "123", "producao") == 4059
+        assert get_ultimo_numero_nf(estado, "123", "1", "homologacao") == 7
+
+    def test_atualizar_chave_atomico_entre_threads(self, tmp_path):
+        import threading
+        backend = EstadoSqlite(str(tmp_path / "state.db"))
+
+        def incrementar():
+            for _ in range(20):
+                backend.atualizar_chave("numeracao", "123:1:producao", lambda v: (v or 0) + 1)
+
+        threads = [threading.Thread(target=incrementar) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert backend.get_ultimo_numero_nf("123", "1", "producao") == 100
+
+    def test_atualizar_chave_funciona_tambem_no_json(self, tmp_path):
+        backend = EstadoJson(str(tmp_path / "state.json"))
+        backend.atualizar_chave("nsu", "123:producao", lambda v: (v or 0) + 5)
+        backend.atualizar_chave("nsu", "123:producao", lambda v: (v or 0) + 5)
+        assert backend.get_ultimo_nsu("123", "producao") == 10
+
+
+class TestMigrarEstadoJson:
+    def test_migra_e_renomeia_original(self, tmp_path):
+        origem = tmp_path / "state.json"
+        estado = {"nsu": {"123:producao": 10, "456:producao": 20}, "numeracao": {"123:1:producao": 3}}
+        salvar_estado(str(origem), estado)
+
+        total = migrar_estado_json(str(origem), str(tmp_path / "state.db"))
+
+        assert total == 3
+        assert carregar_estado(str(tmp_path / "state.db")) == estado
+        assert not origem.exists()
+        assert (tmp_path / "state.json.migrado").exists()
+
+    def test_recusa_destino_com_estado(self, tmp_path):
+        origem = str(tmp_path / "state.json")
+        destino = str(tmp_path / "state.db")
+        salvar_estado(origem, {"nsu": {"123:producao": 10}})
+        salvar_estado(destino, {"nsu": {"123:producao": 99}})
+
+        with pytest.raises(ValueError, match="ja contem estado"):
+            migrar_estado_json(origem, destino)
+        assert carregar_estado(destino)["nsu"]["123:producao"] == 99
+
+    def test_origem_inexistente(self, tmp_path):
+        with pytest.raises(ValueError, match="nao encontrado"):
+            migrar_estado_json(str(tmp_path / "nao_existe.json"), str(tmp_path / "state.db"))
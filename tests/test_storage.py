@@ -1,9 +1,12 @@
 """Testes para storage.py — Issue #26."""
 import logging
+import multiprocessing
+import os
 import pytest
 from unittest.mock import patch, MagicMock
 
-from nfe_sync.storage import DocumentoStorage
+from nfe_sync.exceptions import NfeConfigError
+from nfe_sync.storage import DocumentoStorage, DocumentoStorageCompactado, _IndiceDocumentos, abrir_storage
 
 
 class TestDocumentoStorage:
@@ -16,6 +19,15 @@ class TestDocumentoStorage:
         with open(caminho) as f:
             assert f.read() == "<nfe/>"
 
+    def test_salvar_bytes_grava_sem_conversao(self, tmp_path):
+        storage = DocumentoStorage()
+        storage.BASE = str(tmp_path)
+        conteudo = '<?xml version="1.0" encoding="UTF-8"?><resNFe><xNome>AÇÚCAR</xNome></resNFe>'.encode()
+        caminho = storage.salvar("99999999000191", "nota.xml", conteudo)
+        with open(caminho, "rb") as f:
+            assert f.read() == conteudo
+        assert storage.root_tag("99999999000191", "nota.xml") == "resNFe"
+
     def test_existe_verdadeiro(self, tmp_path):
         storage = DocumentoStorage()
         storage.BASE = str(tmp_path)
@@ -39,7 +51,7 @@ class TestDocumentoStorage:
         storage = DocumentoStorage()
         storage.BASE = str(tmp_path)
         import nfe_sync.storage as storage_mod
-        with patch.object(storage_mod, "safe_parse", side_effect=Exception("parse error")):
+        with patch.object(storage_mod, "safe_root_tag", side_effect=Exception("parse error")):
             with caplog.at_level(logging.WARNING):
                 tag = storage.root_tag("99999999000191", "invalido.xml")
         assert tag is None
@@ -49,22 +61,10 @@ class TestDocumentoStorage:
         storage = DocumentoStorage()
         storage.BASE = str(tmp_path)
         cnpj = "99999999000191"
-        import nfe_sync.storage as storage_mod
+        storage.salvar(cnpj, "resumo.xml", '<resNFe xmlns="http://www.portalfiscal.inf.br/nfe"/>')
+        storage.salvar(cnpj, "proc.xml", "<procNFe/>")
 
-        with patch("os.path.isdir", return_value=True), \
-             patch("os.listdir", return_value=["resumo.xml", "proc.xml"]), \
-             patch.object(storage_mod, "safe_parse") as mock_parse:
-
-            def fake_parse(path):
-                tree = MagicMock()
-                if path.endswith("resumo.xml"):
-                    tree.getroot.return_value.tag = "{http://www.portalfiscal.inf.br/nfe}resNFe"
-                else:
-                    tree.getroot.return_value.tag = "procNFe"
-                return tree
-
-            mock_parse.side_effect = fake_parse
-            resultado = storage.listar_resumos_pendentes(cnpj)
+        resultado = storage.listar_resumos_pendentes(cnpj)
 
         assert "resumo" in resultado
         assert "proc" not in resultado
@@ -75,6 +75,82 @@ class TestDocumentoStorage:
         resultado = storage.listar_resumos_pendentes("00000000000000")
         assert resultado == []
 
+    def test_listar_completos_so_procnfe(self, tmp_path):
+        storage = DocumentoStorage()
+        storage.BASE = str(tmp_path)
+        cnpj = "99999999000191"
+        storage.salvar(cnpj, "a.xml", "<procNFe/>", schema="procNFe_v4.00.xsd")
+        storage.salvar(cnpj, "b.xml", '<resNFe xmlns="http://www.portalfiscal.inf.br/nfe"/>')
+        storage.salvar(cnpj, "c-cancelamento.xml", "<procEventoNFe/>")
+
+        with patch("nfe_sync.storage.safe_root_tag") as mock_parse:
+            assert storage.listar_completos(cnpj) == {"a"}
+        mock_parse.assert_not_called()
+        assert storage.listar_completos("00000000000000") == set()
+
+    def test_lacunas_nsu(self, tmp_path):
+        storage = DocumentoStorage()
+        storage.BASE = str(tmp_path)
+        cnpj = "99999999000191"
+        assert storage.lacunas_nsu(cnpj, 10) == []
+        storage.registrar_nsus(cnpj, [(3, "ok"), (4, "ok"), (6, "erro"), (8, "vazio")])
+
+        assert storage.lacunas_nsu(cnpj, 10) == [(5, 7), (9, 10)]  # erro conta como lacuna
+        assert storage.lacunas_nsu(cnpj, 10, desde=1) == [(1, 2), (5, 7), (9, 10)]
+        assert storage.lacunas_nsu(cnpj, 4) == []
+
+        storage.registrar_nsus(cnpj, [(5, "ok"), (6, "ok"), (7, "vazio")])
+        assert storage.lacunas_nsu(cnpj, 8) == []
+
+    def test_sincronizar_fsync_dos_gravados(self, tmp_path):
+        storage = DocumentoStorage(fsync="lote")
+        storage.BASE = str(tmp_path)
+        cnpj = "99999999000191"
+        storage.salvar(cnpj, "a.xml", "<procNFe/>")
+        storage.salvar(cnpj, "b.xml", "<procNFe/>")
+        storage.renomear(cnpj, "b.xml", "b-cancelada.xml")
+
+        with patch("nfe_sync.storage.os.fsync") as mock_fsync:
+            assert storage.sincronizar(cnpj) == 2
+            assert mock_fsync.call_count == 3  # dois arquivos + a pasta
+            assert storage.sincronizar(cnpj) == 0
+
+    def test_salvar_atomico_preserva_anterior_em_falha(self, tmp_path):
+        storage = DocumentoStorage()
+        storage.BASE = str(tmp_path)
+        cnpj = "99999999000191"
+        storage.salvar(cnpj, "a.xml", "<resNFe/>")
+
+        with patch("nfe_sync.storage.os.replace", side_effect=OSError("disco cheio")):
+            with pytest.raises(OSError):
+                storage.salvar(cnpj, "a.xml", "<procNFe>" + "x" * 100000)
+        assert (tmp_path / cnpj / "a.xml").read_text() == "<resNFe/>"
+        assert sorted(os.listdir(tmp_path / cnpj)) == [".indice.db", "a.xml"]  # sem .tmp
+
+    def test_fsync_por_arquivo(self, tmp_path):
+        storage = DocumentoStorage()
+        storage.BASE = str(tmp_path)
+        cnpj = "99999999000191"
+        storage.salvar(cnpj, "a.xml", "<x/>")  # cria a pasta e o índice fora do mock
+        with patch("nfe_sync.storage.os.fsync") as mock_fsync:
+            storage.salvar(cnpj, "b.xml", "<procNFe/>")
+            assert mock_fsync.call_count == 2  # o arquivo e a pasta
+        assert storage.sincronizar(cnpj) == 0
+
+    def test_reindexar_remove_temporario_orfao(self, tmp_path):
+        storage = DocumentoStorage()
+        storage.BASE = str(tmp_path)
+        cnpj = "99999999000191"
+        storage.salvar(cnpj, "a.xml", "<x/>")
+        orfao, recente = tmp_path / cnpj / ".b.xml.1-1.tmp", tmp_path / cnpj / ".c.xml.2-2.tmp"
+        orfao.write_text("<pela")
+        recente.write_text("<meta")
+        os.utime(orfao, (0, 0))
+
+        storage.reindexar(cnpj)
+        assert not orfao.exists()
+        assert recente.exists()  # pode ser de outro processo gravando agora
+
     def test_listar_resumos_ignora_nao_xml(self, tmp_path):
         storage = DocumentoStorage()
         storage.BASE = str(tmp_path)
@@ -105,3 +181,273 @@ class TestDocumentoStorage:
         storage.BASE = str(tmp_path)
         # Não deve levantar exceção
         storage.remover("99999999000191", "inexistente.xml")
+
+
+class TestIndiceDocumentos:
+    """Indice em downloads/{cnpj}/.indice.db: existe/pendentes sem abrir XMLs."""
+
+    CNPJ = "99999999000191"
+
+    def _storage(self, tmp_path):
+        storage = DocumentoStorage()
+        storage.BASE = str(tmp_path)
+        return storage
+
+    def test_pendentes_e_existe_nao_leem_xml(self, tmp_path):
+        import nfe_sync.storage as storage_mod
+        storage = self._storage(tmp_path)
+        storage.salvar(self.CNPJ, "resumo.xml", "<resNFe/>", schema="resNFe_v1.01.xsd", nsu="1")
+        storage.salvar(self.CNPJ, "proc.xml", "<nfeProc/>", schema="procNFe_v4.00.xsd", nsu="2")
+
+        with patch.object(storage_mod, "safe_root_tag", side_effect=AssertionError("leu XML")):
+            assert storage.listar_resumos_pendentes(self.CNPJ) == ["resumo"]
+            assert storage.existe(self.CNPJ, "proc.xml") is True
+            assert storage.root_tag(self.CNPJ, "proc.xml") == "nfeProc"
+
+    def test_root_tag_vem_do_schema(self, tmp_path):
+        storage = self._storage(tmp_path)
+        storage.salvar(self.CNPJ, "ev.xml", "<procEventoNFe/>", schema="procEventoNFe_v1.00.xsd")
+        assert storage.root_tag(self.CNPJ, "ev.xml") == "procEventoNFe"
+
+    def test_indice_antigo_com_tag_do_schema_e_migrado(self, tmp_path):
+        import sqlite3
+        storage = self._storage(tmp_path)
+        os.makedirs(tmp_path / self.CNPJ)
+        con = sqlite3.connect(tmp_path / self.CNPJ / ".indice.db")
+        con.execute(
+            "CREATE TABLE documentos (nome TEXT PRIMARY KEY, root_tag TEXT, schema TEXT, nsu TEXT,"
+            " tamanho INTEGER, mtime REAL)"
+        )
+        con.execute("INSERT INTO documentos VALUES ('chave.xml', 'procNFe', 'procNFe_v4.00.xsd', '1', 10, 0)")
+        con.commit()
+        con.close()
+        assert storage.root_tag(self.CNPJ, "chave.xml") == "nfeProc"
+        assert storage.listar_completos(self.CNPJ) == {"chave"}
+
+    def test_listar_completos_acha_procnfe_anterior_ao_indice(self, tmp_path):
+        storage = self._storage(tmp_path)
+        os.makedirs(tmp_path / self.CNPJ)
+        (tmp_path / self.CNPJ / "completa.xml").write_text('<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe"/>')
+        (tmp_path / self.CNPJ / "resumo.xml").write_text("<resNFe/>")
+        assert storage.listar_completos(self.CNPJ) == {"completa"}
+
+    def test_procnfe_substitui_resumo_no_indice(self, tmp_path):
+        storage = self._storage(tmp_path)
+        storage.salvar(self.CNPJ, "chave.xml", "<resNFe/>", schema="resNFe_v1.01.xsd")
+        storage.salvar(self.CNPJ, "chave.xml", "<nfeProc/>", schema="procNFe_v4.00.xsd")
+        assert storage.listar_resumos_pendentes(self.CNPJ) == []
+
+    def test_renomear_e_remover_atualizam_indice(self, tmp_path):
+        storage = self._storage(tmp_path)
+        storage.salvar(self.CNPJ, "a.xml", "<resNFe/>")
+        storage.renomear(self.CNPJ, "a.xml", "b.xml")
+        assert storage.listar_resumos_pendentes(self.CNPJ) == ["b"]
+        storage.remover(self.CNPJ, "b.xml")
+        assert storage.listar_resumos_pendentes(self.CNPJ) == []
+        assert storage.existe(self.CNPJ, "b.xml") is False
+
+    def test_pasta_legada_sem_indice_e_indexada_no_primeiro_uso(self, tmp_path):
+        pasta = tmp_path / self.CNPJ
+        pasta.mkdir()
+        (pasta / "resumo.xml").write_text("<resNFe/>")
+        storage = self._storage(tmp_path)
+
+        assert storage.existe(self.CNPJ, "resumo.xml") is True
+        assert (pasta / ".indice.db").exists()
+
+    def test_reindexar_so_le_arquivos_alterados(self, tmp_path):
+        import nfe_sync.storage as storage_mod
+        storage = self._storage(tmp_path)
+        storage.salvar(self.CNPJ, "resumo.xml", "<resNFe/>")
+        pasta = tmp_path / self.CNPJ
+        (pasta / "copiado.xml").write_text("<resNFe/>")
+        (pasta / "resumo.xml").unlink()
+
+        original = storage_mod.safe_root_tag
+        with patch.object(storage_mod, "safe_root_tag", side_effect=original) as mock_parse:
+            lidos = storage.reindexar(self.CNPJ)
+            assert storage.reindexar(self.CNPJ) == 0
+
+        assert lidos == 1
+        assert mock_parse.call_count == 1
+        assert storage.listar_resumos_pendentes(self.CNPJ) == ["copiado"]
+
+
+class TestLayoutAamm:
+    CNPJ = "99999999000191"
+    CHAVE = "35260211111111000191550010000000011000000010"  # emitida em 2026-02
+    RES = '<resNFe xmlns="http://www.portalfiscal.inf.br/nfe"/>'
+
+    def _storage(self, tmp_path, layout="aamm"):
+        storage = DocumentoStorage(layout)
+        storage.BASE = str(tmp_path)
+        return storage
+
+    def test_grava_na_subpasta_da_emissao(self, tmp_path):
+        storage = self._storage(tmp_path)
+        caminho = storage.salvar(self.CNPJ, f"{self.CHAVE}.xml", self.RES)
+        storage.salvar(self.CNPJ, "nsu-000000000000001.xml", "<procEventoNFe/>")
+
+        assert caminho == f"{tmp_path}/{self.CNPJ}/2602/{self.CHAVE}.xml"
+        assert os.path.exists(f"{tmp_path}/{self.CNPJ}/sem-chave/nsu-000000000000001.xml")
+        assert storage.listar_resumos_pendentes(self.CNPJ) == [self.CHAVE]
+
+        destino = storage.renomear(self.CNPJ, f"{self.CHAVE}.xml", f"{self.CHAVE}-cancelada.xml")
+        assert destino == f"{tmp_path}/{self.CNPJ}/2602/{self.CHAVE}-cancelada.xml"
+        os.remove(tmp_path / self.CNPJ / ".indice.db")
+        assert storage.listar(self.CNPJ) == [f"{self.CHAVE}-cancelada.xml", "nsu-000000000000001.xml"]
+
+    def test_migracao_incremental_e_retomavel(self, tmp_path):
+        plano = self._storage(tmp_path, "plano")
+        chaves = [f"3526{i:02d}" + self.CHAVE[6:] for i in range(1, 4)]
+        for chave in chaves:
+            plano.salvar(self.CNPJ, f"{chave}.xml", self.RES)
+
+        storage = self._storage(tmp_path)
+        assert storage.migrar_layout(self.CNPJ, limite=2) == (2, 1)
+        # durante a migração os arquivos são achados nos dois layouts
+        assert all(storage.root_tag(self.CNPJ, f"{c}.xml") == "resNFe" for c in chaves)
+        assert storage.ler(self.CNPJ, f"{chaves[2]}.xml") == self.RES.encode()
+
+        storage.salvar(self.CNPJ, f"{chaves[2]}.xml", "<procNFe/>", schema="procNFe_v4.00.xsd")
+        assert not os.path.exists(tmp_path / self.CNPJ / f"{chaves[2]}.xml")  # salvar já migrou
+        assert storage.migrar_layout(self.CNPJ) == (0, 0)
+        assert sorted(os.listdir(tmp_path / self.CNPJ)) == [".indice.db", "2601", "2602", "2603"]
+        assert storage.listar_completos(self.CNPJ) == {chaves[2]}
+
+    def test_layout_invalido(self):
+        assert abrir_storage(None, "aamm").layout == "aamm"
+        with pytest.raises(NfeConfigError):
+            abrir_storage(None, "anual")
+
+
+class TestDocumentoStorageCompactado:
+    CNPJ = "99999999000191"
+    RES = '<resNFe xmlns="http://www.portalfiscal.inf.br/nfe"><chNFe>1</chNFe></resNFe>'
+
+    def _storage(self, tmp_path):
+        storage = DocumentoStorageCompactado()
+        storage.BASE = str(tmp_path)
+        return storage
+
+    def test_mesma_interface_sem_arquivos_soltos(self, tmp_path):
+        storage = self._storage(tmp_path)
+        storage.salvar(self.CNPJ, "a.xml", self.RES)
+        storage.salvar(self.CNPJ, "b.xml", b"<procNFe/>", schema="procNFe_v4.00.xsd", nsu="000000000000007")
+
+        assert storage.existe(self.CNPJ, "a.xml")
+        assert not storage.existe(self.CNPJ, "c.xml")
+        assert storage.ler(self.CNPJ, "a.xml") == self.RES.encode()
+        assert storage.root_tag(self.CNPJ, "a.xml") == "resNFe"
+        assert storage.listar_resumos_pendentes(self.CNPJ) == ["a"]
+        assert storage.listar_completos(self.CNPJ) == {"b"}
+        assert sorted(os.listdir(tmp_path / self.CNPJ)) == [".indice.db", "docs-000001.seg"]
+
+    def test_alias_e_lapide_sobrevivem_a_reindexar(self, tmp_path):
+        storage = self._storage(tmp_path)
+        storage.salvar(self.CNPJ, "a.xml", "<nfeProc/>", schema="procNFe_v4.00.xsd")
+        storage.salvar(self.CNPJ, "b.xml", self.RES)
+        storage.salvar(self.CNPJ, "b.xml", "<nfeProc/>", schema="procNFe_v4.00.xsd")  # substitui o resumo
+        caminho = storage.renomear(self.CNPJ, "a.xml", "a-cancelada.xml")
+        storage.remover(self.CNPJ, "b.xml")
+        assert caminho.endswith("docs-000001.seg:a-cancelada.xml")
+
+        os.remove(tmp_path / self.CNPJ / ".indice.db")
+        assert storage.listar(self.CNPJ) == ["a-cancelada.xml"]  # índice refeito a partir do segmento
+        assert storage.ler(self.CNPJ, "a-cancelada.xml") == b"<nfeProc/>"
+        assert storage.root_tag(self.CNPJ, "a-cancelada.xml") == "nfeProc"
+
+    def test_cauda_incompleta_e_descartada(self, tmp_path):
+        storage = self._storage(tmp_path)
+        storage.salvar(self.CNPJ, "a.xml", self.RES)
+        segmento = tmp_path / self.CNPJ / "docs-000001.seg"
+        with open(segmento, "ab") as f:
+            f.write(b"NFSG\x44\x05")  # gravação interrompida no cabeçalho
+
+        storage.salvar(self.CNPJ, "b.xml", "<procNFe/>")
+        assert storage.ler(self.CNPJ, "b.xml") == b"<procNFe/>"
+        # a cauda não é cortada (pode ser de outro processo): o registro seguinte vai para outro segmento
+        assert segmento.read_bytes().endswith(b"NFSG\x44\x05")
+        assert os.path.exists(tmp_path / self.CNPJ / "docs-000002.seg")
+        assert storage.reindexar(self.CNPJ) == 2
+
+    def test_novo_segmento_ao_atingir_tamanho(self, tmp_path):
+        storage = self._storage(tmp_path)
+        storage.TAMANHO_SEGMENTO = 1
+        for nome in ("a.xml", "b.xml", "c.xml"):
+            storage.salvar(self.CNPJ, nome, self.RES)
+        assert sorted(n for n in os.listdir(tmp_path / self.CNPJ) if n.endswith(".seg")) == [
+            "docs-000001.seg", "docs-000002.seg", "docs-000003.seg",
+        ]
+        assert storage.ler(self.CNPJ, "c.xml") == self.RES.encode()
+
+    def test_exportar_e_compactar_soltos(self, tmp_path):
+        soltos = DocumentoStorage()
+        soltos.BASE = str(tmp_path / "downloads")
+        soltos.salvar(self.CNPJ, "a.xml", self.RES)
+        os.remove(tmp_path / "downloads" / self.CNPJ / ".indice.db")
+
+        storage = self._storage(tmp_path / "downloads")
+        assert storage.reindexar(self.CNPJ) == 1  # só indexa: o XML solto continua lá
+        assert os.path.exists(tmp_path / "downloads" / self.CNPJ / "a.xml")
+        assert storage.compactar(self.CNPJ) == (1, 0)
+        assert not os.path.exists(tmp_path / "downloads" / self.CNPJ / "a.xml")
+        assert storage.listar_resumos_pendentes(self.CNPJ) == ["a"]
+
+        assert storage.exportar(self.CNPJ, str(tmp_path / "exportados")) == 1
+        assert (tmp_path / "exportados" / "a.xml").read_text() == self.RES
+
+    def test_pasta_indexada_no_modo_arquivos(self, tmp_path):
+        """Trocar para gzip não perde nada: os XMLs soltos já indexados continuam legíveis."""
+        soltos = DocumentoStorage()
+        soltos.BASE = str(tmp_path)
+        soltos.salvar(self.CNPJ, "a.xml", self.RES)
+        soltos.salvar(self.CNPJ, "b.xml", "<procNFe/>", schema="procNFe_v4.00.xsd", nsu="000000000000009")
+        soltos.salvar(self.CNPJ, "c.xml", self.RES)
+
+        storage = self._storage(tmp_path)
+        assert storage.existe(self.CNPJ, "a.xml")
+        assert storage.ler(self.CNPJ, "a.xml") == self.RES.encode()
+        storage.renomear(self.CNPJ, "a.xml", "a-cancelada.xml")
+        assert storage.ler(self.CNPJ, "a-cancelada.xml") == self.RES.encode()
+        storage.remover(self.CNPJ, "c.xml")
+        assert not storage.existe(self.CNPJ, "c.xml")
+
+        assert storage.compactar(self.CNPJ, limite=1) == (1, 1)
+        assert storage.compactar(self.CNPJ) == (1, 0)
+        assert [n for n in os.listdir(tmp_path / self.CNPJ) if n.endswith(".xml")] == []
+        assert storage.listar(self.CNPJ) == ["a-cancelada.xml", "b.xml"]
+        assert storage.listar_completos(self.CNPJ) == {"b"}
+        assert _IndiceDocumentos(str(tmp_path / self.CNPJ)).buscar("b.xml")[2] == "000000000000009"
+
+    def test_varios_processos_no_mesmo_cnpj(self, tmp_path):
+        ctx = multiprocessing.get_context("spawn")
+        processos = [
+            ctx.Process(target=_gravar_compactado, args=(str(tmp_path), self.CNPJ, f"p{i}", 40)) for i in range(4)
+        ]
+        for p in processos:
+            p.start()
+        for p in processos:
+            p.join(60)
+            assert p.exitcode == 0
+
+        storage = self._storage(tmp_path)
+        nomes = storage.listar(self.CNPJ)
+        assert len(nomes) == 160
+        for nome in nomes:
+            assert storage.ler(self.CNPJ, nome) == f"<resNFe>{nome}</resNFe>".encode()
+        assert storage.reindexar(self.CNPJ) == 160
+
+    def test_abrir_storage(self):
+        assert type(abrir_storage(None)) is DocumentoStorage
+        assert type(abrir_storage("gzip")) is DocumentoStorageCompactado
+        with pytest.raises(NfeConfigError):
+            abrir_storage("zip")
+
+
+def _gravar_compactado(base: str, cnpj: str, prefixo: str, total: int) -> None:
+    storage = DocumentoStorageCompactado(fsync="lote")
+    storage.BASE = base
+    for i in range(total):
+        nome = f"{prefixo}-{i}.xml"
+        storage.salvar(cnpj, nome, f"<resNFe>{nome}</resNFe>")
@@ -1,9 +1,11 @@
 """Testes para xml_utils.py — Issues #3 (XXE), #11 (timeout), #27 (chamar_sefaz)."""
 import pytest
+import requests
 from pynfe.utils import etree
 from unittest.mock import patch, MagicMock, call
 
-from nfe_sync.xml_utils import safe_fromstring, safe_parse, criar_comunicacao, chamar_sefaz, _com_retry
+from nfe_sync.retentativa import ControleRetentativas, PoliticaRetentativa, configurar_retentativas
+from nfe_sync.xml_utils import safe_fromstring, safe_parse, safe_root_tag, criar_comunicacao, chamar_sefaz, _com_retry
 
 
 class TestSafeFromstring:
@@ -110,6 +112,13 @@ class TestCriarComunicacao:
         assert chamadas == [60]
 
 
+@pytest.fixture
+def sem_espera():
+    anterior = configurar_retentativas(ControleRetentativas(dormir=lambda s: None))
+    yield
+    configurar_retentativas(anterior)
+
+
 class TestChamarSefaz:
     """Issue #27: chamar_sefaz centraliza retry + parsing de resposta."""
 
@@ -163,18 +172,27 @@ class TestChamarSefaz:
             empresa_sul.homologacao,
         )
 
-    def test_aplica_retry_em_falha(self, empresa_sul):
+    def test_aplica_retry_em_falha(self, empresa_sul, sem_espera):
         mock_resp = MagicMock()
         mock_resp.content = self.XML_RESP
-        with patch("nfe_sync.xml_utils.ComunicacaoSefaz") as mock_cls, \
-             patch("nfe_sync.xml_utils.time.sleep"):
+        with patch("nfe_sync.xml_utils.ComunicacaoSefaz") as mock_cls:
             mock_cls.return_value.consulta_nota.side_effect = [
-                RuntimeError("timeout"), mock_resp
+                requests.Timeout("timeout"), mock_resp
             ]
             xml_el, xml_str = chamar_sefaz(empresa_sul, "consulta_nota", modelo="nfe", chave="x")
 
         assert mock_cls.return_value.consulta_nota.call_count == 2
 
+    def test_politica_por_operacao(self, empresa_sul, sem_espera):
+        with patch("nfe_sync.xml_utils.ComunicacaoSefaz") as mock_cls:
+            mock_cls.return_value.consulta_nota.side_effect = requests.Timeout("timeout")
+            with pytest.raises(requests.Timeout):
+                chamar_sefaz(empresa_sul, "consulta_nota", modelo="nfe", chave="x",
+                             politica=PoliticaRetentativa(tentativas=5, base=1))
+
+        assert mock_cls.return_value.consulta_nota.call_count == 5
+        assert "politica" not in mock_cls.return_value.consulta_nota.call_args.kwargs
+
     def test_trata_resposta_sem_content(self, empresa_sul):
         """Resposta que é bytes diretamente (sem .content) também deve funcionar."""
         with patch("nfe_sync.xml_utils.ComunicacaoSefaz") as mock_cls:
@@ -182,3 +200,248 @@ class TestChamarSefaz:
             xml_el, xml_str = chamar_sefaz(empresa_sul, "consulta_nota", modelo="nfe", chave="x")
 
         assert "retConsSitNFe" in xml_el.tag
+
+
+class TestSafeRootTag:
+    """Leitura do elemento raiz sem parse completo (usada pelo DocumentoStorage)."""
+
+    def test_arquivo_com_namespace(self, tmp_path):
+        arquivo = tmp_path / "resumo.xml"
+        arquivo.write_text(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<resNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.01"><chNFe>1</chNFe></resNFe>'
+        )
+        assert safe_root_tag(str(arquivo)) == "resNFe"
+
+    def test_bytes_sem_namespace(self):
+        assert safe_root_tag(b"<procNFe><NFe/></procNFe>") == "procNFe"
+
+    def test_para_no_primeiro_elemento(self, tmp_path):
+        """Conteúdo corrompido depois da raiz não importa — o resto do arquivo não é lido."""
+        arquivo = tmp_path / "grande.xml"
+        arquivo.write_bytes(b'<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe">' + b"<det/>" * 200_000 + b"<<lixo")
+        assert safe_root_tag(str(arquivo)) == "nfeProc"
+
+    def test_nao_expande_entidade_externa(self, tmp_path):
+        xml_xxe = (
+            b'<?xml version="1.0"?>'
+            b'<!DOCTYPE foo [<!ENTITY xxe SYSTEM "file:///etc/passwd">]>'
+            b"<root>&xxe;</root>"
+        )
+        assert safe_root_tag(xml_xxe) == "root"
+
+    @pytest.mark.parametrize("xml,raiz", [
+        (b"<a/>", "a"),
+        (b'<resNFe xmlns="http://www.portalfiscal.inf.br/nfe"/>', "resNFe"),
+        (b"<a><b>", "a"),  # truncado: a raiz já foi lida
+    ])
+    def test_documento_curto(self, xml, raiz):
+        assert safe_root_tag(xml) == raiz
+
+    def test_vazio_levanta(self):
+        with pytest.raises(Exception):
+            safe_root_tag(b"")
+
+    def test_sem_elemento_levanta(self):
+        with pytest.raises(ValueError, match="sem elemento raiz"):
+            safe_root_tag(b'<?xml version="1.0"?>')
+
+
+def _gerar_certificados(pasta):
+    """CA de teste, certificado do servidor (127.0.0.1) e .pfx do cliente com senha."""
+    import datetime
+    import ipaddress
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    from cryptography.x509.oid import NameOID
+
+    agora = datetime.datetime.now(datetime.timezone.utc)
+
+    def emitir(nome, emissor_nome, emissor_chave, ca=False, san=None):
+        chave = ec.generate_private_key(ec.SECP256R1())
+        builder = (
+            x509.CertificateBuilder()
+            .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, nome)]))
+            .issuer_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, emissor_nome or nome)]))
+            .public_key(chave.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(agora - datetime.timedelta(minutes=1))
+            .not_valid_after(agora + datetime.timedelta(days=1))
+            .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+            .add_extension(x509.SubjectKeyIdentifier.from_public_key(chave.public_key()), critical=False)
+            .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(
+                (emissor_chave or chave).public_key()), critical=False)
+        )
+        if ca:
+            builder = builder.add_extension(x509.KeyUsage(
+                digital_signature=True, content_commitment=False, key_encipherment=False,
+                data_encipherment=False, key_agreement=False, key_cert_sign=True, crl_sign=True,
+                encipher_only=False, decipher_only=False), critical=True)
+        if san:
+            builder = builder.add_extension(x509.SubjectAlternativeName(san), critical=False)
+        return chave, builder.sign(emissor_chave or chave, hashes.SHA256())
+
+    ca_chave, ca_cert = emitir("CA teste", None, None, ca=True)
+    srv_chave, srv_cert = emitir(
+        "127.0.0.1", "CA teste", ca_chave, san=[x509.IPAddress(ipaddress.ip_address("127.0.0.1"))],
+    )
+    cli_chave, cli_cert = emitir("EMPRESA TESTE:99999999000191", "CA teste", ca_chave)
+
+    pem = serialization.Encoding.PEM
+    (pasta / "ca.pem").write_bytes(ca_cert.public_bytes(pem))
+    (pasta / "srv.pem").write_bytes(srv_cert.public_bytes(pem))
+    (pasta / "srv.key").write_bytes(srv_chave.private_bytes(
+        pem, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+    ))
+    (pasta / "cliente.pfx").write_bytes(pkcs12.serialize_key_and_certificates(
+        b"cliente", cli_chave, cli_cert, None, serialization.BestAvailableEncryption(b"123456"),
+    ))
+
+
+@pytest.fixture(scope="module")
+def servidor_sefaz_local(tmp_path_factory):
+    """Stand-in HTTPS da SEFAZ: exige certificado cliente e conta conexões (handshakes) aceitas."""
+    import ssl
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    pasta = tmp_path_factory.mktemp("certs")
+    _gerar_certificados(pasta)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            with self.server.lock:
+                type(self.server).em_andamento += 1
+                type(self.server).pico = max(self.server.pico, self.server.em_andamento)
+            time.sleep(self.server.atraso)
+            with self.server.lock:
+                type(self.server).em_andamento -= 1
+            corpo = b'<retConsStatServ xmlns="http://www.portalfiscal.inf.br/nfe"><cStat>107</cStat></retConsStatServ>'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/soap+xml; charset=utf-8")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, *args):
+            pass
+
+    class Servidor(ThreadingHTTPServer):
+        daemon_threads = True
+        conexoes = 0
+        atraso = 0.0  # segundos de espera em cada POST
+        em_andamento = pico = 0  # requisições simultâneas
+        lock = threading.Lock()
+
+        def get_request(self):
+            sock, endereco = super().get_request()
+            sock.do_handshake()
+            type(self).conexoes += 1
+            return sock, endereco
+
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ctx.load_cert_chain(pasta / "srv.pem", pasta / "srv.key")
+    ctx.load_verify_locations(pasta / "ca.pem")
+    ctx.verify_mode = ssl.CERT_REQUIRED
+
+    servidor = Servidor(("127.0.0.1", 0), Handler)
+    servidor.socket = ctx.wrap_socket(servidor.socket, server_side=True, do_handshake_on_connect=False)
+    thread = threading.Thread(target=servidor.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield servidor, f"https://127.0.0.1:{servidor.server_address[1]}/ws", str(pasta / "cliente.pfx")
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+
+@pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+class TestSessoesSefaz:
+    """Pool de sessões keep-alive: um handshake TLS com certificado cliente por (empresa, UF, ambiente)."""
+
+    CHAMADAS = 5
+
+    def _chamar(self, empresa, url, pfx):
+        con = criar_comunicacao(empresa, cert_path=pfx)
+        resp = con._post(url, etree.fromstring("<consStatServ/>"))
+        assert resp.status_code == 200
+        assert safe_fromstring(resp.content).findtext("{*}cStat") == "107"
+
+    def _conexoes_em(self, servidor, fn):
+        antes = servidor.conexoes
+        fn()
+        return servidor.conexoes - antes
+
+    def test_sem_pool_um_handshake_por_chamada(self, empresa_sul, servidor_sefaz_local):
+        servidor, url, pfx = servidor_sefaz_local
+
+        def chamar():
+            for _ in range(self.CHAMADAS):
+                self._chamar(empresa_sul, url, pfx)
+
+        assert self._conexoes_em(servidor, chamar) == self.CHAMADAS
+
+    def test_com_pool_reaproveita_conexao(self, empresa_sul, servidor_sefaz_local):
+        from nfe_sync.xml_utils import sessoes_sefaz
+        servidor, url, pfx = servidor_sefaz_local
+
+        def chamar():
+            with sessoes_sefaz() as pool:
+                for _ in range(self.CHAMADAS):
+                    self._chamar(empresa_sul, url, pfx)
+                assert len(pool) == 1
+
+        assert self._conexoes_em(servidor, chamar) == 1
+
+    def test_chave_por_uf_e_ambiente(self, empresa_sul, servidor_sefaz_local):
+        from nfe_sync.xml_utils import sessoes_sefaz
+        _, url, pfx = servidor_sefaz_local
+        producao = empresa_sul.model_copy(update={"homologacao": False})
+        with sessoes_sefaz() as pool:
+            criar_comunicacao(empresa_sul, cert_path=pfx)
+            criar_comunicacao(empresa_sul, uf="rs", cert_path=pfx)
+            criar_comunicacao(producao, cert_path=pfx)
+            criar_comunicacao(empresa_sul, uf="SP", cert_path=pfx)
+            assert len(pool) == 3
+
+    def test_fechar_encerra_sessoes_e_desativa(self, empresa_sul, servidor_sefaz_local):
+        from nfe_sync import xml_utils
+        _, url, pfx = servidor_sefaz_local
+        with xml_utils.sessoes_sefaz() as pool:
+            self._chamar(empresa_sul, url, pfx)
+            with xml_utils.sessoes_sefaz() as interno:
+                assert interno is pool
+        assert len(pool) == 0
+        assert xml_utils._pool_ativo is None
+
+    def test_chamadas_paralelas_nao_esperam_umas_pelas_outras(self, empresa_sul, servidor_sefaz_local):
+        """A sessão compartilhada não serializa as requisições do mesmo CNPJ/UF/ambiente."""
+        from concurrent.futures import ThreadPoolExecutor
+        from nfe_sync.xml_utils import sessoes_sefaz
+        servidor, url, pfx = servidor_sefaz_local
+        type(servidor).atraso, type(servidor).pico = 0.2, 0
+        try:
+            with sessoes_sefaz() as pool:
+                with ThreadPoolExecutor(4) as executor:
+                    list(executor.map(lambda _: self._chamar(empresa_sul, url, pfx), range(4)))
+                assert len(pool) == 1
+        finally:
+            type(servidor).atraso = 0.0
+        assert servidor.pico >= 2
+
+    def test_pfx_decifrado_uma_vez(self, empresa_sul, servidor_sefaz_local):
+        from nfe_sync.certificado import _cache, limpar_certificados
+        from nfe_sync.xml_utils import sessoes_sefaz
+        _, url, pfx = servidor_sefaz_local
+        limpar_certificados()
+        antes = _cache.decifrados
+        with sessoes_sefaz():
+            for _ in range(self.CHAMADAS):
+                self._chamar(empresa_sul, url, pfx)
+        assert _cache.decifrados - antes == 1
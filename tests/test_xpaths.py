@@ -0,0 +1,126 @@
+import pytest
+from lxml import etree
+
+from nfe_sync.consulta import nome_arquivo_nsu, TIPOS_EVENTO
+from nfe_sync.xpaths import XP_CSTAT, XP_DOC_ZIP, extrair_campos_documento, extrair_retorno
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+CHAVE = "35240199999999000191550010000001231234567890"
+
+DET = (
+    '<det nItem="{n}"><prod><cProd>{n}</cProd><cEAN>SEM GTIN</cEAN><xProd>PRODUTO {n}</xProd>'
+    "<NCM>71131100</NCM><CFOP>5102</CFOP><uCom>UN</uCom><qCom>1.0000</qCom>"
+    "<vUnCom>10.00</vUnCom><vProd>10.00</vProd></prod><imposto><ICMS><ICMSSN102>"
+    "<orig>0</orig><CSOSN>102</CSOSN></ICMSSN102></ICMS><PIS><PISNT><CST>07</CST></PISNT></PIS>"
+    "<COFINS><COFINSNT><CST>07</CST></COFINSNT></COFINS></imposto></det>"
+)
+
+PROC_NFE = (
+    f'<nfeProc xmlns="{NS_NFE}" versao="4.00"><NFe><infNFe Id="NFe{CHAVE}" versao="4.00">'
+    "<ide><cUF>35</cUF><natOp>VENDA</natOp><mod>55</mod><serie>1</serie><nNF>123</nNF></ide>"
+    "<emit><CNPJ>99999999000191</CNPJ><xNome>EMITENTE</xNome><enderEmit><UF>SP</UF></enderEmit></emit>"
+    "<dest><CNPJ>11222333000181</CNPJ><xNome>DESTINATARIO</xNome></dest>"
+    + "".join(DET.format(n=n) for n in range(1, 41)) +
+    "<total><ICMSTot><vNF>400.00</vNF></ICMSTot></total></infNFe></NFe>"
+    f"<protNFe versao=\"4.00\"><infProt><tpAmb>1</tpAmb><chNFe>{CHAVE}</chNFe>"
+    "<nProt>135240000000001</nProt><cStat>100</cStat></infProt></protNFe></nfeProc>"
+)
+
+RES_EVENTO = (
+    f'<resEvento xmlns="{NS_NFE}" versao="1.01"><cOrgao>91</cOrgao><CNPJ>99999999000191</CNPJ>'
+    f"<chNFe>{CHAVE}</chNFe><dhEvento>2024-01-10T10:00:00-03:00</dhEvento>"
+    "<tpEvento>210210</tpEvento><nSeqEvento>1</nSeqEvento><xEvento>Ciencia da Operacao</xEvento>"
+    "<dhRecbto>2024-01-10T10:00:01-03:00</dhRecbto><nProt>891240000000001</nProt></resEvento>"
+)
+
+PROC_EVENTO = (
+    f'<procEventoNFe xmlns="{NS_NFE}" versao="1.00"><evento versao="1.00"><infEvento>'
+    f"<cOrgao>35</cOrgao><CNPJ>99999999000191</CNPJ><chNFe>{CHAVE}</chNFe>"
+    "<tpEvento>110111</tpEvento><nSeqEvento>2</nSeqEvento></infEvento></evento>"
+    f"<retEvento versao=\"1.00\"><infEvento><cStat>135</cStat><chNFe>{CHAVE}</chNFe>"
+    "<tpEvento>110111</tpEvento><nSeqEvento>2</nSeqEvento></infEvento></retEvento></procEventoNFe>"
+)
+
+# NF-e sem protocolo (sem chNFe): nome vem de dest/emit/serie/nNF
+NFE_SEM_PROT = (
+    f'<NFe xmlns="{NS_NFE}"><infNFe><ide><serie>2</serie><nNF>77</nNF></ide>'
+    "<emit><CNPJ>99999999000191</CNPJ></emit><dest><CNPJ>11222333000181</CNPJ></dest>"
+    "<autXML><CNPJ>55666777000100</CNPJ></autXML></infNFe></NFe>"
+)
+
+RET_DIST = (
+    '<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope"><soap:Body>'
+    f'<retDistDFeInt xmlns="{NS_NFE}" versao="1.01"><tpAmb>1</tpAmb><cStat>138</cStat>'
+    "<xMotivo>Documento localizado</xMotivo><ultNSU>000000000000050</ultNSU>"
+    "<maxNSU>000000000000090</maxNSU><loteDistDFeInt>"
+    + "".join(f'<docZip NSU="{i:015d}" schema="resNFe_v1.01.xsd">H4sI</docZip>' for i in range(1, 51)) +
+    "</loteDistDFeInt></retDistDFeInt></soap:Body></soap:Envelope>"
+)
+
+
+def _nome_arquivo_nsu_xpath(xml_doc, schema: str, fallback: str):
+    """Implementação anterior (um scan //*[local-name()] por campo) — referência."""
+    chaves = xml_doc.xpath("//*[local-name()='chNFe']/text()")
+    if chaves:
+        chave = chaves[0]
+        if "Evento" in schema or "evento" in schema:
+            tp_evento = (xml_doc.xpath("//*[local-name()='tpEvento']/text()") or [""])[0]
+            n_seq = (xml_doc.xpath("//*[local-name()='nSeqEvento']/text()") or ["1"])[0]
+            return f"{chave}-evento-{TIPOS_EVENTO.get(tp_evento, tp_evento)}-{n_seq}", chave
+        return chave, chave
+    cnpj_dest = (xml_doc.xpath("//*[local-name()='dest']/*[local-name()='CNPJ']/text()") or [""])[0]
+    cnpj_emit = (xml_doc.xpath("//*[local-name()='emit']/*[local-name()='CNPJ']/text()") or [""])[0]
+    serie = (xml_doc.xpath("//*[local-name()='ide']/*[local-name()='serie']/text()") or [""])[0]
+    numero = (xml_doc.xpath("//*[local-name()='ide']/*[local-name()='nNF']/text()") or [""])[0]
+    nome = f"{cnpj_dest}-{cnpj_emit}-{serie}-{numero}" if any([cnpj_dest, cnpj_emit, serie, numero]) else fallback
+    return nome, None
+
+
+FIXTURES = [
+    (PROC_NFE, "procNFe_v4.00.xsd"),
+    (RES_EVENTO, "resEvento_v1.01.xsd"),
+    (PROC_EVENTO, "procEventoNFe_v1.00.xsd"),
+    (NFE_SEM_PROT, "procNFe_v4.00.xsd"),
+    ("<vazio/>", "resNFe_v1.01.xsd"),
+]
+
+
+class TestExtrairCamposDocumento:
+    @pytest.mark.parametrize("xml,schema", FIXTURES)
+    def test_equivale_aos_xpaths_anteriores(self, xml, schema):
+        doc = etree.fromstring(xml.encode())
+        assert nome_arquivo_nsu(doc, schema, "fallback") == _nome_arquivo_nsu_xpath(doc, schema, "fallback")
+
+    def test_campos_proc_nfe(self):
+        campos = extrair_campos_documento(etree.fromstring(PROC_NFE.encode()))
+        assert campos["chNFe"] == CHAVE
+        assert campos["cnpj_emit"] == "99999999000191"
+        assert campos["cnpj_dest"] == "11222333000181"
+        assert (campos["serie"], campos["nNF"]) == ("1", "123")
+
+    def test_cnpj_fora_de_dest_emit_ignorado(self):
+        campos = extrair_campos_documento(etree.fromstring(NFE_SEM_PROT.encode()))
+        assert campos["cnpj_dest"] == "11222333000181"
+        assert nome_arquivo_nsu(etree.fromstring(NFE_SEM_PROT.encode()), "x", "f") == (
+            "11222333000181-99999999000191-2-77", None,
+        )
+
+    def test_sem_namespace(self):
+        doc = etree.fromstring(b"<resEvento><chNFe>123</chNFe><tpEvento>210200</tpEvento></resEvento>")
+        assert nome_arquivo_nsu(doc, "resEvento_v1.01.xsd", "f") == ("123-evento-confirmacao-1", "123")
+
+
+class TestExtrairRetorno:
+    def test_escalares_da_distribuicao(self):
+        resp = etree.fromstring(RET_DIST.encode())
+        assert extrair_retorno(resp, "cStat", "xMotivo", "ultNSU", "maxNSU") == {
+            "cStat": "138", "xMotivo": "Documento localizado",
+            "ultNSU": "000000000000050", "maxNSU": "000000000000090",
+        }
+        assert XP_CSTAT(resp)[0].text == "138"
+        assert len(XP_DOC_ZIP(resp)) == 50
+
+    def test_campo_ausente_vira_none(self):
+        resp = etree.fromstring(f'<ret xmlns="{NS_NFE}"><cStat>656</cStat></ret>'.encode())
+        assert extrair_retorno(resp, "cStat", "ultNSU") == {"cStat": "656", "ultNSU": None}
+
@@ -0,0 +1,92 @@
+"""
+Benchmark: leitura do root tag por parse completo (safe_parse) x leitura
+incremental (safe_root_tag), em um diretorio sintetico com resNFe e procNFe.
+
+Uso:
+    python utils/bench_root_tag.py [--arquivos 2000] [--itens 400]
+
+--arquivos  total de XMLs gerados (metade resNFe, metade procNFe)
+--itens     quantidade de <det> em cada procNFe (controla o tamanho do arquivo)
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from nfe_sync.xml_utils import safe_parse, safe_root_tag
+
+NS = "http://www.portalfiscal.inf.br/nfe"
+
+RES_NFE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    f'<resNFe xmlns="{NS}" versao="1.01"><chNFe>{{chave}}</chNFe>'
+    "<CNPJ>99999999000191</CNPJ><xNome>EMITENTE</xNome><vNF>10.00</vNF></resNFe>\n"
+)
+
+DET = (
+    '<det nItem="{n}"><prod><cProd>{n}</cProd><xProd>PRODUTO {n}</xProd>'
+    "<NCM>71131100</NCM><CFOP>5102</CFOP><qCom>1.0000</qCom><vUnCom>10.00</vUnCom>"
+    "<vProd>10.00</vProd></prod><imposto><ICMS><ICMSSN102><orig>0</orig>"
+    "<CSOSN>102</CSOSN></ICMSSN102></ICMS></imposto></det>"
+)
+
+
+def _proc_nfe(chave: str, itens: int) -> str:
+    dets = "".join(DET.format(n=n) for n in range(1, itens + 1))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<nfeProc xmlns="{NS}" versao="4.00"><NFe><infNFe Id="NFe{chave}">{dets}</infNFe></NFe>'
+        f"<protNFe><infProt><chNFe>{chave}</chNFe><cStat>100</cStat></infProt></protNFe></nfeProc>\n"
+    )
+
+
+def gerar(pasta: Path, arquivos: int, itens: int) -> int:
+    total_bytes = 0
+    for i in range(arquivos):
+        chave = f"{i:044d}"
+        conteudo = RES_NFE.format(chave=chave) if i % 2 == 0 else _proc_nfe(chave, itens)
+        (pasta / f"{chave}.xml").write_text(conteudo)
+        total_bytes += len(conteudo)
+    return total_bytes
+
+
+def parse_completo(caminho: str) -> str:
+    tag = safe_parse(caminho).getroot().tag
+    return tag.split("}")[-1] if "}" in tag else tag
+
+
+def medir(fn, caminhos: list[str]) -> tuple[float, int]:
+    inicio = time.perf_counter()
+    resumos = sum(1 for c in caminhos if fn(c) == "resNFe")
+    return time.perf_counter() - inicio, resumos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de leitura do root tag")
+    parser.add_argument("--arquivos", type=int, default=2000)
+    parser.add_argument("--itens", type=int, default=400)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pasta = Path(tmp)
+        total_bytes = gerar(pasta, args.arquivos, args.itens)
+        caminhos = sorted(str(p) for p in pasta.glob("*.xml"))
+        print(f"{len(caminhos)} arquivos, {total_bytes / 1024 / 1024:.1f} MB")
+
+        # aquece o page cache para medir CPU, nao disco
+        medir(safe_root_tag, caminhos)
+
+        t_completo, r1 = medir(parse_completo, caminhos)
+        t_rapido, r2 = medir(safe_root_tag, caminhos)
+        assert r1 == r2, "os dois metodos devem encontrar os mesmos resumos"
+
+        print(f"safe_parse (arvore completa): {t_completo:.3f}s  ({t_completo / len(caminhos) * 1e6:.0f} us/arquivo)")
+        print(f"safe_root_tag (incremental):  {t_rapido:.3f}s  ({t_rapido / len(caminhos) * 1e6:.0f} us/arquivo)")
+        print(f"Ganho: {t_completo / t_rapido:.1f}x  ({r1} resNFe encontrados)")
+
+
+if __name__ == "__main__":
+    main()
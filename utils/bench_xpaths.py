@@ -0,0 +1,106 @@
+"""
+Benchmark: nome do arquivo de um documento da distribuicao DFe por um XPath
+//*[local-name()] por campo (implementacao anterior) x extrator de passada
+unica (nome_arquivo_nsu / xpaths.extrair_campos_documento).
+
+Uso:
+    python utils/bench_xpaths.py [--repeticoes 2000] [--itens 40]
+
+--repeticoes  chamadas por documento em cada medicao (melhor de 3)
+--itens       quantidade de <det> no procNFe (controla o tamanho da arvore)
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from pynfe.utils import etree
+
+from nfe_sync.consulta import TIPOS_EVENTO, nome_arquivo_nsu
+
+NS = "http://www.portalfiscal.inf.br/nfe"
+CHAVE = "35240199999999000191550010000001231234567890"
+
+DET = (
+    '<det nItem="{n}"><prod><cProd>{n}</cProd><xProd>PRODUTO {n}</xProd>'
+    "<NCM>71131100</NCM><CFOP>5102</CFOP><qCom>1.0000</qCom><vUnCom>10.00</vUnCom>"
+    "<vProd>10.00</vProd></prod><imposto><ICMS><ICMSSN102><orig>0</orig>"
+    "<CSOSN>102</CSOSN></ICMSSN102></ICMS></imposto></det>"
+)
+
+RES_EVENTO = (
+    f'<resEvento xmlns="{NS}" versao="1.01"><cOrgao>91</cOrgao><CNPJ>99999999000191</CNPJ>'
+    f"<chNFe>{CHAVE}</chNFe><tpEvento>210210</tpEvento><nSeqEvento>1</nSeqEvento>"
+    "<xEvento>Ciencia da Operacao</xEvento><nProt>891240000000001</nProt></resEvento>"
+)
+
+PROC_EVENTO = (
+    f'<procEventoNFe xmlns="{NS}" versao="1.00"><evento versao="1.00"><infEvento>'
+    f"<cOrgao>35</cOrgao><CNPJ>99999999000191</CNPJ><chNFe>{CHAVE}</chNFe>"
+    "<tpEvento>110111</tpEvento><nSeqEvento>2</nSeqEvento></infEvento></evento>"
+    f"<retEvento versao=\"1.00\"><infEvento><cStat>135</cStat><chNFe>{CHAVE}</chNFe>"
+    "<tpEvento>110111</tpEvento><nSeqEvento>2</nSeqEvento></infEvento></retEvento></procEventoNFe>"
+)
+
+
+def _proc_nfe(itens: int) -> str:
+    dets = "".join(DET.format(n=n) for n in range(1, itens + 1))
+    return (
+        f'<nfeProc xmlns="{NS}" versao="4.00"><NFe><infNFe Id="NFe{CHAVE}" versao="4.00">'
+        "<ide><serie>1</serie><nNF>123</nNF></ide><emit><CNPJ>99999999000191</CNPJ></emit>"
+        f"<dest><CNPJ>11222333000181</CNPJ></dest>{dets}</infNFe></NFe>"
+        f"<protNFe><infProt><chNFe>{CHAVE}</chNFe><cStat>100</cStat></infProt></protNFe></nfeProc>"
+    )
+
+
+def nome_por_xpath(xml_doc, schema: str, fallback: str):
+    """Implementacao anterior: um scan //*[local-name()] por campo."""
+    chaves = xml_doc.xpath("//*[local-name()='chNFe']/text()")
+    if chaves:
+        chave = chaves[0]
+        if "Evento" in schema or "evento" in schema:
+            tp_evento = (xml_doc.xpath("//*[local-name()='tpEvento']/text()") or [""])[0]
+            n_seq = (xml_doc.xpath("//*[local-name()='nSeqEvento']/text()") or ["1"])[0]
+            return f"{chave}-evento-{TIPOS_EVENTO.get(tp_evento, tp_evento)}-{n_seq}", chave
+        return chave, chave
+    cnpj_dest = (xml_doc.xpath("//*[local-name()='dest']/*[local-name()='CNPJ']/text()") or [""])[0]
+    cnpj_emit = (xml_doc.xpath("//*[local-name()='emit']/*[local-name()='CNPJ']/text()") or [""])[0]
+    serie = (xml_doc.xpath("//*[local-name()='ide']/*[local-name()='serie']/text()") or [""])[0]
+    numero = (xml_doc.xpath("//*[local-name()='ide']/*[local-name()='nNF']/text()") or [""])[0]
+    nome = f"{cnpj_dest}-{cnpj_emit}-{serie}-{numero}" if any([cnpj_dest, cnpj_emit, serie, numero]) else fallback
+    return nome, None
+
+
+def medir(fn, doc, schema: str, repeticoes: int) -> float:
+    melhor = float("inf")
+    for _ in range(3):
+        inicio = time.perf_counter()
+        for _ in range(repeticoes):
+            fn(doc, schema, "f")
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor / repeticoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos extratores de nome de arquivo")
+    parser.add_argument("--repeticoes", type=int, default=2000)
+    parser.add_argument("--itens", type=int, default=40)
+    args = parser.parse_args()
+
+    documentos = [
+        (_proc_nfe(args.itens), "procNFe_v4.00.xsd"),
+        (RES_EVENTO, "resEvento_v1.01.xsd"),
+        (PROC_EVENTO, "procEventoNFe_v1.00.xsd"),
+    ]
+    for xml, schema in documentos:
+        doc = etree.fromstring(xml.encode())
+        assert nome_por_xpath(doc, schema, "f") == nome_arquivo_nsu(doc, schema, "f"), "resultados diferentes"
+        antes = medir(nome_por_xpath, doc, schema, args.repeticoes)
+        depois = medir(nome_arquivo_nsu, doc, schema, args.repeticoes)
+        print(f"{schema:28s} xpath: {antes * 1e6:7.1f} us  passada unica: {depois * 1e6:7.1f} us  ({antes / depois:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()